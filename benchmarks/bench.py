@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark the solver, analysis and I/O hot paths of pytesimal.
+
+Times `numerical_methods.discretisation` across grid sizes, timesteps and
+constant or temperature-dependent mantle properties, along with
+`analysis.meteorite_depth_and_timing`, `analysis.cooling_rate`,
+`load_plot_save.save_result_arrays` and `load_plot_save.read_datafile`.
+Each benchmark records its best and median wall time over several repeats
+and its peak traced memory (from a separate run under `tracemalloc`).
+Everything runs offline with the package's own dependencies.
+
+Usage
+-----
+
+Run the suite and save the results::
+
+    python benchmarks/bench.py run -o results.json
+
+Add `--quick` for a shorter run, `--filter discretisation` to run only the
+benchmarks whose names contain a string, or `--tree path/to/checkout` to
+benchmark another checkout of the package, e.g. an older commit added with
+`git worktree add ../baseline <commit>`.
+
+Compare two result files; benchmarks that got slower or used more memory
+than the thresholds allow are flagged and the exit status is 1::
+
+    python benchmarks/bench.py compare baseline.json results.json
+
+"""
+
+import argparse
+import functools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+MYR = 3.1556926e13  # seconds in a million years
+
+# (name, r_planet, dr, timestep); all stable for every property mode
+GRIDS = (
+    ("small", 30000.0, 1000.0, 1e11),
+    ("medium", 60000.0, 1000.0, 1e11),
+    ("fine", 30000.0, 500.0, 2.5e10),
+)
+# (name, cond_constant, density_constant, heat_cap_constant)
+PROPERTY_MODES = (
+    ("constant", "y", "y", "y"),
+    ("variable_k", "n", "y", "y"),
+    ("all_variable", "n", "n", "n"),
+)
+
+
+def _import_package(tree):
+    """Import pytesimal from the checkout at `tree`."""
+    sys.path.insert(0, os.path.abspath(tree))
+    from pytesimal import (
+        analysis,
+        core_function,
+        load_plot_save,
+        mantle_properties,
+        numerical_methods,
+        setup_functions,
+    )
+
+    return {
+        "analysis": analysis,
+        "core_function": core_function,
+        "load_plot_save": load_plot_save,
+        "mantle_properties": mantle_properties,
+        "numerical_methods": numerical_methods,
+        "setup_functions": setup_functions,
+    }
+
+
+def _solve(pkg, r_planet, dr, timestep, n_steps, modes):
+    """Return a callable that solves `n_steps` steps, and its set-up."""
+
+    def setup():
+        (
+            r_core,
+            radii,
+            core_radii,
+            reg_thickness,
+            where_regolith,
+            times,
+            temperatures,
+            coretemp,
+        ) = pkg["setup_functions"].set_up(
+            timestep, r_planet, 0.5, 0.1, n_steps * timestep / MYR, dr
+        )
+        core = pkg["core_function"].IsothermalEutecticCore(
+            1600.0, 1200.0, r_core, 0, 7800.0, 850.0, 270000.0
+        )
+        cond, heatcap, dens = pkg[
+            "mantle_properties"
+        ].set_up_mantle_properties(*modes)
+        return (
+            core, [], 1600.0, 1600.0,
+            pkg["numerical_methods"].surface_dirichlet_bc,
+            pkg["numerical_methods"].cmb_dirichlet_bc,
+            250.0, temperatures, dr, coretemp, timestep, r_core, radii,
+            times, where_regolith, 5e-8, cond, heatcap, dens,
+        )
+
+    return pkg["numerical_methods"].discretisation, setup
+
+
+def _synthetic_history(n_radii, n_times):
+    """Return a smooth cooling history and its cooling rates."""
+    depth = np.linspace(0, 1, n_radii)[:, None]
+    times = np.linspace(0, 1, n_times)[None, :]
+    temperatures = 250 + 1350 * np.exp(-times / (0.05 + depth))
+    return temperatures, np.gradient(temperatures, 1e11, axis=1)
+
+
+def benchmarks(pkg, folder, quick=False):
+    """
+    Yield (name, parameters, function, setup) for every benchmark.
+
+    `setup()` returns the arguments of `function`; it is not timed. Shared
+    inputs (arrays, files and the solved history) are only built by the
+    first `setup()` that needs them, so benchmarks skipped by a filter cost
+    nothing. Files are written to `folder`.
+    """
+    n_steps = 200 if quick else 1000
+    for grid, r_planet, dr, timestep in GRIDS:
+        for mode, *flags in PROPERTY_MODES:
+            function, setup = _solve(
+                pkg, r_planet, dr, timestep, n_steps, flags
+            )
+            yield (
+                f"discretisation[{grid}-{mode}]",
+                {
+                    "r_planet": r_planet,
+                    "dr": dr,
+                    "timestep": timestep,
+                    "steps": n_steps,
+                    "properties": mode,
+                },
+                function,
+                setup,
+            )
+
+    n_radii, n_times = 125, (5000 if quick else 20000)
+    shape = {"n_radii": n_radii, "n_times": n_times}
+    analysis = pkg["analysis"]
+    load_plot_save = pkg["load_plot_save"]
+
+    @functools.lru_cache(maxsize=None)
+    def arrays():
+        temperatures, rates = _synthetic_history(n_radii, n_times)
+        return temperatures, temperatures[:50], rates, rates[:50]
+
+    @functools.lru_cache(maxsize=None)
+    def saved():
+        load_plot_save.save_result_arrays("read", folder, *arrays())
+        return os.path.join(folder, "read.npz")
+
+    yield (
+        "cooling_rate",
+        shape,
+        analysis.cooling_rate,
+        lambda: (arrays()[0], 1e11),
+    )
+    yield (
+        "save_result_arrays",
+        shape,
+        load_plot_save.save_result_arrays,
+        lambda: ("bench", folder) + arrays(),
+    )
+    yield (
+        "read_datafile",
+        shape,
+        load_plot_save.read_datafile,
+        lambda: (saved(),),
+    )
+
+    # a real history, so the contour searches behave as in production
+    n_steps = 2000 if quick else 8000
+    function, setup = _solve(
+        pkg, 60000.0, 1000.0, 1e11, n_steps, PROPERTY_MODES[0][1:]
+    )
+
+    @functools.lru_cache(maxsize=None)
+    def solved():
+        temperatures, _, _ = function(*setup())
+        return temperatures, analysis.cooling_rate(temperatures, 1e11)
+
+    n_solved = setup()[7].shape
+    radii = np.arange(30000.0, 60000.0, 1000.0)
+    yield (
+        "meteorite_depth_and_timing",
+        {"n_radii": n_solved[0], "n_times": n_solved[1]},
+        analysis.meteorite_depth_and_timing,
+        lambda: (
+            1e-14, *solved(), radii, 60000.0, 0.5,
+            n_solved[1] // 4, n_solved[1] // 2,
+        ),
+    )
+
+
+def time_benchmark(function, setup, repeat):
+    """Return the wall times of `repeat` calls, and the peak memory."""
+    seconds = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        function(*args)
+        seconds.append(time.perf_counter() - start)
+    args = setup()
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def _git_commit(tree):
+    """Return the commit of the checkout at `tree` and whether it is dirty."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=tree, capture_output=True,
+            text=True, check=True,
+        ).stdout.strip()
+        dirty = bool(
+            subprocess.run(
+                ["git", "status", "--porcelain", "--untracked-files=no"],
+                cwd=tree, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def run(tree=ROOT, quick=False, repeat=None, name_filter=None, stream=None):
+    """
+    Run the benchmark suite.
+
+    Parameters
+    ----------
+    tree : str
+        Checkout of the package to benchmark.
+    quick : bool, default False
+        Use fewer timesteps and smaller arrays.
+    repeat : int, optional
+        Timed calls per benchmark; 3 if `quick`, otherwise 5.
+    name_filter : str, optional
+        Only run benchmarks whose names contain this.
+    stream : file, optional
+        Stream for one line of progress per benchmark.
+
+    Returns
+    -------
+    results : dict
+        "meta" (commit, versions and host) and "benchmarks", mapping names
+        to "params", "seconds" (best), "median", "repeats" and
+        "peak_bytes".
+
+    """
+    pkg = _import_package(tree)
+    repeat = repeat or (3 if quick else 5)
+    commit, dirty = _git_commit(tree)
+    results = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "tree": os.path.abspath(tree),
+            "quick": quick,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "host": socket.gethostname(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.time(),
+        },
+        "benchmarks": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="pytesimal-bench-") as folder:
+        for name, params, function, setup in benchmarks(pkg, folder, quick):
+            if name_filter and name_filter not in name:
+                continue
+            seconds, peak = time_benchmark(function, setup, repeat)
+            results["benchmarks"][name] = {
+                "params": params,
+                "seconds": min(seconds),
+                "median": float(np.median(seconds)),
+                "repeats": seconds,
+                "peak_bytes": peak,
+            }
+            if stream is not None:
+                stream.write(
+                    f"{name:<42}{min(seconds):>10.4f} s"
+                    f"{peak / 1e6:>10.1f} MB\n"
+                )
+                stream.flush()
+    return results
+
+
+def compare(baseline, current, threshold=0.1, memory_threshold=0.1):
+    """
+    Compare two sets of results.
+
+    Parameters
+    ----------
+    baseline, current : dict
+        Results from `run`.
+    threshold : float, default 0.1
+        Flag benchmarks whose best time grew by more than this fraction.
+    memory_threshold : float, default 0.1
+        Flag benchmarks whose peak memory grew by more than this fraction.
+
+    Returns
+    -------
+    rows : list of dict
+        One row per benchmark in either set, with "name", "time_ratio",
+        "memory_ratio" (None if the benchmark is missing from one set) and
+        "regression" (True if either ratio exceeds its threshold).
+
+    """
+    rows = []
+    base = baseline["benchmarks"]
+    new = current["benchmarks"]
+    for name in list(base) + [name for name in new if name not in base]:
+        row = {"name": name, "time_ratio": None, "memory_ratio": None,
+               "regression": False}
+        if name in base and name in new:
+            row["time_ratio"] = new[name]["seconds"] / base[name]["seconds"]
+            if base[name]["peak_bytes"]:
+                row["memory_ratio"] = (
+                    new[name]["peak_bytes"] / base[name]["peak_bytes"]
+                )
+            row["regression"] = row["time_ratio"] > 1 + threshold or (
+                row["memory_ratio"] is not None
+                and row["memory_ratio"] > 1 + memory_threshold
+            )
+        rows.append(row)
+    return rows
+
+
+def format_comparison(rows, baseline, current):
+    """Return the rows from `compare` as a text table."""
+
+    def label(results):
+        commit = results["meta"].get("commit") or "unknown"
+        return commit[:10] + ("+" if results["meta"].get("dirty") else "")
+
+    lines = [f"baseline {label(baseline)} -> current {label(current)}"]
+    lines.append(f"{'benchmark':<42}{'time':>10}{'memory':>10}")
+    for row in rows:
+        if row["time_ratio"] is None:
+            status = "only in baseline" if row["name"] in baseline[
+                "benchmarks"
+            ] else "new"
+            lines.append(f"{row['name']:<42}{status:>20}")
+            continue
+        memory = (
+            "-" if row["memory_ratio"] is None
+            else f"{row['memory_ratio']:.2f}x"
+        )
+        lines.append(
+            f"{row['name']:<42}{row['time_ratio']:>9.2f}x{memory:>10}"
+            + ("  REGRESSION" if row["regression"] else "")
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run the benchmarks.")
+    run_parser.add_argument("-o", "--output", default="benchmarks.json",
+                            help="Results file to write.")
+    run_parser.add_argument("--tree", default=ROOT,
+                            help="Checkout of pytesimal to benchmark.")
+    run_parser.add_argument("--quick", action="store_true",
+                            help="Smaller problems, fewer repeats.")
+    run_parser.add_argument("--repeat", type=int,
+                            help="Timed calls per benchmark.")
+    run_parser.add_argument("--filter", dest="name_filter",
+                            help="Only run benchmarks containing this.")
+    compare_parser = commands.add_parser(
+        "compare", help="Compare two results files."
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="Allowed fractional slowdown.")
+    compare_parser.add_argument("--memory-threshold", type=float,
+                                default=0.1,
+                                help="Allowed fractional memory growth.")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run(args.tree, args.quick, args.repeat, args.name_filter,
+                      stream=sys.stdout)
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    rows = compare(baseline, current, args.threshold, args.memory_threshold)
+    print(format_comparison(rows, baseline, current))
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
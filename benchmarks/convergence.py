@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Measure solver accuracy against the analytical solution for a cooling sphere.
+
+A planetesimal without a core (see `examples/no_core.py`), with constant
+mantle properties, no regolith, a fixed surface temperature and a zero-flux
+condition at the centre, cools as a conducting sphere, for which the
+temperature is known as a series (Carslaw and Jaeger, 1959, sec. 9.3):
+
+    T(r, t) = Ts + (T0 - Ts) * 2 * sum_n (-1)^(n+1) * sinc(n r / a)
+                                       * exp(-kappa n^2 pi^2 t / a^2)
+
+Every solver backend in `numerical_methods.SOLVER_BACKENDS` is run over a
+ladder of radial steps and timesteps. For each run the maximum and the
+volume-weighted root mean square errors at a set of output times are
+recorded with the wall time of the solve. The observed order of convergence
+is worked out between neighbouring rungs of each ladder, and the runs that
+no other run beats on both error and cost form a Pareto front, from which
+the cheapest run meeting an accuracy target can be picked.
+
+Usage
+-----
+
+Run the default ladder and save the results::
+
+    python benchmarks/convergence.py -o convergence.json
+
+Choose the ladder, output times and accuracy target (in K)::
+
+    python benchmarks/convergence.py --dr 4000 2000 1000 500 \\
+        --timestep 2e11 1e11 5e10 --times 2.5 5 10 --target 0.5
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from pytesimal import core_function  # noqa: E402
+from pytesimal import mantle_properties  # noqa: E402
+from pytesimal import numerical_methods  # noqa: E402
+from pytesimal import setup_functions  # noqa: E402
+
+MYR = 3.1556926e13  # seconds in a million years
+NORMS = ("linf", "l2")
+
+
+def analytical_temperature(
+    radii,
+    time_s,
+    radius,
+    diffusivity,
+    temp_init,
+    temp_surface,
+    tolerance=1e-12,
+    max_terms=100000,
+):
+    """
+    Return the temperature in a conductively cooling sphere.
+
+    The sphere starts at a uniform `temp_init` and its surface is held at
+    `temp_surface`.
+
+    Parameters
+    ----------
+    radii : numpy.ndarray
+        Distances from the centre, in m.
+    time_s : float
+        Time since cooling started, in s.
+    radius : float
+        Radius of the sphere, in m.
+    diffusivity : float
+        Thermal diffusivity, in m^2 s^-1.
+    temp_init : float
+        Initial temperature, in K.
+    temp_surface : float
+        Surface temperature, in K.
+    tolerance : float, default 1e-12
+        Terms are summed until their exponential factor drops below this.
+    max_terms : int, default 100000
+        Never sum more terms than this.
+
+    Returns
+    -------
+    temperatures : numpy.ndarray
+        Temperatures at `radii`, in K.
+
+    """
+    radii = np.asarray(radii, dtype=float)
+    if time_s <= 0:
+        return np.where(radii < radius, temp_init, temp_surface)
+    decay = diffusivity * np.pi ** 2 * time_s / radius ** 2
+    n_terms = int(np.ceil(np.sqrt(np.log(1.0 / tolerance) / decay))) + 1
+    n_terms = min(n_terms, max_terms)
+    theta = np.zeros_like(radii)
+    # sum in blocks so that many terms on a fine grid stay small in memory
+    for first in range(1, n_terms + 1, 1000):
+        n = np.arange(first, min(first + 1000, n_terms + 1))[:, None]
+        theta += np.sum(
+            np.where(n % 2 == 1, 1.0, -1.0)
+            * np.sinc(n * radii / radius)
+            * np.exp(-decay * n ** 2),
+            axis=0,
+        )
+    return temp_surface + (temp_init - temp_surface) * 2.0 * theta
+
+
+def solve_sphere(
+    backend,
+    radius,
+    dr,
+    timestep,
+    max_time,
+    temp_init=1600.0,
+    temp_surface=250.0,
+):
+    """
+    Solve a planetesimal without a core with one solver backend.
+
+    The grid runs from a vanishingly small core (radius `dr / 1000`) out to
+    `radius`, where the surface temperature is fixed; the base of the
+    mantle has a zero-flux condition and there is no regolith.
+
+    Parameters
+    ----------
+    backend : str
+        Name of the backend in `numerical_methods.SOLVER_BACKENDS`.
+    radius : float
+        Radius of the sphere, in m.
+    dr : float
+        Radial step, in m.
+    timestep : float
+        Timestep, in s.
+    max_time : float
+        Model time to run for, in Myr.
+    temp_init : float, default 1600.0
+        Initial temperature, in K.
+    temp_surface : float, default 250.0
+        Surface temperature, in K.
+
+    Returns
+    -------
+    radii : numpy.ndarray
+        Radii of the grid, in m.
+    times : numpy.ndarray
+        Model times, in s.
+    temperatures : numpy.ndarray
+        Mantle temperature history, in K.
+    wall_time : float
+        Wall time of the solve, in s.
+
+    """
+    r_core = dr / 1000.0
+    # extend the planet by one step: set_up leaves out the last radius
+    r_planet = radius + dr
+    (
+        r_core,
+        radii,
+        core_radii,
+        reg_thickness,
+        where_regolith,
+        times,
+        temperatures,
+        coretemp,
+    ) = setup_functions.set_up(
+        timestep, r_planet, r_core / r_planet, 0.0, max_time, dr
+    )
+    # the core is too small to hold any heat and is not coupled to the
+    # mantle through the zero-flux condition
+    core_values = core_function.IsothermalEutecticCore(
+        initial_temperature=temp_init,
+        melting_temperature=1200.0,
+        outer_r=r_core,
+        inner_r=0,
+        rho=7800.0,
+        cp=850.0,
+        core_latent_heat=270000.0,
+    )
+    cond, heatcap, dens = mantle_properties.set_up_mantle_properties()
+    start = time.perf_counter()
+    temperatures, _, _ = numerical_methods.SOLVER_BACKENDS[backend](
+        core_values,
+        [],
+        temp_init,
+        temp_init,
+        numerical_methods.surface_dirichlet_bc,
+        numerical_methods.cmb_neumann_bc,
+        temp_surface,
+        temperatures,
+        dr,
+        coretemp,
+        timestep,
+        r_core,
+        radii,
+        times,
+        where_regolith,
+        0.0,
+        cond,
+        heatcap,
+        dens,
+    )
+    wall_time = time.perf_counter() - start
+    return radii, times, temperatures, wall_time
+
+
+def error_norms(radii, computed, expected):
+    """
+    Return the maximum and volume-weighted rms differences of two profiles.
+
+    Parameters
+    ----------
+    radii : numpy.ndarray
+        Radii of the grid, in m.
+    computed, expected : numpy.ndarray
+        Temperatures at `radii`, with radius along the first axis.
+
+    Returns
+    -------
+    norms : dict
+        "linf" and "l2", in K.
+
+    """
+    error = np.asarray(computed) - np.asarray(expected)
+    weights = radii ** 2
+    if error.ndim > 1:
+        weights = weights[:, None] * np.ones(error.shape[1:])
+    return {
+        "linf": float(np.max(np.abs(error))),
+        "l2": float(np.sqrt(np.sum(weights * error ** 2) / np.sum(weights))),
+    }
+
+
+def observed_order(coarse_error, fine_error, coarse_step, fine_step):
+    """
+    Return the order of convergence seen between two resolutions.
+
+    Returns None when either error is zero or the steps are equal.
+    """
+    if coarse_error <= 0 or fine_error <= 0 or coarse_step == fine_step:
+        return None
+    return float(
+        np.log(coarse_error / fine_error) / np.log(coarse_step / fine_step)
+    )
+
+
+def run_ladder(
+    drs=(4000.0, 2000.0, 1000.0),
+    timesteps=(4e11, 2e11, 1e11),
+    output_times=(2.5, 5.0, 10.0),
+    radius=50000.0,
+    backends=None,
+    stream=None,
+):
+    """
+    Run every backend on every stable combination of `drs` and `timesteps`.
+
+    Parameters
+    ----------
+    drs : sequence of float
+        Radial steps, in m.
+    timesteps : sequence of float
+        Timesteps, in s.
+    output_times : sequence of float
+        Model times to measure the error at, in Myr. Each is rounded to the
+        nearest timestep of a run.
+    radius : float, default 50000.0
+        Radius of the sphere, in m.
+    backends : sequence of str, optional
+        Backends to run; all of `numerical_methods.SOLVER_BACKENDS` by
+        default.
+    stream : file, optional
+        Stream for one line of progress per run.
+
+    Returns
+    -------
+    runs : list of dict
+        One entry per run with "backend", "dr", "timestep",
+        "stability_criterion", "stable", and for stable runs "wall_time",
+        "steps", "linf" and "l2" (errors in K over all output times) and
+        "errors" per output time.
+
+    """
+    if backends is None:
+        backends = sorted(numerical_methods.SOLVER_BACKENDS)
+    cond, heatcap, dens = mantle_properties.set_up_mantle_properties()
+    diffusivity = numerical_methods.calculate_diffusivity(
+        cond.getk(), heatcap.getcp(), dens.getrho()
+    )
+    max_time = max(output_times)
+    runs = []
+    for backend in backends:
+        for dr in sorted(drs, reverse=True):
+            for timestep in sorted(timesteps, reverse=True):
+                criterion = numerical_methods.stability_criterion(
+                    diffusivity, timestep, dr
+                )
+                entry = {
+                    "backend": backend,
+                    "dr": dr,
+                    "timestep": timestep,
+                    "stability_criterion": criterion,
+                    "stable": criterion <= 0.5,
+                }
+                runs.append(entry)
+                if not entry["stable"]:
+                    continue
+                radii, times, temperatures, wall_time = solve_sphere(
+                    backend, radius, dr, timestep, max_time
+                )
+                columns = sorted(
+                    {
+                        min(int(round(t * MYR / timestep)), times.size - 1)
+                        for t in output_times
+                    }
+                )
+                expected = np.stack(
+                    [
+                        analytical_temperature(
+                            radii, times[i], radii[-1], diffusivity,
+                            1600.0, 250.0,
+                        )
+                        for i in columns
+                    ],
+                    axis=1,
+                )
+                computed = temperatures[:, columns]
+                entry.update(error_norms(radii, computed, expected))
+                entry["errors"] = [
+                    dict(
+                        time=times[i] / MYR,
+                        **error_norms(
+                            radii, computed[:, k], expected[:, k]
+                        ),
+                    )
+                    for k, i in enumerate(columns)
+                ]
+                entry["wall_time"] = wall_time
+                entry["steps"] = times.size - 1
+                if stream is not None:
+                    stream.write(
+                        f"{backend:<8}dr {dr:>8g} m  dt {timestep:>8.3g} s"
+                        f"  linf {entry['linf']:>10.4g} K"
+                        f"  {wall_time:>8.3f} s\n"
+                    )
+                    stream.flush()
+    return runs
+
+
+def convergence_orders(runs, norm="linf"):
+    """
+    Return the observed orders along each rung of the ladders.
+
+    Parameters
+    ----------
+    runs : list of dict
+        Runs returned by `run_ladder`.
+    norm : str, default "linf"
+        Error norm to use, "linf" or "l2".
+
+    Returns
+    -------
+    orders : list of dict
+        Entries with "backend", "refine" ("dr" at a fixed timestep, or
+        "timestep" at a fixed dr), the fixed "dr" or "timestep", the
+        "coarse" and "fine" steps and the observed "order".
+
+    """
+    stable = [run for run in runs if run["stable"]]
+    orders = []
+    for refine, fixed in (("dr", "timestep"), ("timestep", "dr")):
+        groups = {}
+        for run in stable:
+            groups.setdefault((run["backend"], run[fixed]), []).append(run)
+        for (backend, value), group in sorted(groups.items()):
+            group.sort(key=lambda run: -run[refine])
+            for coarse, fine in zip(group, group[1:]):
+                orders.append(
+                    {
+                        "backend": backend,
+                        "refine": refine,
+                        fixed: value,
+                        "coarse": coarse[refine],
+                        "fine": fine[refine],
+                        "order": observed_order(
+                            coarse[norm], fine[norm],
+                            coarse[refine], fine[refine],
+                        ),
+                    }
+                )
+    return orders
+
+
+def pareto_front(runs, norm="linf"):
+    """
+    Return the runs that no other run beats on both error and wall time.
+
+    Parameters
+    ----------
+    runs : list of dict
+        Runs returned by `run_ladder`.
+    norm : str, default "linf"
+        Error norm to use, "linf" or "l2".
+
+    Returns
+    -------
+    front : list of dict
+        Runs on the front, from cheapest to most accurate.
+
+    """
+    front = []
+    best = np.inf
+    stable = [run for run in runs if run["stable"]]
+    for run in sorted(stable, key=lambda run: (run["wall_time"], run[norm])):
+        if run[norm] < best:
+            front.append(run)
+            best = run[norm]
+    return front
+
+
+def cheapest_within(runs, target, norm="linf"):
+    """
+    Return the fastest run with an error of at most `target`, or None.
+    """
+    for run in pareto_front(runs, norm):
+        if run[norm] <= target:
+            return run
+    return None
+
+
+def format_report(runs, norm="linf", target=None):
+    """
+    Return the runs, observed orders and Pareto front as readable text.
+    """
+    front = pareto_front(runs, norm)
+    lines = [
+        f"{'backend':<8}{'dr (m)':>9}{'dt (s)':>10}{'stability':>11}"
+        f"{'linf (K)':>11}{'l2 (K)':>11}{'time (s)':>10}"
+    ]
+    for run in runs:
+        if not run["stable"]:
+            lines.append(
+                f"{run['backend']:<8}{run['dr']:>9g}{run['timestep']:>10.3g}"
+                f"{run['stability_criterion']:>11.3f}    unstable, not run"
+            )
+            continue
+        lines.append(
+            f"{run['backend']:<8}{run['dr']:>9g}{run['timestep']:>10.3g}"
+            f"{run['stability_criterion']:>11.3f}{run['linf']:>11.4g}"
+            f"{run['l2']:>11.4g}{run['wall_time']:>10.3f}"
+            + ("  *" if any(run is other for other in front) else "")
+        )
+    lines.append("")
+    lines.append(f"Observed order ({norm}):")
+    for entry in convergence_orders(runs, norm):
+        fixed = "timestep" if entry["refine"] == "dr" else "dr"
+        order = "-" if entry["order"] is None else f"{entry['order']:.2f}"
+        lines.append(
+            f"  {entry['backend']:<8}{entry['refine']:<9}"
+            f"{entry['coarse']:>9.3g} -> {entry['fine']:<9.3g}"
+            f"at {fixed} {entry[fixed]:<9.3g}{order:>7}"
+        )
+    lines.append("")
+    lines.append(f"* Pareto front of {norm} error against wall time")
+    if target is not None:
+        best = cheapest_within(runs, target, norm)
+        if best is None:
+            lines.append(f"No run reaches {norm} <= {target:g} K")
+        else:
+            lines.append(
+                f"Cheapest with {norm} <= {target:g} K: {best['backend']}, "
+                f"dr {best['dr']:g} m, timestep {best['timestep']:g} s "
+                f"({best['wall_time']:.3f} s)"
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--dr", type=float, nargs="+",
+                        default=[4000.0, 2000.0, 1000.0],
+                        help="Radial steps, in m.")
+    parser.add_argument("--timestep", type=float, nargs="+",
+                        default=[4e11, 2e11, 1e11],
+                        help="Timesteps, in s.")
+    parser.add_argument("--times", type=float, nargs="+",
+                        default=[2.5, 5.0, 10.0],
+                        help="Output times to measure errors at, in Myr.")
+    parser.add_argument("--radius", type=float, default=50000.0,
+                        help="Radius of the sphere, in m.")
+    parser.add_argument("--backend", nargs="+", dest="backends",
+                        choices=sorted(numerical_methods.SOLVER_BACKENDS),
+                        help="Backends to run (default: all).")
+    parser.add_argument("--norm", choices=NORMS, default="linf",
+                        help="Error norm for orders and the Pareto front.")
+    parser.add_argument("--target", type=float,
+                        help="Accuracy target, in K.")
+    parser.add_argument("-o", "--output", help="Results file to write.")
+    args = parser.parse_args(argv)
+
+    runs = run_ladder(args.dr, args.timestep, args.times, args.radius,
+                      args.backends, stream=sys.stdout)
+    print()
+    print(format_report(runs, args.norm, args.target))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(
+                {
+                    "radius": args.radius,
+                    "output_times": args.times,
+                    "runs": runs,
+                    "orders": convergence_orders(runs, args.norm),
+                    "pareto_front": [
+                        [run["backend"], run["dr"], run["timestep"]]
+                        for run in pareto_front(runs, args.norm)
+                    ],
+                },
+                file,
+                indent=2,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
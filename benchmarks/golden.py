@@ -0,0 +1,631 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Check solver backends against stored reference outputs.
+
+A set of canonical configurations is solved with the reference backend
+(`numerical_methods.discretisation`, registered as "ftcs") and the
+temperature and cooling rate histories are stored as chunked result files,
+along with the derived analysis outputs: when the core starts and finishes
+freezing, and the depths and timings of the Imilac and Esquel pallasites.
+Every backend in `numerical_methods.SOLVER_BACKENDS` can then be checked
+against them. The reference is streamed one block of timesteps at a time, so
+only the history being checked is held in memory in full, and for each array
+the maximum absolute error, the relative error (maximum absolute error over
+the largest reference value) and the position of the worst difference are
+reported.
+
+The configurations are:
+
+default_constant
+    The default parameters file, with constant mantle properties.
+all_variable
+    The default parameters with temperature-dependent conductivity,
+    density and heat capacity.
+neumann_no_core
+    A planetesimal without a core and with a zero-flux base, as in
+    `examples/no_core.py`.
+bryson2015
+    The model of Bryson et al. (2015), as in `examples/recreate_bryson.py`.
+
+Usage
+-----
+
+Record references from a trusted checkout; the full 400 Myr runs take a
+while, so `--max-time` records shorter runs (the checks use the same
+duration as the references)::
+
+    python benchmarks/golden.py record --max-time 20
+
+Check every backend against them; the exit status is 1 if any array or
+analysis output differs by more than the tolerances::
+
+    python benchmarks/golden.py check --rtol 1e-10 -o report.json
+
+References are written to `benchmarks/golden` unless `--dir` is given, and
+are not tracked by git.
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from pytesimal import analysis  # noqa: E402
+from pytesimal import core_function  # noqa: E402
+from pytesimal import load_plot_save  # noqa: E402
+from pytesimal import mantle_properties  # noqa: E402
+from pytesimal import numerical_methods  # noqa: E402
+from pytesimal import setup_functions  # noqa: E402
+
+GOLDEN_DIR = os.path.join(ROOT, "benchmarks", "golden")
+REFERENCE_BACKEND = "ftcs"
+CHUNK_STEPS = 4096
+ARRAY_NAMES = ("temperatures", "coretemp", "dT_by_dt", "dT_by_dt_core")
+
+_DEFAULT = {
+    "timestep": 1e11,
+    "r_planet": 250000.0,
+    "core_size_factor": 0.5,
+    "reg_fraction": 0.032,
+    "max_time": 400.0,
+    "temp_core_melting": 1200.0,
+    "mantle_heat_cap_value": 819.0,
+    "mantle_density_value": 3341.0,
+    "mantle_conductivity_value": 3.0,
+    "core_cp": 850.0,
+    "core_density": 7800.0,
+    "temp_init": 1600.0,
+    "temp_surface": 250.0,
+    "core_temp_init": 1600.0,
+    "core_latent_heat": 270000.0,
+    "kappa_reg": 5e-8,
+    "dr": 1000.0,
+    "cond_constant": "y",
+    "density_constant": "y",
+    "heat_cap_constant": "y",
+    "bottom_bc": "dirichlet",
+}
+
+CONFIGURATIONS = {
+    "default_constant": dict(_DEFAULT),
+    "all_variable": dict(
+        _DEFAULT,
+        cond_constant="n",
+        density_constant="n",
+        heat_cap_constant="n",
+    ),
+    "neumann_no_core": dict(
+        _DEFAULT, core_size_factor=0.001, bottom_bc="neumann"
+    ),
+    # Bryson et al. (2015): 200 km body with an 8 km megaregolith
+    "bryson2015": dict(
+        _DEFAULT,
+        timestep=2e11,
+        r_planet=200000.0,
+        core_size_factor=(200000.0 - 8000.0) * 0.5 / 200000.0,
+        reg_fraction=8000.0 / 200000.0,
+        mantle_density_value=3000.0,
+        mantle_heat_cap_value=3.0 / (3000.0 * 5e-7),
+    ),
+}
+
+# cloudy zone diameters of the pallasites in Bryson et al. (2015), in nm
+METEORITES = {"imilac": 147, "esquel": 158}
+
+
+def solve(config, backend=REFERENCE_BACKEND, max_time=None):
+    """
+    Solve a configuration with one backend.
+
+    Parameters
+    ----------
+    config : dict
+        Model parameters, as in `CONFIGURATIONS`.
+    backend : str
+        Name of the backend in `numerical_methods.SOLVER_BACKENDS`.
+    max_time : float, optional
+        Model time in Myr, instead of the configuration's.
+
+    Returns
+    -------
+    result : dict
+        "temperatures", "coretemp", "latent", "times", "radii",
+        "max_time" and "wall_time" of the solve.
+
+    """
+    if max_time is None:
+        max_time = config["max_time"]
+    (
+        r_core,
+        radii,
+        core_radii,
+        reg_thickness,
+        where_regolith,
+        times,
+        temperatures,
+        coretemp,
+    ) = setup_functions.set_up(
+        config["timestep"],
+        config["r_planet"],
+        config["core_size_factor"],
+        config["reg_fraction"],
+        max_time,
+        config["dr"],
+    )
+    core_values = core_function.IsothermalEutecticCore(
+        initial_temperature=config["core_temp_init"],
+        melting_temperature=config["temp_core_melting"],
+        outer_r=r_core,
+        inner_r=0,
+        rho=config["core_density"],
+        cp=config["core_cp"],
+        core_latent_heat=config["core_latent_heat"],
+    )
+    cond, heatcap, dens = mantle_properties.set_up_mantle_properties(
+        config["cond_constant"],
+        config["density_constant"],
+        config["heat_cap_constant"],
+        config["mantle_density_value"],
+        config["mantle_heat_cap_value"],
+        config["mantle_conductivity_value"],
+    )
+    bottom_mantle_bc = {
+        "dirichlet": numerical_methods.cmb_dirichlet_bc,
+        "neumann": numerical_methods.cmb_neumann_bc,
+    }[config["bottom_bc"]]
+    start = time.perf_counter()
+    (
+        temperatures,
+        coretemp,
+        latent,
+    ) = numerical_methods.SOLVER_BACKENDS[backend](
+        core_values,
+        [],
+        config["temp_init"],
+        config["core_temp_init"],
+        numerical_methods.surface_dirichlet_bc,
+        bottom_mantle_bc,
+        config["temp_surface"],
+        temperatures,
+        config["dr"],
+        coretemp,
+        config["timestep"],
+        r_core,
+        radii,
+        times,
+        where_regolith,
+        config["kappa_reg"],
+        cond,
+        heatcap,
+        dens,
+    )
+    return {
+        "temperatures": temperatures,
+        "coretemp": coretemp,
+        "latent": latent,
+        "times": times,
+        "radii": radii,
+        "max_time": max_time,
+        "wall_time": time.perf_counter() - start,
+    }
+
+
+def _plain(value):
+    """Return `value` with numpy scalars and tuples made json-friendly."""
+    if isinstance(value, (tuple, list)):
+        return [_plain(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def derived_outputs(config, result, mantle_rates):
+    """
+    Return the analysis outputs of a solved configuration.
+
+    Parameters
+    ----------
+    config : dict
+        Model parameters, as in `CONFIGURATIONS`.
+    result : dict
+        Solve returned by `solve`.
+    mantle_rates : numpy.ndarray
+        Cooling rates of the mantle, in K/s.
+
+    Returns
+    -------
+    outputs : dict
+        "time_core_frozen" and "fully_frozen" in s, "latent_steps", and for
+        each meteorite in `METEORITES` the values returned by
+        `analysis.meteorite_depth_and_timing` (or the error it raised).
+
+    """
+    timestep = config["timestep"]
+    (_, _, time_core_frozen, fully_frozen) = analysis.core_freezing(
+        result["coretemp"],
+        result["max_time"],
+        result["times"],
+        result["latent"],
+        config["temp_core_melting"],
+        timestep,
+    )
+    outputs = {
+        "time_core_frozen": _plain(time_core_frozen),
+        "fully_frozen": _plain(fully_frozen),
+        "latent_steps": len(result["latent"]),
+    }
+    for name, diameter in METEORITES.items():
+        rate = analysis.cooling_rate_to_seconds(
+            analysis.cooling_rate_cloudyzone_diameter(diameter)
+        )
+        try:
+            outputs[name] = _plain(
+                analysis.meteorite_depth_and_timing(
+                    rate,
+                    result["temperatures"],
+                    mantle_rates,
+                    result["radii"],
+                    config["r_planet"],
+                    config["core_size_factor"],
+                    time_core_frozen,
+                    fully_frozen,
+                    dr=config["dr"],
+                    dt=timestep,
+                )
+            )
+        except Exception as error:
+            # recorded so that a backend failing the same way still matches
+            outputs[name] = f"{type(error).__name__}: {error}"
+    return outputs
+
+
+def _git_commit():
+    """Return the commit of this checkout, or None."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+            text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def record(names=None, folder=GOLDEN_DIR, max_time=None, stream=None):
+    """
+    Solve configurations with the reference backend and store the outputs.
+
+    Parameters
+    ----------
+    names : sequence of str, optional
+        Configurations to record; all of `CONFIGURATIONS` by default.
+    folder : str
+        Directory to write `<name>.npz` and `<name>.json` to.
+    max_time : float, optional
+        Model time in Myr, instead of each configuration's.
+    stream : file, optional
+        Stream for one line of progress per configuration.
+
+    """
+    load_plot_save.check_folder_exists(folder)
+    for name in names or CONFIGURATIONS:
+        config = CONFIGURATIONS[name]
+        result = solve(config, REFERENCE_BACKEND, max_time)
+        timestep = config["timestep"]
+        mantle_rates = analysis.cooling_rate(result["temperatures"], timestep)
+        core_rates = analysis.cooling_rate(result["coretemp"], timestep)
+        load_plot_save.save_result_arrays(
+            name,
+            folder,
+            result["temperatures"],
+            result["coretemp"],
+            mantle_rates,
+            core_rates,
+            result["latent"],
+            chunk_steps=CHUNK_STEPS,
+            timestep=timestep,
+        )
+        with open(os.path.join(folder, f"{name}.json"), "w") as file:
+            json.dump(
+                {
+                    "config": config,
+                    "max_time": result["max_time"],
+                    "backend": REFERENCE_BACKEND,
+                    "commit": _git_commit(),
+                    "analysis": derived_outputs(config, result, mantle_rates),
+                },
+                file,
+                indent=2,
+            )
+        if stream is not None:
+            stream.write(
+                f"recorded {name:<20}{result['wall_time']:>10.1f} s\n"
+            )
+            stream.flush()
+
+
+class ErrorStats:
+    """
+    Streaming maximum absolute and relative error between two arrays.
+
+    Blocks of the candidate and reference arrays are passed to `update` in
+    turn; only the running maxima are kept.
+
+    Attributes
+    ----------
+    max_abs : float
+        Largest absolute difference seen.
+    max_reference : float
+        Largest absolute reference value seen.
+    worst : tuple or None
+        (radius index, time index) of the largest difference, or None if
+        there is none.
+
+    """
+
+    def __init__(self):
+        """Start with no differences."""
+        self.max_abs = 0.0
+        self.max_reference = 0.0
+        self.worst = None
+
+    @property
+    def max_rel(self):
+        """Largest absolute difference relative to the largest value."""
+        if self.max_abs == 0:
+            return 0.0
+        if self.max_reference == 0:
+            return np.inf
+        return self.max_abs / self.max_reference
+
+    def update(self, candidate, reference, offset=0):
+        """
+        Add one block of timesteps, starting at time index `offset`.
+        """
+        candidate = np.asarray(candidate, dtype=float)
+        reference = np.asarray(reference, dtype=float)
+        if candidate.size == 0:
+            return
+        diff = np.abs(candidate - reference)
+        # the same non-finite value in both is a match, anything else is not
+        same = (candidate == reference) | (
+            np.isnan(candidate) & np.isnan(reference)
+        )
+        diff[same] = 0.0
+        diff[np.isnan(diff)] = np.inf
+        finite = reference[np.isfinite(reference)]
+        if finite.size:
+            self.max_reference = max(
+                self.max_reference, float(np.max(np.abs(finite)))
+            )
+        index = np.unravel_index(np.argmax(diff), diff.shape)
+        if diff[index] > self.max_abs:
+            self.max_abs = float(diff[index])
+            self.worst = (int(index[0]), int(index[-1]) + offset)
+
+    def passes(self, rtol, atol=0.0):
+        """Return whether the error is within `atol + rtol * max_reference`."""
+        return self.max_abs <= atol + rtol * self.max_reference
+
+    def as_dict(self):
+        """Return the statistics as a dictionary."""
+        return {
+            "max_abs": self.max_abs,
+            "max_rel": self.max_rel,
+            "max_reference": self.max_reference,
+            "worst": self.worst,
+        }
+
+
+def compare_array(candidate, reference):
+    """
+    Compare an in-memory history with a `LazyResultArray`, block by block.
+
+    Parameters
+    ----------
+    candidate : numpy.ndarray
+        History to check, with radius along the first axis.
+    reference : load_plot_save.LazyResultArray
+        Stored reference history.
+
+    Returns
+    -------
+    stats : ErrorStats or None
+        The errors, or None if the shapes differ.
+
+    """
+    if tuple(candidate.shape) != tuple(reference.shape):
+        return None
+    stats = ErrorStats()
+    n_times = reference.shape[-1]
+    step = max(reference.chunk_steps, 1)
+    for start in range(0, n_times, step):
+        stop = min(start + step, n_times)
+        stats.update(
+            candidate[:, start:stop], reference[:, start:stop], offset=start
+        )
+    return stats
+
+
+def _outputs_match(candidate, reference, rtol, atol):
+    """Return whether two analysis outputs agree within the tolerances."""
+    if isinstance(reference, list) and isinstance(candidate, list):
+        return len(candidate) == len(reference) and all(
+            _outputs_match(c, r, rtol, atol)
+            for c, r in zip(candidate, reference)
+        )
+    numbers = (int, float)
+    if (
+        isinstance(reference, numbers)
+        and isinstance(candidate, numbers)
+        and not isinstance(reference, bool)
+    ):
+        return abs(candidate - reference) <= atol + rtol * abs(reference)
+    return candidate == reference
+
+
+def check(names=None, backends=None, folder=GOLDEN_DIR, rtol=1e-10,
+          atol=0.0, stream=None):
+    """
+    Check backends against the stored references.
+
+    Parameters
+    ----------
+    names : sequence of str, optional
+        Configurations to check; all those recorded in `folder` by default.
+    backends : sequence of str, optional
+        Backends to check; all of `numerical_methods.SOLVER_BACKENDS` by
+        default.
+    folder : str
+        Directory holding the references written by `record`.
+    rtol : float, default 1e-10
+        Allowed error relative to the largest reference value of each array,
+        and relative tolerance of numerical analysis outputs.
+    atol : float, default 0.0
+        Allowed absolute error.
+    stream : file, optional
+        Stream for one line per array and configuration.
+
+    Returns
+    -------
+    report : list of dict
+        One entry per backend and configuration with "backend", "config",
+        "wall_time", "arrays" (the `ErrorStats` of each array, or None if
+        the shape differs), "analysis" (reference and candidate values that
+        differ) and "passed".
+
+    """
+    if names is None:
+        names = sorted(
+            filename[:-len(".json")]
+            for filename in os.listdir(folder)
+            if filename.endswith(".json")
+        )
+    if backends is None:
+        backends = sorted(numerical_methods.SOLVER_BACKENDS)
+    report = []
+    for name in names:
+        with open(os.path.join(folder, f"{name}.json")) as file:
+            golden = json.load(file)
+        config = golden["config"]
+        for backend in backends:
+            result = solve(config, backend, golden["max_time"])
+            timestep = config["timestep"]
+            mantle_rates = analysis.cooling_rate(
+                result["temperatures"], timestep
+            )
+            candidates = {
+                "temperatures": result["temperatures"],
+                "coretemp": result["coretemp"],
+                "dT_by_dt": mantle_rates,
+                "dT_by_dt_core": analysis.cooling_rate(
+                    result["coretemp"], timestep
+                ),
+            }
+            arrays = {}
+            passed = True
+            with load_plot_save.load_results(
+                os.path.join(folder, f"{name}.npz")
+            ) as reference:
+                for array_name in ARRAY_NAMES:
+                    stats = compare_array(
+                        candidates[array_name],
+                        getattr(reference, array_name),
+                    )
+                    ok = stats is not None and stats.passes(rtol, atol)
+                    passed = passed and ok
+                    arrays[array_name] = (
+                        None if stats is None else stats.as_dict()
+                    )
+                    if stream is not None:
+                        if stats is None:
+                            summary = "shape differs"
+                        elif stats.worst is None:
+                            summary = "identical"
+                        else:
+                            summary = (
+                                f"max abs {stats.max_abs:.3g}, rel "
+                                f"{stats.max_rel:.3g} at {stats.worst}"
+                            )
+                        stream.write(
+                            f"{'ok  ' if ok else 'FAIL'} {backend:<10}"
+                            f"{name:<20}{array_name:<15}{summary}\n"
+                        )
+            outputs = derived_outputs(config, result, mantle_rates)
+            differences = {
+                key: {"reference": value, "candidate": outputs.get(key)}
+                for key, value in golden["analysis"].items()
+                if not _outputs_match(outputs.get(key), value, rtol, atol)
+            }
+            passed = passed and not differences
+            if stream is not None:
+                stream.write(
+                    f"{'ok  ' if not differences else 'FAIL'} {backend:<10}"
+                    f"{name:<20}{'analysis':<15}"
+                    + (", ".join(sorted(differences)) or "identical")
+                    + "\n"
+                )
+                stream.flush()
+            report.append(
+                {
+                    "backend": backend,
+                    "config": name,
+                    "wall_time": result["wall_time"],
+                    "arrays": arrays,
+                    "analysis": differences,
+                    "passed": passed,
+                }
+            )
+    return report
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser(
+        "record", help="Store reference outputs."
+    )
+    record_parser.add_argument("--max-time", type=float,
+                               help="Model time in Myr for every run.")
+    check_parser = commands.add_parser(
+        "check", help="Check backends against the references."
+    )
+    check_parser.add_argument("--backend", nargs="+", dest="backends",
+                              choices=sorted(numerical_methods.SOLVER_BACKENDS),
+                              help="Backends to check (default: all).")
+    check_parser.add_argument("--rtol", type=float, default=1e-10,
+                              help="Allowed relative error.")
+    check_parser.add_argument("--atol", type=float, default=0.0,
+                              help="Allowed absolute error.")
+    check_parser.add_argument("-o", "--output", help="Report file to write.")
+    for command in (record_parser, check_parser):
+        command.add_argument("--config", nargs="+", dest="names",
+                             choices=sorted(CONFIGURATIONS),
+                             help="Configurations (default: all).")
+        command.add_argument("--dir", dest="folder", default=GOLDEN_DIR,
+                             help="Directory of the reference outputs.")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        record(args.names, args.folder, args.max_time, stream=sys.stdout)
+        return 0
+
+    report = check(args.names, args.backends, args.folder, args.rtol,
+                   args.atol, stream=sys.stdout)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2, default=float)
+    return 0 if all(entry["passed"] for entry in report) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
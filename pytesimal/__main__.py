@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run the `pytesimal` command with `python -m pytesimal`.
+
+"""
+
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -75,10 +75,23 @@ def core_freezing(
     return (core_frozen, times_frozen, time_core_frozen, fully_frozen)
 
 
-def cooling_rate(temperature_array, timestep):
-    """Calculate an array of cooling rates from temperature array."""
-    dTdt = np.gradient(temperature_array, timestep, axis=1)
-    return dTdt
+def cooling_rate(temperature_array, timestep, out=None):
+    """
+    Calculate an array of cooling rates from temperature array.
+
+    Central differences in time, and one-sided differences at the first and
+    last timesteps, as by `numpy.gradient`. If `out` is given, an array of
+    the same shape, the rates are written to it instead of a new array.
+    """
+    if out is None:
+        dTdt = np.gradient(temperature_array, timestep, axis=1)
+        return dTdt
+    temperatures = np.asarray(temperature_array)
+    np.subtract(temperatures[:, 2:], temperatures[:, :-2], out=out[:, 1:-1])
+    out[:, 1:-1] /= 2.0 * timestep
+    out[:, 0] = (temperatures[:, 1] - temperatures[:, 0]) / timestep
+    out[:, -1] = (temperatures[:, -1] - temperatures[:, -2]) / timestep
+    return out
 
 
 def cooling_rate_cloudyzone_diameter(d):
@@ -223,11 +236,65 @@ def meteorite_depth_and_timing(
         t_val.append(index_where_800K_ish)
         dt_val.append(index_where_dtbydT)
 
-    # Find the points where they cross, this will lead to a depth of formation
     assert len(t_val) == len(
         dt_val
     ), "Contour length error!"  # flags an error if t_val and dt_val are not
     # the same length
+
+    t_val2 = []  # for the 593K contour
+    if any(np.array(t_val) - np.array(dt_val) == 0):
+        # only needed if the 800K and cooling rate contours cross
+        for ti in range(5, temperatures.shape[1]):
+            # Find the index where temperatures are 593K by finding the
+            # minimum of (a given temperature-593)
+            t_val2.append(np.argmin(np.absolute(temperatures[:, ti] - 593)))
+
+    return _depth_and_timing_from_contours(
+        t_val,
+        dt_val,
+        t_val2,
+        radii,
+        r_planet,
+        core_size_factor,
+        time_core_frozen,
+        fully_frozen,
+        dr,
+        dt,
+    )
+
+
+def _depth_and_timing_from_contours(
+    t_val,
+    dt_val,
+    t_val2,
+    radii,
+    r_planet,
+    core_size_factor,
+    time_core_frozen,
+    fully_frozen,
+    dr,
+    dt,
+):
+    """
+    Find depth of genesis and timing from the isotherm contours of a run.
+
+    Shared by `meteorite_depth_and_timing` and the precomputed indices of
+    `query_service.ResultIndex`, so that both return the same values. The
+    other parameters and the return values are those of
+    `meteorite_depth_and_timing`.
+
+    Parameters
+    ----------
+    t_val : array_like of int
+        Radial index of the 800K contour at each timestep where it lies in
+        the mantle and the meteorite cooling rate was matched.
+    dt_val : array_like of int
+        Radial index of the matched cooling rate at the same timesteps.
+    t_val2 : array_like of int
+        Radial index of the 593K contour at every timestep from the fifth.
+
+    """
+    # Find the points where they cross, this will lead to a depth of formation
     crosses = (
         np.array(t_val) - np.array(dt_val) == 0
     )  # boolean for if the indices of the two arrays are the same
@@ -245,58 +312,40 @@ def meteorite_depth_and_timing(
         dt_val[crossing_index2]
     ]  # radius where this first crossing occurs
 
-    t_val2 = []  # for the 593K contour
-    d_val = []
-    for ti in range(5, temperatures.shape[1]):
-        # Find the index where temperatures are 593K by finding the minimum of
-        # (a given temperature-593)
-        index_where_593K_ish = np.argmin(
-            np.absolute(temperatures[:, ti] - 593)
-        )
-        if (np.absolute(temperatures[index_where_593K_ish, ti] - 593)) > 10:
-            pass
-
-        t_val2.append(index_where_593K_ish)
-        d_val.append(
-            ((Critical_Radius) / dr - ((r_planet / dr) * core_size_factor))
-        )  # computes the depth, converts from radius to depth
-    crossing = [
-        np.array(t_val2) - d_val < 0.00001
-    ]  # indices where computed depth crosses temperature contour (593 K)
-
+    # computes the depth, converts from radius to depth
+    d_val = (Critical_Radius) / dr - ((r_planet / dr) * core_size_factor)
     crossing_index = np.argmax(
-        crossing
-    )  # finds the first 'maximum' which is the first TRUE,
-    # or the first crossing
+        np.array(t_val2) - d_val < 0.00001
+    )  # indices where computed depth crosses temperature contour (593 K),
+    # the first 'maximum' is the first crossing
     Time_of_Crossing = crossing_index * (dt)  # converts to seconds
-    radii_index = int(((d_val)[crossing is True]))
+    radii_index = int(d_val)
 
     # check to see if the depth crosses the 593K contour during solidification
     # or before/after
     if time_core_frozen == 0:
         string = "Core Freezes after Max Time"
-        depth = ((r_planet) - radii[int(((d_val)[crossing is True]))]) / dr
+        depth = ((r_planet) - radii[radii_index]) / dr
+        return (depth, string, time_core_frozen, Time_of_Crossing)
+    if radii_index > len(radii):
+        string = "Core has finished solidifying"
+        depth = 0
         return (depth, string, time_core_frozen, Time_of_Crossing)
+    depth = ((r_planet) - radii[radii_index]) / dr
+    if Time_of_Crossing == 0:
+        string = "hmm, see plot"  # lines cross at 0 time, doesn't tell
+        # you when it formed
+    elif Time_of_Crossing < time_core_frozen:
+        string = "Core has not started solidifying yet"
+    elif Time_of_Crossing < fully_frozen:
+        # including a crossing exactly as the core starts to freeze
+        string = "Core has started solidifying"
     else:
-        if radii_index > len(radii):
-            string = "Core has finished solidifying"
-            depth = 0
-            return (depth, string, time_core_frozen, Time_of_Crossing)
-        else:
-            depth = ((r_planet) - radii[int(((d_val)[crossing is True]))]) / dr
-            if Time_of_Crossing == 0:
-                string = "hmm, see plot"  # lines cross at 0 time, doesn't tell
-                # you when it formed
-            if Time_of_Crossing < time_core_frozen and Time_of_Crossing != 0:
-                string = "Core has not started solidifying yet"
-            if time_core_frozen < Time_of_Crossing < fully_frozen:
-                string = "Core has started solidifying"
-            if Time_of_Crossing > fully_frozen:
-                string = "Core has finished solidifying"
-            return (
-                depth,
-                string,
-                time_core_frozen,
-                Time_of_Crossing,
-                Critical_Radius,
-            )
+        string = "Core has finished solidifying"
+    return (
+        depth,
+        string,
+        time_core_frozen,
+        Time_of_Crossing,
+        Critical_Radius,
+    )
@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run model runs from asyncio code without blocking the event loop.
+
+`sweep.run_sweep` blocks until the whole sweep is done. An `AsyncSweep`
+instead accepts runs at any time from a coroutine and solves them in worker
+processes, so that a notebook, a dashboard or an API server running an
+event loop keeps responding while the runs are solved. Runs are solved by
+`quick_workflow.workflow` in a pool of at most `jobs` worker processes, which
+are kept and reused from run to run so that each run does not pay for
+starting Python and importing numpy. Unlike in a
+`concurrent.futures.ProcessPoolExecutor`, each worker solves one run at a
+time over a pipe of its own, so that a run that takes longer than its
+timeout, or is cancelled, can be stopped by killing its worker, which is
+then replaced. Runs waiting for a process start in order of
+priority, lowest value first, and then in the order they were submitted; at
+most `max_queued` can wait, beyond which `submit` waits for room.
+
+Example
+-------
+
+Submit runs, then use the results as they finish::
+
+    async with AsyncSweep(jobs=4, timeout=3600) as runs:
+        for paramfile in paramfiles:
+            await runs.submit(paramfile)
+        urgent = await runs.submit('urgent.txt', priority=-1)
+        async for result in runs.as_completed():
+            print(result['paramfile'], result['error'])
+
+A handle returned by `submit` can be awaited for the result of its run, or
+cancelled::
+
+    handle = await runs.submit('slow.txt', timeout=60)
+    handle.cancel()
+
+Or run a list of parameters files and wait for all the results::
+
+    results = await run_sweep_async(paramfiles, jobs=4)
+
+"""
+
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import multiprocessing
+import os
+import time
+
+from . import sweep
+
+# `sweep._run_job` settings: no lock files, arrays returned in files only
+_NO_CLAIMS = {"claim_dir": None, "skip_complete": False, "stale_after": None}
+_NO_ARRAYS = {"kind": None, "directory": None}
+
+
+def _worker(connection):
+    """Solve the runs sent by an `AsyncSweep` until told to stop."""
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        paramfile, options = job
+        connection.send(
+            sweep._run_job(
+                (paramfile, options, None, 0.0, _NO_CLAIMS, _NO_ARRAYS)
+            )
+        )
+    connection.close()
+
+
+class _Worker:
+    """A worker process of an `AsyncSweep`, and its end of the pipe."""
+
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker, args=(child,), daemon=True
+        )
+        self.process.start()
+        child.close()
+
+    def run(self, paramfile, options):
+        """Solve one run; return its result, or None if the worker died."""
+        try:
+            self.connection.send((paramfile, options))
+            return self.connection.recv()
+        except (EOFError, OSError):
+            return None
+
+    def kill(self):
+        """Stop a run by killing the worker."""
+        self.process.kill()
+
+    def stop(self):
+        """Wait for the worker to exit, asking it to if it is alive."""
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass  # already dead
+        self.process.join()
+        self.connection.close()
+
+
+def _failed(paramfile, error, start):
+    """Return the result of a run that did not finish."""
+    return {
+        "paramfile": paramfile,
+        "summary": None,
+        "error": error,
+        "skipped": None,
+        "arrays": None,
+        "wall_time": time.perf_counter() - start,
+    }
+
+
+class RunHandle:
+    """
+    A run submitted to an `AsyncSweep`.
+
+    Await the handle for the result of the run: a dictionary with the keys
+    of the results of `sweep.run_sweep`. A run that fails, times out or
+    whose worker dies has its "error" set; awaiting a cancelled run raises
+    `asyncio.CancelledError`.
+
+    Attributes
+    ----------
+    paramfile : str
+        Path of the parameters file.
+    priority : float
+        Runs with lower values start first.
+    timeout : float or None
+        Seconds the run may take once started.
+    state : str
+        "queued", "running", "done" or "cancelled" (read only).
+
+    """
+
+    def __init__(self, paramfile, priority, timeout, options, future):
+        self.paramfile = paramfile
+        self.priority = priority
+        self.timeout = timeout
+        self.options = options
+        self._state = "queued"
+        self._future = future
+        self._task = None
+
+    def __repr__(self):
+        """Return string."""
+        return "RunHandle({0!r}, priority={1}, state={2!r})".format(
+            self.paramfile, self.priority, self.state
+        )
+
+    @property
+    def state(self):
+        """"queued", "running", "done" or "cancelled"."""
+        if self._future.cancelled():
+            return "cancelled"
+        if self._future.done():
+            return "done"
+        return self._state
+
+    def __await__(self):
+        return self._future.__await__()
+
+    def done(self):
+        """Return whether the run has finished or was cancelled."""
+        return self._future.done()
+
+    def cancelled(self):
+        """Return whether the run was cancelled."""
+        return self._future.cancelled()
+
+    def cancel(self):
+        """
+        Cancel the run, killing its worker process if it has started.
+
+        Returns
+        -------
+        cancelled : bool
+            False if the run had already finished.
+
+        """
+        return self._future.cancel()
+
+    def result(self):
+        """Return the result of a finished run."""
+        return self._future.result()
+
+
+class AsyncSweep:
+    """
+    Solve runs in worker processes, submitted and awaited from asyncio.
+
+    Use as an asynchronous context manager: on leaving the block, the
+    unfinished runs are waited for, or cancelled if the block raised.
+
+    Attributes
+    ----------
+    jobs : int
+        Maximum number of runs solved at once.
+    max_queued : int or None
+        Maximum number of runs waiting to start; None for no limit.
+    timeout : float or None
+        Default seconds a run may take once started.
+    options : dict
+        Keyword arguments passed to `quick_workflow.workflow` for every run.
+
+    """
+
+    def __init__(
+        self, jobs=None, max_queued=None, timeout=None, mp_context=None,
+        **options,
+    ):
+        """
+        Prepare to run, starting nothing until the first `submit`.
+
+        Parameters
+        ----------
+        jobs : int, optional
+            Maximum number of runs solved at once; defaults to the number
+            of processors.
+        max_queued : int, optional
+            Maximum number of runs waiting to start.
+        timeout : float, optional
+            Default seconds a run may take once started, after which its
+            process is killed and the run fails with a TimeoutError.
+        mp_context : multiprocessing context, optional
+            Context to start worker processes with; defaults to
+            "forkserver" where available and "spawn" elsewhere, which are
+            safe to use from a process running threads.
+        **options
+            Keyword arguments passed to `quick_workflow.workflow` for every
+            run, e.g. `backend`, `cache` or `instruments`.
+
+        """
+        self.jobs = jobs or os.cpu_count() or 1
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.options = options
+        if mp_context is None:
+            methods = multiprocessing.get_all_start_methods()
+            mp_context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn"
+            )
+        self._context = mp_context
+        self._queue = []
+        self._order = itertools.count()
+        self._running = set()
+        self._idle = []
+        self._handles = []
+        self._closed = False
+        self._dispatcher = None
+
+    def __repr__(self):
+        """Return string."""
+        return "AsyncSweep(jobs={0}, queued={1}, running={2})".format(
+            self.jobs, len(self._queue), len(self._running)
+        )
+
+    def _start(self):
+        """Start dispatching runs, from within the running event loop."""
+        self._wake = asyncio.Event()
+        self._room = asyncio.Event()
+        # one thread per running run waits for its worker
+        self._threads = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.jobs
+        )
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def submit(self, paramfile, priority=0, timeout=None, **options):
+        """
+        Queue a run, waiting while `max_queued` runs are already queued.
+
+        Parameters
+        ----------
+        paramfile : str
+            Path of a parameters file with a .txt extension.
+        priority : float, default 0
+            Runs with lower values start first.
+        timeout : float, optional
+            Seconds the run may take once started; defaults to `timeout`.
+        **options
+            Keyword arguments for `quick_workflow.workflow`, added to
+            `options` for this run.
+
+        Returns
+        -------
+        handle : RunHandle
+            Handle to await or cancel the run.
+
+        """
+        if self._closed:
+            raise RuntimeError("Cannot submit runs to a closed AsyncSweep")
+        if self._dispatcher is None:
+            self._start()
+        while (
+            self.max_queued is not None
+            and len(self._queue) >= self.max_queued
+        ):
+            self._room.clear()
+            await self._room.wait()
+        handle = RunHandle(
+            str(paramfile),
+            priority,
+            self.timeout if timeout is None else timeout,
+            dict(self.options, **options),
+            asyncio.get_running_loop().create_future(),
+        )
+        entry = (priority, next(self._order), handle)
+        handle._future.add_done_callback(
+            lambda future: self._finished(entry)
+        )
+        heapq.heappush(self._queue, entry)
+        self._handles.append(handle)
+        self._wake.set()
+        return handle
+
+    def _finished(self, entry):
+        """Tidy up after a run is done or cancelled."""
+        handle = entry[2]
+        if handle.cancelled():
+            if entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._room.set()
+            elif handle._task is not None:
+                handle._task.cancel()  # kills the worker process
+        self._wake.set()
+
+    async def _dispatch(self):
+        """Start queued runs whenever a worker is free."""
+        while True:
+            while self._queue and len(self._running) < self.jobs:
+                _, _, handle = heapq.heappop(self._queue)
+                self._room.set()
+                if handle.done():
+                    continue  # cancelled while queued
+                handle._state = "running"
+                self._running.add(handle)
+                handle._task = asyncio.ensure_future(self._execute(handle))
+                handle._task.add_done_callback(
+                    lambda task, handle=handle: self._stopped(handle)
+                )
+            if self._closed and not self._queue and not self._running:
+                return
+            self._wake.clear()
+            await self._wake.wait()
+
+    async def _execute(self, handle):
+        """Solve a run in an idle worker process, or a new one."""
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        worker = None
+        try:
+            worker = self._idle.pop() if self._idle else _Worker(self._context)
+            waiting = loop.run_in_executor(
+                self._threads, worker.run, handle.paramfile, handle.options
+            )
+            try:
+                result = await asyncio.wait_for(
+                    asyncio.shield(waiting), handle.timeout
+                )
+                if result is not None:
+                    self._idle.append(worker)  # reuse it for the next run
+                    worker = None
+            except asyncio.TimeoutError:
+                worker.kill()
+                await waiting
+                result = _failed(
+                    handle.paramfile,
+                    f"TimeoutError: run took longer than {handle.timeout} s",
+                    start,
+                )
+            except asyncio.CancelledError:
+                worker.kill()
+                await asyncio.shield(waiting)
+                raise
+            if result is None:
+                worker.process.join()
+                result = _failed(
+                    handle.paramfile,
+                    "Worker process exited with code "
+                    f"{worker.process.exitcode}",
+                    start,
+                )
+            if not handle.done():
+                handle._future.set_result(result)
+        except asyncio.CancelledError:
+            # an Exception before Python 3.8: never swallow it below
+            raise
+        except Exception as error:
+            # e.g. the worker process could not be started
+            if not handle.done():
+                handle._future.set_exception(error)
+        finally:
+            if worker is not None:
+                # killed, dead or in an unknown state: not reused
+                worker.kill()
+                await asyncio.shield(loop.run_in_executor(
+                    self._threads, worker.stop
+                ))
+
+    def _stopped(self, handle):
+        """Free the worker of a run, even one cancelled before it began."""
+        self._running.discard(handle)
+        self._wake.set()
+
+    @property
+    def handles(self):
+        """Handles of every run submitted, in the order submitted."""
+        return list(self._handles)
+
+    def counts(self):
+        """Return the number of runs queued, running, done and cancelled."""
+        counts = dict.fromkeys(("queued", "running", "done", "cancelled"), 0)
+        for handle in self._handles:
+            counts[handle.state] += 1
+        return counts
+
+    async def as_completed(self, handles=None):
+        """
+        Yield the results of runs as they finish.
+
+        Parameters
+        ----------
+        handles : iterable of RunHandle, optional
+            Runs to wait for; defaults to every run submitted so far.
+
+        Yields
+        ------
+        result : dict
+            Result of each run, in the order they finish. Cancelled runs
+            are left out.
+
+        """
+        pending = {
+            handle._future: handle
+            for handle in (self._handles if handles is None else handles)
+        }
+        while pending:
+            done, _ = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for future in done:
+                pending.pop(future)
+                if not future.cancelled():
+                    yield future.result()
+
+    async def close(self, cancel=False):
+        """
+        Stop accepting runs and wait for those submitted.
+
+        Parameters
+        ----------
+        cancel : bool, default False
+            Cancel the unfinished runs instead of waiting for them.
+
+        """
+        self._closed = True
+        if self._dispatcher is None:
+            return
+        if cancel:
+            for handle in self._handles:
+                handle.cancel()
+        self._wake.set()
+        await self._dispatcher
+        loop = asyncio.get_running_loop()
+        while self._idle:
+            await loop.run_in_executor(self._threads, self._idle.pop().stop)
+        self._threads.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close(cancel=exc_type is not None)
+
+
+async def run_sweep_async(paramfiles, jobs=None, timeout=None, **options):
+    """
+    Run parameters files with an `AsyncSweep` and wait for every result.
+
+    Parameters
+    ----------
+    paramfiles : iterable of str
+        Paths of parameters files, each with a .txt extension.
+    jobs : int, optional
+        Maximum number of runs solved at once.
+    timeout : float, optional
+        Seconds each run may take once started.
+    **options
+        Keyword arguments passed to `quick_workflow.workflow`.
+
+    Returns
+    -------
+    results : list of dict
+        Result of each run, in the order given, as from `sweep.run_sweep`.
+
+    """
+    async with AsyncSweep(jobs=jobs, timeout=timeout, **options) as runs:
+        handles = [await runs.submit(paramfile) for paramfile in paramfiles]
+        return [await handle for handle in handles]
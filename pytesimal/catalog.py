@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Index the parameters and results of many model runs in a SQLite catalog.
+
+Each model run saves its parameters and scalar results to a json results
+file (see `load_plot_save.save_params_and_results`). Searching thousands of
+these files for runs with particular parameters means opening every file, so
+this module keeps an index of them in a single local SQLite database: one row
+per run with every parameter, the core crystallisation times, meteorite
+results, wall time and the paths of the results files.
+
+Example
+-------
+
+Runs can be added to a catalog by `pytesimal.quick_workflow.workflow`::
+
+    workflow('example_params', 'path/to/folder', catalog='runs.sqlite')
+
+or existing results files can be indexed, and then queried::
+
+    with RunCatalog('runs.sqlite') as catalog:
+        catalog.index_folder('path/to/results')
+        runs = catalog.query(
+            columns=['r_planet', 'core_begins_to_freeze'],
+            core_size_factor=(0.3, 0.6),
+            cond_constant='n',
+        )
+
+`runs` is a dictionary of numpy arrays, one per column.
+
+Numerical meteorite results are flattened into named values (e.g.
+`meteorite_results.imilac.depth`) which can also be requested as query
+columns.
+
+"""
+
+import glob
+import json
+import numbers
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from . import load_plot_save
+
+# json results keys that are not valid column names
+_RESULT_COLUMNS = {
+    "core_begins_to_freeze": "core_begins_to_freeze",
+    "core finishes freezing": "core_finishes_freezing",
+    "latent_list_len": "latent_list_len",
+}
+_RUN_COLUMNS = (
+    load_plot_save.PARAMETER_NAMES
+    + tuple(_RESULT_COLUMNS.values())
+    + (
+        "meteorite_results",
+        "wall_time",
+        "cache_hit",
+        "results_file",
+        "arrays_file",
+        "added",
+    )
+)
+# parameters that are most often searched on
+_INDEXED_COLUMNS = (
+    "r_planet",
+    "core_size_factor",
+    "reg_fraction",
+    "kappa_reg",
+    "temp_init",
+    "dr",
+    "timestep",
+    "cond_constant",
+    "density_constant",
+    "heat_cap_constant",
+)
+
+
+def _flatten(value, prefix):
+    """Yield (name, value) for every number in a nested results value."""
+    if isinstance(value, bool):
+        return
+    if isinstance(value, numbers.Number):
+        yield prefix, float(value)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, f"{prefix}.{key}")
+    elif isinstance(value, (list, tuple)):
+        for n, item in enumerate(value):
+            yield from _flatten(item, f"{prefix}.{n}")
+
+
+def _column_value(value):
+    """Convert a parameter or result to a value SQLite can store."""
+    if value is None or isinstance(value, (str, numbers.Number)):
+        return value
+    if hasattr(value, "tolist"):
+        value = value.tolist()
+    return json.dumps(value)
+
+
+class RunCatalog:
+    """
+    SQLite catalog of model runs.
+
+    The database file is created if it does not exist. Several processes can
+    add runs to the same catalog; writes wait for a lock held by another
+    writer for up to `timeout` seconds. A run is identified by the real path
+    of its json results file: adding a results file again (a re-run, a cache
+    hit or indexing the same folder twice) replaces its row.
+
+    Attributes
+    ----------
+    filepath : str
+        Path of the SQLite database file.
+    timeout : float, default 60.0
+        Time to wait for another writer to release the database, in s.
+    wal : bool
+        Whether the database is in write-ahead log mode, in which readers do
+        not block a writer. It needs shared memory between the processes
+        using the catalog, so it is only turned on when asked for with
+        `wal=True`, for a catalog on a local disk; the default rollback
+        journal also works on network filesystems such as NFS, e.g. for
+        sweeps across nodes. A database file stays in the mode once set.
+    """
+
+    def __init__(self, filepath, timeout=60.0, wal=False):
+        self.filepath = str(filepath)
+        self.connection = sqlite3.connect(self.filepath, timeout=timeout)
+        if wal:
+            try:
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.OperationalError:
+                pass  # e.g. locked by another process: keep the journal
+        self.wal = (
+            self.connection.execute("PRAGMA journal_mode").fetchone()[0]
+            == "wal"
+        )
+        columns = ", ".join(f'"{name}"' for name in _RUN_COLUMNS)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS runs "
+                f"(id INTEGER PRIMARY KEY, {columns})"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS scalars "
+                "(run_id INTEGER, name TEXT, value REAL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS scalars_name_run "
+                "ON scalars (name, run_id)"
+            )
+            for name in _INDEXED_COLUMNS:
+                self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "runs_{name}" '
+                    f'ON runs ("{name}")'
+                )
+            self._unique_results_files()
+
+    def _unique_results_files(self):
+        """Enforce one row per results file, in catalogs of any age."""
+        exists = self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' "
+            "AND name = 'runs_results_file_unique'"
+        ).fetchone()
+        if exists:
+            return
+        # catalogs made before results files were unique: keep the latest
+        duplicates = (
+            "SELECT id FROM runs WHERE results_file IS NOT NULL AND id NOT IN "
+            "(SELECT MAX(id) FROM runs GROUP BY results_file)"
+        )
+        self.connection.execute(
+            f"DELETE FROM scalars WHERE run_id IN ({duplicates})"
+        )
+        self.connection.execute(f"DELETE FROM runs WHERE id IN ({duplicates})")
+        self.connection.execute('DROP INDEX IF EXISTS "runs_results_file"')
+        self.connection.execute(
+            "CREATE UNIQUE INDEX runs_results_file_unique "
+            "ON runs (results_file)"
+        )
+
+    def __str__(self):
+        """Return string."""
+        return "Run catalog at {0} ({1} runs)".format(self.filepath, len(self))
+
+    def __len__(self):
+        """Return the number of runs in the catalog."""
+        return self.connection.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the database connection."""
+        self.connection.close()
+
+    def add_run(
+        self,
+        params,
+        results=None,
+        wall_time=None,
+        results_file=None,
+        arrays_file=None,
+        cache_hit=None,
+    ):
+        """
+        Add one model run to the catalog.
+
+        A run with the same results file as one already in the catalog
+        replaces it, keeping its row id.
+
+        Parameters
+        ----------
+        params : dict or tuple
+            Parameters as a dictionary, or as the tuple returned by
+            `load_plot_save.load_params_from_file`.
+        results : dict, optional
+            Scalar results keyed as in the json results file, i.e.
+            "core_begins_to_freeze", "core finishes freezing",
+            "meteorite_results" and "latent_list_len".
+        wall_time : float, optional
+            Wall time of the run, in s.
+        results_file : str, optional
+            Path of the json results file, stored as its real path.
+        arrays_file : str, optional
+            Path of the .npz results array file.
+        cache_hit : bool, optional
+            Whether the results came from a result cache.
+
+        Returns
+        -------
+        run_id : int
+            Row id of the run.
+
+        """
+        if results_file is not None:
+            results_file = os.path.realpath(str(results_file))
+        if not isinstance(params, dict):
+            params = dict(zip(load_plot_save.PARAMETER_NAMES, params))
+        results = results or {}
+        row = {name: params.get(name) for name in load_plot_save.PARAMETER_NAMES}
+        for key, column in _RESULT_COLUMNS.items():
+            row[column] = results.get(key)
+        meteorite_results = results.get("meteorite_results")
+        row.update(
+            meteorite_results=meteorite_results,
+            wall_time=wall_time,
+            cache_hit=None if cache_hit is None else int(cache_hit),
+            results_file=results_file,
+            arrays_file=arrays_file,
+            added=time.time(),
+        )
+        with self.connection:
+            known = self.connection.execute(
+                "SELECT id FROM runs WHERE results_file = ?", (results_file,)
+            ).fetchone()
+            if known is not None:
+                row["id"] = known[0]
+                self.connection.execute(
+                    "DELETE FROM scalars WHERE run_id = ?", known
+                )
+            names = list(row)
+            cursor = self.connection.execute(
+                "INSERT OR REPLACE INTO runs ({0}) VALUES ({1})".format(
+                    ", ".join(f'"{name}"' for name in names),
+                    ", ".join("?" for _ in names),
+                ),
+                [_column_value(row[name]) for name in names],
+            )
+            run_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO scalars VALUES (?, ?, ?)",
+                [
+                    (run_id, name, value)
+                    for name, value in _flatten(
+                        meteorite_results, "meteorite_results"
+                    )
+                ],
+            )
+        return run_id
+
+    def add_results_file(
+        self, filepath, arrays_file=None, wall_time=None, cache_hit=None
+    ):
+        """
+        Add a run from its json results file.
+
+        Parameters
+        ----------
+        filepath : str
+            Path of the results file written by
+            `load_plot_save.save_params_and_results`.
+        arrays_file : str, optional
+            Path of the .npz array file; by default the .npz file with the
+            same name as `filepath`, if it exists.
+        wall_time : float, optional
+            Wall time of the run, in s.
+        cache_hit : bool, optional
+            Whether the results came from a result cache.
+
+        Returns
+        -------
+        run_id : int
+            Row id of the run.
+
+        """
+        with open(filepath) as json_file:
+            data = json.load(json_file)
+        if arrays_file is None:
+            candidate = os.path.splitext(filepath)[0] + ".npz"
+            if os.path.isfile(candidate):
+                arrays_file = candidate
+        return self.add_run(
+            data,
+            results=data,
+            wall_time=wall_time,
+            results_file=str(filepath),
+            arrays_file=arrays_file,
+            cache_hit=cache_hit,
+        )
+
+    def index_folder(self, folder, pattern="*_results.txt"):
+        """
+        Add every results file in `folder` that is not yet in the catalog.
+
+        Parameters
+        ----------
+        folder : str
+            Directory to search.
+        pattern : str, default "*_results.txt"
+            Glob pattern of the json results files.
+
+        Returns
+        -------
+        added : int
+            Number of runs added.
+
+        """
+        known = {
+            row[0]
+            for row in self.connection.execute(
+                "SELECT results_file FROM runs"
+            )
+        }
+        added = 0
+        for filepath in sorted(glob.glob(os.path.join(str(folder), pattern))):
+            if os.path.realpath(filepath) not in known:
+                self.add_results_file(filepath)
+                added += 1
+        return added
+
+    def query(self, columns=None, **criteria):
+        """
+        Return the runs matching `criteria` as arrays.
+
+        Each keyword argument names a column and gives the value to match. A
+        tuple `(low, high)` matches an inclusive range, with None for an open
+        end, a list matches any of its values, and any other value must match
+        exactly.
+
+        Parameters
+        ----------
+        columns : list of str, optional
+            Columns to return; all run columns by default. Names of flattened
+            meteorite results (e.g. "meteorite_results.imilac.depth") can also
+            be given.
+        **criteria
+            Column values to match.
+
+        Returns
+        -------
+        runs : dict
+            Numpy array of values for each column (plus "id"), one entry per
+            matching run. Numeric columns are float arrays with NaN for
+            missing values, other columns are object arrays.
+
+        """
+        if columns is None:
+            columns = list(_RUN_COLUMNS)
+        selected = ["id"]
+        select_args = []
+        for name in columns:
+            if name in _RUN_COLUMNS:
+                selected.append(f'"{name}"')
+            else:
+                selected.append(
+                    "(SELECT value FROM scalars "
+                    "WHERE scalars.run_id = runs.id AND scalars.name = ?)"
+                )
+                select_args.append(name)
+        conditions = []
+        where_args = []
+        for name, value in criteria.items():
+            if name not in _RUN_COLUMNS:
+                raise KeyError(f"Unknown catalog column {name!r}")
+            if isinstance(value, tuple):
+                low, high = value
+                if low is not None:
+                    conditions.append(f'"{name}" >= ?')
+                    where_args.append(low)
+                if high is not None:
+                    conditions.append(f'"{name}" <= ?')
+                    where_args.append(high)
+            elif isinstance(value, list):
+                conditions.append(
+                    f'"{name}" IN ({", ".join("?" for _ in value)})'
+                )
+                where_args.extend(value)
+            elif value is None:
+                conditions.append(f'"{name}" IS NULL')
+            else:
+                conditions.append(f'"{name}" = ?')
+                where_args.append(value)
+        sql = f"SELECT {', '.join(selected)} FROM runs"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id"
+        rows = self.connection.execute(sql, select_args + where_args).fetchall()
+
+        runs = {}
+        for n, name in enumerate(["id"] + list(columns)):
+            values = [row[n] for row in rows]
+            if all(
+                value is None or isinstance(value, (int, float))
+                for value in values
+            ):
+                runs[name] = np.array(
+                    [np.nan if value is None else value for value in values],
+                    dtype=float,
+                )
+            else:
+                runs[name] = np.array(values, dtype=object)
+        runs["id"] = runs["id"].astype(int)
+        return runs
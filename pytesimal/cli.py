@@ -0,0 +1,617 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Drive the model from the command line.
+
+Installing the package provides a `pytesimal` command (also available as
+`python -m pytesimal`) with seven subcommands:
+
+run
+    Run one parameters file with `quick_workflow.workflow`.
+sweep
+    Run many parameters files, or a `sweep_spec.SweepSpec`, in parallel
+    with `sweep.run_sweep`.
+plot
+    Render results array files to images with
+    `load_plot_save.render_batch`.
+plan
+    Estimate the memory and run time of a parameters file with
+    `planning.plan_run`.
+inspect
+    Summarise a results array file without loading its arrays.
+serve
+    Answer meteorite depth and timing queries over HTTP with
+    `query_service`.
+invert
+    Fit parameters to meteorite cooling rates with an
+    `inversion.InverseProblem`.
+
+Example
+-------
+
+Plan a run, run it, and look at the results::
+
+    pytesimal plan example_params.txt --memory-budget 8e9
+    pytesimal run example_params.txt --progress --metrics-log metrics.jsonl
+    pytesimal inspect example_default/example_params_results.npz
+    pytesimal plot 'example_default/*_results.npz' -o figures
+
+Run a folder of parameters files on eight processes::
+
+    pytesimal sweep 'sweep/*.txt' --jobs 8 --cache-dir cache
+
+or a sweep described by a specification file (see `sweep_spec`)::
+
+    pytesimal sweep --spec sweep.toml --jobs 8
+
+Several machines sharing a filesystem can work through one sweep together,
+claiming runs with lock files and skipping finished ones (which also
+resumes an interrupted sweep)::
+
+    pytesimal sweep 'sweep/*.txt' --claim-dir sweep/claims --skip-complete
+
+Each subcommand lists its options with `--help`.
+
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+import numpy as np
+
+from . import __version__
+from . import inversion
+from . import load_plot_save
+from . import planning
+from . import query_service
+from . import quick_workflow
+from . import result_cache
+from . import sweep
+from . import sweep_spec
+
+
+def _expand(patterns):
+    """Return the paths matching a list of paths or glob patterns."""
+    paths = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def _shard(text):
+    """Parse a shard given as "INDEX/COUNT"."""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"shard {text!r} must be INDEX/COUNT, e.g. 0/4"
+        )
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(
+            f"shard index must be between 0 and {count - 1}"
+        )
+    return index, count
+
+
+def _workflow_options(args):
+    """Return the `workflow` keyword arguments set on the command line."""
+    cache = None
+    if args.cache_dir is not None:
+        cache = result_cache.ResultCache(
+            args.cache_dir,
+            max_bytes=args.cache_max_bytes,
+            link=args.cache_link,
+        )
+    return {
+        "backend": args.backend,
+        "storage": quick_workflow.StorageOptions(
+            svd_tolerance=args.svd_tolerance, chunk_steps=args.chunk_steps
+        ),
+        "cache": cache,
+        "catalog": args.catalog,
+        "instruments": quick_workflow.InstrumentOptions(
+            profile=args.profile, metrics_log=args.metrics_log
+        ),
+        "memory_budget": args.memory_budget,
+    }
+
+
+def summarise_results(filepath):
+    """
+    Summarise a results array file without loading its arrays.
+
+    Shapes are read from the array headers, and only the first and last
+    blocks of timesteps of the mantle temperatures are decompressed.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the .npz results array file.
+
+    Returns
+    -------
+    summary : dict
+        "file", "bytes", the storage "layout" ("single", "chunked" or
+        "svd") and "block_steps", the "timestep" in s and "max_time" in Myr
+        (None if not recorded), the "shapes" of the arrays, "latent_steps",
+        the "initial" and "final" range of mantle temperatures in K, whether
+        a pyramid exists, and the run parameters and results from the
+        companion json file ("run", empty if there is none).
+
+    """
+    myr = 3.1556926e13  # seconds in a million years
+    filepath = str(filepath)
+    timestep, maxtime = load_plot_save.read_run_times(filepath)
+    with np.load(filepath) as npz_file:
+        files = npz_file.files
+    with load_plot_save.load_results(filepath, timestep=timestep) as results:
+        temperatures = results.temperatures
+        if "svd_steps" in files:
+            layout = "svd"
+        elif "chunk_steps" in files:
+            layout = "chunked"
+        else:
+            layout = "single"
+        summary = {
+            "file": filepath,
+            "bytes": os.path.getsize(filepath),
+            "layout": layout,
+            "block_steps": temperatures.chunk_steps,
+            "timestep": timestep,
+            "max_time": None if maxtime is None else maxtime / myr,
+            "shapes": {
+                name: getattr(results, name).shape
+                for name in ("temperatures", "coretemp", "dT_by_dt",
+                             "dT_by_dt_core")
+            },
+            "latent_steps": int(results.latent_array),
+            "initial": None,
+            "final": None,
+            "pyramid": os.path.isfile(load_plot_save.pyramid_path(filepath)),
+        }
+        if temperatures.shape[0] and temperatures.shape[-1]:
+            for key, index in (("initial", 0), ("final", -1)):
+                column = temperatures[:, index]
+                summary[key] = (float(column.min()), float(column.max()))
+    json_path = os.path.splitext(filepath)[0] + ".txt"
+    summary["run"] = {}
+    if os.path.isfile(json_path):
+        with open(json_path) as json_file:
+            summary["run"] = json.load(json_file)
+    return summary
+
+
+def describe_results(summary):
+    """
+    Return a summary from `summarise_results` as readable text.
+    """
+    run = summary["run"]
+    lines = [
+        "{0} ({1:.1f} MB, {2} layout, {3} steps per block)".format(
+            summary["file"], summary["bytes"] / 1e6, summary["layout"],
+            summary["block_steps"],
+        )
+    ]
+    if run:
+        lines.append(f"Run ID: {run.get('run_ID')}")
+    if summary["timestep"] is not None:
+        lines.append(
+            "Timestep: {0:g} s, model time: {1:g} Myr".format(
+                summary["timestep"], summary["max_time"]
+            )
+        )
+    for name, shape in summary["shapes"].items():
+        lines.append(f"  {name:<15}{str(shape):>20}")
+    for key in ("initial", "final"):
+        if summary[key] is not None:
+            lines.append(
+                "{0} mantle temperatures: {1:.1f} to {2:.1f} K".format(
+                    key.capitalize(), *summary[key]
+                )
+            )
+    for key in ("core_begins_to_freeze", "core finishes freezing"):
+        if key in run:
+            lines.append(f"{key.replace('_', ' ').capitalize()}: "
+                         f"{run[key]:g} Myr")
+    if isinstance(run.get("meteorite_results"), dict):
+        for name, result in run["meteorite_results"].items():
+            lines.append(f"{name}: {result}")
+    lines.append("Pyramid: " + ("yes" if summary["pyramid"] else "no"))
+    return "\n".join(lines)
+
+
+def _run(args):
+    """Run one parameters file."""
+    options = _workflow_options(args)
+    summary = quick_workflow.workflow(
+        *sweep.split_param_path(args.paramfile),
+        checkpoints=quick_workflow.CheckpointOptions(
+            every_steps=args.checkpoint_every_steps,
+            every_seconds=args.checkpoint_every_seconds,
+            resume=args.resume,
+        ),
+        progress=args.progress,
+        **options,
+    )
+    print(json.dumps(summary, indent=2, default=str))
+    return 0
+
+
+def _sweep(args):
+    """Run many parameters files in parallel."""
+
+    def report(progress):
+        sys.stderr.write(sweep.describe_progress(progress) + "\n")
+        sys.stderr.flush()
+
+    if args.spec:
+        spec = sweep_spec.SweepSpec.from_file(args.spec)
+        params_folder = args.params_folder or os.path.join(
+            os.path.dirname(args.spec), f"{spec.name}_params"
+        )
+        paramfiles = spec.paramfiles(params_folder)
+    elif args.paramfiles:
+        paramfiles = _expand(args.paramfiles)
+    else:
+        sys.stderr.write("pytesimal sweep: give parameters files or --spec\n")
+        return 2
+    results = sweep.run_sweep(
+        paramfiles,
+        jobs=args.jobs,
+        progress=report if args.progress else None,
+        interval=args.interval,
+        shard=args.shard,
+        claim_dir=args.claim_dir,
+        skip_complete=args.skip_complete,
+        stale_after=args.stale_after,
+        **_workflow_options(args),
+    )
+    for result in results:
+        if result["skipped"] is not None:
+            status = f"skipped ({result['skipped']})"
+        elif result["error"] is None:
+            status = result["summary"]["arrays_file"]
+            if result["summary"]["cache_hit"]:
+                status += " (cached)"
+        else:
+            status = "FAILED " + result["error"]
+        print(f"{result['paramfile']}: {status}")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2, default=str)
+    return 1 if any(result["error"] for result in results) else 0
+
+
+def _plot(args):
+    """Render results array files to images."""
+    if args.sweep:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        load_plot_save.plot_sweep(
+            args.datafiles,
+            quantity=args.quantity,
+            savefile=args.sweep,
+            show=False,
+        )
+        print(args.sweep)
+        return 0
+    for savefile in load_plot_save.render_batch(
+        args.datafiles,
+        output_folder=args.output_folder,
+        jobs=args.jobs,
+        fig_w=args.fig_width,
+        fig_h=args.fig_height,
+    ):
+        print(savefile)
+    return 0
+
+
+def _plan(args):
+    """Estimate the memory and run time of a parameters file."""
+    plan = planning.plan_run(
+        args.paramfile,
+        memory_budget=args.memory_budget,
+        calibrate_time=not args.no_calibrate,
+    )
+    if args.json:
+        print(json.dumps(plan, indent=2))
+    else:
+        print(planning.describe_plan(plan))
+    if args.memory_budget is not None and not plan["fits_budget"]:
+        return 1
+    return 0
+
+
+def _inspect(args):
+    """Summarise results array files."""
+    summaries = [summarise_results(path) for path in _expand(args.datafiles)]
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+    else:
+        print("\n\n".join(describe_results(s) for s in summaries))
+    return 0
+
+
+def _serve(args):
+    """Answer meteorite queries over HTTP until interrupted."""
+    server = query_service.make_server(
+        args.root,
+        host=args.host,
+        port=args.port,
+        catalog=args.catalog,
+        max_entries=args.max_entries,
+        verbose=args.verbose,
+    )
+    host, port = server.server_address[:2]
+    sys.stderr.write(f"Serving {server.root} on http://{host}:{port}/\n")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+def _invert(args):
+    """Fit parameters to meteorite constraints."""
+    options = {}
+    if args.jobs is not None:
+        options["jobs"] = args.jobs
+    if args.memo_file is not None:
+        options["memo_file"] = args.memo_file
+    with inversion.InverseProblem.from_file(args.spec, **options) as problem:
+        if args.method == "optimise":
+            result = problem.optimise(
+                population=args.population,
+                generations=args.generations,
+                seed=args.seed,
+            )
+        else:
+            sampled = problem.sample(
+                walkers=args.walkers, steps=args.steps, seed=args.seed
+            )
+            burn = sampled["chain"][args.steps // 2:]
+            result = {
+                "names": sampled["names"],
+                "mean": burn.mean(axis=(0, 1)).tolist(),
+                "std": burn.std(axis=(0, 1)).tolist(),
+                "acceptance": float(sampled["acceptance"].mean()),
+                "runs": sampled["runs"],
+                "evaluations": sampled["evaluations"],
+            }
+            if args.chain is not None:
+                np.savez_compressed(
+                    args.chain,
+                    names=np.array(sampled["names"]),
+                    chain=sampled["chain"],
+                    misfit=sampled["misfit"],
+                    acceptance=sampled["acceptance"],
+                )
+    if args.json or args.method == "sample":
+        print(json.dumps(result, indent=2, default=str))
+    else:
+        print(
+            "Best misfit {0:.4g} after {1} generations ({2} runs):".format(
+                result["misfit"], result["generations"], result["runs"]
+            )
+        )
+        for name, value in result["parameters"].items():
+            print(f"  {name} = {value}")
+        if "meteorites" in result["result"]:
+            for constraint, prediction in zip(
+                problem.constraints, result["result"]["meteorites"]
+            ):
+                print(
+                    "  {0}: {1:.4g} K/Myr, depth {2} km, {3}".format(
+                        constraint.name,
+                        constraint.cooling_rate,
+                        prediction["depth"],
+                        prediction["timing"],
+                    )
+                )
+    return 0
+
+
+def _add_workflow_arguments(parser):
+    """Add the options shared by `run` and `sweep`."""
+    parser.add_argument("--backend", default="ftcs",
+                        help="Solver backend, or a saved reduced-order "
+                             "model .npz file (default: ftcs).")
+    parser.add_argument("--cache-dir",
+                        help="Reuse and store results in this cache.")
+    parser.add_argument("--cache-link", action="store_true",
+                        help="Hard link cached array files, not copies.")
+    parser.add_argument("--cache-max-bytes", type=int,
+                        help="Evict old cache entries above this size.")
+    parser.add_argument("--catalog",
+                        help="SQLite run catalog to add the runs to.")
+    parser.add_argument("--svd-tolerance", type=float,
+                        help="Store arrays as truncated SVDs accurate to "
+                        "this many K.")
+    parser.add_argument("--chunk-steps", type=int,
+                        help="Store arrays in blocks of this many timesteps, "
+                        "for fast windowed reads of long runs.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record the time spent in each solver phase.")
+    parser.add_argument("--memory-budget", type=float,
+                        help="Refuse runs needing more bytes than this.")
+    parser.add_argument("--metrics-log",
+                        help="JSON lines file to append run metrics to.")
+    parser.add_argument("--progress", action="store_true",
+                        help="Report progress to standard error.")
+
+
+def build_parser():
+    """Return the argument parser of the `pytesimal` command."""
+    parser = argparse.ArgumentParser(
+        prog="pytesimal",
+        description="Model the conductive cooling of planetesimals.",
+    )
+    parser.add_argument("--version", action="version",
+                        version=f"%(prog)s {__version__}")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    run = commands.add_parser("run", help="Run one parameters file.")
+    run.add_argument("paramfile", help="Parameters file (.txt).")
+    _add_workflow_arguments(run)
+    run.add_argument("--resume", action="store_true",
+                     help="Resume from the last checkpoint.")
+    run.add_argument("--checkpoint-every-steps", type=int,
+                     help="Checkpoint every this many timesteps.")
+    run.add_argument("--checkpoint-every-seconds", type=float,
+                     help="Checkpoint every this many seconds.")
+    run.set_defaults(function=_run)
+
+    sweep_parser = commands.add_parser(
+        "sweep", help="Run many parameters files in parallel."
+    )
+    sweep_parser.add_argument("paramfiles", nargs="*",
+                              help="Parameters files or glob patterns.")
+    sweep_parser.add_argument("--spec",
+                              help="Sweep specification (.json or .toml) "
+                              "to run instead of parameters files.")
+    sweep_parser.add_argument("--params-folder",
+                              help="Folder to write the parameters files "
+                              "of a --spec sweep to (default: "
+                              "<name>_params next to the spec).")
+    sweep_parser.add_argument("-j", "--jobs", type=int,
+                              help="Number of processes (default: all "
+                              "processors).")
+    sweep_parser.add_argument("--interval", type=float, default=5.0,
+                              help="Seconds between progress reports.")
+    sweep_parser.add_argument("-o", "--output",
+                              help="JSON file to write the results of each "
+                              "run to.")
+    sweep_parser.add_argument("--shard", type=_shard,
+                              metavar="INDEX/COUNT",
+                              help="Run only shard INDEX (from 0) of COUNT "
+                              "equal shards of the runs, e.g. 0/4.")
+    sweep_parser.add_argument("--claim-dir",
+                              help="Folder of lock files shared by every "
+                              "process running the sweep; each run is "
+                              "claimed before it starts.")
+    sweep_parser.add_argument("--skip-complete", action="store_true",
+                              help="Skip runs that already have valid "
+                              "results, to resume a sweep.")
+    sweep_parser.add_argument("--stale-after", type=float,
+                              help="Take over lock files not touched for "
+                              "this many seconds.")
+    _add_workflow_arguments(sweep_parser)
+    sweep_parser.set_defaults(function=_sweep)
+
+    plot = commands.add_parser(
+        "plot", help="Render results array files to images."
+    )
+    plot.add_argument("datafiles", nargs="+",
+                      help="Results array files (.npz) or glob patterns.")
+    plot.add_argument("-o", "--output-folder",
+                      help="Folder for the images (default: next to each "
+                      "file).")
+    plot.add_argument("-j", "--jobs", type=int,
+                      help="Number of processes (default: all processors).")
+    plot.add_argument("--fig-width", type=float, default=6,
+                      help="Figure width in inches.")
+    plot.add_argument("--fig-height", type=float, default=9,
+                      help="Figure height in inches.")
+    plot.add_argument("--sweep", metavar="SAVEFILE",
+                      help="Draw all files as panels of one figure instead.")
+    plot.add_argument("--quantity", default="temperatures",
+                      choices=("temperatures", "dT_by_dt"),
+                      help="History to draw with --sweep.")
+    plot.set_defaults(function=_plot)
+
+    plan = commands.add_parser(
+        "plan", help="Estimate the memory and run time of a run."
+    )
+    plan.add_argument("paramfile", help="Parameters file (.txt).")
+    plan.add_argument("--memory-budget", type=float,
+                      help="Memory available in bytes; exit status 1 if the "
+                      "run does not fit.")
+    plan.add_argument("--no-calibrate", action="store_true",
+                      help="Skip the timed calibration solve.")
+    plan.add_argument("--json", action="store_true",
+                      help="Print the plan as json.")
+    plan.set_defaults(function=_plan)
+
+    inspect = commands.add_parser(
+        "inspect", help="Summarise results array files."
+    )
+    inspect.add_argument("datafiles", nargs="+",
+                         help="Results array files (.npz) or glob patterns.")
+    inspect.add_argument("--json", action="store_true",
+                         help="Print the summaries as json.")
+    inspect.set_defaults(function=_inspect)
+
+    serve = commands.add_parser(
+        "serve", help="Answer meteorite queries over HTTP."
+    )
+    serve.add_argument("root", help="Folder of the results array files.")
+    serve.add_argument("--host", default="127.0.0.1",
+                       help="Address to listen on (default: localhost "
+                       "only).")
+    serve.add_argument("--port", type=int, default=8750,
+                       help="Port to listen on.")
+    serve.add_argument("--catalog",
+                       help="Run catalog to look up runs by run ID.")
+    serve.add_argument("--max-entries", type=int, default=16,
+                       help="Number of runs to keep indexed in memory.")
+    serve.add_argument("--verbose", action="store_true",
+                       help="Log each request.")
+    serve.set_defaults(function=_serve)
+
+    invert = commands.add_parser(
+        "invert", help="Fit parameters to meteorite cooling rates."
+    )
+    invert.add_argument("spec",
+                        help="Fit specification file (.json or .toml).")
+    invert.add_argument("--method", default="optimise",
+                        choices=("optimise", "sample"),
+                        help="Differential evolution, or MCMC sampling.")
+    invert.add_argument("--jobs", type=int,
+                        help="Number of processes (default: all "
+                        "processors).")
+    invert.add_argument("--memo-file",
+                        help="JSON lines file of forward runs to reuse.")
+    invert.add_argument("--population", type=int,
+                        help="Differential evolution population size.")
+    invert.add_argument("--generations", type=int, default=30,
+                        help="Most differential evolution generations.")
+    invert.add_argument("--walkers", type=int,
+                        help="Number of MCMC walkers.")
+    invert.add_argument("--steps", type=int, default=100,
+                        help="Number of MCMC steps.")
+    invert.add_argument("--chain", metavar="SAVEFILE",
+                        help="Save the MCMC chain to a .npz file.")
+    invert.add_argument("--seed", type=int, help="Random seed.")
+    invert.add_argument("--json", action="store_true",
+                        help="Print the result as json.")
+    invert.set_defaults(function=_invert)
+    return parser
+
+
+def main(argv=None):
+    """
+    Run the `pytesimal` command.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        Command line arguments; `sys.argv[1:]` by default.
+
+    Returns
+    -------
+    status : int
+        Exit status: 0 on success, 1 if a run failed or did not fit the
+        memory budget.
+
+    """
+    args = build_parser().parse_args(argv)
+    return args.function(args)
@@ -132,6 +132,57 @@ class IsothermalEutecticCore:
             self.latentlist.append(self.latent)
             self.templist.append(self.temperature)
 
+    @property
+    def phase(self):
+        """
+        State of the core: "liquid", "freezing" or "frozen".
+
+        The core is liquid while it cools towards its melting temperature,
+        freezing while latent heat is being extracted at the melting
+        temperature, and frozen once all of the latent heat has been
+        extracted.
+        """
+        if self.latent >= self.maxlatent:
+            return "frozen"
+        if self.temperature > self.melting:
+            return "liquid"
+        return "freezing"
+
+    def get_state(self):
+        """
+        Return the state of the core needed to restart a model run.
+
+        Returns
+        -------
+        state : dict
+            Current `temperature`, `boundary_temperature` and `latent` heat,
+            and the `templist` and `latentlist` histories as numpy arrays.
+
+        """
+        return {
+            "temperature": self.temperature,
+            "boundary_temperature": self.boundary_temperature,
+            "latent": self.latent,
+            "templist": np.asarray(self.templist, dtype=float),
+            "latentlist": np.asarray(self.latentlist, dtype=float),
+        }
+
+    def set_state(self, state):
+        """
+        Restore the state of the core from `get_state` output.
+
+        Parameters
+        ----------
+        state : dict
+            Dictionary with the keys returned by `get_state`.
+
+        """
+        self.temperature = float(state["temperature"])
+        self.boundary_temperature = float(state["boundary_temperature"])
+        self.latent = float(state["latent"])
+        self.templist = [float(t) for t in state["templist"]]
+        self.latentlist = [float(lat) for lat in state["latentlist"]]
+
     def temperature_array_1D(self):
         """
         Return a time-series of core boundary temperatures
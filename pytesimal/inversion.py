@@ -0,0 +1,879 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fit planetesimal parameters to the cooling rates of meteorites.
+
+An `InverseProblem` searches over chosen parameters of a base parameters
+file for the bodies in which a set of meteorites, each with a measured
+cooling rate, would have formed as observed. Each `MeteoriteConstraint`
+gives the cooling rate of a meteorite (directly, or from its cloudy zone
+particle diameter or tetrataenite bandwidth with
+`analysis.cooling_rate_cloudyzone_diameter` and
+`analysis.cooling_rate_tetra_width`), and may require its depth of formation
+to fall in a range and whether it cooled through the tetrataenite formation
+temperature while the core was freezing, and so could record a core dynamo.
+The misfit of a body is the sum of the squared distances, in units of
+`depth_sigma` and `timing_sigma`, by which the predictions of
+`analysis.meteorite_depth_and_timing` miss these requirements, with
+`MISSING_PENALTY` for every meteorite whose cooling rate no depth of the
+body matches.
+
+Two drivers search the parameters, each working in the unit cube of
+quantiles of the `sweep_spec.Parameter` of every varied parameter:
+
+`InverseProblem.optimise`
+    Differential evolution, stopping once a body fits every constraint.
+`InverseProblem.sample`
+    An affine-invariant ensemble Markov chain Monte Carlo sampler
+    (Goodman & Weare, 2010) of the posterior with likelihood
+    exp(-misfit / 2), the parameter distributions being the prior.
+
+Both evaluate a whole generation, or half of the walkers, at once, spread
+over a pool of processes. Every forward run is memoised: its predictions
+are kept by parameter hash and reused whenever the same body is asked for
+again, within a search or across searches, and optionally written to a JSON
+lines `memo_file` so that they outlive the process. Parameters can be
+rounded to a `resolution` so that nearby candidates share runs. Forward runs
+stop early, once the core has frozen and cooled below `stop_temperature`:
+the base of the mantle is held at the core temperature and is then its
+hottest part, so the 800 K and 593 K isotherms have crossed the whole mantle
+and the rest of the run cannot change the predictions.
+
+Example
+-------
+
+Fit the radius and core size of the pallasite parent body to two
+meteorites that record a dynamo::
+
+    problem = InverseProblem(
+        'example_params.txt',
+        parameters={
+            'r_planet': {'min': 150000.0, 'max': 300000.0},
+            'core_size_factor': {'min': 0.3, 'max': 0.7},
+        },
+        constraints=[
+            MeteoriteConstraint('Imilac', cloudy_zone_diameter=143,
+                                dynamo=True),
+            MeteoriteConstraint('Esquel', cloudy_zone_diameter=158,
+                                dynamo=True),
+        ],
+        resolution={'r_planet': 1000.0, 'core_size_factor': 0.01},
+        memo_file='fit_memo.jsonl',
+        jobs=8,
+    )
+    with problem:
+        best = problem.optimise(population=16, generations=20, seed=1)
+        print(best['parameters'], best['misfit'], best['runs'])
+        posterior = problem.sample(walkers=16, steps=50, seed=2)
+
+A problem can also be read from a JSON or TOML file with
+`InverseProblem.from_file`, with "base", "parameters" (as in a sweep
+specification, see `sweep_spec`), "constraints" (a list of keyword
+arguments of `MeteoriteConstraint`) and optionally "resolution",
+"stop_temperature" and "memo_file"; the command line runs it with::
+
+    pytesimal invert fit.json --jobs 8 --generations 20
+
+"""
+
+import concurrent.futures
+import json
+import os
+import time
+
+import numpy as np
+
+from . import analysis
+from . import core_function
+from . import load_plot_save
+from . import mantle_properties
+from . import numerical_methods
+from . import result_cache
+from . import setup_functions
+from . import sweep_spec
+
+# misfit of a meteorite whose cooling rate no depth of the body matches
+MISSING_PENALTY = 100.0
+# forward runs stop once the frozen core is below this temperature, in K
+STOP_TEMPERATURE = 550.0
+
+
+class _Finished(Exception):
+    """Raised by a forward run's progress callback to stop the solver."""
+
+
+def forward_run(params, cooling_rates, stop_temperature=STOP_TEMPERATURE,
+                solver=None):
+    """
+    Solve a run and predict the depth and timing of meteorites in it.
+
+    The run is set up as by `quick_workflow.workflow`, but nothing is
+    written to disk.
+
+    Parameters
+    ----------
+    params : dict
+        Parameters of the run, with the names of
+        `load_plot_save.PARAMETER_NAMES`; "run_ID" and "folder" are unused.
+    cooling_rates : sequence of float
+        Meteorite cooling rates, in K/Myr.
+    stop_temperature : float or None, default `STOP_TEMPERATURE`
+        Stop the run once the core is frozen and cooler than this, in K;
+        None runs to "max_time".
+    solver : callable, optional
+        Solver with the signature of `numerical_methods.discretisation`,
+        which is the default.
+
+    Returns
+    -------
+    result : dict
+        "core_begins_to_freeze" and "core_finishes_freezing" in Myr (0 if
+        the core does not freeze within the run), the number of timesteps
+        solved ("steps"), whether the run stopped early ("stopped_early"),
+        its "wall_time" in s, and "meteorites": for each cooling rate, the
+        "depth" of formation in km, the "timing" relative to core
+        freezing, the "time_of_crossing" of 593 K in Myr and the
+        "critical_radius" in m, each None if no depth matches.
+
+    """
+    start = time.perf_counter()
+    myr = 3.1556926e13
+    solver = solver or numerical_methods.discretisation
+    timestep = params["timestep"]
+    dr = params["dr"]
+    (
+        r_core,
+        radii,
+        core_radii,
+        reg_thickness,
+        where_regolith,
+        times,
+        temperatures,
+        coretemp,
+    ) = setup_functions.set_up(
+        timestep,
+        params["r_planet"],
+        params["core_size_factor"],
+        params["reg_fraction"],
+        params["max_time"],
+        dr,
+    )
+    core_values = core_function.IsothermalEutecticCore(
+        initial_temperature=params["core_temp_init"],
+        melting_temperature=params["temp_core_melting"],
+        outer_r=r_core,
+        inner_r=0,
+        rho=params["core_density"],
+        cp=params["core_cp"],
+        core_latent_heat=params["core_latent_heat"],
+    )
+    conductivity, heatcap, density = (
+        mantle_properties.set_up_mantle_properties(
+            params["cond_constant"],
+            params["density_constant"],
+            params["heat_cap_constant"],
+            params["mantle_density_value"],
+            params["mantle_heat_cap_value"],
+            params["mantle_conductivity_value"],
+        )
+    )
+    last_step = [len(times) - 1]
+
+    def progress(step, n_steps, time_s, core_phase):
+        if (
+            core_phase == "frozen"
+            and core_values.temperature < stop_temperature
+        ):
+            last_step[0] = step
+            raise _Finished
+
+    try:
+        solver(
+            core_values,
+            [],
+            params["temp_init"],
+            params["core_temp_init"],
+            numerical_methods.surface_dirichlet_bc,
+            numerical_methods.cmb_dirichlet_bc,
+            params["temp_surface"],
+            temperatures,
+            dr,
+            coretemp,
+            timestep,
+            r_core,
+            radii,
+            times,
+            where_regolith,
+            params["kappa_reg"],
+            conductivity,
+            heatcap,
+            density,
+            progress=None if stop_temperature is None else progress,
+        )
+    except _Finished:
+        pass
+    n_columns = last_step[0] + 1
+    coretemp = core_values.temperature_array_2D(coretemp)[:, :n_columns]
+    temperatures = temperatures[:, :n_columns]
+    latent = core_values.latentlist
+    _, _, time_core_frozen, fully_frozen = analysis.core_freezing(
+        coretemp,
+        params["max_time"],
+        times,
+        latent,
+        params["temp_core_melting"],
+        timestep,
+    )
+    dT_by_dt = analysis.cooling_rate(temperatures, timestep)
+    result = {
+        "core_begins_to_freeze": time_core_frozen / myr,
+        "core_finishes_freezing": fully_frozen / myr,
+        "steps": n_columns - 1,
+        "stopped_early": n_columns < len(times),
+        "meteorites": [],
+    }
+    for rate in cooling_rates:
+        prediction = dict.fromkeys(
+            ("depth", "timing", "time_of_crossing", "critical_radius")
+        )
+        prediction["cooling_rate"] = float(rate)
+        found = analysis.meteorite_depth_and_timing(
+            analysis.cooling_rate_to_seconds(rate),
+            temperatures,
+            dT_by_dt,
+            radii,
+            params["r_planet"],
+            params["core_size_factor"],
+            time_core_frozen,
+            fully_frozen,
+            dr=dr,
+            dt=timestep,
+        )
+        prediction["timing"] = found[1]
+        if found[0] is not None:
+            # depth is returned in cells of dr
+            prediction["depth"] = float(found[0]) * dr / 1000.0
+            prediction["time_of_crossing"] = float(found[3]) / myr
+            if len(found) > 4:
+                prediction["critical_radius"] = float(found[4])
+        result["meteorites"].append(prediction)
+    result["wall_time"] = time.perf_counter() - start
+    return result
+
+
+class MeteoriteConstraint:
+    """
+    What is known about one meteorite.
+
+    Attributes
+    ----------
+    name : str
+        Name of the meteorite.
+    cooling_rate : float
+        Cooling rate at 800 K, in K/Myr.
+    depth : tuple of float or None
+        Least and greatest depth of formation allowed, in km; either may be
+        None.
+    dynamo : bool or None
+        True if the meteorite records a core dynamo, so must have cooled
+        through 593 K while the core was freezing; False if it must not
+        have; None if unknown.
+    depth_sigma : float
+        Depth misfit scale, in km.
+    timing_sigma : float
+        Timing misfit scale, in Myr.
+
+    """
+
+    def __init__(
+        self,
+        name,
+        cooling_rate=None,
+        cloudy_zone_diameter=None,
+        tetra_width=None,
+        depth=None,
+        dynamo=None,
+        depth_sigma=1.0,
+        timing_sigma=1.0,
+    ):
+        """
+        Describe a meteorite.
+
+        Parameters
+        ----------
+        name : str
+            Name of the meteorite.
+        cooling_rate : float, optional
+            Cooling rate in K/Myr.
+        cloudy_zone_diameter : float, optional
+            Cloudy zone particle diameter in nm, giving the cooling rate by
+            `analysis.cooling_rate_cloudyzone_diameter`.
+        tetra_width : float, optional
+            Tetrataenite bandwidth in nm, giving the cooling rate by
+            `analysis.cooling_rate_tetra_width`.
+        depth : tuple of float, optional
+            Least and greatest depth of formation, in km.
+        dynamo : bool, optional
+            Whether the meteorite records a core dynamo.
+        depth_sigma : float, default 1.0
+            Depth misfit scale, in km.
+        timing_sigma : float, default 1.0
+            Timing misfit scale, in Myr.
+
+        """
+        given = [
+            value
+            for value in (cooling_rate, cloudy_zone_diameter, tetra_width)
+            if value is not None
+        ]
+        if len(given) != 1:
+            raise ValueError(
+                f"{name}: give one of 'cooling_rate', 'cloudy_zone_diameter' "
+                "and 'tetra_width'"
+            )
+        if cloudy_zone_diameter is not None:
+            cooling_rate = analysis.cooling_rate_cloudyzone_diameter(
+                cloudy_zone_diameter
+            )
+        elif tetra_width is not None:
+            cooling_rate = analysis.cooling_rate_tetra_width(tetra_width)
+        self.name = name
+        self.cooling_rate = float(cooling_rate)
+        self.depth = None if depth is None else tuple(depth)
+        self.dynamo = dynamo
+        self.depth_sigma = depth_sigma
+        self.timing_sigma = timing_sigma
+
+    def __repr__(self):
+        """Return string."""
+        return "MeteoriteConstraint({0!r}, cooling_rate={1:.4g})".format(
+            self.name, self.cooling_rate
+        )
+
+    def misfit(self, prediction, core_begins, core_finishes):
+        """
+        Return the misfit of a prediction of `forward_run`.
+
+        Parameters
+        ----------
+        prediction : dict
+            Prediction for this meteorite's cooling rate.
+        core_begins, core_finishes : float
+            When the core begins and finishes freezing, in Myr.
+
+        Returns
+        -------
+        misfit : float
+            Sum of squared misses, in units of the sigmas; 0 if every
+            requirement is met.
+
+        """
+        depth = prediction["depth"]
+        if depth is None:
+            return MISSING_PENALTY
+        misfit = 0.0
+        if self.depth is not None:
+            low, high = self.depth
+            miss = max(
+                0.0,
+                -np.inf if low is None else low - depth,
+                -np.inf if high is None else depth - high,
+            )
+            misfit += (miss / self.depth_sigma) ** 2
+        if self.dynamo is not None:
+            crossing = prediction["time_of_crossing"]
+            if core_begins == 0:
+                # the core does not freeze within the run
+                return misfit + (MISSING_PENALTY if self.dynamo else 0.0)
+            if self.dynamo:
+                miss = max(0.0, core_begins - crossing,
+                           crossing - core_finishes)
+            else:
+                miss = max(
+                    0.0,
+                    min(crossing - core_begins, core_finishes - crossing),
+                )
+            misfit += (miss / self.timing_sigma) ** 2
+        return misfit
+
+
+def _forward_job(job):
+    """Run `forward_run` in a pool worker, catching failures."""
+    params, cooling_rates, stop_temperature, solver = job
+    try:
+        return forward_run(params, cooling_rates, stop_temperature, solver)
+    except Exception as error:
+        return {"error": f"{type(error).__name__}: {error}"}
+
+
+class InverseProblem:
+    """
+    Parameters, constraints and memoised forward runs of a fit.
+
+    Use as a context manager, or call `close`, to shut down the process
+    pool.
+
+    Attributes
+    ----------
+    base : dict
+        Parameters shared by every forward run.
+    parameters : list of sweep_spec.Parameter
+        The parameters searched over.
+    constraints : list of MeteoriteConstraint
+        The meteorites to match.
+    resolution : dict
+        Step each parameter is rounded to, by name.
+    stop_temperature : float or None
+        Forward runs stop once the frozen core is below this, in K.
+    backend : str
+        Name of the solver in `numerical_methods.SOLVER_BACKENDS`.
+    jobs : int
+        Number of forward runs solved at once.
+    memo : dict
+        Result of every successful forward run by parameter hash.
+    runs : int
+        Number of forward runs solved (not taken from the memo).
+    evaluations : int
+        Number of misfits evaluated.
+
+    """
+
+    def __init__(
+        self,
+        base,
+        parameters,
+        constraints,
+        resolution=None,
+        stop_temperature=STOP_TEMPERATURE,
+        backend="ftcs",
+        memo_file=None,
+        jobs=None,
+    ):
+        """
+        Set up a fit.
+
+        Parameters
+        ----------
+        base : str or dict
+            Base parameters file, or its parameters as a dictionary.
+        parameters : dict
+            Specification of each parameter to search over, by name, as in
+            a sweep specification: "min" and "max" (with "scale": "log" for
+            a log-uniform range), "mean" and "std", or "values".
+        constraints : sequence of MeteoriteConstraint or dict
+            The meteorites, or keyword arguments of `MeteoriteConstraint`.
+        resolution : dict, optional
+            Step to round each parameter to, by name, so that nearby
+            candidates share forward runs.
+        stop_temperature : float or None, default `STOP_TEMPERATURE`
+            See `forward_run`.
+        backend : str, default "ftcs"
+            Solver backend, e.g. a registered
+            `reduced_order.ReducedOrderModel`.
+        memo_file : str, optional
+            JSON lines file to read earlier forward runs from and to append
+            new ones to.
+        jobs : int, optional
+            Number of forward runs solved at once, in a process pool;
+            defaults to the number of processors. 1 solves them in this
+            process.
+
+        """
+        if not isinstance(base, dict):
+            base = dict(
+                zip(
+                    load_plot_save.PARAMETER_NAMES,
+                    load_plot_save.load_params_from_file(base),
+                )
+            )
+        self.base = dict(base)
+        self.parameters = [
+            sweep_spec.Parameter(name, spec)
+            for name, spec in parameters.items()
+        ]
+        if not self.parameters:
+            raise ValueError("A fit needs at least one parameter")
+        self.constraints = [
+            constraint
+            if isinstance(constraint, MeteoriteConstraint)
+            else MeteoriteConstraint(**constraint)
+            for constraint in constraints
+        ]
+        if not self.constraints:
+            raise ValueError("A fit needs at least one constraint")
+        self.resolution = dict(resolution or {})
+        self.stop_temperature = stop_temperature
+        if backend not in numerical_methods.SOLVER_BACKENDS:
+            raise ValueError(
+                f"Unknown solver backend {backend!r}, choose from "
+                f"{sorted(numerical_methods.SOLVER_BACKENDS)}"
+            )
+        self.backend = backend
+        self.jobs = jobs or os.cpu_count() or 1
+        self.memo = {}
+        self.memo_file = None if memo_file is None else str(memo_file)
+        self.runs = 0
+        self.evaluations = 0
+        self._executor = None
+        if self.memo_file is not None and os.path.exists(self.memo_file):
+            with open(self.memo_file) as file:
+                for line in file:
+                    if line.strip():
+                        record = json.loads(line)
+                        if "error" not in record["result"]:
+                            self.memo[record["key"]] = record["result"]
+
+    @classmethod
+    def from_file(cls, filepath, **kwargs):
+        """
+        Read a fit from a JSON or TOML (.toml) file.
+
+        Relative paths in the file are taken relative to its folder.
+        Keyword arguments override those of the file.
+        """
+        filepath = str(filepath)
+        if filepath.endswith(".toml"):
+            try:
+                import tomllib
+            except ImportError:  # before Python 3.11
+                import tomli as tomllib
+            with open(filepath, "rb") as file:
+                spec = tomllib.load(file)
+        else:
+            with open(filepath) as file:
+                spec = json.load(file)
+        root = os.path.dirname(filepath)
+        if "base" not in spec:
+            raise ValueError("A fit needs a 'base' parameters file")
+        base = spec["base"]
+        if not isinstance(base, dict):
+            base = os.path.join(root, base)
+        options = {
+            name: spec[name]
+            for name in ("resolution", "stop_temperature", "backend", "jobs")
+            if name in spec
+        }
+        if "memo_file" in spec:
+            options["memo_file"] = os.path.join(root, spec["memo_file"])
+        options.update(kwargs)
+        return cls(
+            base,
+            spec.get("parameters", {}),
+            spec.get("constraints", []),
+            **options,
+        )
+
+    def __repr__(self):
+        """Return string."""
+        return "InverseProblem(parameters={0}, constraints={1})".format(
+            [parameter.name for parameter in self.parameters],
+            [constraint.name for constraint in self.constraints],
+        )
+
+    def values(self, unit):
+        """
+        Return the parameters at a point of the unit cube.
+
+        Parameters
+        ----------
+        unit : sequence of float
+            Quantile of each parameter, between 0 and 1.
+
+        Returns
+        -------
+        values : dict
+            Value of each parameter, rounded to its `resolution`.
+
+        """
+        values = {}
+        for parameter, u in zip(self.parameters, unit):
+            value = parameter.from_unit(float(u))
+            step = self.resolution.get(parameter.name)
+            if step and not isinstance(value, str):
+                value = round(round(value / step) * step, 12)
+            values[parameter.name] = sweep_spec._plain(value)
+        return values
+
+    def _key(self, params):
+        """Return the memo key of a forward run."""
+        cooling_rates = [c.cooling_rate for c in self.constraints]
+        return result_cache.parameter_hash(
+            dict(
+                params,
+                cooling_rates=cooling_rates,
+                stop_temperature=self.stop_temperature,
+            ),
+            backend=self.backend,
+        )
+
+    def results(self, candidates):
+        """
+        Return the forward run of each candidate, from the memo if possible.
+
+        Failed runs are not memoised, so they are tried again the next time
+        they are asked for.
+
+        Parameters
+        ----------
+        candidates : sequence of dict
+            Values of the varied parameters of each candidate.
+
+        Returns
+        -------
+        results : list of dict
+            The `forward_run` result of each candidate, or a dictionary
+            with its "error".
+
+        """
+        params = [dict(self.base, **values) for values in candidates]
+        keys = [self._key(run) for run in params]
+        missing = {}
+        failed = {}
+        for key, run in zip(keys, params):
+            if key not in self.memo:
+                missing.setdefault(key, run)
+        if missing:
+            cooling_rates = [c.cooling_rate for c in self.constraints]
+            solver = numerical_methods.SOLVER_BACKENDS[self.backend]
+            jobs = [
+                (run, cooling_rates, self.stop_temperature, solver)
+                for run in missing.values()
+            ]
+            if self.jobs > 1 and len(jobs) > 1:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self.jobs
+                    )
+                solved = list(self._executor.map(_forward_job, jobs))
+            else:
+                solved = [_forward_job(job) for job in jobs]
+            self.runs += len(solved)
+            for key, result in zip(missing, solved):
+                if "error" in result:
+                    failed[key] = result
+                else:
+                    self.memo[key] = result
+            if self.memo_file is not None:
+                with open(self.memo_file, "a") as file:
+                    for key, result in zip(missing, solved):
+                        if key in failed:
+                            continue
+                        file.write(
+                            json.dumps({"key": key, "result": result}) + "\n"
+                        )
+        return [failed.get(key) or self.memo[key] for key in keys]
+
+    def misfit(self, result):
+        """Return the total misfit of a forward run result."""
+        if "error" in result:
+            return np.inf
+        return sum(
+            constraint.misfit(
+                prediction,
+                result["core_begins_to_freeze"],
+                result["core_finishes_freezing"],
+            )
+            for constraint, prediction in zip(
+                self.constraints, result["meteorites"]
+            )
+        )
+
+    def evaluate(self, units):
+        """
+        Return the misfit at each of several points of the unit cube.
+
+        Parameters
+        ----------
+        units : numpy.ndarray
+            Points, shape (n_points, n_parameters); points outside the
+            cube have an infinite misfit.
+
+        Returns
+        -------
+        misfits : numpy.ndarray
+            Misfit of each point.
+
+        """
+        units = np.atleast_2d(units)
+        inside = np.all((units >= 0) & (units <= 1), axis=1)
+        misfits = np.full(len(units), np.inf)
+        results = self.results([self.values(unit) for unit in units[inside]])
+        misfits[inside] = [self.misfit(result) for result in results]
+        self.evaluations += len(units)
+        return misfits
+
+    def optimise(
+        self,
+        population=None,
+        generations=30,
+        mutation=0.7,
+        crossover=0.9,
+        target=0.0,
+        seed=None,
+    ):
+        """
+        Minimise the misfit by differential evolution.
+
+        Each generation, every member of the population is challenged by a
+        trial point made from three others (the "rand/1/bin" scheme), and
+        the trials are evaluated together.
+
+        Parameters
+        ----------
+        population : int, optional
+            Size of the population; defaults to 10 per parameter, at least
+            `jobs`.
+        generations : int, default 30
+            Most generations to evolve.
+        mutation : float, default 0.7
+            Differential weight.
+        crossover : float, default 0.9
+            Probability of taking each parameter from the mutant.
+        target : float, default 0.0
+            Stop once the best misfit is no greater.
+        seed : int, optional
+            Seed of the random numbers.
+
+        Returns
+        -------
+        result : dict
+            The best "parameters" and their "misfit" and forward run
+            ("result"), the best misfit of each generation ("history"), the
+            number of "generations" evolved, and the numbers of forward
+            "runs" solved and misfit "evaluations" made so far.
+
+        """
+        rng = np.random.default_rng(seed)
+        dimensions = len(self.parameters)
+        size = max(population or 10 * dimensions, 4)
+        members = sweep_spec.latin_hypercube(size, dimensions, rng)
+        misfits = self.evaluate(members)
+        history = [float(misfits.min())]
+        generation = 0
+        while generation < generations and misfits.min() > target:
+            generation += 1
+            trials = np.empty_like(members)
+            for n in range(size):
+                a, b, c = rng.choice(
+                    [m for m in range(size) if m != n], 3, replace=False
+                )
+                mutant = members[a] + mutation * (members[b] - members[c])
+                mix = rng.random(dimensions) < crossover
+                mix[rng.integers(dimensions)] = True
+                trials[n] = np.clip(
+                    np.where(mix, mutant, members[n]), 0.0, 1.0
+                )
+            trial_misfits = self.evaluate(trials)
+            better = trial_misfits <= misfits
+            members[better] = trials[better]
+            misfits[better] = trial_misfits[better]
+            history.append(float(misfits.min()))
+        best = int(np.argmin(misfits))
+        values = self.values(members[best])
+        return {
+            "parameters": values,
+            "misfit": float(misfits[best]),
+            "result": self.results([values])[0],
+            "history": history,
+            "generations": generation,
+            "runs": self.runs,
+            "evaluations": self.evaluations,
+        }
+
+    def sample(self, walkers=None, steps=100, scale=2.0, seed=None,
+               initial=None):
+        """
+        Sample the posterior with an affine-invariant ensemble sampler.
+
+        The walkers are split in two halves; each half moves by "stretch"
+        proposals towards walkers of the other, and its proposals are
+        evaluated together. Every parameter must be numeric.
+
+        Parameters
+        ----------
+        walkers : int, optional
+            Number of walkers, even; defaults to 4 per parameter, at least
+            8.
+        steps : int, default 100
+            Number of steps of every walker.
+        scale : float, default 2.0
+            Stretch move scale.
+        seed : int, optional
+            Seed of the random numbers.
+        initial : numpy.ndarray, optional
+            Starting points in the unit cube, shape (walkers,
+            n_parameters); by default a Latin hypercube.
+
+        Returns
+        -------
+        result : dict
+            The "chain" of parameter values, shape (steps, walkers,
+            n_parameters), with the parameter "names", the "misfit" of each
+            sample, shape (steps, walkers), the "acceptance" fraction of
+            each walker, and the numbers of forward "runs" solved and misfit
+            "evaluations" made so far.
+
+        """
+        rng = np.random.default_rng(seed)
+        dimensions = len(self.parameters)
+        if initial is not None:
+            positions = np.array(initial, dtype=float)
+        else:
+            size = walkers or max(4 * dimensions, 8)
+            positions = sweep_spec.latin_hypercube(
+                size + size % 2, dimensions, rng
+            )
+        size = len(positions)
+        if size % 2 or size < 4:
+            raise ValueError("Need an even number of at least 4 walkers")
+        misfits = self.evaluate(positions)
+        chain = np.empty((steps, size, dimensions))
+        chain_misfits = np.empty((steps, size))
+        accepted = np.zeros(size)
+        halves = (np.arange(0, size // 2), np.arange(size // 2, size))
+        for step in range(steps):
+            for moving, other in (halves, halves[::-1]):
+                # stretch factors z distributed as 1/sqrt(z) on [1/a, a]
+                z = (
+                    (scale - 1.0) * rng.random(moving.size) + 1.0
+                ) ** 2 / scale
+                partners = positions[rng.choice(other, moving.size)]
+                proposals = partners + z[:, None] * (
+                    positions[moving] - partners
+                )
+                proposal_misfits = self.evaluate(proposals)
+                log_ratio = (dimensions - 1) * np.log(z) - 0.5 * (
+                    proposal_misfits - misfits[moving]
+                )
+                with np.errstate(invalid="ignore"):
+                    accept = np.log(rng.random(moving.size)) < log_ratio
+                accept &= np.isfinite(proposal_misfits)
+                positions[moving[accept]] = proposals[accept]
+                misfits[moving[accept]] = proposal_misfits[accept]
+                accepted[moving[accept]] += 1
+            chain_misfits[step] = misfits
+            for walker in range(size):
+                chain[step, walker] = [
+                    value
+                    for value in self.values(positions[walker]).values()
+                ]
+        return {
+            "names": [parameter.name for parameter in self.parameters],
+            "chain": chain,
+            "misfit": chain_misfits,
+            "acceptance": accepted / max(steps, 1),
+            "runs": self.runs,
+            "evaluations": self.evaluations,
+        }
+
+    def close(self):
+        """Shut down the process pool."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -29,14 +29,48 @@ Depending on usage, some functions take a `folder` and `filename` argument and
 create an absolute path with these to save or load a file, while some take
 a full filepath. Please check which argument is required.
 
+matplotlib is only imported when a plotting function is first called, so
+the loading and saving functions (and the solver modules that use them) can
+be imported without it.
+
 """
 
+import contextlib
 import json
 import os
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
-import matplotlib.ticker as plticker
+
+
+# Names of the model parameters, in the order they are returned by
+# `load_params_from_file` and passed to `save_params_and_results`.
+PARAMETER_NAMES = (
+    "run_ID",
+    "folder",
+    "timestep",
+    "r_planet",
+    "core_size_factor",
+    "reg_fraction",
+    "max_time",
+    "temp_core_melting",
+    "mantle_heat_cap_value",
+    "mantle_density_value",
+    "mantle_conductivity_value",
+    "core_cp",
+    "core_density",
+    "temp_init",
+    "temp_surface",
+    "core_temp_init",
+    "core_latent_heat",
+    "kappa_reg",
+    "dr",
+    "cond_constant",
+    "density_constant",
+    "heat_cap_constant",
+)
+
+
+# Names of the arrays stored by `save_result_arrays`.
+_RESULT_ARRAY_NAMES = ("temperatures", "coretemp", "dT_by_dt", "dT_by_dt_core")
 
 
 def check_folder_exists(folder):
@@ -230,6 +264,7 @@ def save_params_and_results(
     fully_frozen,
     meteorite_results="None given",
     latent_list_len=0,
+    profile=None,
 ):
     """
     Save parameters and results from model run to a json file.
@@ -302,6 +337,9 @@ def save_params_and_results(
     latent_list_len : float, optional
         The length of the latent heat list, needed for further analysis of
         core crystallisation duration at a later point.
+    profile : dict, optional
+        Solver profile to record under "profile", e.g. from
+        `numerical_methods.SolverProfile.as_dict`.
 
     Returns
     -------
@@ -337,6 +375,8 @@ def save_params_and_results(
         "meteorite_results": meteorite_results,
         "latent_list_len": latent_list_len,
     }
+    if profile is not None:
+        data["profile"] = profile
     with open(f"{folder}/{result_filename}.txt", "w") as file:
         json.dump(data, file, indent=4)
 
@@ -349,6 +389,10 @@ def save_result_arrays(
     mantle_cooling_rates,
     core_cooling_rates,
     latent=[],
+    chunk_steps=None,
+    timestep=None,
+    svd_tolerance=None,
+    svd_rate_tolerance=1e-17,
 ):
     """
     Save results as a compressed Numpy array (npz).
@@ -356,6 +400,21 @@ def save_result_arrays(
     Result arrays of temperatures and cooling rates for both the mantle and the
     core (numpy arrays) are saved to a specified file.
 
+    If `chunk_steps` is given, each array is split along the time axis into
+    blocks of `chunk_steps` timesteps which are compressed separately. This
+    allows `load_results` to decompress only the blocks needed for a slice
+    instead of the whole history; `read_datafile` reads both layouts.
+
+    If `svd_tolerance` is given, each block of timesteps (1024 unless
+    `chunk_steps` is set) is instead stored as a truncated singular value
+    decomposition. Conductive cooling histories are smooth in radius and
+    time, so a few singular vectors reproduce each block to within a
+    fraction of a kelvin, and the file is typically 50 to 100 times smaller.
+    The rank of each block is the smallest whose maximum absolute error is no
+    more than `svd_tolerance` (K) for the temperatures and
+    `svd_rate_tolerance` (K/s) for the cooling rates. Such files are read
+    with `read_datafile` or `load_results` as usual.
+
     Parameters
     ----------
     result_filename : str
@@ -375,6 +434,20 @@ def save_result_arrays(
     latent: list, optional
         List of latent heat values for the core; needed to
         calculate timing of core crystallisation, in J kg^-1.
+    chunk_steps : int, optional
+        Number of timesteps stored in each compressed block. If None (the
+        default), each array is stored as a single block, or in blocks of
+        1024 timesteps if `svd_tolerance` is set.
+    timestep : float, optional
+        The timestep used in numerical method, in s. Stored alongside the
+        arrays so that `load_results` can slice by time in Myr.
+    svd_tolerance : float, optional
+        Maximum absolute error of the stored temperatures, in K. If None (the
+        default), the arrays are stored exactly.
+    svd_rate_tolerance : float, default 1e-17
+        Maximum absolute error of the stored cooling rates when
+        `svd_tolerance` is set, in K/s; well below the 1e-15 K/s matching
+        tolerance of `analysis.meteorite_depth_and_timing`.
 
     Returns
     -------
@@ -382,14 +455,91 @@ def save_result_arrays(
     array format.
 
     """
-    np.savez_compressed(
-        f"{folder}/{result_filename}.npz",
-        temperatures=mantle_temperature_array,
-        coretemp=core_temperature_array,
-        dT_by_dt=mantle_cooling_rates,
-        dT_by_dt_core=core_cooling_rates,
-        latent_array=np.array(len(latent))
-    )
+    arrays = {
+        "temperatures": mantle_temperature_array,
+        "coretemp": core_temperature_array,
+        "dT_by_dt": mantle_cooling_rates,
+        "dT_by_dt_core": core_cooling_rates,
+    }
+    contents = {"latent_array": np.array(len(latent))}
+    if timestep is not None:
+        contents["timestep"] = np.array(timestep)
+    if svd_tolerance is not None:
+        tolerances = {
+            "temperatures": svd_tolerance,
+            "coretemp": svd_tolerance,
+            "dT_by_dt": svd_rate_tolerance,
+            "dT_by_dt_core": svd_rate_tolerance,
+        }
+        svd_steps = 1024 if chunk_steps is None else int(chunk_steps)
+        contents["svd_steps"] = np.array(svd_steps)
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            if array.ndim != 2 or array.size == 0:
+                contents[name] = array
+                continue
+            contents[f"{name}_shape"] = np.array(array.shape)
+            for n, start in enumerate(range(0, array.shape[1], svd_steps)):
+                left, right = _truncated_svd(
+                    array[:, start:start + svd_steps], tolerances[name]
+                )
+                contents[f"{name}_svd{n:05d}_u"] = left
+                contents[f"{name}_svd{n:05d}_vt"] = right
+    elif chunk_steps is None:
+        contents.update(arrays)
+    else:
+        contents["chunk_steps"] = np.array(int(chunk_steps))
+        for name, array in arrays.items():
+            _add_chunks(contents, name, array, chunk_steps)
+    np.savez_compressed(f"{folder}/{result_filename}.npz", **contents)
+
+
+def _truncated_svd(array, tolerance):
+    """
+    Return low-rank factors of `array` with maximum error below `tolerance`.
+
+    Returns the factors of lowest rank whose reconstruction differs from
+    `array` by no more than `tolerance` anywhere, stored in single precision
+    if that is accurate enough and in double precision otherwise.
+    """
+    left, singular_values, right = np.linalg.svd(array, full_matrices=False)
+
+    def factors(rank, dtype):
+        left_factor = (left[:, :rank] * singular_values[:rank]).astype(dtype)
+        right_factor = right[:rank].astype(dtype)
+        error = np.max(
+            np.abs(
+                left_factor.astype(float) @ right_factor.astype(float) - array
+            ),
+            initial=0.0,
+        )
+        return left_factor, right_factor, error
+
+    for dtype in (np.float32, np.float64):
+        if factors(singular_values.size, dtype)[2] > tolerance:
+            continue
+        # the error falls with rank, so bisect for the lowest rank that fits
+        low, high = 0, singular_values.size
+        while low < high:
+            middle = (low + high) // 2
+            if factors(middle, dtype)[2] <= tolerance:
+                high = middle
+            else:
+                low = middle + 1
+        return factors(low, dtype)[:2]
+    # no truncation is accurate enough; keep the full decomposition
+    return factors(singular_values.size, np.float64)[:2]
+
+
+def _add_chunks(contents, name, array, chunk_steps):
+    """Split `array` along time into blocks stored under `name` in contents."""
+    array = np.asarray(array)
+    contents[f"{name}_shape"] = np.array(array.shape)
+    n_times = array.shape[-1]
+    for n, start in enumerate(range(0, n_times, int(chunk_steps))):
+        contents[f"{name}_chunk{n:05d}"] = array[
+            ..., start:start + int(chunk_steps)
+        ]
 
 
 def read_datafile(filepath):
@@ -416,11 +566,11 @@ def read_datafile(filepath):
     dT_by_dt_core : numpy.ndarray
         Array filled with core cooling rates, in K/dt.
     """
-    with np.load(filepath) as data:
-        temperatures = data["temperatures"]  # mantle temperatures in K
-        coretemp = data["coretemp"]  # core temperatures in K
-        dT_by_dt = data["dT_by_dt"]  # mantle cooling rates in K/dt
-        dT_by_dt_core = data["dT_by_dt_core"]  # core cooling rates in K/dt
+    with load_results(filepath) as results:
+        temperatures = results.temperatures.read()  # mantle temperatures in K
+        coretemp = results.coretemp.read()  # core temperatures in K
+        dT_by_dt = results.dT_by_dt.read()  # mantle cooling rates in K/dt
+        dT_by_dt_core = results.dT_by_dt_core.read()  # core rates in K/dt
 
     return temperatures, coretemp, dT_by_dt, dT_by_dt_core
 
@@ -452,16 +602,577 @@ def read_datafile_with_latent(filepath):
     latent_array : numpy.ndarray
         Array filled with latent heat of the core, as it crystallises, J kg^-1.
     """
-    with np.load(filepath) as data:
-        temperatures = data["temperatures"]  # mantle temperatures in K
-        coretemp = data["coretemp"]  # core temperatures in K
-        dT_by_dt = data["dT_by_dt"]  # mantle cooling rates in K/1E11 s
-        dT_by_dt_core = data["dT_by_dt_core"]  # core cooling rates in K/1E11 s
-        latent_array = data["latent_array"]  # tsteps in core crystallisation
+    with load_results(filepath) as results:
+        temperatures = results.temperatures.read()  # mantle temperatures in K
+        coretemp = results.coretemp.read()  # core temperatures in K
+        dT_by_dt = results.dT_by_dt.read()  # mantle cooling rates in K/1E11 s
+        dT_by_dt_core = results.dT_by_dt_core.read()  # core rates in K/1E11 s
+        latent_array = results.latent_array  # tsteps in core crystallisation
 
     return temperatures, coretemp, dT_by_dt, dT_by_dt_core, latent_array
 
 
+class LazyResultArray:
+    """
+    A result array that is only decompressed when it is sliced.
+
+    Instances are created by `load_results` and support numpy-style indexing
+    with a radius index first and a time index second, e.g.
+    `results.temperatures[-2, 1000:2000]`. Only the compressed blocks that
+    overlap the requested timesteps are read from the file. The full array can
+    be read with the `read` method. Arrays stored as truncated singular value
+    decompositions (see `save_result_arrays`) are reconstructed one block at
+    a time in the same way.
+
+    Attributes
+    ----------
+    name : str
+        The name of the array in the .npz file.
+    shape : tuple
+        Shape of the full array, (n_radii, n_times).
+    timestep : float or None
+        The timestep of the model run in s, needed by `myr`.
+
+    """
+
+    def __init__(self, npz_file, name, timestep=None):
+        """Create a lazy view of array `name` in an open npz file."""
+        self._npz = npz_file
+        self.name = name
+        self.timestep = timestep
+        self._cached_chunk = (None, None)
+        self._svd = f"{name}_svd00000_u" in npz_file.files
+        if self._svd:
+            # blocks of timesteps stored as truncated SVD factors
+            self.shape = tuple(int(n) for n in npz_file[f"{name}_shape"])
+            self.chunk_steps = int(npz_file["svd_steps"])
+            self._chunk_keys = sorted(
+                key[:-len("_u")]
+                for key in npz_file.files
+                if key.startswith(f"{name}_svd") and key.endswith("_u")
+            )
+        elif "chunk_steps" in npz_file.files:
+            self.shape = tuple(int(n) for n in npz_file[f"{name}_shape"])
+            self.chunk_steps = int(npz_file["chunk_steps"])
+            self._chunk_keys = sorted(
+                key
+                for key in npz_file.files
+                if key.startswith(f"{name}_chunk")
+            )
+        else:
+            # single block, read the header only to find the shape
+            self.shape = _npz_member_shape(npz_file, name)
+            self.chunk_steps = max(self.shape[-1], 1)
+            self._chunk_keys = [name]
+
+    def __repr__(self):
+        """Return string."""
+        return "LazyResultArray({0!r}, shape={1})".format(
+            self.name, self.shape
+        )
+
+    def __len__(self):
+        """Return the length of the first axis."""
+        return self.shape[0]
+
+    @property
+    def ndim(self):
+        """Number of array dimensions."""
+        return len(self.shape)
+
+    def _chunk(self, n):
+        """Return block `n`, keeping the most recent block in memory."""
+        if self._cached_chunk[0] != n:
+            key = self._chunk_keys[n]
+            if self._svd:
+                block = self._npz[f"{key}_u"].astype(float) @ self._npz[
+                    f"{key}_vt"
+                ].astype(float)
+            else:
+                block = self._npz[key]
+            self._cached_chunk = (n, block)
+        return self._cached_chunk[1]
+
+    def read(self):
+        """Decompress and return the full array."""
+        return self[...]
+
+    def __array__(self, dtype=None, copy=None):
+        """Allow use with `numpy.asarray`."""
+        array = self.read()
+        if dtype is not None:
+            array = array.astype(dtype)
+        return array
+
+    def __getitem__(self, key):
+        """Return the slice `key`, decompressing only the blocks needed."""
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            if len(key) != 1:
+                raise IndexError("Ellipsis is only supported on its own")
+            key = ()
+        key = key + (slice(None),) * (self.ndim - len(key))
+        if len(key) > self.ndim:
+            raise IndexError("too many indices for LazyResultArray")
+        time_key = key[-1]
+        other_key = key[:-1]
+        n_times = self.shape[-1]
+
+        if isinstance(time_key, (int, np.integer)):
+            index = int(time_key)
+            if index < 0:
+                index += n_times
+            if not 0 <= index < n_times:
+                raise IndexError(
+                    f"time index {time_key} out of range for {n_times} steps"
+                )
+            chunk = self._chunk(index // self.chunk_steps)
+            return chunk[other_key + (index % self.chunk_steps,)]
+
+        if isinstance(time_key, slice):
+            start, stop, step = time_key.indices(n_times)
+            if step < 0:
+                return self[other_key + (slice(None),)][
+                    (slice(None),) * len(other_key) + (time_key,)
+                ]
+            pieces = []
+            first = start // self.chunk_steps
+            last = (max(stop, start + 1) - 1) // self.chunk_steps
+            for n in range(first, min(last, len(self._chunk_keys) - 1) + 1):
+                offset = n * self.chunk_steps
+                # first index in this block that keeps the stride aligned
+                first_index = max(start, offset)
+                first_index += (start - first_index) % step
+                local_start = first_index - offset
+                local_stop = min(stop - offset, self.chunk_steps)
+                if local_start >= local_stop:
+                    continue
+                chunk = self._chunk(n)
+                pieces.append(
+                    chunk[
+                        other_key + (slice(local_start, local_stop, step),)
+                    ]
+                )
+            if not pieces:
+                empty = self._chunk(0)[other_key + (slice(0, 0),)]
+                return empty
+            return np.concatenate(pieces, axis=-1)
+
+        # fancy time indexing: read each block needed once
+        indices = np.arange(n_times)[time_key]
+        if indices.ndim != 1:
+            raise IndexError("time index must be an int, slice or 1D array")
+        blocks = indices // self.chunk_steps
+        result = None
+        for n in np.unique(blocks):
+            positions = np.nonzero(blocks == n)[0]
+            local = indices[positions] - n * self.chunk_steps
+            values = self._chunk(int(n))[other_key + (local,)]
+            if result is None:
+                result = np.empty(
+                    values.shape[:-1] + (indices.size,), dtype=values.dtype
+                )
+            result[..., positions] = values
+        if result is None:
+            return self._chunk(0)[other_key + (slice(0, 0),)]
+        return result
+
+    def time_index(self, time_myr):
+        """Return the timestep index closest to `time_myr` (in Myr)."""
+        if self.timestep is None:
+            raise ValueError(
+                "timestep unknown; pass timestep to load_results"
+            )
+        myr = 3.1556926e13
+        return int(round((time_myr * myr) / self.timestep))
+
+    def myr(self, start, stop, radius=slice(None)):
+        """
+        Return the slice between two times given in Myr.
+
+        Parameters
+        ----------
+        start : float
+            Start of the time window, in Myr.
+        stop : float
+            End of the time window (inclusive), in Myr.
+        radius : int, slice or array, optional
+            Radius index; by default all radii are returned.
+
+        Returns
+        -------
+        array : numpy.ndarray
+            Values at `radius` for all timesteps between `start` and `stop`.
+
+        """
+        first = max(self.time_index(start), 0)
+        last = min(self.time_index(stop), self.shape[-1] - 1)
+        time_key = slice(first, last + 1)
+        if self.ndim == 1:
+            return self[time_key]
+        return self[radius, time_key]
+
+
+class LazyResults:
+    """
+    Handle to a results file with lazily loaded arrays.
+
+    Returned by `load_results`. The attributes `temperatures`, `coretemp`,
+    `dT_by_dt` and `dT_by_dt_core` are `LazyResultArray` objects which can be
+    sliced by radius index, time index, or time in Myr (using their `myr`
+    method). The file is kept open until `close` is called, or until the end
+    of a `with` block.
+
+    Attributes
+    ----------
+    filepath : str
+        Location of the .npz data file.
+    timestep : float or None
+        The timestep of the model run, in s.
+    latent_array : numpy.ndarray
+        Number of timesteps the core was crystallising for.
+
+    """
+
+    def __init__(self, filepath, timestep=None):
+        """Open the results file at `filepath`."""
+        self.filepath = str(filepath)
+        self._npz = np.load(self.filepath)
+        if timestep is None:
+            timestep = _find_timestep(self._npz, self.filepath)
+        self.timestep = timestep
+        self.temperatures = LazyResultArray(
+            self._npz, "temperatures", timestep
+        )
+        self.coretemp = LazyResultArray(self._npz, "coretemp", timestep)
+        self.dT_by_dt = LazyResultArray(self._npz, "dT_by_dt", timestep)
+        self.dT_by_dt_core = LazyResultArray(
+            self._npz, "dT_by_dt_core", timestep
+        )
+
+    @property
+    def latent_array(self):
+        """Number of timesteps the core was crystallising for."""
+        return self._npz["latent_array"]
+
+    def close(self):
+        """Close the underlying file."""
+        self._npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_results(filepath, timestep=None):
+    """
+    Open a results file without decompressing the arrays.
+
+    Returns a `LazyResults` handle whose arrays are only read from disk when
+    they are sliced, so that e.g. the surface temperature history or a single
+    time window can be loaded without reading the whole file. Files saved with
+    `save_result_arrays(..., chunk_steps=n)` only decompress the blocks of
+    timesteps that a slice needs.
+
+    Example
+    -------
+
+    Read the temperature just below the surface between 10 and 50 Myr::
+
+        with load_results('results_folder/run_results.npz') as results:
+            surface = results.temperatures.myr(10, 50, radius=-2)
+
+    Parameters
+    ----------
+    filepath : str
+        Location of .npz data file, including file name and npz suffix.
+    timestep : float, optional
+        The timestep of the model run in s, only needed to slice by time in
+        Myr. If not given, it is read from the .npz file or from the
+        companion results (.txt) file if either contains it.
+
+    Returns
+    -------
+    results : LazyResults
+        Handle to the lazily loaded arrays.
+
+    """
+    return LazyResults(filepath, timestep=timestep)
+
+
+def _npz_member_shape(npz_file, name):
+    """Read the shape of an array stored in an npz file from its header."""
+    with npz_file.zip.open(f"{name}.npy") as member:
+        version = np.lib.format.read_magic(member)
+        if version == (1, 0):
+            shape, _, _ = np.lib.format.read_array_header_1_0(member)
+        else:
+            shape, _, _ = np.lib.format.read_array_header_2_0(member)
+    return tuple(shape)
+
+
+def _find_timestep(npz_file, filepath):
+    """Find the timestep stored with a results file, or return None."""
+    if "timestep" in npz_file.files:
+        return float(npz_file["timestep"])
+    json_path = os.path.splitext(filepath)[0] + ".txt"
+    if os.path.isfile(json_path):
+        try:
+            with open(json_path) as json_file:
+                return float(json.load(json_file)["timestep"])
+        except (ValueError, KeyError, TypeError):
+            return None
+    return None
+
+
+def decimate_history(low, mean, high, counts, factor):
+    """
+    Reduce a history along time by `factor`, keeping min, mean and max.
+
+    Parameters
+    ----------
+    low, mean, high : numpy.ndarray
+        Minimum, mean and maximum values of each column; for an undecimated
+        history all three are the history itself.
+    counts : numpy.ndarray
+        Number of timesteps summarised by each column.
+    factor : int
+        Number of columns combined into one.
+
+    Returns
+    -------
+    low, mean, high, counts : numpy.ndarray
+        The decimated minimum, mean, maximum and timestep counts.
+
+    """
+    starts = np.arange(0, counts.size, factor)
+    new_counts = np.add.reduceat(counts, starts)
+    new_low = np.minimum.reduceat(low, starts, axis=-1)
+    new_high = np.maximum.reduceat(high, starts, axis=-1)
+    new_mean = np.add.reduceat(mean * counts, starts, axis=-1) / new_counts
+    return new_low, new_mean, new_high, new_counts
+
+
+def pyramid_path(filepath):
+    """Return the path of the pyramid file for a results array file."""
+    return os.path.splitext(str(filepath))[0] + "_pyramid.npz"
+
+
+def build_pyramid(filepath, factor=8, min_columns=512, chunk_steps=4096):
+    """
+    Store decimated levels of a run's histories for fast plotting.
+
+    Each level summarises `factor` columns of the level below by their
+    minimum, mean and maximum, down to the first level with no more than
+    `min_columns` timesteps. The levels of all four result arrays are saved
+    to `<results>_pyramid.npz` next to the results file, in blocks of
+    `chunk_steps` columns, so that a time window of any level can be read
+    without decompressing the rest. The results file is read one block at
+    a time.
+
+    Parameters
+    ----------
+    filepath : str
+        Location of .npz data file, including file name and npz suffix.
+    factor : int, default 8
+        Decimation factor between successive levels. Each level stores three
+        statistics, so the levels together take about 3 / (factor - 1) of
+        the size of the full histories.
+    min_columns : int, default 512
+        Width at which to stop adding coarser levels.
+    chunk_steps : int, default 4096
+        Number of columns stored in each compressed block.
+
+    Returns
+    -------
+    path : str
+        Location of the pyramid file.
+
+    """
+    contents = {"chunk_steps": np.array(int(chunk_steps))}
+    factors = [1]
+    with load_results(filepath) as results:
+        for name in _RESULT_ARRAY_NAMES:
+            source = getattr(results, name)
+            n_times = source.shape[-1]
+            # read whole source blocks, rounded to a multiple of factor
+            window = factor * max(1, source.chunk_steps // factor)
+            pieces = []
+            for start in range(0, n_times, window):
+                block = source[
+                    (slice(None),) * (source.ndim - 1)
+                    + (slice(start, start + window),)
+                ]
+                pieces.append(
+                    decimate_history(
+                        block, block, block, np.ones(block.shape[-1]), factor
+                    )
+                )
+            level = [
+                np.concatenate([piece[n] for piece in pieces], axis=-1)
+                for n in range(4)
+            ]
+            level_number = 1
+            while True:
+                for stat, values in zip(("min", "mean", "max"), level[:3]):
+                    _add_chunks(
+                        contents,
+                        f"{name}_level{level_number}_{stat}",
+                        values,
+                        chunk_steps,
+                    )
+                if level_number >= len(factors):
+                    factors.append(factors[-1] * factor)
+                if level[3].size <= min_columns:
+                    break
+                level = decimate_history(*level, factor)
+                level_number += 1
+    contents["factors"] = np.array(factors)
+    contents["n_times"] = np.array(n_times)
+    contents["source"] = np.array(os.path.basename(str(filepath)))
+    path = pyramid_path(filepath)
+    np.savez_compressed(path, **contents)
+    return path
+
+
+class ResultPyramid:
+    """
+    Decimated levels of the histories of a model run.
+
+    Level 0 is the full-resolution results file and level `n` summarises
+    `factors[n]` timesteps per column. Returned by `load_pyramid`; use
+    `choose_level` to find the coarsest level that still fills a given
+    number of display columns, and `read` to load a time window of it.
+
+    Attributes
+    ----------
+    filepath : str
+        Location of the pyramid file.
+    factors : list of int
+        Number of timesteps per column for each level, starting with 1.
+    n_times : int
+        Number of timesteps of the full-resolution histories.
+    source : str
+        Location of the full-resolution results file.
+
+    """
+
+    def __init__(self, filepath):
+        """Open the pyramid file at `filepath`."""
+        self.filepath = str(filepath)
+        self._npz = np.load(self.filepath)
+        self.factors = [int(f) for f in self._npz["factors"]]
+        self.n_times = int(self._npz["n_times"])
+        self.source = os.path.join(
+            os.path.dirname(self.filepath), str(self._npz["source"])
+        )
+        self._results = None
+        self._arrays = {}
+
+    def close(self):
+        """Close the pyramid file and the results file if it was opened."""
+        self._npz.close()
+        if self._results is not None:
+            self._results.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def choose_level(self, n_steps, n_columns):
+        """
+        Return the coarsest level with at least `n_columns` columns.
+
+        Parameters
+        ----------
+        n_steps : int
+            Number of timesteps to display.
+        n_columns : int
+            Number of columns (pixels) available to display them.
+
+        Returns
+        -------
+        level : int
+            Index into `factors`; 0 if even the full histories have fewer
+            than `n_columns` timesteps in the range.
+
+        """
+        for level in range(len(self.factors) - 1, 0, -1):
+            if n_steps / self.factors[level] >= n_columns:
+                return level
+        return 0
+
+    def read(self, name, level, stat="mean", start=0, stop=None):
+        """
+        Read a time window of one level.
+
+        Parameters
+        ----------
+        name : str
+            One of "temperatures", "coretemp", "dT_by_dt" or "dT_by_dt_core".
+        level : int
+            Level to read, see `choose_level`.
+        stat : str, default "mean"
+            "min", "mean" or "max" of each decimated column; ignored for
+            level 0.
+        start, stop : int, optional
+            Range of timesteps to cover; by default the whole history.
+
+        Returns
+        -------
+        values : numpy.ndarray
+            Columns of the level that cover timesteps `start` to `stop`.
+        first_step : int
+            Timestep index at the start of the first column.
+        factor : int
+            Number of timesteps per column.
+
+        """
+        stop = self.n_times if stop is None else min(stop, self.n_times)
+        start = max(start, 0)
+        factor = self.factors[level]
+        if level == 0:
+            if self._results is None:
+                self._results = load_results(self.source)
+            array = getattr(self._results, name)
+        else:
+            key = f"{name}_level{level}_{stat}"
+            if key not in self._arrays:
+                self._arrays[key] = LazyResultArray(self._npz, key)
+            array = self._arrays[key]
+        first = start // factor
+        last = -(-stop // factor)  # ceiling division
+        values = array[(slice(None),) * (array.ndim - 1) + (slice(first, last),)]
+        return values, first * factor, factor
+
+
+def load_pyramid(filepath):
+    """
+    Open the pyramid of a results file built by `build_pyramid`.
+
+    Parameters
+    ----------
+    filepath : str
+        Location of the pyramid file, or of the results (.npz) file it was
+        built from.
+
+    Returns
+    -------
+    pyramid : ResultPyramid
+        Handle to the decimated levels.
+
+    """
+    filepath = str(filepath)
+    if not filepath.endswith("_pyramid.npz"):
+        filepath = pyramid_path(filepath)
+    return ResultPyramid(filepath)
+
+
 def get_million_years_formatters(timestep, maxtime):
     """
     Return a matplotlib formatter.
@@ -499,6 +1210,116 @@ def get_million_years_formatters(timestep, maxtime):
     return million_years, cooling_rate, myr
 
 
+def _pyplot():
+    """Import and return `matplotlib.pyplot` on first use."""
+    import matplotlib.pyplot as plt
+
+    return plt
+
+
+def _ticker():
+    """Import and return `matplotlib.ticker` on first use."""
+    import matplotlib.ticker as plticker
+
+    return plticker
+
+
+def _display_columns(ax, fig, dpi=None):
+    """Return the width of `ax` in pixels at `dpi` (default: figure dpi)."""
+    dpi = fig.dpi if dpi is None else dpi
+    width = ax.get_position().width * fig.get_figwidth() * dpi
+    return max(int(width), 1)
+
+
+def _history_image(
+    ax, fig, mantle, core, names, pyramid, stat, decimate, dpi, **kwargs
+):
+    """Show mantle and core histories as one image at display resolution."""
+    n_columns = _display_columns(ax, fig, dpi)
+    if pyramid is not None:
+        return _PyramidView(ax, pyramid, names, stat, n_columns, kwargs).image
+    image = np.concatenate((mantle[-1:0:-1, :], core[-1:0:-1, :]), axis=0)
+    n_times = image.shape[1]
+    factor = n_times // n_columns if decimate else 1
+    if factor < 2:
+        return ax.imshow(image, **kwargs)
+    starts = np.arange(0, n_times, factor)
+    counts = np.diff(np.append(starts, n_times))
+    image = np.add.reduceat(image, starts, axis=1) / counts
+    return ax.imshow(
+        image,
+        extent=(-0.5, n_times - 0.5, image.shape[0] - 0.5, -0.5),
+        **kwargs,
+    )
+
+
+class _PyramidView:
+    """
+    Image of a pyramid that loads finer levels when the axis is zoomed.
+
+    A pyramid given as a path is opened only while a level is read, so no
+    file is left open for the lifetime of the figure.
+    """
+
+    def __init__(self, ax, pyramid, names, stat, n_columns, kwargs):
+        self.pyramid = pyramid
+        self.names = names
+        self.stat = stat
+        self.n_columns = n_columns
+        self._window = None
+        with self._open() as opened:
+            self.n_times = opened.n_times
+            data, extent = self._data(opened, 0, opened.n_times)
+        self.image = ax.imshow(data, extent=extent, **kwargs)
+        self.image.pyramid_view = self  # callbacks only hold weak refs
+        ax.callbacks.connect("xlim_changed", self._on_xlim_changed)
+
+    def _open(self):
+        if isinstance(self.pyramid, ResultPyramid):
+            return contextlib.nullcontext(self.pyramid)
+        return load_pyramid(self.pyramid)
+
+    def _data(self, pyramid, start, stop):
+        level = pyramid.choose_level(stop - start, self.n_columns)
+        mantle, first, factor = pyramid.read(
+            self.names[0], level, self.stat, start, stop
+        )
+        core, _, _ = pyramid.read(
+            self.names[1], level, self.stat, start, stop
+        )
+        data = np.concatenate((mantle[-1:0:-1, :], core[-1:0:-1, :]), axis=0)
+        self._window = (level, first, first + data.shape[1] * factor)
+        extent = (
+            first - 0.5,
+            min(first + data.shape[1] * factor, self.n_times) - 0.5,
+            data.shape[0] - 0.5,
+            -0.5,
+        )
+        return data, extent
+
+    def _on_xlim_changed(self, ax):
+        low, high = sorted(ax.get_xlim())
+        start = max(int(np.floor(low)), 0)
+        stop = min(int(np.ceil(high)) + 1, self.n_times)
+        if stop <= start:
+            return
+        with self._open() as pyramid:
+            level = pyramid.choose_level(stop - start, self.n_columns)
+            current_level, current_start, current_stop = self._window
+            if (
+                level == current_level
+                and current_start <= start
+                and stop <= current_stop
+            ):
+                return
+            data, extent = self._data(pyramid, start, stop)
+        autoscale = ax.get_autoscalex_on()
+        ax.set_autoscalex_on(False)
+        self.image.set_data(data)
+        self.image.set_extent(extent)
+        ax.set_autoscalex_on(autoscale)
+
+
 def plot_temperature_history(
     temperatures,
     coretemp,
@@ -510,6 +1331,9 @@ def plot_temperature_history(
     fig_w=8,
     fig_h=6,
     show=True,
+    pyramid=None,
+    stat="mean",
+    decimate=False,
 ):
     """
     Generate a heat map of depth vs time; colormap shows variation in temp.
@@ -523,7 +1347,17 @@ def plot_temperature_history(
     figure and axis objects. Passing a string via outfile causes the figure
     to be saved as an image in a file.
 
+    If `decimate` is True, histories with more timesteps than there are
+    pixels across the axis are averaged down to the display resolution
+    before plotting. If a `pyramid` (a `ResultPyramid`, or the path of a
+    pyramid or results file) is given, `temperatures` and `coretemp` can be
+    None: the coarsest level that fills the axis is plotted, using the
+    `stat` ("min", "mean" or "max") of each decimated column, and zooming
+    into a time window loads the finer level for that window only.
+
     """
+    plt = _pyplot()
+    plticker = _ticker()
     million_years, _, myr = get_million_years_formatters(timestep, maxtime)
 
     if (fig is None) and (ax is None):
@@ -531,12 +1365,18 @@ def plot_temperature_history(
 
     for label in ax.get_xticklabels() + ax.get_yticklabels():
         label.set_fontsize(8)
-    formatter = FuncFormatter(million_years)
+    formatter = plticker.FuncFormatter(million_years)
     ax.xaxis.set_major_formatter(formatter)
-    im = ax.imshow(
-        np.concatenate(
-            (temperatures[-1:0:-1, :], coretemp[-1:0:-1, :]), axis=0
-        ),
+    im = _history_image(
+        ax,
+        fig,
+        temperatures,
+        coretemp,
+        ("temperatures", "coretemp"),
+        pyramid,
+        stat,
+        decimate,
+        300 if savefile is not None else None,
         aspect="auto",
         cmap="magma",
     )
@@ -577,6 +1417,9 @@ def plot_coolingrate_history(
     fig_w=8,
     fig_h=6,
     show=True,
+    pyramid=None,
+    stat="mean",
+    decimate=False,
 ):
     """
     Generate a heat map of cooling rate vs time.
@@ -593,7 +1436,12 @@ def plot_coolingrate_history(
     figure and axis objects. Passing a string via outfile causes the figure
     to be saved as an image in a file.
 
+    `pyramid`, `stat` and `decimate` select the resolution of the plotted
+    history as for `plot_temperature_history`.
+
     """
+    plt = _pyplot()
+    plticker = _ticker()
     million_years, cooling_rate, myr = get_million_years_formatters(
         timestep, maxtime
     )
@@ -602,17 +1450,23 @@ def plot_coolingrate_history(
     if (fig is None) and (ax is None):
         fig, ax = plt.subplots(figsize=(fig_w, fig_h))
 
-    im2 = ax.imshow(
-        np.concatenate(
-            (dT_by_dt[-1:0:-1, :], dT_by_dt_core[-1:0:-1, :]), axis=0
-        ),
+    im2 = _history_image(
+        ax,
+        fig,
+        dT_by_dt,
+        dT_by_dt_core,
+        ("dT_by_dt", "dT_by_dt_core"),
+        pyramid,
+        stat,
+        decimate,
+        300 if savefile is not None else None,
         aspect="auto",
         vmin=-6e-13,
         cmap="magma",
     )
     for label in ax.get_xticklabels() + ax.get_yticklabels():
         label.set_fontsize(8)
-    formatter = FuncFormatter(million_years)
+    formatter = plticker.FuncFormatter(million_years)
     ax.xaxis.set_major_formatter(formatter)
 
     ticker_step = (100 * myr) / timestep
@@ -649,23 +1503,55 @@ def two_in_one(
     dT_by_dt,
     dT_by_dt_core,
     savefile=None,
-    timestep=1e11
+    timestep=1e11,
+    maxtime=None,
 ):
     """
     Return a heat map of depth vs time; colormap shows variation in temp.
 
-    Change save="n" to save="y" when function is called to produce a png
-    image named after the data filename.
+    Plots the temperature and cooling rate histories one above the other.
+    If `savefile` is given the figure is saved there and closed, otherwise
+    it is shown. `maxtime` is the total model time in s; by default it is
+    the number of timesteps times `timestep`.
 
     """
+    plt = _pyplot()
     fig, axs = plt.subplots(2, 1, figsize=(fig_w, fig_h), sharey=True)
+    _draw_two_in_one(
+        fig,
+        axs,
+        temperatures,
+        coretemp,
+        dT_by_dt,
+        dT_by_dt_core,
+        timestep,
+        maxtime,
+    )
+
+    if savefile is not None:
+        fig.savefig(savefile, dpi=300, bbox_inches="tight")
+        plt.close(fig)
+    else:
+        plt.show()
+
+
+def _draw_two_in_one(
+    fig,
+    axs,
+    temperatures,
+    coretemp,
+    dT_by_dt,
+    dT_by_dt_core,
+    timestep,
+    maxtime,
+):
+    """Draw the panels of `two_in_one` on two existing axes of `fig`."""
     ax, ax2 = axs
 
-    # These probably belong in the data files...
-    # timestep = 1e11
-    maxtime = 400 * 3.1556926e13
+    if maxtime is None:
+        maxtime = np.shape(temperatures)[-1] * timestep
 
-    fig, ax = plot_temperature_history(
+    plot_temperature_history(
         temperatures,
         coretemp,
         timestep,
@@ -676,7 +1562,7 @@ def two_in_one(
         show=False,
     )
 
-    fig, ax2 = plot_coolingrate_history(
+    plot_coolingrate_history(
         dT_by_dt,
         dT_by_dt_core,
         timestep,
@@ -684,13 +1570,376 @@ def two_in_one(
         ax=ax2,
         fig=fig,
         savefile=None,
-        show=True,
+        show=False,
     )
 
-    if savefile is not None:
-        plt.savefig(savefile, dpi=300, bbox_inches="tight")
+
+def read_run_times(filepath):
+    """
+    Return the timestep and total model time of a results array file.
+
+    Both are read from the companion json results file (the .txt file with
+    the same name as `filepath`) if there is one, otherwise the timestep
+    stored in the array file is used and the total time is the number of
+    timesteps times the timestep.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the .npz results array file.
+
+    Returns
+    -------
+    timestep : float or None
+        Numerical timestep, in s, or None if it is not recorded.
+    maxtime : float or None
+        Total model time, in s, or None if it is not recorded.
+
+    """
+    myr = 3.1556926e13  # seconds in a million years
+    data = _results_json(filepath)
+    if "timestep" in data and "max_time" in data:
+        return float(data["timestep"]), float(data["max_time"]) * myr
+    with load_results(filepath) as results:
+        if results.timestep is None:
+            return None, None
+        return (
+            results.timestep,
+            results.temperatures.shape[-1] * results.timestep,
+        )
+
+
+def _results_json(filepath):
+    """Return the companion json results of an array file, or {}."""
+    json_path = os.path.splitext(str(filepath))[0] + ".txt"
+    if not os.path.isfile(json_path):
+        return {}
+    with open(json_path) as json_file:
+        return json.load(json_file)
+
+
+def _expand_patterns(patterns):
+    """Return the results array files matching paths or glob patterns."""
+    import glob
+
+    if isinstance(patterns, (str, os.PathLike)):
+        patterns = [patterns]
+    filepaths = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(str(pattern))) or [str(pattern)]:
+            if not path.endswith("_pyramid.npz") and path not in filepaths:
+                filepaths.append(path)
+    return filepaths
+
+
+def render_result_file(filepath, savefile=None, fig_w=6, fig_h=9):
+    """
+    Plot the histories in a results array file to an image.
+
+    The timestep and total time of the run are read with `read_run_times`.
+    The figure is drawn with the Agg renderer without going through pyplot,
+    so the current matplotlib backend and open figures are left alone.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the .npz results array file.
+    savefile : str, optional
+        Image file to save; by default `filepath` with a .png extension.
+    fig_w, fig_h : float, default 6, 9
+        Figure width and height in inches.
+
+    Returns
+    -------
+    savefile : str
+        Path of the saved image.
+
+    """
+    filepath = str(filepath)
+    if savefile is None:
+        savefile = os.path.splitext(filepath)[0] + ".png"
+    timestep, maxtime = read_run_times(filepath)
+    if timestep is None:
+        raise ValueError(
+            f"No timestep recorded for {filepath}; save it with "
+            "save_result_arrays(timestep=...) or keep the json results file "
+            "alongside it."
+        )
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    temperatures, coretemp, dT_by_dt, dT_by_dt_core = read_datafile(filepath)
+    fig = Figure(figsize=(fig_w, fig_h))
+    FigureCanvasAgg(fig)
+    axs = fig.subplots(2, 1, sharey=True)
+    _draw_two_in_one(
+        fig,
+        axs,
+        temperatures,
+        coretemp,
+        dT_by_dt,
+        dT_by_dt_core,
+        timestep,
+        maxtime,
+    )
+    fig.savefig(savefile, dpi=300, bbox_inches="tight")
+    return savefile
+
+
+def _render_job(job):
+    """Render one (filepath, savefile, fig_w, fig_h) job."""
+    return render_result_file(*job)
+
+
+def render_batch(
+    patterns, output_folder=None, jobs=None, fig_w=6, fig_h=9
+):
+    """
+    Render the results array files matching `patterns` to png images.
+
+    Figures are drawn with the non-interactive Agg renderer across a pool of
+    `jobs` processes, so a whole parameter sweep can be re-plotted on a
+    headless machine using every core. Each file is plotted with its own
+    timestep and total time (see `read_run_times`).
+
+    Parameters
+    ----------
+    patterns : str or list of str
+        Paths or glob patterns of .npz results array files, e.g.
+        "results/*_results.npz". Pyramid files ("*_pyramid.npz") are
+        skipped.
+    output_folder : str, optional
+        Folder for the images; by default each image is saved next to its
+        array file. Created if it does not exist.
+    jobs : int, optional
+        Number of processes; defaults to the number of processors.
+    fig_w, fig_h : float, default 6, 9
+        Figure width and height in inches.
+
+    Returns
+    -------
+    savefiles : list of str
+        Paths of the saved images, in the order of `patterns` with the
+        matches of each glob pattern sorted.
+
+    """
+    import concurrent.futures
+
+    filepaths = _expand_patterns(patterns)
+    if output_folder is not None:
+        check_folder_exists(output_folder)
+    job_list = []
+    for filepath in filepaths:
+        savefile = os.path.splitext(filepath)[0] + ".png"
+        if output_folder is not None:
+            savefile = os.path.join(
+                str(output_folder), os.path.basename(savefile)
+            )
+        job_list.append((filepath, savefile, fig_w, fig_h))
+    if jobs == 1 or len(job_list) < 2:
+        return [_render_job(job) for job in job_list]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(_render_job, job_list))
+
+
+def _sweep_panel(filepath, names, n_columns):
+    """
+    Summarise one run for `plot_sweep` in a single pass over its history.
+
+    Returns the image rows (mantle then core, surface first) averaged down
+    to about `n_columns` columns, their minimum and maximum values at full
+    resolution, and the number of timesteps. A pyramid is used if the run
+    has one, otherwise the results file is read one block at a time.
+    """
+    if os.path.isfile(pyramid_path(filepath)):
+        with load_pyramid(filepath) as pyramid:
+            coarsest = len(pyramid.factors) - 1
+            level = pyramid.choose_level(pyramid.n_times, n_columns)
+            images, lows, highs = [], [], []
+            for name in names:
+                # the minimum and maximum are kept exactly at every level
+                low, _, _ = pyramid.read(name, coarsest, "min")
+                high, _, _ = pyramid.read(name, coarsest, "max")
+                mean, _, _ = pyramid.read(name, level, "mean")
+                lows.append(low[1:].min())
+                highs.append(high[1:].max())
+                images.append(mean[-1:0:-1])
+            return (
+                np.concatenate(images, axis=0),
+                min(lows),
+                max(highs),
+                pyramid.n_times,
+            )
+
+    with load_results(filepath) as results:
+        images, low, high = [], np.inf, -np.inf
+        for name in names:
+            source = getattr(results, name)
+            n_times = source.shape[-1]
+            factor = max(1, n_times // n_columns)
+            # whole blocks rounded to a multiple of factor, so that no
+            # averaged column straddles two reads
+            window = factor * max(1, source.chunk_steps // factor)
+            means = []
+            for start in range(0, n_times, window):
+                block = source[1:, start:start + window]
+                low = min(low, block.min())
+                high = max(high, block.max())
+                means.append(
+                    decimate_history(
+                        block, block, block, np.ones(block.shape[-1]), factor
+                    )[1]
+                )
+            images.append(np.concatenate(means, axis=-1)[::-1])
+    return np.concatenate(images, axis=0), low, high, n_times
+
+
+def plot_sweep(
+    filepaths,
+    quantity="temperatures",
+    ncols=None,
+    panel_w=3.0,
+    panel_h=2.0,
+    n_columns=256,
+    vmin=None,
+    vmax=None,
+    titles=None,
+    savefile=None,
+    show=True,
+):
+    """
+    Plot the histories of many runs as a grid of heat maps on shared axes.
+
+    Every run is read once, one block (or pyramid level) at a time, to find
+    the global colour limits and an image averaged down to `n_columns`
+    timesteps, so only the small images of all runs are held in memory
+    together and hundreds of runs can be compared. All panels share one
+    colour scale and one time axis in Myr, so that runs with different
+    timesteps or durations line up. Depth is in km when the companion json
+    results file records "dr", and in grid cells otherwise.
+
+    Parameters
+    ----------
+    filepaths : str or list of str
+        Paths or glob patterns of the .npz results array files.
+    quantity : str, default "temperatures"
+        "temperatures" for temperature or "dT_by_dt" for cooling rate.
+    ncols : int, optional
+        Number of panels per row; by default about the square root of the
+        number of runs.
+    panel_w, panel_h : float, default 3.0, 2.0
+        Width and height of each panel in inches.
+    n_columns : int, default 256
+        Number of time columns to average each history down to.
+    vmin, vmax : float, optional
+        Colour limits; by default the minimum and maximum over all runs.
+    titles : list of str, optional
+        Panel titles; by default the "run_ID" of each run, or its file name.
+    savefile : str, optional
+        Save the figure to this file.
+    show : bool, default True
+        Show the figure.
+
+    Returns
+    -------
+    fig : matplotlib.figure.Figure
+        The figure.
+    axs : numpy.ndarray
+        Array of axes, one row per row of panels.
+
+    """
+    myr = 3.1556926e13  # seconds in a million years
+    if quantity == "temperatures":
+        names = ("temperatures", "coretemp")
+    elif quantity == "dT_by_dt":
+        names = ("dT_by_dt", "dT_by_dt_core")
     else:
+        raise ValueError(
+            f"quantity must be 'temperatures' or 'dT_by_dt', not {quantity!r}"
+        )
+    filepaths = _expand_patterns(filepaths)
+    if not filepaths:
+        raise ValueError("No results files to plot")
+
+    panels = []
+    low, high = np.inf, -np.inf
+    depth_in_km = True
+    for n, filepath in enumerate(filepaths):
+        data = _results_json(filepath)
+        timestep, _ = read_run_times(filepath)
+        if timestep is None:
+            raise ValueError(f"No timestep recorded for {filepath}")
+        image, image_low, image_high, n_times = _sweep_panel(
+            filepath, names, n_columns
+        )
+        low, high = min(low, image_low), max(high, image_high)
+        if titles is not None:
+            title = titles[n]
+        else:
+            title = data.get(
+                "run_ID", os.path.splitext(os.path.basename(filepath))[0]
+            )
+        depth = image.shape[0]
+        if "dr" in data:
+            depth = depth * float(data["dr"]) / 1000
+        else:
+            depth_in_km = False
+        panels.append((image, n_times * timestep / myr, depth, title))
+    vmin = low if vmin is None else vmin
+    vmax = high if vmax is None else vmax
+
+    plt = _pyplot()
+    if ncols is None:
+        ncols = int(np.ceil(np.sqrt(len(panels))))
+    nrows = -(-len(panels) // ncols)
+    fig, axs = plt.subplots(
+        nrows,
+        ncols,
+        figsize=(ncols * panel_w, nrows * panel_h),
+        sharex=True,
+        squeeze=False,
+    )
+    for ax, (image, duration, depth, title) in zip(axs.flat, panels):
+        im = ax.imshow(
+            image,
+            extent=(0, duration, depth, 0),
+            aspect="auto",
+            cmap="magma",
+            vmin=vmin,
+            vmax=vmax,
+            interpolation="nearest",
+        )
+        ax.set_title(title, fontsize=8)
+        ax.tick_params(labelsize=7)
+    for ax in axs.flat[len(panels):]:
+        ax.set_visible(False)
+    axs[0, 0].set_xlim(0, max(panel[1] for panel in panels))
+    for ax in axs[:, 0]:
+        ax.set_ylabel(
+            "Depth (km)" if depth_in_km else "Depth (cells)", fontsize=8
+        )
+    for ax in axs[-1, :]:
+        ax.set_xlabel("Time (Myr)", fontsize=8)
+
+    if quantity == "temperatures":
+        cb = fig.colorbar(im, ax=axs.ravel().tolist())
+        cb.set_label("Temperature (K)", fontsize=8)
+    else:
+        _, cooling_rate, _ = get_million_years_formatters(1, 1)
+        cb = fig.colorbar(
+            im,
+            ax=axs.ravel().tolist(),
+            format=_ticker().FuncFormatter(cooling_rate),
+        )
+        cb.set_label("Cooling Rate (K/Myr)", fontsize=8)
+        cb.ax.invert_yaxis()
+    cb.ax.tick_params(labelsize=8)
+
+    if savefile is not None:
+        fig.savefig(savefile, dpi=300, bbox_inches="tight")
+    if show:
         plt.show()
+    return fig, axs
 
 
 if __name__ == "__main__":
@@ -700,35 +1949,69 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Plot planetesimal cooling history."
     )
-    parser.add_argument("datafile", help="Cooling history file name.")
+    parser.add_argument(
+        "datafiles",
+        nargs="+",
+        help="Cooling history file names or glob patterns. Several files "
+        + "are rendered to png images in parallel.",
+    )
     parser.add_argument(
         "-s",
         "--savefile",
         action="store",
         type=str,
-        help="Filename for saving figure as image. "
+        help="Filename for saving figure as image when plotting one file. "
         + "If not set figure is plotted directly.",
     )
     parser.add_argument(
-        "--fig_height", default=9, help="Figure height in inches"
+        "-o",
+        "--output-folder",
+        help="Folder for batch-rendered images; defaults to the folder of "
+        + "each data file.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of processes for batch rendering; defaults to the "
+        + "number of processors.",
+    )
+    parser.add_argument(
+        "--fig_height", default=9, type=float, help="Figure height in inches"
     )
     parser.add_argument(
-        "--fig_width", default=6, help="Figure width in inches"
+        "--fig_width", default=6, type=float, help="Figure width in inches"
     )
     args = parser.parse_args()
     fig_w = args.fig_width
     fig_h = args.fig_height
 
-    # Read data and make graph
-    temperatures, coretemp, dT_by_dt, dT_by_dt_core = read_datafile(
-        args.datafile
-    )
-    two_in_one(
-        fig_w,
-        fig_h,
-        temperatures,
-        coretemp,
-        dT_by_dt,
-        dT_by_dt_core,
-        savefile=args.savefile,
-    )
+    if len(args.datafiles) == 1 and os.path.isfile(args.datafiles[0]) and (
+        args.jobs is None and args.output_folder is None
+    ):
+        # Read data and make graph
+        datafile = args.datafiles[0]
+        timestep, maxtime = read_run_times(datafile)
+        temperatures, coretemp, dT_by_dt, dT_by_dt_core = read_datafile(
+            datafile
+        )
+        two_in_one(
+            fig_w,
+            fig_h,
+            temperatures,
+            coretemp,
+            dT_by_dt,
+            dT_by_dt_core,
+            savefile=args.savefile,
+            timestep=1e11 if timestep is None else timestep,
+            maxtime=maxtime,
+        )
+    else:
+        for savefile in render_batch(
+            args.datafiles,
+            output_folder=args.output_folder,
+            jobs=args.jobs,
+            fig_w=fig_w,
+            fig_h=fig_h,
+        ):
+            print(savefile)
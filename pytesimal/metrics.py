@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Append operational metrics of model runs to a JSON lines log.
+
+The results json file of a run records its parameters and scientific
+results. This module records how the run went: one json object per line with
+the wall and CPU time, peak memory, solver throughput, bytes written, solver
+backend, host and whether the result came from the cache. Many processes can
+append to the same log; each record is written with a single write while
+holding an exclusive lock on the file, so lines are never interleaved.
+
+Example
+-------
+
+Runs started through `pytesimal.quick_workflow.workflow` append a record when
+a log is given::
+
+    workflow(
+        'example_params',
+        'path/to/folder',
+        instruments=InstrumentOptions(metrics_log='metrics.jsonl'),
+    )
+
+The records can be read back as a list of dictionaries::
+
+    records = read_records('metrics.jsonl')
+
+"""
+
+import json
+import os
+import socket
+import sys
+import time
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+from . import __version__
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of this process.
+
+    Returns
+    -------
+    peak : int or None
+        Peak memory in bytes, or None where the `resource` module is not
+        available.
+
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return int(peak) if sys.platform == "darwin" else int(peak) * 1024
+
+
+def _bytes_written(summary):
+    """
+    Return the size of the results files a run wrote, or 0 on a cache hit.
+
+    The files of a cache hit are copied or hard linked from the cache rather
+    than written by the run (and a hard link has the full size of the file).
+    """
+    if summary.get("cache_hit"):
+        return 0
+    size = 0
+    for key in ("results_file", "arrays_file"):
+        try:
+            size += os.stat(summary[key]).st_size
+        except (KeyError, OSError, TypeError):
+            pass
+    return size
+
+
+def run_record(
+    summary,
+    backend,
+    cpu_time,
+    run_ID=None,
+    solve_time=None,
+    steps=None,
+):
+    """
+    Build the metrics record of a run.
+
+    Parameters
+    ----------
+    summary : dict
+        Summary returned by `quick_workflow.workflow`, with "wall_time",
+        "cache_hit", "cache_key", "results_file" and "arrays_file".
+    backend : str
+        Name of the solver backend.
+    cpu_time : float
+        CPU time used by the run, in s.
+    run_ID : str, optional
+        Identifier of the run.
+    solve_time : float, optional
+        Wall time spent in the solver, in s; None on a cache hit.
+    steps : int, optional
+        Number of timesteps solved; None on a cache hit.
+
+    Returns
+    -------
+    record : dict
+        The metrics, ready for `append_record`. "bytes_written" is the size
+        of the results files written by the run, 0 on a cache hit.
+
+    """
+    steps_per_second = None
+    if steps and solve_time:
+        steps_per_second = steps / solve_time
+    return {
+        "timestamp": time.time(),
+        "host": socket.gethostname(),
+        "pid": os.getpid(),
+        "version": __version__,
+        "run_ID": run_ID,
+        "backend": backend,
+        "cache_hit": bool(summary.get("cache_hit")),
+        "cache_key": summary.get("cache_key"),
+        "wall_time": summary.get("wall_time"),
+        "cpu_time": cpu_time,
+        "peak_rss_bytes": peak_rss(),
+        "solve_time": solve_time,
+        "steps": steps,
+        "steps_per_second": steps_per_second,
+        "bytes_written": _bytes_written(summary),
+        "results_file": summary.get("results_file"),
+        "arrays_file": summary.get("arrays_file"),
+    }
+
+
+def append_record(filepath, record):
+    """
+    Append one record to a JSON lines log, safely under concurrent writers.
+
+    The file is created if needed. The record is written as one line with a
+    single write in append mode, under an exclusive `flock` where available.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the log file.
+    record : dict
+        JSON-serialisable record.
+
+    """
+    line = json.dumps(record, sort_keys=True, default=str) + "\n"
+    data = line.encode("utf-8")
+    fd = os.open(
+        str(filepath), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+    )
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            written = 0
+            while written < len(data):
+                written += os.write(fd, data[written:])
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def read_records(filepath):
+    """
+    Read all records from a JSON lines log.
+
+    Lines that are not valid json (e.g. a record cut short when a disk
+    filled) are skipped.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the log file.
+
+    Returns
+    -------
+    records : list of dict
+        The records in the order they were written.
+
+    """
+    records = []
+    with open(str(filepath)) as log:
+        for line in log:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
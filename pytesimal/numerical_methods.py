@@ -9,8 +9,25 @@ the mantle of a planetesimal. This module also contains functions to calculate
 the thermal diffusivity of a material form the thermal conductivity, heat
 capacity and the density, and to check whether the diffusivity, timestep and
 radial discretisation meet Von Neumann stability criteria.
+
+Long runs can be checkpointed with a `Checkpointer`, which periodically saves
+the solver state so that a run can be resumed after a crash, or extended past
+its original maximum time, without recomputing from the start.
+
+Where the solver spends its time can be measured by passing a `SolverProfile`
+to `discretisation`, which records the wall time and number of calls of each
+phase of a timestep (the stencil, property evaluations, boundary conditions,
+heat extraction across the core-mantle boundary and checkpointing).
+
+Progress through a long run can be followed by passing a `progress` callback
+to `discretisation`, such as a `ProgressReporter`, which prints the simulated
+time, throughput, estimated time remaining and the state of the core.
 """
 
+import os
+import sys
+import time
+
 import numpy as np
 
 
@@ -40,6 +57,31 @@ def calculate_diffusivity(conductivity, heat_capacity, density):
     return diffusivity
 
 
+def stability_criterion(max_diffusivity, timestep, dr):
+    """
+    Return the Von Neumann stability number of the explicit scheme.
+
+    The scheme is stable if the number is no more than 0.5, see
+    `check_stability`.
+
+    Parameters
+    ----------
+    max_diffusivity : float
+        The highest diffusivity of the system, in m^2 s^-1.
+    timestep : float
+        The timestep used for the numerical scheme, in s.
+    dr : float
+        The radial step used for the numerical scheme, in m.
+
+    Returns
+    -------
+    criterion : float
+        max_diffusivity * timestep / dr ** 2
+
+    """
+    return (max_diffusivity * timestep) / (dr ** 2)
+
+
 def check_stability(max_diffusivity, timestep, dr):
     """
     Check adherence to Von Neumann stability criteria.
@@ -66,7 +108,7 @@ def check_stability(max_diffusivity, timestep, dr):
         fail.
 
     """
-    criterion = (max_diffusivity * timestep) / (dr ** 2)
+    criterion = stability_criterion(max_diffusivity, timestep, dr)
     if criterion <= 0.5:
         print("Von Neumann stability criteria met")
         return True
@@ -204,6 +246,422 @@ class EnergyExtractedAcrossCMB:
         return heat
 
 
+class SolverProfile:
+    """
+    Accumulate the wall time and call count of each phase of a solve.
+
+    Pass an instance to `discretisation` as `profiler`; it is filled in as
+    the solver runs and can be reused to accumulate over several runs.
+
+    The phases are "stencil" (the update of the interior of the mantle,
+    including the property evaluations it makes), one phase per property
+    getter (e.g. "getk", also included in "stencil" except for the
+    conductivity at the core-mantle boundary), "top_mantle_bc",
+    "bottom_mantle_bc", "cmb_power", "extract_heat" and "checkpoint".
+
+    Attributes
+    ----------
+    seconds : dict
+        Total wall time in each phase, in s.
+    calls : dict
+        Number of times each phase ran.
+    wall_time : float
+        Total wall time of the profiled solves, in s.
+    steps : int
+        Number of timesteps computed.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.wall_time = 0.0
+        self.steps = 0
+
+    def __str__(self):
+        """Return string."""
+        lines = [
+            "{0:<18}{1:>12}{2:>12}{3:>8}".format(
+                "phase", "seconds", "calls", "%"
+            )
+        ]
+        for phase, seconds in sorted(
+            self.seconds.items(), key=lambda item: -item[1]
+        ):
+            lines.append(
+                "{0:<18}{1:>12.4f}{2:>12d}{3:>8.1f}".format(
+                    phase,
+                    seconds,
+                    self.calls[phase],
+                    100 * seconds / self.wall_time if self.wall_time else 0,
+                )
+            )
+        lines.append(
+            "{0:<18}{1:>12.4f}{2:>12d}".format(
+                "total", self.wall_time, self.steps
+            )
+        )
+        return "\n".join(lines)
+
+    def add(self, phase, seconds, calls=1):
+        """Add `calls` calls taking `seconds` in total to `phase`."""
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + calls
+
+    def wrap(self, phase, function):
+        """Return `function` wrapped to record each call under `phase`."""
+        perf_counter = time.perf_counter
+        add = self.add
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add(phase, perf_counter() - start)
+
+        return timed
+
+    def as_dict(self):
+        """
+        Return the profile as a json-serialisable dictionary.
+
+        Returns
+        -------
+        profile : dict
+            "wall_time" and "steps" of the profiled solves, "steps_per_second"
+            and, under "phases", the "seconds" and "calls" of each phase.
+
+        """
+        return {
+            "wall_time": self.wall_time,
+            "steps": self.steps,
+            "steps_per_second": (
+                self.steps / self.wall_time if self.wall_time else None
+            ),
+            "phases": {
+                phase: {"seconds": seconds, "calls": self.calls[phase]}
+                for phase, seconds in self.seconds.items()
+            },
+        }
+
+
+class ProgressReporter:
+    """
+    Report the progress of a solve, at most once every `interval` seconds.
+
+    An instance can be passed to `discretisation` as its `progress` callback.
+    Each report gives the simulated time in Myr, the fraction of the run
+    done, the number of timesteps computed per second, the estimated time
+    remaining and the state of the core. The last state seen is also
+    available from `snapshot`, e.g. to combine the progress of many runs.
+
+    Attributes
+    ----------
+    interval : float, default 10.0
+        Minimum wall time between reports, in s. The final step is always
+        reported.
+    stream : file, optional
+        Stream to write reports to; standard error by default. If None is
+        given explicitly nothing is written, which is useful when only
+        `snapshot` is used.
+    label : str, optional
+        Prefix for each report, e.g. the run ID.
+    """
+
+    def __init__(self, interval=10.0, stream=sys.stderr, label=None):
+        self.interval = interval
+        self.stream = stream
+        self.label = label
+        self.step = None
+        self.n_steps = None
+        self.time = None
+        self.core_phase = None
+        self._first = None
+        self._last_report = None
+
+    def __str__(self):
+        """Return the current progress as one line of text."""
+        snapshot = self.snapshot()
+        if snapshot["step"] is None:
+            return "{0}waiting to start".format(
+                f"{self.label}: " if self.label else ""
+            )
+        rate = snapshot["steps_per_second"]
+        eta = snapshot["eta"]
+        text = "{0}{1:.2f} Myr ({2:.1f}%), {3} steps/s, ETA {4}, core {5}"
+        return text.format(
+            f"{self.label}: " if self.label else "",
+            snapshot["time_myr"],
+            100 * snapshot["fraction"],
+            "-" if rate is None else f"{rate:.0f}",
+            "-" if eta is None else _format_seconds(eta),
+            snapshot["core_phase"] or "unknown",
+        )
+
+    def __call__(self, step, n_steps, time_s, core_phase):
+        """Record the completion of timestep `step` of `n_steps`."""
+        now = time.perf_counter()
+        if self._first is None:
+            self._first = (step, now)
+            self._last_report = now
+        self.step = step
+        self.n_steps = n_steps
+        self.time = time_s
+        self.core_phase = core_phase
+        if step < n_steps and now - self._last_report < self.interval:
+            return
+        self._last_report = now
+        if self.stream is not None:
+            self.stream.write(str(self) + "\n")
+            self.stream.flush()
+
+    def snapshot(self):
+        """
+        Return the latest progress.
+
+        Returns
+        -------
+        progress : dict
+            "step", "n_steps", "time_myr", "fraction" of steps done,
+            "steps_per_second" and "eta" (estimated seconds remaining; both
+            None until measurable), "elapsed" wall time in s and
+            "core_phase".
+
+        """
+        myr = 3.1556926e13  # seconds in a million years
+        if self.step is None:
+            return {
+                "step": None,
+                "n_steps": None,
+                "time_myr": None,
+                "fraction": 0.0,
+                "steps_per_second": None,
+                "eta": None,
+                "elapsed": 0.0,
+                "core_phase": None,
+            }
+        first_step, first_time = self._first
+        elapsed = time.perf_counter() - first_time
+        rate = None
+        eta = None
+        if self.step > first_step and elapsed > 0:
+            rate = (self.step - first_step) / elapsed
+            eta = (self.n_steps - self.step) / rate
+        return {
+            "step": self.step,
+            "n_steps": self.n_steps,
+            "time_myr": self.time / myr,
+            "fraction": self.step / self.n_steps if self.n_steps else 1.0,
+            "steps_per_second": rate,
+            "eta": eta,
+            "elapsed": elapsed,
+            "core_phase": self.core_phase,
+        }
+
+
+def _format_seconds(seconds):
+    """Format a duration in s as H:MM:SS."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class _ProfiledProperties:
+    """Proxy for a mantle properties object that times its getters."""
+
+    def __init__(self, properties, profiler):
+        self._properties = properties
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        attribute = getattr(self._properties, name)
+        if name.startswith("get") and callable(attribute):
+            attribute = self._profiler.wrap(name, attribute)
+            # cache so the wrapper is only built once per getter
+            setattr(self, name, attribute)
+        return attribute
+
+
+class Checkpointer:
+    """
+    Periodically save the solver state of `discretisation` to disk.
+
+    The state (step index, current mantle profile and the state of the core
+    object) is saved to `filepath`, and the temperature history computed
+    since the previous checkpoint is appended as a separate `.npy` segment
+    next to it, so that each checkpoint only writes the new part of the
+    history. The state file is replaced atomically, so a crash while saving
+    leaves the previous checkpoint intact.
+
+    A checkpoint is written when either `every_steps` timesteps or
+    `every_seconds` of wall time have passed since the last one, and always
+    at the end of a run.
+
+    Attributes
+    ----------
+    filepath : str
+        Path of the checkpoint state file, ending in .npz.
+    every_steps : int, optional
+        Checkpoint cadence in timesteps.
+    every_seconds : float, optional
+        Checkpoint cadence in seconds of wall time.
+    """
+
+    def __init__(self, filepath, every_steps=None, every_seconds=None):
+        self.filepath = str(filepath)
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self._segments = []
+        self._saved_until = -1
+        self._last_time = time.perf_counter()
+
+    def __str__(self):
+        """Return string."""
+        return "Checkpoint to {0}, saved up to step {1}".format(
+            self.filepath, self._saved_until
+        )
+
+    def exists(self):
+        """Return True if a checkpoint has been saved to `filepath`."""
+        return os.path.isfile(self.filepath)
+
+    def due(self, i):
+        """Return True if a checkpoint should be written at step `i`."""
+        if self.every_steps is not None and (
+            i - max(self._saved_until, 0) >= self.every_steps
+        ):
+            return True
+        if self.every_seconds is not None and (
+            time.perf_counter() - self._last_time >= self.every_seconds
+        ):
+            return True
+        return False
+
+    def _segment_path(self, n):
+        base = os.path.splitext(self.filepath)[0]
+        return f"{base}_history{n:05d}.npy"
+
+    def save(self, temperatures, core_values, i, timestep=None, dr=None):
+        """
+        Save the state after step `i` has been computed.
+
+        Parameters
+        ----------
+        temperatures : numpy.ndarray
+            Mantle temperature array, filled up to column `i`.
+        core_values : core object
+            Core object providing `get_state` and `set_state` methods.
+        i : int
+            Index of the last computed timestep.
+        timestep : float, optional
+            Timestep of the run in s, recorded to check restarts.
+        dr : float, optional
+            Radial step of the run in m, recorded to check restarts.
+
+        """
+        if i > self._saved_until:
+            segment = self._segment_path(len(self._segments))
+            np.save(segment, temperatures[:, self._saved_until + 1:i + 1])
+            self._segments.append(os.path.basename(segment))
+        core_state = core_values.get_state()
+        tmp_path = self.filepath + ".tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(
+                file,
+                step=np.array(i),
+                n_radii=np.array(temperatures.shape[0]),
+                timestep=np.array(np.nan if timestep is None else timestep),
+                dr=np.array(np.nan if dr is None else dr),
+                segments=np.array(self._segments),
+                profile=temperatures[:, i],
+                **{f"core_{key}": value for key, value in core_state.items()},
+            )
+        os.replace(tmp_path, self.filepath)
+        self._saved_until = i
+        self._last_time = time.perf_counter()
+
+    def restore(self, temperatures, core_values, timestep=None, dr=None):
+        """
+        Restore a saved state into a temperature array and a core object.
+
+        The temperature history is copied into the first columns of
+        `temperatures`, which may have more columns than the original run
+        (e.g. to extend it past its original maximum time).
+
+        Parameters
+        ----------
+        temperatures : numpy.ndarray
+            Mantle temperature array to fill with the saved history.
+        core_values : core object
+            Core object providing a `set_state` method.
+        timestep : float, optional
+            Timestep of the new run in s; checked against the checkpoint.
+        dr : float, optional
+            Radial step of the new run in m; checked against the checkpoint.
+
+        Returns
+        -------
+        start_step : int
+            Index of the first timestep still to be computed. This is passed
+            to `discretisation` as `start_step`.
+
+        """
+        with np.load(self.filepath) as state:
+            step = int(state["step"])
+            n_radii = int(state["n_radii"])
+            saved_timestep = float(state["timestep"])
+            saved_dr = float(state["dr"])
+            segments = [str(name) for name in state["segments"]]
+            core_state = {
+                key[len("core_"):]: state[key]
+                for key in state.files
+                if key.startswith("core_")
+            }
+        if n_radii != temperatures.shape[0]:
+            raise ValueError(
+                f"Checkpoint has {n_radii} radii but the temperature array "
+                f"has {temperatures.shape[0]}"
+            )
+        for name, new, saved in (
+            ("timestep", timestep, saved_timestep),
+            ("dr", dr, saved_dr),
+        ):
+            if new is not None and not np.isnan(saved) and new != saved:
+                raise ValueError(
+                    f"Checkpoint {name} {saved} does not match {name} {new}"
+                )
+        if step >= temperatures.shape[1]:
+            raise ValueError(
+                f"Checkpoint reaches step {step}, beyond the "
+                f"{temperatures.shape[1]} timesteps of the temperature array"
+            )
+        folder = os.path.dirname(self.filepath)
+        column = 0
+        for name in segments:
+            history = np.load(os.path.join(folder, name))
+            temperatures[:, column:column + history.shape[1]] = history
+            column += history.shape[1]
+        core_values.set_state(core_state)
+        self._segments = segments
+        self._saved_until = step
+        self._last_time = time.perf_counter()
+        return step + 1
+
+    def remove(self):
+        """Delete the checkpoint state file and its history segments."""
+        if self.exists():
+            with np.load(self.filepath) as state:
+                segments = [str(name) for name in state["segments"]]
+            folder = os.path.dirname(self.filepath)
+            for name in segments:
+                segment = os.path.join(folder, name)
+                if os.path.isfile(segment):
+                    os.remove(segment)
+            os.remove(self.filepath)
+        self._segments = []
+        self._saved_until = -1
+
+
 def discretisation(
     core_values,
     latent,
@@ -225,6 +683,10 @@ def discretisation(
     heatcap,
     dens,
     non_lin_term="y",
+    checkpoint=None,
+    start_step=1,
+    profiler=None,
+    progress=None,
 ):
     """
     Finite difference solver with variable k.
@@ -325,6 +787,25 @@ def discretisation(
     non_lin_term : str, default `'y'`
         Flag to switch off the non-linear term when temperature-dependent
         conductivity is being used.
+    checkpoint : Checkpointer, optional
+        If given, the solver state is saved at the cadence set on the
+        `Checkpointer` and at the end of the run.
+    start_step : int, default 1
+        Index of the first timestep to compute. Values greater than 1 resume
+        a run: `temperatures` must already hold the history up to
+        `start_step - 1` and `core_values` the matching core state, as set up
+        by `Checkpointer.restore`.
+    profiler : SolverProfile, optional
+        If given, the wall time and number of calls of each phase of the
+        solve are added to it. Without a profiler the solver runs
+        uninstrumented.
+    progress : callable, optional
+        Called after each timestep as `progress(step, n_steps, time,
+        core_phase)`, where `step` is the index of the timestep just
+        computed, `n_steps` the index of the last timestep, `time` the
+        model time in s and `core_phase` the `phase` attribute of
+        `core_values` (None if it has none). See `ProgressReporter`. An
+        exception raised by the callback stops the run.
 
 
     Returns
@@ -338,12 +819,31 @@ def discretisation(
 
     """
 
-    temperatures[:, 0] = temp_init  # this can be an array or a scalar
-    core_boundary_temperature = core_temp_init
+    if start_step <= 1:
+        temperatures[:, 0] = temp_init  # this can be an array or a scalar
+        core_boundary_temperature = core_temp_init
+    else:
+        # resuming: history and core state have been restored
+        core_boundary_temperature = core_values.temperature
     coretemp_array[:, 0] = core_temp_init
     cmb_energy = EnergyExtractedAcrossCMB(r_core, timestep, dr)
-
-    for i in range(1, len(times[1:]) + 1):
+    cmb_power = cmb_energy.power
+    extract_heat = core_values.extract_heat
+    if profiler is not None:
+        solve_start = time.perf_counter()
+        first_step = max(start_step, 1)
+        cond = _ProfiledProperties(cond, profiler)
+        heatcap = _ProfiledProperties(heatcap, profiler)
+        dens = _ProfiledProperties(dens, profiler)
+        top_mantle_bc = profiler.wrap("top_mantle_bc", top_mantle_bc)
+        bottom_mantle_bc = profiler.wrap("bottom_mantle_bc", bottom_mantle_bc)
+        cmb_power = profiler.wrap("cmb_power", cmb_power)
+        extract_heat = profiler.wrap("extract_heat", extract_heat)
+
+    for i in range(max(start_step, 1), len(times[1:]) + 1):
+
+        if profiler is not None:
+            stencil_start = time.perf_counter()
 
         for j in range(1, len(radii[1:-1]) + 1):
 
@@ -428,6 +928,9 @@ def discretisation(
 
                 temperatures[j, i] = temperatures[j, i - 1] + A_1 + B_1 + C_1
 
+        if profiler is not None:
+            profiler.add("stencil", time.perf_counter() - stencil_start)
+
         # top boundary condition
         temperatures = top_mantle_bc(temperatures, temp_surface, i)
 
@@ -438,13 +941,48 @@ def discretisation(
 
         # Allow core to cool
         cmb_conductivity = cond.getk(temperatures[0, i])
-        power = cmb_energy.power(temperatures, i, cmb_conductivity)
-        core_values.extract_heat(power, timestep)
+        power = cmb_power(temperatures, i, cmb_conductivity)
+        extract_heat(power, timestep)
         latent = core_values.latentlist
         core_boundary_temperature = core_values.temperature
+
+        if progress is not None:
+            progress(
+                i,
+                len(times) - 1,
+                times[i],
+                getattr(core_values, "phase", None),
+            )
+
+        if checkpoint is not None and checkpoint.due(i):
+            if profiler is not None:
+                checkpoint_start = time.perf_counter()
+            checkpoint.save(temperatures, core_values, i, timestep, dr)
+            if profiler is not None:
+                profiler.add(
+                    "checkpoint", time.perf_counter() - checkpoint_start
+                )
+
+    if checkpoint is not None:
+        if profiler is not None:
+            checkpoint_start = time.perf_counter()
+        checkpoint.save(
+            temperatures, core_values, len(times) - 1, timestep, dr
+        )
+        if profiler is not None:
+            profiler.add("checkpoint", time.perf_counter() - checkpoint_start)
+    if profiler is not None:
+        profiler.wall_time += time.perf_counter() - solve_start
+        profiler.steps += max(len(times) - first_step, 0)
+    latent = core_values.latentlist
     coretemp_array = core_values.temperature_array_2D(coretemp_array)
     return (
         temperatures,
         coretemp_array,
         latent,
     )
+
+
+# Solver backends by name. Every backend has the calling signature and
+# return values of `discretisation`, which is the reference implementation.
+SOLVER_BACKENDS = {"ftcs": discretisation}
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Estimate the memory and run time of a model run before starting it.
+
+`setup_functions.set_up` allocates the full temperature histories that a set
+of parameters implies, which for fine timesteps or long runs can be larger
+than the memory available. `plan_run` works out the shape and size of every
+output array without allocating them, checks the Von Neumann stability
+criterion, and predicts the wall time of the solve from a short calibration
+run on the same radial grid.
+
+Example
+-------
+
+Plan a run from a parameters file::
+
+    plan = plan_run('path/to/example_params.txt', memory_budget=8e9)
+    print(describe_plan(plan))
+
+`pytesimal.quick_workflow.workflow` can refuse runs that would not fit in a
+memory budget::
+
+    workflow('example_params', 'path/to/folder', memory_budget=8e9)
+
+"""
+
+import time
+
+import numpy as np
+
+from . import load_plot_save
+from . import setup_functions
+from . import core_function
+from . import mantle_properties
+from . import numerical_methods
+
+# bytes of history kept per timestep by the core object, in python lists
+_CORE_HISTORY_BYTES = 32
+
+
+def _as_dict(params):
+    """Return parameters from a file path, tuple or dict as a dict."""
+    if isinstance(params, dict):
+        return params
+    if not isinstance(params, (tuple, list)):
+        params = load_plot_save.load_params_from_file(str(params))
+    return dict(zip(load_plot_save.PARAMETER_NAMES, params))
+
+
+def grid_size(timestep, r_planet, core_size_factor, max_time, dr):
+    """
+    Return the array sizes `setup_functions.set_up` would allocate.
+
+    Parameters
+    ----------
+    timestep : float
+        Numerical timestep, in s.
+    r_planet : float
+        Radius of the planetesimal, in m.
+    core_size_factor : float
+        Core radius as a fraction of `r_planet`.
+    max_time : float
+        Total model time, in Myr.
+    dr : float
+        Radial step, in m.
+
+    Returns
+    -------
+    n_radii : int
+        Number of mantle radii.
+    n_core_radii : int
+        Number of core radii.
+    n_times : int
+        Number of timesteps, including the initial state.
+
+    """
+    myr = 3.1556926e13  # seconds in a million years
+    r_core = r_planet * core_size_factor
+
+    # lengths of the np.arange calls in set_up
+    def arange_size(start, stop, step):
+        return max(int(np.ceil((stop - start) / step)), 0)
+
+    n_times = arange_size(0, max_time * myr + 0.5 * timestep, timestep)
+    n_radii = arange_size(r_core, r_planet, dr)
+    n_core_radii = arange_size(0, r_core - dr + 0.5 * dr, dr)
+    return n_radii, n_core_radii, n_times
+
+
+def max_diffusivity(params, n_samples=200):
+    """
+    Return the highest mantle or regolith diffusivity of a run.
+
+    Temperature-dependent properties are evaluated between the surface
+    temperature and the highest initial temperature.
+
+    Parameters
+    ----------
+    params : dict
+        Model parameters, see `load_plot_save.PARAMETER_NAMES`.
+    n_samples : int, default 200
+        Number of temperatures to evaluate variable properties at.
+
+    Returns
+    -------
+    diffusivity : float
+        Maximum diffusivity, in m^2 s^-1.
+
+    """
+    cond, heatcap, dens = mantle_properties.set_up_mantle_properties(
+        params["cond_constant"],
+        params["density_constant"],
+        params["heat_cap_constant"],
+        params["mantle_density_value"],
+        params["mantle_heat_cap_value"],
+        params["mantle_conductivity_value"],
+    )
+    hottest = max(
+        np.max(params["temp_init"]), np.max(params["core_temp_init"])
+    )
+    temperatures = np.linspace(params["temp_surface"], hottest, n_samples)
+    diffusivity = max(
+        numerical_methods.calculate_diffusivity(
+            cond.getk(T), heatcap.getcp(T), dens.getrho(T)
+        )
+        for T in temperatures
+    )
+    if params["reg_fraction"] > 0:
+        diffusivity = max(diffusivity, params["kappa_reg"])
+    return float(diffusivity)
+
+
+def calibrate(params, target_seconds=0.2, max_steps=None):
+    """
+    Time a short solve on the radial grid of a run.
+
+    The number of timesteps is doubled until the solve takes at least
+    `target_seconds`, so that the estimate is not dominated by set-up costs.
+
+    Parameters
+    ----------
+    params : dict
+        Model parameters, see `load_plot_save.PARAMETER_NAMES`.
+    target_seconds : float, default 0.2
+        Minimum duration of the timed solve, in s.
+    max_steps : int, optional
+        Never time more than this many timesteps.
+
+    Returns
+    -------
+    seconds_per_step : float
+        Wall time per timestep, in s.
+
+    """
+    myr = 3.1556926e13  # seconds in a million years
+    timestep = params["timestep"]
+    n_steps = 32
+    while True:
+        if max_steps is not None:
+            n_steps = min(n_steps, max_steps)
+        (
+            r_core,
+            radii,
+            core_radii,
+            reg_thickness,
+            where_regolith,
+            times,
+            temperatures,
+            coretemp,
+        ) = setup_functions.set_up(
+            timestep,
+            params["r_planet"],
+            params["core_size_factor"],
+            params["reg_fraction"],
+            n_steps * timestep / myr,
+            params["dr"],
+        )
+        core_values = core_function.IsothermalEutecticCore(
+            initial_temperature=params["core_temp_init"],
+            melting_temperature=params["temp_core_melting"],
+            outer_r=r_core,
+            inner_r=0,
+            rho=params["core_density"],
+            cp=params["core_cp"],
+            core_latent_heat=params["core_latent_heat"],
+        )
+        cond, heatcap, dens = mantle_properties.set_up_mantle_properties(
+            params["cond_constant"],
+            params["density_constant"],
+            params["heat_cap_constant"],
+            params["mantle_density_value"],
+            params["mantle_heat_cap_value"],
+            params["mantle_conductivity_value"],
+        )
+        start = time.perf_counter()
+        numerical_methods.discretisation(
+            core_values,
+            [],
+            params["temp_init"],
+            params["core_temp_init"],
+            numerical_methods.surface_dirichlet_bc,
+            numerical_methods.cmb_dirichlet_bc,
+            params["temp_surface"],
+            temperatures,
+            params["dr"],
+            coretemp,
+            timestep,
+            r_core,
+            radii,
+            times,
+            where_regolith,
+            params["kappa_reg"],
+            cond,
+            heatcap,
+            dens,
+        )
+        elapsed = time.perf_counter() - start
+        steps_run = max(times.size - 1, 1)
+        if elapsed >= target_seconds or (
+            max_steps is not None and n_steps >= max_steps
+        ):
+            return elapsed / steps_run
+        n_steps *= 2
+
+
+def plan_run(params, memory_budget=None, calibrate_time=True):
+    """
+    Report the memory, stability and run time of a run without running it.
+
+    Parameters
+    ----------
+    params : str, dict or tuple
+        Path of a parameters file, or parameters as a dictionary or as the
+        tuple returned by `load_plot_save.load_params_from_file`.
+    memory_budget : float, optional
+        Memory available for the run, in bytes. If given, the plan reports
+        whether the run fits and the longest "max_time" that would.
+    calibrate_time : bool, default True
+        Time a short solve to predict the wall time of the run.
+
+    Returns
+    -------
+    plan : dict
+        "n_radii", "n_core_radii" and "n_times"; "shapes" and "bytes" of
+        each output array; "peak_bytes", the memory held at once by the
+        workflow; "max_diffusivity", the Von Neumann "stability_criterion"
+        and whether the run is "stable"; "seconds_per_step" and
+        "predicted_wall_time" in s (None if not calibrated); and, if a
+        `memory_budget` is given, "memory_budget", "fits_budget" and
+        "max_time_within_budget" in Myr.
+
+    """
+    myr = 3.1556926e13  # seconds in a million years
+    params = _as_dict(params)
+    timestep = params["timestep"]
+    n_radii, n_core_radii, n_times = grid_size(
+        timestep,
+        params["r_planet"],
+        params["core_size_factor"],
+        params["max_time"],
+        params["dr"],
+    )
+    item = np.dtype(float).itemsize
+    shapes = {
+        "times": (n_times,),
+        "mantle_temperature_array": (n_radii, n_times),
+        "core_temperature_array": (n_core_radii, n_times),
+        "mantle_cooling_rates": (n_radii, n_times),
+        "core_cooling_rates": (n_core_radii, n_times),
+    }
+    sizes = {name: int(np.prod(shape)) * item for name, shape in shapes.items()}
+    sizes["core_history"] = n_times * _CORE_HISTORY_BYTES
+    # all of these are held at once while the results are saved
+    peak_bytes = sum(sizes.values())
+
+    diffusivity = max_diffusivity(params)
+    criterion = numerical_methods.stability_criterion(
+        diffusivity, timestep, params["dr"]
+    )
+    plan = {
+        "n_radii": n_radii,
+        "n_core_radii": n_core_radii,
+        "n_times": n_times,
+        "shapes": shapes,
+        "bytes": sizes,
+        "peak_bytes": peak_bytes,
+        "max_diffusivity": diffusivity,
+        "stability_criterion": criterion,
+        "stable": criterion <= 0.5,
+        "seconds_per_step": None,
+        "predicted_wall_time": None,
+    }
+    if calibrate_time:
+        seconds_per_step = calibrate(params, max_steps=max(n_times - 1, 1))
+        plan["seconds_per_step"] = seconds_per_step
+        plan["predicted_wall_time"] = seconds_per_step * max(n_times - 1, 0)
+    if memory_budget is not None:
+        bytes_per_step = peak_bytes / n_times
+        max_steps = int(memory_budget // bytes_per_step)
+        plan["memory_budget"] = memory_budget
+        plan["fits_budget"] = peak_bytes <= memory_budget
+        plan["max_time_within_budget"] = max(max_steps - 1, 0) * timestep / myr
+    return plan
+
+
+def describe_plan(plan):
+    """
+    Return a plan from `plan_run` as readable text.
+
+    Parameters
+    ----------
+    plan : dict
+        Plan returned by `plan_run`.
+
+    Returns
+    -------
+    text : str
+        One line per array, then the totals, stability and predicted time.
+
+    """
+
+    def size(n_bytes):
+        for unit in ("B", "kB", "MB", "GB"):
+            if n_bytes < 1000:
+                return f"{n_bytes:.1f} {unit}"
+            n_bytes /= 1000
+        return f"{n_bytes:.1f} TB"
+
+    lines = [
+        "Grid: {0} mantle radii, {1} core radii, {2} timesteps".format(
+            plan["n_radii"], plan["n_core_radii"], plan["n_times"]
+        )
+    ]
+    for name, n_bytes in plan["bytes"].items():
+        shape = plan["shapes"].get(name, "")
+        lines.append(f"  {name:<26}{str(shape):>20}{size(n_bytes):>12}")
+    lines.append(f"Peak memory: {size(plan['peak_bytes'])}")
+    lines.append(
+        "Von Neumann stability number: {0:.3g} ({1})".format(
+            plan["stability_criterion"],
+            "stable" if plan["stable"] else "unstable, reduce the timestep",
+        )
+    )
+    if plan["predicted_wall_time"] is not None:
+        lines.append(
+            "Predicted solve time: {0:.1f} s ({1:.3g} s per step)".format(
+                plan["predicted_wall_time"], plan["seconds_per_step"]
+            )
+        )
+    if "memory_budget" in plan:
+        lines.append(
+            "Memory budget {0}: {1}".format(
+                size(plan["memory_budget"]),
+                "fits"
+                if plan["fits_budget"]
+                else "exceeded; max_time of at most {0:.1f} Myr fits".format(
+                    plan["max_time_within_budget"]
+                ),
+            )
+        )
+    return "\n".join(lines)
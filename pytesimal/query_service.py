@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Answer meteorite depth and timing queries over HTTP from cached results.
+
+Finding where a meteorite with a given cooling rate formed in a model run
+(`analysis.meteorite_depth_and_timing`) means loading the results arrays of
+the run and scanning the whole history in python for each cooling rate.
+This module does the scan once per run: a `ResultIndex` keeps the indices of
+the 800 K and 593 K isotherms at each timestep and the cooling rates of only
+the timesteps where the 800 K isotherm lies in the mantle, so a query is a
+few vectorised numpy operations. Indices are kept in a least-recently-used
+`IndexCache`, and a small JSON service built on `http.server` (standard
+library only) answers batches of queries against them.
+
+The service listens on localhost by default and only reads results array
+files under its root folder, or runs found by "run_ID" in a run catalog.
+
+Example
+-------
+
+Start the service from the command line::
+
+    pytesimal serve results_folder --port 8750 --catalog runs.sqlite
+
+and query it with any HTTP client, giving cooling rates in K/Myr (or
+"cz_diameters", cloudy zone particle sizes in nm)::
+
+    curl -d '{"run": "example_params_results.npz",
+              "cooling_rates": [6.0, 8.5]}' http://localhost:8750/query
+
+The reply holds one result per cooling rate, with the values returned by
+`analysis.meteorite_depth_and_timing`, and the time taken.
+
+In python, start a server in a thread with `make_server`::
+
+    server = make_server('results_folder', port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/query'
+
+"""
+
+import collections
+import http.server
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from . import analysis
+from . import catalog as run_catalog
+from . import load_plot_save
+from . import setup_functions
+
+# timesteps before this are skipped by `analysis.meteorite_depth_and_timing`
+_FIRST_STEP = 5
+
+
+class ResultIndex:
+    """
+    Isotherm indices of a model run, for fast meteorite queries.
+
+    `depth_and_timing` returns the same values as
+    `analysis.meteorite_depth_and_timing` for the run.
+
+    Attributes
+    ----------
+    filepath : str
+        Results array file the index was built from.
+    r_planet, core_size_factor, dr, timestep : float
+        Parameters of the run, in m, m and s.
+    time_core_frozen, fully_frozen : float
+        When the core starts and finishes freezing, in s.
+    radii : numpy.ndarray
+        Mantle radii, in m.
+
+    """
+
+    def __init__(self, filepath):
+        """Build the index of the results array file at `filepath`."""
+        self.filepath = str(filepath)
+        params = load_plot_save._results_json(self.filepath)
+        if not params:
+            raise FileNotFoundError(
+                f"No results json file next to {self.filepath}"
+            )
+        myr = 3.1556926e13
+        self.r_planet = params["r_planet"]
+        self.core_size_factor = params["core_size_factor"]
+        self.dr = params["dr"]
+        self.timestep = params["timestep"]
+        # stored in Myr, but both are whole numbers of timesteps: rebuild
+        # them as `analysis.core_freezing` computes them
+        frozen_steps = round(
+            params["core_begins_to_freeze"] * myr / self.timestep
+        )
+        latent_steps = (
+            round(params["core finishes freezing"] * myr / self.timestep)
+            - frozen_steps
+        )
+        self.time_core_frozen = frozen_steps * self.timestep
+        self.fully_frozen = (
+            latent_steps * self.timestep + self.time_core_frozen
+        )
+        self.radii = setup_functions.set_up(
+            self.timestep,
+            self.r_planet,
+            self.core_size_factor,
+            params["reg_fraction"],
+            0.0,
+            self.dr,
+        )[1]
+        index_800, near_800, index_593, rates = [], [], [], []
+        with load_plot_save.load_results(self.filepath) as results:
+            temperatures = results.temperatures
+            n_steps = temperatures.shape[-1]
+            # one stored block of timesteps at a time
+            for block_start in range(0, n_steps, temperatures.chunk_steps):
+                start = max(block_start, _FIRST_STEP)
+                stop = min(block_start + temperatures.chunk_steps, n_steps)
+                if start >= stop:
+                    continue
+                block = temperatures[:, start:stop]
+                index = np.argmin(np.absolute(block - 800), axis=0)
+                near = (
+                    np.absolute(block[index, np.arange(index.size)] - 800)
+                    <= 10
+                )
+                index_800.append(index[near])
+                near_800.append(np.nonzero(near)[0] + start)
+                index_593.append(
+                    np.argmin(np.absolute(block - 593), axis=0)
+                )
+                if near.any():
+                    rates.append(
+                        results.dT_by_dt[:, start:stop][:, near]
+                    )
+        self.index_800 = np.concatenate(index_800 or [np.zeros(0, int)])
+        self.steps_800 = np.concatenate(near_800 or [np.zeros(0, int)])
+        self.index_593 = np.concatenate(index_593 or [np.zeros(0, int)])
+        self.rates_800 = (
+            np.concatenate(rates, axis=1)
+            if rates
+            else np.zeros((self.radii.size, 0))
+        )
+
+    def __repr__(self):
+        """Return string."""
+        return "ResultIndex({0!r}, {1} steps near 800 K)".format(
+            self.filepath, self.steps_800.size
+        )
+
+    @property
+    def nbytes(self):
+        """Memory used by the index, in bytes."""
+        return sum(
+            array.nbytes
+            for array in (
+                self.radii,
+                self.index_800,
+                self.steps_800,
+                self.index_593,
+                self.rates_800,
+            )
+        )
+
+    def depth_and_timing(self, CR):
+        """
+        Find the depth of genesis given the cooling rate.
+
+        Parameters
+        ----------
+        CR : float
+            Cooling rate of the meteorite, in K/s.
+
+        Returns
+        -------
+        result : tuple
+            As returned by `analysis.meteorite_depth_and_timing`.
+
+        """
+        radius_index = np.argmin(np.absolute(self.rates_800 + CR), axis=0)
+        matched = (
+            np.absolute(
+                self.rates_800[radius_index, np.arange(radius_index.size)]
+                + CR
+            )
+            <= 1e-15
+        )
+        return analysis._depth_and_timing_from_contours(
+            self.index_800[matched],
+            radius_index[matched],
+            self.index_593,
+            self.radii,
+            self.r_planet,
+            self.core_size_factor,
+            self.time_core_frozen,
+            self.fully_frozen,
+            self.dr,
+            self.timestep,
+        )
+
+
+class IndexCache:
+    """
+    Least-recently-used cache of `ResultIndex` objects, safe across threads.
+
+    An index is rebuilt if its results array file has changed since.
+
+    Attributes
+    ----------
+    max_entries : int
+        Maximum number of indices kept.
+    max_bytes : int or None
+        Maximum total `ResultIndex.nbytes` kept; the most recently used
+        index is always kept.
+    hits, misses : int
+        Number of lookups answered from the cache, and that built an index.
+
+    """
+
+    def __init__(self, max_entries=16, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._building = {}  # filepath: lock held while indexing it
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        """Total memory of the cached indices, in bytes."""
+        return sum(index.nbytes for index in self._entries.values())
+
+    def get(self, filepath):
+        """Return the index of a results array file, building it if needed."""
+        filepath = os.path.realpath(filepath)
+        stat = os.stat(filepath)
+        key = (filepath, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            index = self._lookup(key)
+            if index is not None:
+                return index
+            building = self._building.setdefault(filepath, threading.Lock())
+        # each file is indexed once, while other files are looked up or
+        # indexed in other threads
+        with building:
+            with self._lock:
+                index = self._lookup(key)
+                if index is not None:
+                    return index
+                self.misses += 1
+            index = ResultIndex(filepath)
+            with self._lock:
+                self._entries[key] = index
+                while len(self._entries) > 1 and (
+                    len(self._entries) > self.max_entries
+                    or (
+                        self.max_bytes is not None
+                        and self.nbytes > self.max_bytes
+                    )
+                ):
+                    self._entries.popitem(last=False)
+            return index
+
+    def _lookup(self, key):
+        """Return a cached index and count the hit, or None; hold the lock."""
+        if key not in self._entries:
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def stats(self):
+        """Return the entries, size, hits and misses of the cache."""
+        return {
+            "entries": len(self),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _plain(value):
+    """Return numpy scalars as python numbers for json."""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def query_result(index, rate_k_per_myr):
+    """
+    Answer one query as a dictionary.
+
+    Parameters
+    ----------
+    index : ResultIndex
+        Index of the run.
+    rate_k_per_myr : float
+        Cooling rate of the meteorite, in K/Myr.
+
+    Returns
+    -------
+    result : dict
+        The "cooling_rate" queried and the "depth", "timing" (string),
+        "time_core_frozen", "time_of_crossing" (s) and "critical_radius"
+        (m) returned by `analysis.meteorite_depth_and_timing`, any missing
+        ones None; or the "error" raised.
+
+    """
+    result = {"cooling_rate": rate_k_per_myr}
+    try:
+        values = index.depth_and_timing(
+            analysis.cooling_rate_to_seconds(rate_k_per_myr)
+        )
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+        return result
+    values = tuple(values) + (None,) * (5 - len(values))
+    names = (
+        "depth",
+        "timing",
+        "time_core_frozen",
+        "time_of_crossing",
+        "critical_radius",
+    )
+    result.update(zip(names, (_plain(value) for value in values)))
+    return result
+
+
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+    """
+    JSON requests to a query server made by `make_server`.
+
+    GET /health
+        Status and cache statistics.
+    POST /query
+        A JSON object with the "run" (a results array file relative to the
+        root folder, or a run ID in the catalog) and "cooling_rates" in
+        K/Myr and/or "cz_diameters" in nm; or a list of such objects to
+        answer in one request.
+
+    """
+
+    server_version = "pytesimal-query"
+
+    def log_message(self, format, *args):
+        """Log requests only when the server is verbose."""
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        """Answer health checks."""
+        if self.path.rstrip("/") != "/health":
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+            return
+        self._reply(
+            200,
+            {"status": "ok", "root": self.server.root,
+             "cache": self.server.cache.stats()},
+        )
+
+    def do_POST(self):
+        """Answer a query, or a list of queries."""
+        if self.path.rstrip("/") != "/query":
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+            return
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"null")
+            if isinstance(request, list):
+                body = {"results": [self._query(item) for item in request]}
+            else:
+                body = self._query(request)
+        except (ValueError, TypeError, KeyError) as error:
+            self._reply(400, {"error": f"{type(error).__name__}: {error}"})
+            return
+        except (LookupError, OSError) as error:
+            # unknown runs, and array files without their json results
+            self._reply(404, {"error": str(error)})
+            return
+        except Exception as error:
+            # e.g. a corrupt array file; keep serving other queries
+            self._reply(500, {"error": f"{type(error).__name__}: {error}"})
+            return
+        body["time_ms"] = 1000 * (time.perf_counter() - start)
+        self._reply(200, body)
+
+    def _query(self, request):
+        """Answer one query object."""
+        if not isinstance(request, dict) or "run" not in request:
+            raise ValueError("A query needs a 'run'")
+        rates = [float(rate) for rate in request.get("cooling_rates", [])]
+        rates += [
+            analysis.cooling_rate_cloudyzone_diameter(float(diameter))
+            for diameter in request.get("cz_diameters", [])
+        ]
+        filepath = self.server.resolve(str(request["run"]))
+        index = self.server.cache.get(filepath)
+        return {
+            "run": request["run"],
+            "arrays_file": filepath,
+            "results": [query_result(index, rate) for rate in rates],
+        }
+
+
+class QueryServer(http.server.ThreadingHTTPServer):
+    """
+    HTTP server answering meteorite queries, see `make_server`.
+
+    Attributes
+    ----------
+    root : str
+        Folder of the results array files that may be queried.
+    cache : IndexCache
+        The cached indices.
+    catalog : str or None
+        Path of a run catalog used to find runs by run ID.
+    verbose : bool
+        Whether requests are logged to standard error.
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, root, cache, catalog=None, verbose=False):
+        super().__init__(address, QueryHandler)
+        self.root = os.path.realpath(root)
+        self.cache = cache
+        self.catalog = None if catalog is None else str(catalog)
+        self.verbose = verbose
+
+    def resolve(self, run):
+        """
+        Return the results array file of a run.
+
+        Parameters
+        ----------
+        run : str
+            Path of a results array file relative to `root`, or a run ID
+            in `catalog`.
+
+        Returns
+        -------
+        filepath : str
+            Absolute path of the results array file.
+
+        """
+        filepath = os.path.realpath(os.path.join(self.root, run))
+        if os.path.commonpath([filepath, self.root]) != self.root:
+            raise ValueError(f"Run {run!r} is outside the served folder")
+        if os.path.isfile(filepath):
+            return filepath
+        if self.catalog is not None:
+            with run_catalog.RunCatalog(self.catalog) as opened:
+                found = opened.query(columns=["arrays_file"], run_ID=run)
+            files = [path for path in found["arrays_file"] if path]
+            if files:
+                return files[-1]
+        raise LookupError(f"No results found for run {run!r}")
+
+
+def make_server(
+    root,
+    host="127.0.0.1",
+    port=8750,
+    catalog=None,
+    max_entries=16,
+    max_bytes=None,
+    verbose=False,
+):
+    """
+    Create a query server, ready to `serve_forever`.
+
+    Parameters
+    ----------
+    root : str
+        Folder of the results array files that may be queried.
+    host : str, default "127.0.0.1"
+        Address to listen on; the default only accepts local connections.
+    port : int, default 8750
+        Port to listen on; 0 picks a free port (see `server_port`).
+    catalog : str, optional
+        Path of a `catalog.RunCatalog` to look up runs by run ID.
+    max_entries : int, default 16
+        Number of run indices to keep in memory.
+    max_bytes : int, optional
+        Memory to keep run indices in, in bytes.
+    verbose : bool, default False
+        Log each request to standard error.
+
+    Returns
+    -------
+    server : QueryServer
+        The server, bound but not yet serving.
+
+    """
+    return QueryServer(
+        (host, port),
+        root,
+        IndexCache(max_entries=max_entries, max_bytes=max_bytes),
+        catalog=catalog,
+        verbose=verbose,
+    )
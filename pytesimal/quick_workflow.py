@@ -18,6 +18,8 @@ directory where results
 
 """
 
+import time
+
 from . import setup_functions
 from . import load_plot_save
 from . import core_function
@@ -25,9 +27,129 @@ from . import mantle_properties
 from . import numerical_methods
 from . import analysis
 
+# the modules of optional features (result_cache, catalog, planning, metrics
+# and reduced_order) are imported only when a run uses them, so that
+# importing this module stays quick and does not load sqlite3
+
+
+class StorageOptions:
+    """
+    How `workflow` stores the results arrays of a run.
+
+    Attributes
+    ----------
+    svd_tolerance : float, optional
+        Store the results arrays as truncated singular value decompositions
+        accurate to this many K, see `load_plot_save.save_result_arrays`.
+        This typically makes the array file 50 to 100 times smaller.
+    chunk_steps : int, optional
+        Store the results arrays in separately compressed blocks of this
+        many timesteps (e.g. 4096, about 4 MB for the default 125 radii), so
+        that time windows of long runs are read without decompressing the
+        whole history; see `load_plot_save.save_result_arrays`. With
+        `svd_tolerance`, the number of timesteps in each SVD block (default
+        1024). By default the arrays are stored whole, and the array file
+        can be read with `numpy.load`; chunked and SVD array files need
+        `load_plot_save.read_datafile` or `load_plot_save.load_results`.
+    save_arrays : bool, default True
+        Save the results array file. Set to False when the arrays are only
+        needed through the `allocate` argument of `workflow`; "arrays_file"
+        is then None.
+
+    """
+
+    def __init__(self, svd_tolerance=None, chunk_steps=None, save_arrays=True):
+        self.svd_tolerance = svd_tolerance
+        self.chunk_steps = chunk_steps
+        self.save_arrays = save_arrays
+
+    def __repr__(self):
+        """Return string."""
+        return (
+            "StorageOptions(svd_tolerance={0!r}, chunk_steps={1!r}, "
+            "save_arrays={2!r})".format(
+                self.svd_tolerance, self.chunk_steps, self.save_arrays
+            )
+        )
+
+
+class CheckpointOptions:
+    """
+    When `workflow` saves checkpoints of the solver state, and resumes.
+
+    Checkpoints are saved to `<filename>_results_checkpoint.npz` (plus
+    history segments) in the results folder, and a final checkpoint is kept
+    at the end of the run so that it can be extended later.
+
+    Attributes
+    ----------
+    every_steps : int, optional
+        Save a checkpoint every this many timesteps.
+    every_seconds : float, optional
+        Save a checkpoint every this many seconds of wall time.
+    resume : bool, default False
+        Resume from the checkpoint saved by a previous call, if there is
+        one. This restarts a run that crashed, or extends a finished run
+        when "max_time" in the parameters file has been increased, without
+        recomputing from t = 0.
+
+    """
+
+    def __init__(self, every_steps=None, every_seconds=None, resume=False):
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.resume = resume
+
+    def __repr__(self):
+        """Return string."""
+        return (
+            "CheckpointOptions(every_steps={0!r}, every_seconds={1!r}, "
+            "resume={2!r})".format(
+                self.every_steps, self.every_seconds, self.resume
+            )
+        )
+
+
+class InstrumentOptions:
+    """
+    What `workflow` records about how a run went.
+
+    Attributes
+    ----------
+    profile : bool, default False
+        Record the time spent in each phase of the solve with a
+        `numerical_methods.SolverProfile`; the profile is written to the
+        results json file and returned in the summary.
+    metrics_log : str, optional
+        Path of a JSON lines log to append the operational metrics of the
+        call to (wall and CPU time, peak memory, steps per second, bytes
+        written, backend, host and cache hit), see `metrics.run_record`.
+
+    """
+
+    def __init__(self, profile=False, metrics_log=None):
+        self.profile = profile
+        self.metrics_log = metrics_log
+
+    def __repr__(self):
+        """Return string."""
+        return "InstrumentOptions(profile={0!r}, metrics_log={1!r})".format(
+            self.profile, self.metrics_log
+        )
+
 
 def workflow(
-    filename, folder_path
+    filename,
+    folder_path,
+    backend="ftcs",
+    storage=None,
+    checkpoints=None,
+    cache=None,
+    catalog=None,
+    instruments=None,
+    progress=None,
+    memory_budget=None,
+    allocate=None,
 ):  # set folder = folder path if you want results saved in same loc as params file
     """
     Run model in full with parameters set by an input file.
@@ -59,9 +181,64 @@ def workflow(
         The absolute path to the directory that holds the parameters file. If
         the "folder" field of the parameters file == `folder_path`, the results
         file will be saved alongside the parameters file.
+    backend : str, default "ftcs"
+        Name of the solver backend in `numerical_methods.SOLVER_BACKENDS`,
+        or the path of a `reduced_order.ReducedOrderModel` saved to a .npz
+        file, which is registered with `reduced_order.load_backend`.
+    storage : StorageOptions, optional
+        How the results arrays are stored; by default whole, in a results
+        array file.
+    checkpoints : CheckpointOptions, optional
+        When to save checkpoints of the solver state, and whether to resume
+        from one; by default no checkpoints are saved.
+    cache : str or result_cache.ResultCache, optional
+        Directory of a result cache (or a `result_cache.ResultCache`, to set
+        its size limit and whether array files are hard linked from it). If
+        the same parameters (ignoring "run_ID" and "folder") have already
+        been run with the same package version and backend, the stored
+        results are reused instead of solving again; otherwise the new
+        results are added to the cache.
+    catalog : str or catalog.RunCatalog, optional
+        Path of a SQLite run catalog (or an open `catalog.RunCatalog`) to
+        add the parameters, results and wall time of this run to.
+    instruments : InstrumentOptions, optional
+        Whether to profile the solve, and a metrics log to append to.
+    progress : bool or callable, optional
+        If True, print the progress of the solve to standard error with a
+        `numerical_methods.ProgressReporter` labelled with the run ID. A
+        callable is passed to the solver as its `progress` callback instead.
+    memory_budget : float, optional
+        Memory available for the run, in bytes. If the arrays of the run
+        would not fit (see `planning.plan_run`), a `MemoryError` is raised
+        before anything is allocated, suggesting the longest "max_time" that
+        would fit.
+    allocate : callable, optional
+        Called as `allocate(name, shape)` to create each of the four result
+        arrays ("temperatures", "coretemp", "dT_by_dt", "dT_by_dt_core") as
+        a zeroed float array, which the run is solved into in place; e.g. a
+        `shared_arrays.ArrayAllocator`, so that the arrays can be handed to
+        another process without copying. On a cache hit, the cached arrays
+        are read into the allocated arrays.
+
+    Returns
+    -------
+    summary : dict
+        Paths of the results json file ("results_file") and array file
+        ("arrays_file"), the cache key ("cache_key", None when no cache is
+        used), whether the results came from the cache ("cache_hit") and the
+        wall time of the call in s ("wall_time"). If profiling is set in
+        `instruments` and the model was solved, the solver profile is
+        included as "profile".
 
     """
+    storage = StorageOptions() if storage is None else storage
+    checkpoints = CheckpointOptions() if checkpoints is None else checkpoints
+    instruments = InstrumentOptions() if instruments is None else instruments
+    start_time = time.perf_counter()
+    cpu_start = time.process_time()
+    solve = {"run_ID": None, "solve_time": None, "steps": None}
     filepath = f"{folder_path}/{filename}.txt"
+    params = load_plot_save.load_params_from_file(filepath)
     (
         run_ID,
         folder,
@@ -85,8 +262,85 @@ def workflow(
         cond_constant,
         density_constant,
         heat_cap_constant,
-    ) = load_plot_save.load_params_from_file(filepath)
+    ) = params
+    solve["run_ID"] = run_ID
     load_plot_save.check_folder_exists(folder)
+    if backend not in numerical_methods.SOLVER_BACKENDS and str(
+        backend
+    ).endswith(".npz"):
+        from . import reduced_order
+
+        backend = reduced_order.load_backend(backend)
+    if backend not in numerical_methods.SOLVER_BACKENDS:
+        raise ValueError(
+            f"Unknown solver backend {backend!r}, choose from "
+            f"{sorted(numerical_methods.SOLVER_BACKENDS)}"
+        )
+
+    result_filename = f"{filename}_results"
+    result_stem = f"{folder}/{result_filename}"
+    summary = {
+        "results_file": f"{result_stem}.txt",
+        "arrays_file": f"{result_stem}.npz",
+        "cache_key": None,
+        "cache_hit": False,
+    }
+    if cache is not None:
+        from . import result_cache
+
+        if not isinstance(cache, result_cache.ResultCache):
+            cache = result_cache.ResultCache(cache)
+        cache_params = params
+        layout = {
+            name: value
+            for name, value in (
+                ("svd_tolerance", storage.svd_tolerance),
+                ("chunk_steps", storage.chunk_steps),
+            )
+            if value is not None
+        }
+        if layout:
+            # array files of each layout are cached separately
+            cache_params = dict(
+                zip(load_plot_save.PARAMETER_NAMES, params), **layout
+            )
+        summary["cache_key"] = result_cache.parameter_hash(
+            cache_params, backend=backend
+        )
+        if cache.fetch(
+            summary["cache_key"], result_stem, run_ID=run_ID, folder=folder
+        ):
+            summary["cache_hit"] = True
+            if allocate is not None:
+                _read_into(allocate, summary["arrays_file"])
+            return _finish(
+                summary,
+                start_time,
+                catalog,
+                instruments.metrics_log,
+                backend,
+                cpu_start,
+                solve,
+            )
+
+    if memory_budget is not None:
+        from . import planning
+
+        plan = planning.plan_run(
+            params, memory_budget=memory_budget, calibrate_time=False
+        )
+        if not plan["fits_budget"]:
+            raise MemoryError(
+                "Run {0} needs about {1:.3g} GB but the memory budget is "
+                "{2:.3g} GB; reduce max_time to {3:.1f} Myr or less, or "
+                "increase dr".format(
+                    run_ID,
+                    plan["peak_bytes"] / 1e9,
+                    memory_budget / 1e9,
+                    plan["max_time_within_budget"],
+                )
+            )
+
     (
         r_core,
         radii,
@@ -99,6 +353,14 @@ def workflow(
     ) = setup_functions.set_up(
         timestep, r_planet, core_size_factor, reg_fraction, max_time, dr
     )
+    if allocate is not None:
+        # the zeros from set_up are not touched yet, so cost no memory
+        mantle_temperature_array = allocate(
+            "temperatures", mantle_temperature_array.shape
+        )
+        core_temperature_array = allocate(
+            "coretemp", core_temperature_array.shape
+        )
     latent = []
 
     core_values = core_function.IsothermalEutecticCore(
@@ -126,11 +388,36 @@ def workflow(
     top_mantle_bc = numerical_methods.surface_dirichlet_bc
     bottom_mantle_bc = numerical_methods.cmb_dirichlet_bc
 
+    profiler = (
+        numerical_methods.SolverProfile() if instruments.profile else None
+    )
+    if progress is True:
+        progress = numerical_methods.ProgressReporter(label=run_ID)
+    elif progress is False:
+        progress = None
+    checkpoint = None
+    start_step = 1
+    if (
+        checkpoints.resume
+        or checkpoints.every_steps
+        or checkpoints.every_seconds
+    ):
+        checkpoint = numerical_methods.Checkpointer(
+            f"{folder}/{result_filename}_checkpoint.npz",
+            every_steps=checkpoints.every_steps,
+            every_seconds=checkpoints.every_seconds,
+        )
+        if checkpoints.resume and checkpoint.exists():
+            start_step = checkpoint.restore(
+                mantle_temperature_array, core_values, timestep, dr
+            )
+
+    solve_start = time.perf_counter()
     (
         mantle_temperature_array,
         core_temperature_array,
         latent,
-    ) = numerical_methods.discretisation(
+    ) = numerical_methods.SOLVER_BACKENDS[backend](
         core_values,
         latent,
         temp_init,
@@ -150,7 +437,15 @@ def workflow(
         mantle_conductivity,
         mantle_heatcap,
         mantle_density,
+        checkpoint=checkpoint,
+        start_step=start_step,
+        profiler=profiler,
+        progress=progress,
     )
+    solve["solve_time"] = time.perf_counter() - solve_start
+    solve["steps"] = max(len(times) - start_step, 0)
+    if profiler is not None:
+        summary["profile"] = profiler.as_dict()
 
     (
         core_frozen,
@@ -166,12 +461,19 @@ def workflow(
         timestep,
     )
     mantle_cooling_rates = analysis.cooling_rate(
-        mantle_temperature_array, timestep
+        mantle_temperature_array,
+        timestep,
+        out=None
+        if allocate is None
+        else allocate("dT_by_dt", mantle_temperature_array.shape),
     )
     core_cooling_rates = analysis.cooling_rate(
-        core_temperature_array, timestep
+        core_temperature_array,
+        timestep,
+        out=None
+        if allocate is None
+        else allocate("dT_by_dt_core", core_temperature_array.shape),
     )
-    result_filename = f"{filename}_results"
     load_plot_save.save_params_and_results(
         result_filename,
         run_ID,
@@ -198,13 +500,80 @@ def workflow(
         heat_cap_constant,
         time_core_frozen,
         fully_frozen,
+        profile=summary.get("profile"),
     )
 
-    load_plot_save.save_result_arrays(
-        result_filename,
-        folder,
-        mantle_temperature_array,
-        core_temperature_array,
-        mantle_cooling_rates,
-        core_cooling_rates,
+    if storage.save_arrays:
+        load_plot_save.save_result_arrays(
+            result_filename,
+            folder,
+            mantle_temperature_array,
+            core_temperature_array,
+            mantle_cooling_rates,
+            core_cooling_rates,
+            chunk_steps=storage.chunk_steps,
+            timestep=timestep,
+            svd_tolerance=storage.svd_tolerance,
+        )
+    else:
+        summary["arrays_file"] = None
+
+    if cache is not None and storage.save_arrays:
+        cache.store(summary["cache_key"], result_stem)
+    return _finish(
+        summary,
+        start_time,
+        catalog,
+        instruments.metrics_log,
+        backend,
+        cpu_start,
+        solve,
     )
+
+
+def _read_into(allocate, arrays_file):
+    """Read the arrays of a results file into arrays from `allocate`."""
+    with load_plot_save.load_results(arrays_file) as results:
+        for name in load_plot_save._RESULT_ARRAY_NAMES:
+            stored = getattr(results, name)
+            array = allocate(name, stored.shape)
+            # one block of timesteps at a time
+            for start in range(0, stored.shape[-1], stored.chunk_steps):
+                stop = start + stored.chunk_steps
+                array[:, start:stop] = stored[:, start:stop]
+
+
+def _finish(
+    summary, start_time, catalog, metrics_log, backend, cpu_start, solve
+):
+    """Record the wall time of a run, and add it to a catalog and log."""
+    summary["wall_time"] = time.perf_counter() - start_time
+    if metrics_log is not None:
+        from . import metrics
+
+        metrics.append_record(
+            metrics_log,
+            metrics.run_record(
+                summary,
+                backend,
+                time.process_time() - cpu_start,
+                **solve,
+            ),
+        )
+    if catalog is not None:
+        from . import catalog as run_catalog
+
+        opened = catalog
+        if not isinstance(catalog, run_catalog.RunCatalog):
+            opened = run_catalog.RunCatalog(catalog)
+        try:
+            opened.add_results_file(
+                summary["results_file"],
+                arrays_file=summary["arrays_file"],
+                wall_time=summary["wall_time"],
+                cache_hit=summary["cache_hit"],
+            )
+        finally:
+            if opened is not catalog:
+                opened.close()
+    return summary
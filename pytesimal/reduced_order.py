@@ -0,0 +1,618 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Solve the mantle heat equation with a reduced-order (POD-Galerkin) model.
+
+Runs that differ only a little in their parameters have temperature
+histories made of the same few radial shapes. A `ReducedOrderModel` learns
+these shapes, by proper orthogonal decomposition (POD), from the temperature
+arrays of solved runs, and then solves new runs for the weights of a handful
+of them instead of the temperature of every cell.
+
+The temperature of the mantle is written as a lift, a linear profile between
+the temperatures at the core-mantle boundary and at the surface, plus a sum
+of POD modes that are zero at both boundaries, so that the Dirichlet boundary
+conditions of `quick_workflow.workflow` hold exactly. Each timestep makes the
+explicit update of `numerical_methods.discretisation` and projects it onto
+the modes (Galerkin projection). The update is non-linear, as conductivity,
+heat capacity and density may depend on temperature, so rather than on every
+cell it is evaluated on a few cells chosen by the discrete empirical
+interpolation method (DEIM) and interpolated across the mantle with POD
+modes of the update itself. The cells either side of the base of the
+regolith, where the diffusivity jumps to `kappa_reg`, and the cell above the
+core-mantle boundary are always among them. The core is coupled as in
+`numerical_methods.discretisation`: the heat conducted across the boundary,
+from the reconstructed temperature of the first cell of the mantle, is
+extracted from the core object on every timestep, and the new core
+temperature sets the boundary for the next.
+
+The model is meant for runs with the grid and geometry of its training runs,
+varying e.g. `kappa_reg`, the initial temperatures or the properties of the
+core. For a run with a different number of cells the modes are interpolated
+onto its grid, in radius scaled from the core-mantle boundary (0) to the
+surface (1), but as the base of the regolith moves the results are then only
+rough.
+
+Example
+-------
+
+Learn 10 modes from a few solved runs, then solve another run with them::
+
+    model = ReducedOrderModel.from_results(
+        ['run1_results.npz', 'run2_results.npz', 'run3_results.npz'],
+        n_modes=10,
+    )
+    backend = model.register()
+    workflow('run4', folder, backend=backend)
+
+Or call `model.discretisation` with the arguments of
+`numerical_methods.discretisation`. Models can be saved and loaded::
+
+    model.save('mantle_rom.npz')
+    model = ReducedOrderModel.load('mantle_rom.npz')
+
+A registered backend only exists in the process that registered it, and in
+process pools forked from it. Pools that start their workers with "spawn" or
+"forkserver", such as those of `async_sweep.AsyncSweep`, can use the saved
+model instead, by its path::
+
+    run_sweep_async(paramfiles, backend='mantle_rom.npz')
+
+"""
+
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from . import load_plot_save
+from . import numerical_methods
+
+# snapshots taken from each training run at most
+MAX_SNAPSHOTS = 2000
+# timesteps of temperatures reconstructed at a time
+_BLOCK = 4096
+
+
+def _scaled_radii(n_radii):
+    """Return radius scaled from 0 at the base to 1 at the top of a grid."""
+    return np.arange(n_radii) / (n_radii - 1)
+
+
+def _interpolation_matrix(source, target):
+    """Return the matrix linearly interpolating from `source` to `target`."""
+    matrix = np.zeros((target.size, source.size))
+    upper = np.clip(np.searchsorted(source, target), 1, source.size - 1)
+    weight = (target - source[upper - 1]) / (
+        source[upper] - source[upper - 1]
+    )
+    weight = np.clip(weight, 0.0, 1.0)
+    rows = np.arange(target.size)
+    matrix[rows, upper - 1] = 1.0 - weight
+    matrix[rows, upper] += weight
+    return matrix
+
+
+def deim_points(basis):
+    """
+    Choose interpolation points for a basis by the DEIM greedy algorithm.
+
+    Parameters
+    ----------
+    basis : numpy.ndarray
+        Basis vectors as columns, shape (n_cells, n_vectors).
+
+    Returns
+    -------
+    points : numpy.ndarray
+        Row index of one point per basis vector.
+
+    """
+    points = [int(np.argmax(np.abs(basis[:, 0])))]
+    for n in range(1, basis.shape[1]):
+        weights = np.linalg.solve(basis[points, :n], basis[points, n])
+        residual = basis[:, n] - basis[:, :n] @ weights
+        points.append(int(np.argmax(np.abs(residual))))
+    return np.array(points)
+
+
+def _pod(snapshots, n_vectors):
+    """Return the leading left singular vectors and all singular values."""
+    vectors, values, _ = np.linalg.svd(snapshots, full_matrices=False)
+    return vectors[:, :n_vectors], values
+
+
+class ReducedOrderModel:
+    """
+    POD-Galerkin model of the mantle, learnt from solved runs.
+
+    Attributes
+    ----------
+    modes : numpy.ndarray
+        POD modes of the temperature above the lift, one column per mode,
+        on the interior cells of the training grid.
+    update_modes : numpy.ndarray
+        POD modes of the explicit update, for interpolating it from the
+        DEIM points.
+    singular_values : numpy.ndarray
+        Singular values of the temperature snapshots; the fraction of their
+        squares in the first `n_modes` (see `energy`) measures how well the
+        modes span the training runs.
+    n_modes : int
+        Number of temperature modes.
+    n_points : int or None
+        Number of DEIM points chosen by the greedy algorithm, before the
+        points at the regolith and the core-mantle boundary are added; None
+        evaluates the update on every cell.
+
+    """
+
+    def __init__(self, modes, update_modes, singular_values, n_points=None):
+        """
+        Build a model from its modes; see `fit` to learn them.
+
+        Parameters
+        ----------
+        modes : numpy.ndarray
+            Orthonormal temperature modes, shape (n_cells - 2, n_modes).
+        update_modes : numpy.ndarray
+            Orthonormal update modes, with at least `n_points` columns.
+        singular_values : numpy.ndarray
+            Singular values of the temperature snapshots.
+        n_points : int, optional
+            Number of DEIM points; None evaluates every cell.
+
+        """
+        self.modes = np.asarray(modes, dtype=float)
+        self.update_modes = np.asarray(update_modes, dtype=float)
+        self.singular_values = np.asarray(singular_values, dtype=float)
+        self.n_modes = self.modes.shape[1]
+        if n_points is not None and n_points > self.update_modes.shape[1]:
+            raise ValueError(
+                f"Need at least {n_points} update modes for {n_points} points"
+            )
+        self.n_points = n_points
+        self._operators = {}
+
+    def __repr__(self):
+        """Return string."""
+        return (
+            "ReducedOrderModel(n_modes={0}, n_points={1}, cells={2})".format(
+                self.n_modes, self.n_points, self.modes.shape[0] + 2
+            )
+        )
+
+    @property
+    def energy(self):
+        """Fraction of the snapshot energy captured by the modes."""
+        squares = self.singular_values ** 2
+        return float(squares[: self.n_modes].sum() / squares.sum())
+
+    @classmethod
+    def fit(cls, temperature_arrays, n_modes=10, n_points=20,
+            max_snapshots=MAX_SNAPSHOTS):
+        """
+        Learn the modes from the mantle temperatures of solved runs.
+
+        Parameters
+        ----------
+        temperature_arrays : sequence of numpy.ndarray
+            Mantle temperatures of each training run, shape
+            (n_radii, n_times). Runs with a different number of cells than
+            the first are interpolated onto its grid.
+        n_modes : int, default 10
+            Number of temperature modes.
+        n_points : int or None, default 20
+            Number of DEIM points; None evaluates the update on every cell.
+        max_snapshots : int, default `MAX_SNAPSHOTS`
+            Most timesteps to take from each run, evenly spaced.
+
+        Returns
+        -------
+        model : ReducedOrderModel
+
+        """
+        temperature_arrays = list(temperature_arrays)
+        if not temperature_arrays:
+            raise ValueError("Need at least one training run")
+        n_cells = np.asarray(temperature_arrays[0]).shape[0]
+        interior = _scaled_radii(n_cells)[1:-1]
+        states, updates = [], []
+        for temperatures in temperature_arrays:
+            temperatures = np.asarray(temperatures, dtype=float)
+            stride = max(1, -(-(temperatures.shape[1] - 1) // max_snapshots))
+            columns = np.arange(1, temperatures.shape[1], stride)
+            scaled = _scaled_radii(temperatures.shape[0])
+            state = temperatures[1:-1, columns] - (
+                np.outer(1.0 - scaled[1:-1], temperatures[0, columns])
+                + np.outer(scaled[1:-1], temperatures[-1, columns])
+            )
+            # the update of step i is taken from the state at step i - 1
+            update = (
+                temperatures[1:-1, columns] - temperatures[1:-1, columns - 1]
+            )
+            largest = np.max(np.abs(update))
+            if largest > 0:
+                update /= largest
+            if temperatures.shape[0] != n_cells:
+                matrix = _interpolation_matrix(scaled[1:-1], interior)
+                state = matrix @ state
+                update = matrix @ update
+            states.append(state)
+            updates.append(update)
+        states = np.hstack(states)
+        updates = np.hstack(updates)
+        limit = min(states.shape)
+        if n_modes > limit:
+            raise ValueError(
+                f"Training runs support at most {limit} modes, not {n_modes}"
+            )
+        modes, singular_values = _pod(states, n_modes)
+        n_update_modes = n_points or n_modes
+        update_modes, _ = _pod(updates, min(n_update_modes, limit))
+        return cls(modes, update_modes, singular_values, n_points)
+
+    @classmethod
+    def from_results(cls, arrays_files, **kwargs):
+        """
+        Learn the modes from the results array files of solved runs.
+
+        Parameters
+        ----------
+        arrays_files : sequence of str
+            Paths of .npz results array files.
+        **kwargs
+            Passed to `fit`.
+
+        Returns
+        -------
+        model : ReducedOrderModel
+
+        """
+        temperature_arrays = []
+        for filepath in arrays_files:
+            with load_plot_save.load_results(filepath) as results:
+                temperature_arrays.append(results.temperatures.read())
+        return cls.fit(temperature_arrays, **kwargs)
+
+    def _grid_operators(self, radii, where_regolith):
+        """Return the modes and DEIM operators for a grid, cached."""
+        key = (radii.size, where_regolith.tobytes())
+        if key in self._operators:
+            return self._operators[key]
+        n_cells = radii.size
+        modes = self.modes
+        update_modes = self.update_modes
+        if n_cells != modes.shape[0] + 2:
+            matrix = _interpolation_matrix(
+                _scaled_radii(modes.shape[0] + 2)[1:-1],
+                _scaled_radii(n_cells)[1:-1],
+            )
+            modes = np.linalg.qr(matrix @ modes)[0]
+            update_modes = np.linalg.qr(matrix @ update_modes)[0]
+        if self.n_points is None:
+            points = np.arange(n_cells - 2)
+            projection = modes.T
+        else:
+            # interior cells either side of the base of the regolith, and the
+            # cell above the core-mantle boundary
+            jumps = np.flatnonzero(np.diff(where_regolith) != 0)
+            forced = np.concatenate([[0], jumps - 1, jumps])
+            forced = forced[(forced >= 0) & (forced < n_cells - 2)]
+            points = np.union1d(
+                deim_points(update_modes[:, : self.n_points]), forced
+            )
+            projection = (
+                modes.T
+                @ update_modes[:, : self.n_points]
+                @ np.linalg.pinv(update_modes[points, : self.n_points])
+            )
+        # full-grid rows of the points and their neighbours
+        cells = points + 1
+        padded = np.vstack([np.zeros(self.n_modes), modes,
+                            np.zeros(self.n_modes)])
+        scaled = _scaled_radii(n_cells)
+        operators = {
+            "modes": modes,
+            "projection": projection,
+            "cells": cells,
+            # below, at and above each point, stacked
+            "rows": np.vstack(
+                [padded[cells + offset] for offset in (-1, 0, 1)]
+            ),
+            "scaled": np.concatenate(
+                [scaled[cells + offset] for offset in (-1, 0, 1)]
+            ),
+            "mantle": (where_regolith[cells] == 1).astype(float),
+            "radii": radii[cells],
+            "lift_bottom": modes.T @ (1.0 - scaled[1:-1]),
+            "lift_top": modes.T @ scaled[1:-1],
+        }
+        self._operators[key] = operators
+        return operators
+
+    def discretisation(
+        self,
+        core_values,
+        latent,
+        temp_init,
+        core_temp_init,
+        top_mantle_bc,
+        bottom_mantle_bc,
+        temp_surface,
+        temperatures,
+        dr,
+        coretemp_array,
+        timestep,
+        r_core,
+        radii,
+        times,
+        where_regolith,
+        kappa_reg,
+        cond,
+        heatcap,
+        dens,
+        non_lin_term="y",
+        checkpoint=None,
+        start_step=1,
+        profiler=None,
+        progress=None,
+    ):
+        """
+        Solve a run with the reduced-order model.
+
+        Takes the arguments and returns the values of
+        `numerical_methods.discretisation`, so that the model can be used as
+        a solver backend (see `register`). Only the Dirichlet boundary
+        conditions `numerical_methods.surface_dirichlet_bc` and
+        `numerical_methods.cmb_dirichlet_bc` are supported, and runs cannot
+        be checkpointed or resumed. As with `numerical_methods.discretisation`,
+        a run stopped by an exception from `progress` keeps the temperatures
+        of the timesteps solved.
+
+        Returns
+        -------
+        temperatures : numpy.ndarray
+            Array filled with mantle temperatures, in K.
+        coretemp : numpy.ndarray
+            Array filled with core temperatures, in K.
+        latent : list
+            List of latent heat values during core crystallisation, in J
+            kg^-1.
+
+        """
+        if (
+            top_mantle_bc is not numerical_methods.surface_dirichlet_bc
+            or bottom_mantle_bc is not numerical_methods.cmb_dirichlet_bc
+        ):
+            raise ValueError(
+                "The reduced-order model needs Dirichlet boundary conditions"
+            )
+        if checkpoint is not None or start_step > 1:
+            raise ValueError(
+                "Reduced-order runs cannot be checkpointed or resumed"
+            )
+        solve_start = time.perf_counter()
+        radii = np.asarray(radii, dtype=float)
+        operators = self._grid_operators(
+            radii, np.asarray(where_regolith, dtype=float)
+        )
+        rows = operators["rows"]
+        rows_scaled = operators["scaled"]
+        n_points = rows.shape[0] // 3
+        mantle = operators["mantle"]
+        regolith = kappa_reg * (1.0 - mantle)
+        inverse_rdr = 1.0 / (operators["radii"] * dr)
+        inverse_dr2 = 1.0 / dr ** 2.0
+        projection = timestep * operators["projection"]
+        lift_bottom = operators["lift_bottom"]
+        lift_top = operators["lift_top"]
+        first_cell = operators["modes"][0]
+        area = 4 * np.pi * r_core ** 2
+        n_steps = len(times) - 1
+
+        temperatures[:, 0] = temp_init
+        coretemp_array[:, 0] = core_temp_init
+        initial = temperatures[:, 0]
+        scaled = _scaled_radii(radii.size)
+        bottom = np.empty(n_steps + 1)
+        top = np.empty(n_steps + 1)
+        weights = np.empty((self.n_modes, n_steps + 1))
+        bottom[0] = initial[0]
+        top[0] = initial[-1]
+        state = operators["modes"].T @ (
+            initial[1:-1]
+            - (1.0 - scaled[1:-1]) * initial[0]
+            - scaled[1:-1] * initial[-1]
+        )
+        weights[:, 0] = state
+        core_boundary_temperature = core_temp_init
+        getk = cond.getk
+        getdkdT = cond.getdkdT
+        getrho = dens.getrho
+        getcp = heatcap.getcp
+        nonlinear = non_lin_term == "y"
+
+        # steps solved, so that a run stopped by `progress` keeps its history
+        completed = 0
+        try:
+            for i in range(1, n_steps + 1):
+                # temperatures of the points and their neighbours at step i - 1
+                lower = bottom[i - 1]
+                upper = top[i - 1]
+                T_rows = lower + (upper - lower) * rows_scaled + rows @ state
+                T_below = T_rows[:n_points]
+                T_centre = T_rows[n_points:2 * n_points]
+                T_above = T_rows[2 * n_points:]
+                gradient = T_above - T_below
+                capacity = getrho(T_centre) * getcp(T_centre)
+                diffusivity = mantle * (getk(T_centre) / capacity) + regolith
+                update = diffusivity * (
+                    gradient * inverse_rdr
+                    + (T_above - 2 * T_centre + T_below) * inverse_dr2
+                )
+                if nonlinear:
+                    update += (
+                        mantle
+                        * (getdkdT(T_centre) / capacity)
+                        * gradient ** 2
+                        * (0.25 * inverse_dr2)
+                    )
+                # project the update, and move the lift to the new boundaries
+                bottom[i] = core_boundary_temperature
+                top[i] = temp_surface
+                state = (
+                    state
+                    + projection @ update
+                    + lift_bottom * (lower - bottom[i])
+                    + lift_top * (upper - top[i])
+                )
+                weights[:, i] = state
+
+                # Allow core to cool
+                T_first = (
+                    bottom[i]
+                    + (top[i] - bottom[i]) * scaled[1]
+                    + first_cell @ state
+                )
+                power = (
+                    -area
+                    * getk(bottom[i])
+                    * ((bottom[i] - T_first) / dr)
+                )
+                core_values.extract_heat(power, timestep)
+                core_boundary_temperature = core_values.temperature
+
+                completed = i
+                if progress is not None:
+                    progress(
+                        i,
+                        n_steps,
+                        times[i],
+                        getattr(core_values, "phase", None),
+                    )
+        finally:
+            self._reconstruct(
+                temperatures, operators["modes"], bottom, top, weights,
+                completed + 1,
+            )
+
+        if profiler is not None:
+            profiler.add("reduced_solve", time.perf_counter() - solve_start)
+            profiler.wall_time += time.perf_counter() - solve_start
+            profiler.steps += n_steps
+        latent = core_values.latentlist
+        coretemp_array = core_values.temperature_array_2D(coretemp_array)
+        return (
+            temperatures,
+            coretemp_array,
+            latent,
+        )
+
+    @staticmethod
+    def _reconstruct(temperatures, modes, bottom, top, weights, n_columns):
+        """Fill the first `n_columns` timesteps of `temperatures`."""
+        temperatures[0, :n_columns] = bottom[:n_columns]
+        temperatures[-1, :n_columns] = top[:n_columns]
+        interior = _scaled_radii(temperatures.shape[0])[1:-1, None]
+        for start in range(0, n_columns, _BLOCK):
+            block = slice(start, min(start + _BLOCK, n_columns))
+            temperatures[1:-1, block] = (
+                (1.0 - interior) * bottom[block]
+                + interior * top[block]
+                + modes @ weights[:, block]
+            )
+
+    @property
+    def digest(self):
+        """Short hash of the modes, identifying the model."""
+        sha = hashlib.sha256()
+        for array in (self.modes, self.update_modes):
+            sha.update(np.ascontiguousarray(array).tobytes())
+        sha.update(str(self.n_points).encode())
+        return sha.hexdigest()[:12]
+
+    def register(self, name=None):
+        """
+        Add the model to `numerical_methods.SOLVER_BACKENDS`.
+
+        Parameters
+        ----------
+        name : str, optional
+            Name of the backend; defaults to "pod-" and the `digest` of the
+            model, so that cached results of different models are kept
+            apart.
+
+        Returns
+        -------
+        name : str
+            The backend name, for `quick_workflow.workflow(backend=name)`.
+
+        Notes
+        -----
+        The backend is only added in this process, so it is also known to
+        pools forked from it later but not to workers started by "spawn" or
+        "forkserver"; give those the path of the saved model instead (see
+        `load_backend`).
+
+        """
+        name = name or f"pod-{self.digest}"
+        numerical_methods.SOLVER_BACKENDS[name] = self.discretisation
+        return name
+
+    def save(self, filepath):
+        """Save the model to a .npz file."""
+        np.savez_compressed(
+            filepath,
+            modes=self.modes,
+            update_modes=self.update_modes,
+            singular_values=self.singular_values,
+            n_points=-1 if self.n_points is None else self.n_points,
+        )
+
+    @classmethod
+    def load(cls, filepath):
+        """Load a model saved with `save`."""
+        with np.load(filepath) as arrays:
+            n_points = int(arrays["n_points"])
+            return cls(
+                arrays["modes"],
+                arrays["update_modes"],
+                arrays["singular_values"],
+                None if n_points < 0 else n_points,
+            )
+
+
+# backend names of the models loaded by `load_backend`, by file and version
+_loaded = {}
+
+
+def load_backend(filepath):
+    """
+    Register a saved model as a solver backend, unless already done.
+
+    `quick_workflow.workflow` calls this for a `backend` ending in .npz, so
+    that a model can be used by its path in any process, including workers
+    that do not share the `numerical_methods.SOLVER_BACKENDS` of the process
+    that made the model. Each file is loaded once per process, and again if
+    it changes.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of a model saved with `ReducedOrderModel.save`.
+
+    Returns
+    -------
+    name : str
+        The backend name, "pod-" and the `digest` of the model, as from
+        `ReducedOrderModel.register`.
+
+    """
+    filepath = str(filepath)
+    version = (os.path.realpath(filepath), os.stat(filepath).st_mtime_ns)
+    name = _loaded.get(version)
+    if name is None or name not in numerical_methods.SOLVER_BACKENDS:
+        name = _loaded[version] = ReducedOrderModel.load(filepath).register()
+    return name
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache model results by a hash of the parameters that produced them.
+
+A model run is fully determined by its physical and numerical parameters,
+the version of the package and the solver backend used. This module hashes a
+canonical form of these into a key, and stores the results files of a run in
+a cache directory under that key, so that repeated runs with identical
+parameters can reuse the stored results instead of solving again.
+
+Example
+-------
+
+Runs started through `pytesimal.quick_workflow.workflow` use the cache when
+a cache directory is given::
+
+    workflow('example_params', 'path/to/folder', cache='path/to/cache')
+
+The parameters "run_ID" and "folder" only label a run and are not part of
+the hash, so the same parameters saved under a different name or folder
+still match.
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+from . import __version__
+from . import load_plot_save
+
+# parameters that label a run without changing its results
+LABEL_PARAMETERS = ("run_ID", "folder")
+
+
+def canonical_parameters(params):
+    """
+    Return the parameters of a run in a canonical form.
+
+    Numbers are converted to floats (so that `400` and `400.0` are
+    equivalent), lists and arrays to lists of floats, and the labelling
+    parameters "run_ID" and "folder" are removed.
+
+    Parameters
+    ----------
+    params : dict or tuple
+        Parameters as a dictionary, or as the tuple returned by
+        `load_plot_save.load_params_from_file`.
+
+    Returns
+    -------
+    canonical : dict
+        The canonical parameters.
+
+    """
+    if not isinstance(params, dict):
+        params = dict(zip(load_plot_save.PARAMETER_NAMES, params))
+
+    def canonical(value):
+        if isinstance(value, str):
+            return value
+        if hasattr(value, "tolist"):  # numpy arrays and scalars
+            value = value.tolist()
+        if isinstance(value, (list, tuple)):
+            return [canonical(item) for item in value]
+        return float(value)
+
+    return {
+        name: canonical(value)
+        for name, value in params.items()
+        if name not in LABEL_PARAMETERS
+    }
+
+
+def parameter_hash(params, backend="ftcs", version=__version__):
+    """
+    Return the cache key for a set of parameters.
+
+    Parameters
+    ----------
+    params : dict or tuple
+        Parameters as a dictionary, or as the tuple returned by
+        `load_plot_save.load_params_from_file`.
+    backend : str, default "ftcs"
+        Name of the solver backend, see
+        `numerical_methods.SOLVER_BACKENDS`.
+    version : str, optional
+        Package version; defaults to the installed version.
+
+    Returns
+    -------
+    key : str
+        Hexadecimal SHA-256 digest.
+
+    """
+    payload = {
+        "parameters": canonical_parameters(params),
+        "backend": backend,
+        "version": version,
+    }
+    text = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Directory of results files stored by parameter hash.
+
+    Each entry is a subdirectory named after its key holding the results
+    array file (`results.npz`) and the results json file (`results.txt`).
+    Entries are used in least-recently-used order for eviction.
+
+    Attributes
+    ----------
+    directory : str
+        Path of the cache directory; created if it does not exist.
+    max_bytes : int, optional
+        If set, the least recently used entries are evicted after each
+        `store` until the cache is no larger than this.
+    link : bool
+        Default of `fetch`: hard link array files instead of copying them.
+    """
+
+    suffixes = (".npz", ".txt")
+
+    def __init__(self, directory, max_bytes=None, link=False):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.link = link
+        load_plot_save.check_folder_exists(self.directory)
+
+    def __str__(self):
+        """Return string."""
+        return "Result cache at {0}".format(self.directory)
+
+    def entry(self, key):
+        """Return the directory of the entry for `key`."""
+        return os.path.join(self.directory, key)
+
+    def lookup(self, key):
+        """
+        Find the cached files for `key`.
+
+        Parameters
+        ----------
+        key : str
+            Cache key from `parameter_hash`.
+
+        Returns
+        -------
+        files : dict or None
+            Paths of the cached files by suffix (".npz", ".txt"), or None if
+            the key is not in the cache.
+
+        """
+        entry = self.entry(key)
+        files = {
+            suffix: os.path.join(entry, f"results{suffix}")
+            for suffix in self.suffixes
+        }
+        if not all(os.path.isfile(path) for path in files.values()):
+            return None
+        os.utime(entry)  # mark as recently used
+        return files
+
+    def store(self, key, result_stem):
+        """
+        Copy the results files of a run into the cache.
+
+        Parameters
+        ----------
+        key : str
+            Cache key from `parameter_hash`.
+        result_stem : str
+            Path of the results files without suffix, e.g.
+            `folder/run_results`.
+
+        Returns
+        -------
+        files : dict
+            Paths of the cached files by suffix.
+
+        """
+        entry = self.entry(key)
+        if not os.path.isdir(entry):
+            # copy into a temporary directory first so that an entry is
+            # either complete or absent
+            tmp_entry = os.path.join(
+                self.directory, f".{key}.{uuid.uuid4().hex}.tmp"
+            )
+            os.makedirs(tmp_entry)
+            for suffix in self.suffixes:
+                shutil.copyfile(
+                    result_stem + suffix,
+                    os.path.join(tmp_entry, f"results{suffix}"),
+                )
+            try:
+                os.rename(tmp_entry, entry)
+            except OSError:
+                # stored concurrently by another process
+                shutil.rmtree(tmp_entry, ignore_errors=True)
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes, keep=key)
+        return self.lookup(key)
+
+    def fetch(self, key, result_stem, link=None, run_ID=None, folder=None):
+        """
+        Copy or link cached results to `result_stem` + suffix.
+
+        The results json file is always copied, with "run_ID" and "folder"
+        replaced if given, so that it describes the new run. The array file
+        is copied, or hard linked to the cached file if `link` is True.
+
+        A hard link keeps the array file readable after its entry is
+        evicted (the disk space is only freed once the link is removed too),
+        but it shares its contents with the cache: replace the linked file
+        rather than writing into it. Where a hard link cannot be made, for
+        example with the cache on another filesystem, the file is copied.
+
+        Parameters
+        ----------
+        key : str
+            Cache key from `parameter_hash`.
+        result_stem : str
+            Path of the results files to create, without suffix.
+        link : bool, optional
+            Hard link to the cached array file instead of copying it;
+            defaults to the `link` attribute.
+        run_ID : str, optional
+            Identifier of the new run to write into the json file.
+        folder : str, optional
+            Results folder of the new run to write into the json file.
+
+        Returns
+        -------
+        hit : bool
+            True if `key` was in the cache and the files were created.
+
+        """
+        files = self.lookup(key)
+        if files is None:
+            return False
+        with open(files[".txt"]) as json_file:
+            data = json.load(json_file)
+        if run_ID is not None:
+            data["run_ID"] = run_ID
+        if folder is not None:
+            data["folder"] = folder
+        with open(result_stem + ".txt", "w") as file:
+            json.dump(data, file, indent=4)
+        target = result_stem + ".npz"
+        if os.path.lexists(target):
+            os.remove(target)
+        if self.link if link is None else link:
+            try:
+                os.link(files[".npz"], target)
+                return True
+            except OSError:
+                pass  # another filesystem, or no hard links
+        shutil.copyfile(files[".npz"], target)
+        return True
+
+    def _entries(self):
+        """Return (last used, size, path) for every complete entry."""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(path, f))
+                for f in os.listdir(path)
+            )
+            entries.append((os.path.getmtime(path), size, path))
+        return entries
+
+    def size(self):
+        """Return the total size of the cached files, in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_bytes, keep=None):
+        """
+        Remove least recently used entries until the cache fits `max_bytes`.
+
+        Parameters
+        ----------
+        max_bytes : int
+            Maximum total size of the cache, in bytes.
+        keep : str, optional
+            Key of an entry that must not be removed.
+
+        Returns
+        -------
+        removed : list
+            Keys of the removed entries.
+
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            key = os.path.basename(path)
+            if key == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed.append(key)
+        return removed
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Hand result arrays from worker processes to their parent without copying.
+
+The temperature and cooling rate histories of a run can be hundreds of MB.
+Returning them from a process pool worker pickles them through a pipe, and
+reading them back from the compressed results file decompresses them again.
+Instead, a worker can solve straight into buffers allocated by an
+`ArrayAllocator`, either in shared memory (`multiprocessing.shared_memory`)
+or in file-backed memory maps (.npy files opened with `numpy.memmap`), and
+return only the small, picklable `handles` of the buffers. The parent opens
+the handles with `SharedResultArrays`, which maps the same memory.
+
+Example
+-------
+
+`sweep.run_sweep` does this for every run when asked to::
+
+    results = sweep.run_sweep(paramfiles, share_arrays='shared_memory')
+    for result in results:
+        with result['arrays'] as arrays:
+            print(arrays['temperatures'][-2].min())
+
+Leaving the `with` block frees the memory (or deletes the memmap files). A
+worker of your own can use an allocator directly::
+
+    def worker(paramfile):
+        allocate = ArrayAllocator('shared_memory')
+        try:
+            workflow(*sweep.split_param_path(paramfile), allocate=allocate)
+        except Exception:
+            allocate.release()
+            raise
+        allocate.close()
+        return allocate.handles
+
+    with SharedResultArrays(pool.submit(worker, paramfile).result()) as a:
+        ...
+
+"""
+
+import os
+import uuid
+
+import numpy as np
+
+KINDS = ("shared_memory", "memmap")
+
+
+def _shared_memory():
+    """Return `multiprocessing.shared_memory`, new in Python 3.8."""
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        raise ValueError(
+            "shared_memory arrays need Python 3.8 or later; use 'memmap' "
+            "arrays instead"
+        )
+    return shared_memory
+
+
+def _create_segment(size):
+    """Create a shared memory segment that only we will unlink."""
+    shared_memory = _shared_memory()
+    from multiprocessing import resource_tracker
+
+    try:
+        # Python 3.13+: keep the resource tracker of this process out of it
+        return shared_memory.SharedMemory(create=True, size=size, track=False)
+    except TypeError:
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class ArrayAllocator:
+    """
+    Allocate zeroed arrays that another process can map by handle.
+
+    "shared_memory" arrays need Python 3.8 or later; "memmap" arrays work
+    with every supported version.
+
+    Pass an allocator as the `allocate` argument of
+    `quick_workflow.workflow` to keep the result arrays of the run in it.
+    The buffers outlive the allocator: the process that opens the handles
+    with `SharedResultArrays` is responsible for freeing them, and the
+    allocating process should only `close` its own mappings (or `release`
+    the buffers if it fails before handing them over).
+
+    Attributes
+    ----------
+    kind : str
+        "shared_memory" or "memmap".
+    directory : str or None
+        Folder of the memmap files.
+    prefix : str
+        Start of the names of the segments or files.
+    handles : dict
+        Handle of each allocated array by name; each is a small dictionary
+        with the "kind", "shape" and "dtype" of the array and the "name" of
+        its segment or the "path" of its file.
+
+    """
+
+    def __init__(self, kind="shared_memory", directory=None, prefix=None):
+        """
+        Start an allocator.
+
+        Parameters
+        ----------
+        kind : str, default "shared_memory"
+            One of `KINDS`.
+        directory : str, optional
+            Folder to write memmap files to; required for "memmap".
+        prefix : str, optional
+            Start of the segment or file names; defaults to a random name.
+
+        """
+        if kind not in KINDS:
+            raise ValueError(
+                f"Unknown array kind {kind!r}, choose from {list(KINDS)}"
+            )
+        if kind == "memmap" and directory is None:
+            raise ValueError("memmap arrays need a directory")
+        if kind == "shared_memory":
+            _shared_memory()  # fail early before Python 3.8
+        self.kind = kind
+        self.directory = None if directory is None else str(directory)
+        self.prefix = prefix or f"pytesimal_{uuid.uuid4().hex[:12]}"
+        self.handles = {}
+        self._mappings = []
+
+    def __repr__(self):
+        """Return string."""
+        return "ArrayAllocator({0!r}, arrays={1})".format(
+            self.kind, sorted(self.handles)
+        )
+
+    def __call__(self, name, shape, dtype=np.float64):
+        """
+        Allocate a zeroed array.
+
+        Parameters
+        ----------
+        name : str
+            Name of the array, e.g. "temperatures".
+        shape : tuple of int
+            Shape of the array.
+        dtype : numpy.dtype, default numpy.float64
+            Type of the elements.
+
+        Returns
+        -------
+        array : numpy.ndarray
+            The array, backed by shared memory or a memmap file.
+
+        """
+        if name in self.handles:
+            raise ValueError(f"Array {name!r} is already allocated")
+        shape = tuple(int(n) for n in shape)
+        dtype = np.dtype(dtype)
+        handle = {"kind": self.kind, "shape": shape, "dtype": dtype.str}
+        if self.kind == "shared_memory":
+            size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+            segment = _create_segment(size)
+            handle["name"] = segment.name
+            self._mappings.append(segment)
+            array = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{self.prefix}_{name}.npy")
+            handle["path"] = path
+            array = np.lib.format.open_memmap(
+                path, mode="w+", dtype=dtype, shape=shape
+            )
+            self._mappings.append(array)
+        self.handles[name] = handle
+        return array
+
+    def close(self):
+        """
+        Unmap the arrays from this process, keeping the buffers.
+
+        Arrays returned by the allocator must no longer be used.
+        """
+        for mapping in self._mappings:
+            if isinstance(mapping, np.memmap):
+                mapping.flush()
+            else:
+                try:
+                    mapping.close()
+                except BufferError:
+                    # still viewed by an array; unmapped when it is freed
+                    pass
+        self._mappings = []
+
+    def release(self):
+        """Unmap the arrays and free the buffers, e.g. after a failure."""
+        self.close()
+        _free(self.handles.values())
+        self.handles = {}
+
+
+def _free(handles):
+    """Unlink the segments or delete the files of `handles`."""
+    for handle in handles:
+        try:
+            if handle["kind"] == "shared_memory":
+                segment = _shared_memory().SharedMemory(name=handle["name"])
+                segment.close()
+                segment.unlink()
+            else:
+                os.remove(handle["path"])
+        except FileNotFoundError:
+            pass
+
+
+class SharedResultArrays:
+    """
+    Arrays mapped from the handles of an `ArrayAllocator`.
+
+    Behaves as a read-only mapping of array name to `numpy.ndarray`; the
+    arrays share memory with the buffers, nothing is copied. Use as a
+    context manager, or call `release` when done, to free the buffers;
+    `close` only unmaps them from this process. Shared memory segments that
+    are never released are freed when this process exits.
+
+    Attributes
+    ----------
+    handles : dict
+        The handles the arrays were opened from.
+
+    """
+
+    def __init__(self, handles):
+        """Map the arrays of `handles`, from `ArrayAllocator.handles`."""
+        self.handles = dict(handles)
+        self._arrays = {}
+        self._segments = []
+        for name, handle in self.handles.items():
+            if handle["kind"] == "shared_memory":
+                # tracked, so segments never released are freed at exit
+                segment = _shared_memory().SharedMemory(name=handle["name"])
+                self._segments.append(segment)
+                array = np.ndarray(
+                    handle["shape"],
+                    dtype=np.dtype(handle["dtype"]),
+                    buffer=segment.buf,
+                )
+            else:
+                array = np.load(handle["path"], mmap_mode="r+")
+            self._arrays[name] = array
+
+    def __repr__(self):
+        """Return string."""
+        return "SharedResultArrays({0})".format(
+            ", ".join(
+                f"{name}={array.shape}" for name, array in self._arrays.items()
+            )
+        )
+
+    def __getitem__(self, name):
+        return self._arrays[name]
+
+    def __iter__(self):
+        return iter(self._arrays)
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def __contains__(self, name):
+        return name in self._arrays
+
+    def keys(self):
+        """Return the names of the arrays."""
+        return self._arrays.keys()
+
+    def items(self):
+        """Return (name, array) pairs."""
+        return self._arrays.items()
+
+    @property
+    def nbytes(self):
+        """Total size of the arrays, in bytes."""
+        return sum(array.nbytes for array in self._arrays.values())
+
+    def close(self):
+        """
+        Unmap the arrays from this process, keeping the buffers.
+
+        Arrays taken from this object must no longer be used.
+        """
+        self._arrays = {}
+        for segment in self._segments:
+            try:
+                segment.close()
+            except BufferError:
+                # still viewed by an array; unmapped when it is freed
+                pass
+        self._segments = []
+
+    def release(self):
+        """Unmap the arrays and free the buffers."""
+        self.close()
+        _free(self.handles.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,545 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Emulate model results from a catalog of completed runs.
+
+A surrogate interpolates the results of the runs in a `catalog.RunCatalog`
+across their parameters, so that parameter studies can be explored without
+solving again. Each output is fitted separately by Gaussian radial basis
+function interpolation, which is also the mean of a Gaussian process with a
+squared exponential kernel. The length scale of each is the one with the
+smallest leave-one-out error, computed in closed form (Rippa, 1999), and the
+leave-one-out errors of the chosen fit are kept as an estimate of the
+accuracy of the surrogate. Predictions also come with the standard deviation
+of the Gaussian process.
+
+The outputs are the times the core begins and finishes freezing, in Myr,
+and, for each cooling rate asked for, the depth of formation (in units of
+`dr`, km by default) and the time of crossing (in Myr) returned by
+`analysis.meteorite_depth_and_timing`; these are found from the results
+array file of each run with a `query_service.ResultIndex`. Runs where an
+output is undefined (the core does not freeze within the run, or no depth
+matches the cooling rate) are left out of the fit of that output.
+
+Parameters are scaled to the unit interval across the runs, logarithmically
+for parameters spanning more than two decades such as `kappa_reg`, and the
+"y"/"n" flags such as `cond_constant` are used as 1 and 0.
+
+Example
+-------
+
+Fit a surrogate to the runs of a catalog and predict across a range of
+planet radii::
+
+    emulator = Surrogate.from_catalog(
+        'runs.sqlite', cooling_rates=[6.0], cond_constant='n'
+    )
+    print(emulator.validation())
+    predictions, std = emulator.predict(
+        r_planet=np.linspace(150e3, 300e3, 100),
+        core_size_factor=0.5,
+        kappa_reg=5e-8,
+        cond_constant='n',
+        return_std=True,
+    )
+    predictions['depth@6'], predictions['core_begins_to_freeze']
+
+Fitted surrogates can be saved and loaded again without the catalog::
+
+    emulator.save('surrogate.npz')
+    emulator = Surrogate.load('surrogate.npz')
+
+"""
+
+import json
+
+import numpy as np
+
+from . import analysis
+from . import catalog as run_catalog
+from . import query_service
+
+# the parameters most parameter studies vary
+DEFAULT_PARAMETERS = (
+    "r_planet",
+    "core_size_factor",
+    "kappa_reg",
+    "cond_constant",
+)
+# outputs read from the catalog, in Myr
+CORE_OUTPUTS = ("core_begins_to_freeze", "core_finishes_freezing")
+
+
+class RBFEmulator:
+    """
+    Gaussian radial basis function interpolation of one output.
+
+    Attributes
+    ----------
+    length_scale : float
+        Length scale of the kernel, in scaled parameter units.
+    smoothing : float
+        Added to the diagonal of the kernel matrix, relative to its unit
+        diagonal, for a smoother and better conditioned fit.
+    loo_errors : numpy.ndarray
+        Leave-one-out error of each training point, prediction minus value.
+
+    """
+
+    def __init__(self, length_scale=None, smoothing=1e-8):
+        """
+        Prepare an emulator.
+
+        Parameters
+        ----------
+        length_scale : float, optional
+            Kernel length scale; by default the one with the smallest
+            leave-one-out error is chosen when fitting.
+        smoothing : float, default 1e-8
+            Relative smoothing of the fit; 0 interpolates exactly.
+
+        """
+        self.length_scale = length_scale
+        self.smoothing = smoothing
+
+    def _kernel(self, a, b, length_scale):
+        """Return the kernel matrix between points `a` and `b`."""
+        squared = (
+            np.sum(a ** 2, axis=1)[:, None]
+            + np.sum(b ** 2, axis=1)[None, :]
+            - 2.0 * a @ b.T
+        )
+        return np.exp(-np.maximum(squared, 0.0) / length_scale ** 2)
+
+    def _solve(self, length_scale):
+        """Return the inverse kernel matrix, weights and LOO errors."""
+        matrix = self._kernel(self.points, self.points, length_scale)
+        matrix[np.diag_indices_from(matrix)] += self.smoothing
+        inverse = np.linalg.inv(matrix)
+        weights = inverse @ self._values
+        # Rippa (1999): the leave-one-out residual of point i
+        errors = -weights / np.diag(inverse)
+        return inverse, weights, errors
+
+    def fit(self, points, values):
+        """
+        Fit the emulator.
+
+        Parameters
+        ----------
+        points : numpy.ndarray
+            Scaled parameters of the training runs, shape (n_runs, n_dims).
+        values : numpy.ndarray
+            Output of each run.
+
+        Returns
+        -------
+        self : RBFEmulator
+
+        """
+        self.points = np.atleast_2d(np.asarray(points, dtype=float))
+        values = np.asarray(values, dtype=float)
+        if self.points.shape[0] != values.size:
+            raise ValueError("Need one value per training point")
+        if values.size < 2:
+            raise ValueError("Need at least two runs to fit an emulator")
+        self.mean = values.mean()
+        self.scale = values.std() or 1.0
+        self._values = (values - self.mean) / self.scale
+        if self.length_scale is None:
+            best = None
+            n_dims = self.points.shape[1]
+            for length_scale in np.geomspace(0.03, 3.0, 25) * np.sqrt(n_dims):
+                try:
+                    errors = self._solve(length_scale)[2]
+                except np.linalg.LinAlgError:
+                    continue
+                rmse = np.sqrt(np.mean(errors ** 2))
+                if np.isfinite(rmse) and (best is None or rmse < best[0]):
+                    best = (rmse, length_scale)
+            if best is None:
+                raise np.linalg.LinAlgError(
+                    "No length scale gave a well conditioned fit"
+                )
+            self.length_scale = best[1]
+        self._inverse, self._weights, errors = self._solve(self.length_scale)
+        self.loo_errors = errors * self.scale
+        # maximum likelihood variance of the Gaussian process
+        self.variance = max(
+            float(self._values @ self._weights) / values.size, 0.0
+        )
+        return self
+
+    def predict(self, points, return_std=False):
+        """
+        Predict the output at scaled parameters `points`.
+
+        Parameters
+        ----------
+        points : numpy.ndarray
+            Scaled parameters, shape (n_points, n_dims).
+        return_std : bool, default False
+            Also return the standard deviation of the Gaussian process.
+
+        Returns
+        -------
+        values : numpy.ndarray
+            Predicted output at each point.
+        std : numpy.ndarray
+            Standard deviation of each prediction, if `return_std`.
+
+        """
+        kernel = self._kernel(
+            np.atleast_2d(points), self.points, self.length_scale
+        )
+        values = self.mean + self.scale * (kernel @ self._weights)
+        if not return_std:
+            return values
+        explained = np.sum(kernel * (kernel @ self._inverse), axis=1)
+        variance = self.variance * np.maximum(
+            1.0 + self.smoothing - explained, 0.0
+        )
+        return values, self.scale * np.sqrt(variance)
+
+    def validation(self):
+        """Return the "n_runs", "rmse" and "max_abs" leave-one-out errors."""
+        return {
+            "n_runs": int(self.loo_errors.size),
+            "rmse": float(np.sqrt(np.mean(self.loo_errors ** 2))),
+            "max_abs": float(np.max(np.absolute(self.loo_errors))),
+        }
+
+
+def _as_numbers(name, values):
+    """Return parameter values as floats, "y"/"n" flags as 1 and 0."""
+    values = np.asarray(values)
+    if values.dtype.kind in "OUS":
+        flags = {"y": 1.0, "n": 0.0}
+        try:
+            return np.array([flags[str(value)] for value in values.ravel()])
+        except KeyError:
+            raise ValueError(
+                f"Parameter {name!r} must be numeric or a 'y'/'n' flag"
+            )
+    return values.astype(float).ravel()
+
+
+def _merge_duplicates(points, values):
+    """
+    Average the values of runs at the same point.
+
+    Identical points make the kernel matrix singular, and the leave-one-out
+    error of each would vanish, as its copy predicts it.
+    """
+    unique, inverse = np.unique(points, axis=0, return_inverse=True)
+    if len(unique) == len(points):
+        return points, values
+    inverse = inverse.ravel()
+    counts = np.bincount(inverse)
+    return unique, np.bincount(inverse, weights=values) / counts
+
+
+class Surrogate:
+    """
+    Emulators of the outputs of model runs across their parameters.
+
+    Attributes
+    ----------
+    parameters : tuple of str
+        Names of the input parameters.
+    outputs : tuple of str
+        Names of the emulated outputs: those of `CORE_OUTPUTS`, and
+        "depth@<rate>" and "time_of_crossing@<rate>" for each cooling rate
+        in K/Myr.
+    emulators : dict
+        `RBFEmulator` of each output.
+
+    """
+
+    def __init__(self, inputs, outputs, length_scale=None, smoothing=1e-8):
+        """
+        Fit emulators to training runs.
+
+        Parameters
+        ----------
+        inputs : dict
+            Values of each parameter for every training run.
+        outputs : dict
+            Values of each output for every training run; NaN where
+            undefined. Runs with the same parameters (e.g. the same run
+            catalogued under two names) are fitted as one, with the mean of
+            their outputs.
+        length_scale : float, optional
+            Kernel length scale of every emulator, see `RBFEmulator`.
+        smoothing : float, default 1e-8
+            Relative smoothing of every emulator.
+
+        """
+        self.parameters = tuple(inputs)
+        columns = [_as_numbers(name, inputs[name]) for name in inputs]
+        raw = np.stack(columns, axis=1)
+        self._log = np.array(
+            [
+                np.all(column > 0) and column.max() > 100 * column.min()
+                for column in columns
+            ]
+        )
+        transformed = np.where(self._log, np.log(np.abs(raw) + 1e-300), raw)
+        self._low = transformed.min(axis=0)
+        span = transformed.max(axis=0) - self._low
+        self._span = np.where(span > 0, span, 1.0)
+        points = (transformed - self._low) / self._span
+        self.emulators = {}
+        for name, values in outputs.items():
+            values = np.asarray(values, dtype=float)
+            defined = np.isfinite(values)
+            unique, merged = _merge_duplicates(
+                points[defined], values[defined]
+            )
+            if len(merged) < 2:
+                continue
+            self.emulators[name] = RBFEmulator(
+                length_scale=length_scale, smoothing=smoothing
+            ).fit(unique, merged)
+        self.outputs = tuple(self.emulators)
+
+    def __repr__(self):
+        """Return string."""
+        return "Surrogate(parameters={0}, outputs={1})".format(
+            list(self.parameters), list(self.outputs)
+        )
+
+    @classmethod
+    def from_catalog(
+        cls,
+        catalog,
+        parameters=DEFAULT_PARAMETERS,
+        cooling_rates=(),
+        length_scale=None,
+        smoothing=1e-8,
+        **criteria,
+    ):
+        """
+        Fit a surrogate to the runs in a catalog.
+
+        Parameters
+        ----------
+        catalog : str or catalog.RunCatalog
+            The run catalog, or its path.
+        parameters : sequence of str, default `DEFAULT_PARAMETERS`
+            Catalog columns to use as inputs.
+        cooling_rates : sequence of float, optional
+            Meteorite cooling rates in K/Myr to emulate the depth and time
+            of crossing for; needs the results array file of each run.
+        length_scale, smoothing
+            See `RBFEmulator`.
+        **criteria
+            Catalog columns to select the runs by, see
+            `catalog.RunCatalog.query`.
+
+        Returns
+        -------
+        surrogate : Surrogate
+
+        """
+        opened = catalog
+        if not isinstance(catalog, run_catalog.RunCatalog):
+            opened = run_catalog.RunCatalog(catalog)
+        try:
+            runs = opened.query(
+                columns=list(parameters) + list(CORE_OUTPUTS)
+                + ["arrays_file"],
+                **criteria,
+            )
+        finally:
+            if opened is not catalog:
+                opened.close()
+        if len(runs["id"]) < 2:
+            raise ValueError("Need at least two runs to fit a surrogate")
+        outputs = {}
+        for name in CORE_OUTPUTS:
+            values = np.asarray(runs[name], dtype=float)
+            # 0 means the core does not freeze within the run
+            outputs[name] = np.where(values > 0, values, np.nan)
+        outputs.update(
+            meteorite_outputs(runs["arrays_file"], cooling_rates)
+        )
+        return cls(
+            {name: runs[name] for name in parameters},
+            outputs,
+            length_scale=length_scale,
+            smoothing=smoothing,
+        )
+
+    def _points(self, params):
+        """Scale parameters given by name into emulator coordinates."""
+        missing = set(self.parameters) - set(params)
+        if missing:
+            raise ValueError(f"Missing parameters {sorted(missing)}")
+        columns = np.broadcast_arrays(
+            *(
+                np.asarray(params[name], dtype=object
+                           if isinstance(params[name], str) else None)
+                for name in self.parameters
+            )
+        )
+        shape = columns[0].shape
+        raw = np.stack(
+            [
+                _as_numbers(name, column)
+                for name, column in zip(self.parameters, columns)
+            ],
+            axis=1,
+        )
+        transformed = np.where(self._log, np.log(np.abs(raw) + 1e-300), raw)
+        return (transformed - self._low) / self._span, shape
+
+    def predict(self, outputs=None, return_std=False, **params):
+        """
+        Predict outputs at the given parameters.
+
+        Parameters
+        ----------
+        outputs : sequence of str, optional
+            Outputs to predict; all by default.
+        return_std : bool, default False
+            Also return the Gaussian process standard deviation of each
+            prediction.
+        **params
+            Value (or array of values, broadcast together) of every
+            parameter in `parameters`.
+
+        Returns
+        -------
+        predictions : dict
+            Array of predictions of each output, in the broadcast shape.
+        std : dict
+            Standard deviations, if `return_std`.
+
+        """
+        points, shape = self._points(params)
+        predictions, std = {}, {}
+        for name in outputs or self.outputs:
+            if return_std:
+                values, errors = self.emulators[name].predict(points, True)
+                std[name] = errors.reshape(shape)
+            else:
+                values = self.emulators[name].predict(points)
+            predictions[name] = values.reshape(shape)
+        if return_std:
+            return predictions, std
+        return predictions
+
+    def validation(self):
+        """
+        Return the leave-one-out errors of each output.
+
+        Returns
+        -------
+        errors : dict
+            For each output, the "n_runs" fitted (runs with the same
+            parameters counting once), and the root mean square
+            ("rmse") and largest ("max_abs") error of predicting each run
+            from all the others.
+
+        """
+        return {
+            name: emulator.validation()
+            for name, emulator in self.emulators.items()
+        }
+
+    def save(self, filepath):
+        """Save the fitted surrogate to a .npz file."""
+        arrays = {
+            "log": self._log,
+            "low": self._low,
+            "span": self._span,
+        }
+        meta = {"parameters": list(self.parameters), "outputs": {}}
+        for n, (name, emulator) in enumerate(self.emulators.items()):
+            meta["outputs"][name] = {
+                "length_scale": emulator.length_scale,
+                "smoothing": emulator.smoothing,
+                "mean": emulator.mean,
+                "scale": emulator.scale,
+                "variance": emulator.variance,
+            }
+            arrays[f"points{n}"] = emulator.points
+            arrays[f"weights{n}"] = emulator._weights
+            arrays[f"inverse{n}"] = emulator._inverse
+            arrays[f"loo{n}"] = emulator.loo_errors
+        arrays["meta"] = np.array(json.dumps(meta))
+        np.savez_compressed(filepath, **arrays)
+
+    @classmethod
+    def load(cls, filepath):
+        """Load a surrogate saved with `save`."""
+        surrogate = cls.__new__(cls)
+        with np.load(filepath) as arrays:
+            meta = json.loads(str(arrays["meta"]))
+            surrogate.parameters = tuple(meta["parameters"])
+            surrogate._log = arrays["log"]
+            surrogate._low = arrays["low"]
+            surrogate._span = arrays["span"]
+            surrogate.emulators = {}
+            for n, (name, fit) in enumerate(meta["outputs"].items()):
+                emulator = RBFEmulator(fit["length_scale"], fit["smoothing"])
+                emulator.mean = fit["mean"]
+                emulator.scale = fit["scale"]
+                emulator.variance = fit["variance"]
+                emulator.points = arrays[f"points{n}"]
+                emulator._weights = arrays[f"weights{n}"]
+                emulator._inverse = arrays[f"inverse{n}"]
+                emulator.loo_errors = arrays[f"loo{n}"]
+                surrogate.emulators[name] = emulator
+        surrogate.outputs = tuple(surrogate.emulators)
+        return surrogate
+
+
+def meteorite_outputs(arrays_files, cooling_rates):
+    """
+    Find the meteorite depth and timing of runs for several cooling rates.
+
+    Parameters
+    ----------
+    arrays_files : sequence of str
+        Results array file of each run (None for a run without one).
+    cooling_rates : sequence of float
+        Cooling rates, in K/Myr.
+
+    Returns
+    -------
+    outputs : dict
+        "depth@<rate>" and "time_of_crossing@<rate>" (in Myr) for each
+        rate: an array with one value per run, NaN where the depth is
+        undefined.
+
+    """
+    myr = 3.1556926e13
+    outputs = {}
+    for rate in cooling_rates:
+        outputs[f"depth@{rate:g}"] = np.full(len(arrays_files), np.nan)
+        outputs[f"time_of_crossing@{rate:g}"] = np.full(
+            len(arrays_files), np.nan
+        )
+    if not cooling_rates:
+        return outputs
+    for n, arrays_file in enumerate(arrays_files):
+        if not arrays_file:
+            continue
+        try:
+            index = query_service.ResultIndex(arrays_file)
+        except (OSError, KeyError, ValueError):
+            continue
+        for rate in cooling_rates:
+            try:
+                result = index.depth_and_timing(
+                    analysis.cooling_rate_to_seconds(rate)
+                )
+            except (IndexError, ValueError):
+                continue
+            if result[0] is None:
+                continue
+            outputs[f"depth@{rate:g}"][n] = result[0]
+            outputs[f"time_of_crossing@{rate:g}"][n] = result[3] / myr
+    return outputs
@@ -0,0 +1,634 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run many parameter files in parallel.
+
+A sweep runs `pytesimal.quick_workflow.workflow` on each of a list of
+parameter files across a pool of processes. The progress of every running
+solve is tracked with a `numerical_methods.ProgressReporter` in its worker,
+and the latest snapshots are combined into the progress of the whole sweep:
+runs finished and failed, the fraction of all timesteps done, the combined
+solver throughput and an estimate of the time remaining. A run that fails
+does not stop the others; its error is returned in its place.
+
+Example
+-------
+
+Run every parameter file in a folder on four processes, logging the metrics
+of each run::
+
+    results = run_sweep(
+        glob.glob('sweep/*.txt'),
+        jobs=4,
+        instruments=quick_workflow.InstrumentOptions(
+            metrics_log='sweep/metrics.jsonl'
+        ),
+    )
+
+Print the combined progress every ten seconds::
+
+    run_sweep(paramfiles, progress=lambda p: print(describe_progress(p)),
+              interval=10)
+
+A sweep can be shared between several machines (or several plain
+processes) that see the same filesystem. Each can take a static shard of
+the runs, or all can work through the whole list and claim runs as they go
+with lock files, skipping runs that already have valid results so that an
+interrupted sweep picks up where it stopped. Run on every node::
+
+    run_sweep(paramfiles, claim_dir='sweep/claims', skip_complete=True,
+              stale_after=600)
+
+or split the runs in four fixed parts, running part `i` on node `i`::
+
+    run_sweep(paramfiles, shard=(i, 4), skip_complete=True)
+
+To analyse the result arrays of every run in this process, have the workers
+solve into shared memory and hand back only its handles::
+
+    for result in run_sweep(paramfiles, share_arrays='shared_memory'):
+        with result['arrays'] as arrays:
+            print(arrays['temperatures'].max())
+
+"""
+
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+import uuid
+import zipfile
+
+from . import load_plot_save
+from . import numerical_methods
+from . import quick_workflow
+from . import shared_arrays
+
+
+def split_param_path(paramfile):
+    """
+    Return the `filename` and `folder_path` arguments of `workflow`.
+
+    Parameters
+    ----------
+    paramfile : str
+        Path of a parameters file with a .txt extension.
+
+    Returns
+    -------
+    filename : str
+        Name of the file without the extension.
+    folder_path : str
+        Folder holding the file.
+
+    """
+    paramfile = str(paramfile)
+    folder_path, name = os.path.split(paramfile)
+    filename, extension = os.path.splitext(name)
+    if extension != ".txt":
+        raise ValueError(
+            f"Parameters file {paramfile!r} must have a .txt extension"
+        )
+    return filename, folder_path or "."
+
+
+def results_valid(paramfile):
+    """
+    Check whether a parameters file already has complete, matching results.
+
+    Parameters
+    ----------
+    paramfile : str
+        Path of a parameters file with a .txt extension.
+
+    Returns
+    -------
+    valid : bool
+        True if the results json file and array file of the run exist, the
+        json file records the same parameters (apart from "run_ID" and
+        "folder") and the array file opens with all four result arrays of
+        equal length. A partly written array file fails to open.
+
+    """
+    filename, _ = split_param_path(paramfile)
+    try:
+        params = dict(
+            zip(
+                load_plot_save.PARAMETER_NAMES,
+                load_plot_save.load_params_from_file(str(paramfile)),
+            )
+        )
+        stem = os.path.join(params["folder"], f"{filename}_results")
+        with open(f"{stem}.txt") as file:
+            saved = json.load(file)
+        if any(
+            saved.get(name) != params[name]
+            for name in load_plot_save.PARAMETER_NAMES
+            if name not in ("run_ID", "folder")
+        ):
+            return False
+        with load_plot_save.load_results(f"{stem}.npz") as results:
+            lengths = {
+                getattr(results, name).shape[-1]
+                for name in load_plot_save._RESULT_ARRAY_NAMES
+            }
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        return False
+    return len(lengths) == 1
+
+
+def _lock_path(claim_dir, paramfile):
+    """Return the lock file of a parameters file in `claim_dir`."""
+    return os.path.join(claim_dir, f"{split_param_path(paramfile)[0]}.lock")
+
+
+def _read_lock(path):
+    """Return the owner written in a lock file and its modification time."""
+    with open(path) as file:
+        return file.read(), os.fstat(file.fileno()).st_mtime
+
+
+def claim_run(claim_dir, paramfile, stale_after=None):
+    """
+    Claim a run by creating its lock file, atomically.
+
+    The lock file is created with `O_CREAT | O_EXCL`, so exactly one of any
+    number of processes (on one machine or on several sharing the folder)
+    claiming the same run succeeds.
+
+    A stale lock is taken over by renaming it to a name of this process's
+    own, which only one process can do. The renamed file is then checked
+    again: if another process had meanwhile taken over the lock and claimed
+    the run afresh, it was that new lock that was moved, and it is put back.
+    Finally the owner written to the lock is read back, so that a claim is
+    only reported once the lock is known to be this process's.
+
+    Parameters
+    ----------
+    claim_dir : str
+        Folder of the lock files, created if needed.
+    paramfile : str
+        Path of the parameters file; the lock is named after the file, so
+        the names of the files in a sweep must be unique.
+    stale_after : float, optional
+        Seconds after which a lock that has not been touched is treated as
+        left behind by a process that died, and is taken over. Running jobs
+        touch their lock as they go (see `run_sweep`), so this should be a
+        few times the progress interval. By default locks never expire.
+
+    Returns
+    -------
+    claimed : bool
+        True if this process now holds the run, False if another does.
+
+    """
+    load_plot_save.check_folder_exists(claim_dir)
+    lock = _lock_path(claim_dir, paramfile)
+    owner = json.dumps(
+        {
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "time": time.time(),
+            "token": uuid.uuid4().hex,
+        }
+    )
+    for attempt in range(2):
+        try:
+            descriptor = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if attempt or stale_after is None:
+                return False
+            if not _take_over(lock, stale_after):
+                return False
+            continue
+        with os.fdopen(descriptor, "w") as file:
+            file.write(owner)
+        for _ in range(100):
+            try:
+                return _read_lock(lock)[0] == owner
+            except FileNotFoundError:
+                time.sleep(0.01)  # being checked by another `claim_run`
+        return False
+    return False
+
+
+def _take_over(lock, stale_after):
+    """Remove `lock` if it is stale; return True if it was removed."""
+    try:
+        seen, modified = _read_lock(lock)
+        if time.time() - modified < stale_after:
+            return False
+        # renaming is atomic: only one process moves any one lock file
+        stale = f"{lock}.{uuid.uuid4().hex}"
+        os.rename(lock, stale)
+    except FileNotFoundError:
+        return False
+    moved, modified = _read_lock(stale)
+    if moved != seen or time.time() - modified < stale_after:
+        # a fresh lock, made since `lock` was read: give it back
+        try:
+            os.link(stale, lock)
+        except FileExistsError:
+            pass
+        os.remove(stale)
+        return False
+    os.remove(stale)
+    return True
+
+
+def release_run(claim_dir, paramfile):
+    """Remove the lock file of a run claimed with `claim_run`."""
+    try:
+        os.remove(_lock_path(claim_dir, paramfile))
+    except FileNotFoundError:
+        pass
+
+
+def _failed(paramfile, error, start):
+    """Return the result of a run that raised `error`."""
+    return {
+        "paramfile": paramfile,
+        "summary": None,
+        "error": f"{type(error).__name__}: {error}",
+        "skipped": None,
+        "arrays": None,
+        "wall_time": time.perf_counter() - start,
+    }
+
+
+def _release_orphan(claim_dir, paramfile):
+    """Remove the lock of a run if it was held by a dead local process."""
+    try:
+        owner = json.loads(_read_lock(_lock_path(claim_dir, paramfile))[0])
+    except (OSError, ValueError):
+        return
+    if os.name != "posix" or owner.get("host") != socket.gethostname():
+        return  # left to go stale
+    try:
+        os.kill(owner["pid"], 0)
+    except ProcessLookupError:
+        release_run(claim_dir, paramfile)
+    except (OSError, KeyError, TypeError):
+        pass
+
+
+def _run_job(job):
+    """Run one parameter file in a worker, sharing its progress."""
+    paramfile, options, shared, interval, claims, arrays = job
+    start = time.perf_counter()
+
+    def skipped(reason):
+        return {
+            "paramfile": paramfile,
+            "summary": None,
+            "error": None,
+            "skipped": reason,
+            "arrays": None,
+            "wall_time": time.perf_counter() - start,
+        }
+
+    claim_dir = claims["claim_dir"]
+    if claims["skip_complete"] and results_valid(paramfile):
+        return skipped("complete")
+    if claim_dir is not None:
+        if not claim_run(claim_dir, paramfile, claims["stale_after"]):
+            return skipped("claimed")
+        # another process may have finished the run and released it since
+        if claims["skip_complete"] and results_valid(paramfile):
+            release_run(claim_dir, paramfile)
+            return skipped("complete")
+
+    progress = None
+    if shared is not None or claim_dir is not None:
+        reporter = numerical_methods.ProgressReporter(stream=None)
+        last_shared = [None]
+
+        def progress(step, n_steps, time_s, core_phase):
+            reporter(step, n_steps, time_s, core_phase)
+            now = time.perf_counter()
+            if (
+                step >= n_steps
+                or last_shared[0] is None
+                or now - last_shared[0] >= interval
+            ):
+                last_shared[0] = now
+                if shared is not None:
+                    shared[paramfile] = reporter.snapshot()
+                if claim_dir is not None:
+                    # keep the lock fresh so it is not taken as stale
+                    try:
+                        os.utime(_lock_path(claim_dir, paramfile))
+                    except FileNotFoundError:
+                        pass  # briefly moved aside by a `claim_run`
+
+    allocate = None
+    if arrays["kind"] is not None:
+        allocate = shared_arrays.ArrayAllocator(
+            arrays["kind"],
+            directory=arrays["directory"],
+            prefix=split_param_path(paramfile)[0],
+        )
+        options = dict(options, allocate=allocate)
+    try:
+        summary = quick_workflow.workflow(
+            *split_param_path(paramfile), progress=progress, **options
+        )
+    except Exception as error:
+        if allocate is not None:
+            allocate.release()
+        return _failed(paramfile, error, start)
+    finally:
+        # failed runs are released too, to be retried by a later sweep
+        if claim_dir is not None:
+            release_run(claim_dir, paramfile)
+    if allocate is not None:
+        # only the handles go back to the parent, which frees the buffers
+        allocate.close()
+    return {
+        "paramfile": paramfile,
+        "summary": summary,
+        "error": None,
+        "skipped": None,
+        "arrays": None if allocate is None else allocate.handles,
+        "wall_time": time.perf_counter() - start,
+    }
+
+
+def combine_progress(snapshots, n_runs, n_done, n_failed, elapsed):
+    """
+    Combine the progress of the runs of a sweep.
+
+    Parameters
+    ----------
+    snapshots : iterable of dict
+        `ProgressReporter.snapshot` of each run still being solved.
+    n_runs : int
+        Number of runs in the sweep.
+    n_done : int
+        Number of runs finished, including those that failed.
+    n_failed : int
+        Number of runs that failed.
+    elapsed : float
+        Wall time since the sweep started, in s.
+
+    Returns
+    -------
+    progress : dict
+        "runs", "done", "failed" and "running" counts; "fraction" of the
+        sweep done, counting finished runs as whole and running ones by
+        their fraction of timesteps; "steps_per_second", the combined
+        throughput of the running solves (None until measurable);
+        "elapsed" and "eta", the estimated seconds remaining (None until
+        measurable).
+
+    """
+    snapshots = [s for s in snapshots if s is not None]
+    rates = [
+        s["steps_per_second"]
+        for s in snapshots
+        if s["steps_per_second"] is not None
+    ]
+    fraction = 1.0
+    if n_runs:
+        fraction = (n_done + sum(s["fraction"] for s in snapshots)) / n_runs
+    eta = None
+    if 0 < fraction < 1:
+        eta = elapsed * (1 - fraction) / fraction
+    elif fraction >= 1:
+        eta = 0.0
+    return {
+        "runs": n_runs,
+        "done": n_done,
+        "failed": n_failed,
+        "running": len(snapshots),
+        "fraction": fraction,
+        "steps_per_second": sum(rates) if rates else None,
+        "elapsed": elapsed,
+        "eta": eta,
+    }
+
+
+def describe_progress(progress):
+    """
+    Return the combined progress of a sweep as one line of text.
+
+    Parameters
+    ----------
+    progress : dict
+        Progress from `combine_progress`.
+
+    Returns
+    -------
+    text : str
+        Runs done, percentage of the sweep done, throughput and ETA.
+
+    """
+    rate = progress["steps_per_second"]
+    eta = progress["eta"]
+    return (
+        "{0}/{1} runs done ({2} failed, {3} running), {4:.1f}%, "
+        "{5} steps/s, ETA {6}".format(
+            progress["done"],
+            progress["runs"],
+            progress["failed"],
+            progress["running"],
+            100 * progress["fraction"],
+            "-" if rate is None else f"{rate:.0f}",
+            "-" if eta is None else numerical_methods._format_seconds(eta),
+        )
+    )
+
+
+def run_sweep(
+    paramfiles,
+    jobs=None,
+    progress=None,
+    interval=5.0,
+    shard=None,
+    claim_dir=None,
+    skip_complete=False,
+    stale_after=None,
+    share_arrays=None,
+    array_dir=None,
+    **options,
+):
+    """
+    Run `workflow` on many parameter files across a pool of processes.
+
+    Parameters
+    ----------
+    paramfiles : iterable of str
+        Paths of parameters files, each with a .txt extension. The results
+        of each are saved to the "folder" set in the file, as by
+        `quick_workflow.workflow`. A sized iterable, such as
+        `sweep_spec.SweepSpec.paramfiles`, is consumed lazily, a few runs
+        ahead of the pool.
+    jobs : int, optional
+        Number of processes; defaults to the number of processors.
+    progress : callable, optional
+        Called with the combined progress of the sweep (see
+        `combine_progress`) every `interval` seconds and when each run
+        finishes.
+    interval : float, default 5.0
+        Seconds between progress updates, and between touches of the lock
+        files of running jobs.
+    shard : tuple of int, optional
+        `(index, count)`: run only every `count`-th parameters file,
+        starting from number `index` (counting from 0). Nodes given the
+        same list and count and each a different index share the sweep
+        without overlap.
+    claim_dir : str, optional
+        Folder of lock files shared by every process working on the sweep.
+        Each run is claimed with `claim_run` just before it starts and
+        released when it ends, so any number of sweeps over the same list
+        share the runs dynamically; runs claimed elsewhere are skipped.
+        Use with `skip_complete`, or a run finished and released by one
+        process may be run again by another that reaches it later.
+    skip_complete : bool, default False
+        Skip runs whose results already pass `results_valid`, e.g. to
+        resume an interrupted sweep.
+    stale_after : float, optional
+        Take over locks in `claim_dir` not touched for this many seconds,
+        see `claim_run`.
+    share_arrays : str, optional
+        "shared_memory" (Python 3.8 or later) or "memmap": solve each run
+        into buffers from a `shared_arrays.ArrayAllocator` and return its
+        result arrays to this process as "arrays" without copying them.
+        Combine with
+        `storage=quick_workflow.StorageOptions(save_arrays=False)` to skip
+        writing the results array files.
+    array_dir : str, optional
+        Folder of the .npy files of "memmap" arrays, named
+        "<filename>_<array>.npy"; defaults to a new temporary folder.
+    **options
+        Keyword arguments passed to `quick_workflow.workflow` for every run,
+        e.g. `backend`, `cache`, `catalog` or `instruments`. A metrics log
+        can be shared by all the runs.
+
+    Returns
+    -------
+    results : list of dict
+        One entry per parameters file (of the shard), in the order given,
+        with "paramfile", the "summary" returned by `workflow` (None if the
+        run failed or was skipped), the "error" raised as text (None if it
+        succeeded), why it was "skipped" ("complete" or "claimed", None if
+        it ran), the "wall_time" of the run in s and, with `share_arrays`,
+        the "arrays" of the run as a `shared_arrays.SharedResultArrays`
+        (None if it did not run). Release each of these when done with it
+        to free its memory or files.
+
+    Notes
+    -----
+    If a worker process dies, e.g. killed when out of memory, every run in
+    the pool at the time fails with a "BrokenProcessPool" error, their locks
+    in `claim_dir` are released, and the rest of the sweep carries on in a
+    new pool. A later sweep with `skip_complete` runs the failed runs again.
+
+    """
+    try:
+        n_runs = len(paramfiles)
+    except TypeError:
+        paramfiles = list(paramfiles)
+        n_runs = len(paramfiles)
+    paramfiles = iter(paramfiles)
+    if shard is not None:
+        index, count = shard
+        if not 0 <= index < count:
+            raise ValueError(
+                f"Shard index {index} must be between 0 and {count - 1}"
+            )
+        n_runs = len(range(index, n_runs, count))
+        paramfiles = itertools.islice(paramfiles, index, None, count)
+    if not n_runs:
+        return []
+    jobs = min(jobs or os.cpu_count() or 1, n_runs)
+    claims = {
+        "claim_dir": None if claim_dir is None else str(claim_dir),
+        "skip_complete": skip_complete,
+        "stale_after": stale_after,
+    }
+    if share_arrays is not None and share_arrays not in shared_arrays.KINDS:
+        raise ValueError(
+            f"Unknown array kind {share_arrays!r}, choose from "
+            f"{list(shared_arrays.KINDS)}"
+        )
+    if share_arrays == "shared_memory":
+        shared_arrays._shared_memory()  # fail early before Python 3.8
+    if share_arrays == "memmap" and array_dir is None:
+        array_dir = tempfile.mkdtemp(prefix="pytesimal_arrays_")
+    arrays = {"kind": share_arrays, "directory": array_dir}
+    queue = enumerate(str(paramfile) for paramfile in paramfiles)
+    sweep_start = time.perf_counter()
+    results = {}
+    # worker progress is shared through a manager process, only if needed
+    manager = multiprocessing.Manager() if progress is not None else None
+    shared = manager.dict() if manager is not None else None
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+    try:
+        pending = {}
+
+        def submit():
+            # keep the pool busy without expanding lazy inputs early
+            for index, paramfile in itertools.islice(
+                queue, 2 * jobs - len(pending)
+            ):
+                future = executor.submit(
+                    _run_job,
+                    (paramfile, options, shared, interval, claims, arrays),
+                )
+                pending[future] = (
+                    index, paramfile, time.perf_counter(), executor
+                )
+
+        submit()
+        while pending:
+            finished, _ = concurrent.futures.wait(
+                pending,
+                timeout=interval,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in finished:
+                index, paramfile, submitted, pool = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as error:
+                    # e.g. a worker killed when out of memory, which breaks
+                    # the pool and fails every run in it
+                    result = _failed(paramfile, error, submitted)
+                    if claim_dir is not None:
+                        _release_orphan(claims["claim_dir"], paramfile)
+                    if pool is executor and isinstance(
+                        error, concurrent.futures.process.BrokenProcessPool
+                    ):
+                        # carry on with the remaining runs in a new pool
+                        executor.shutdown(wait=True)
+                        executor = concurrent.futures.ProcessPoolExecutor(
+                            max_workers=jobs
+                        )
+                if result["arrays"] is not None:
+                    result["arrays"] = shared_arrays.SharedResultArrays(
+                        result["arrays"]
+                    )
+                results[index] = result
+                if shared is not None:
+                    shared.pop(result["paramfile"], None)
+            submit()
+            if progress is not None:
+                progress(
+                    combine_progress(
+                        shared.values(),
+                        n_runs,
+                        len(results),
+                        sum(1 for r in results.values() if r["error"]),
+                        time.perf_counter() - sweep_start,
+                    )
+                )
+    finally:
+        executor.shutdown()
+        if manager is not None:
+            manager.shutdown()
+    return [results[index] for index in sorted(results)]
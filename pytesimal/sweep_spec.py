@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Describe a parameter sweep in a single JSON or TOML file.
+
+A sweep specification names a base parameters file (see
+`load_plot_save.make_default_param_file`) and the parameters to vary, using
+the names returned by `load_plot_save.load_params_from_file`. Each varied
+parameter is given a list of values, a range or a distribution, and the
+sweep uses one of three designs:
+
+grid
+    Every combination of the values of each parameter. Ranges are split
+    into "steps" evenly (or logarithmically) spaced values.
+latin_hypercube
+    "samples" points, each parameter's range split into that many strata
+    which are each sampled once.
+sobol
+    The first "samples" points of a Sobol low-discrepancy sequence, with a
+    random digital shift unless "scramble" is false. Powers of two keep the
+    sequence balanced.
+
+For the sampling designs, each parameter is drawn uniformly between "min"
+and "max" (or log-uniformly with "scale": "log"), from a normal
+distribution with "mean" and "std", or from a list of "values". Runs are
+expanded lazily: a parameters file is only written when a run is about to
+be started, so a sweep of many thousands of runs needs no files up front.
+
+Example
+-------
+
+A Latin hypercube of 64 runs over four parameters, in JSON::
+
+    {
+        "base": "example_params.txt",
+        "folder": "results",
+        "design": "latin_hypercube",
+        "samples": 64,
+        "seed": 1,
+        "parameters": {
+            "r_planet": {"min": 150000.0, "max": 300000.0},
+            "core_size_factor": {"min": 0.2, "max": 0.6},
+            "kappa_reg": {"min": 1e-8, "max": 1e-6, "scale": "log"},
+            "temp_init": {"mean": 1600.0, "std": 25.0}
+        }
+    }
+
+The same file can be written in TOML (read with `tomllib`, or `tomli`
+before Python 3.11). Load it and run the sweep on eight processes::
+
+    spec = SweepSpec.from_file('sweep.json')
+    results = sweep.run_sweep(spec.paramfiles('sweep_params'), jobs=8)
+
+or from the command line::
+
+    pytesimal sweep --spec sweep.json --jobs 8
+
+"""
+
+import itertools
+import json
+import math
+import os
+import socket
+
+import numpy as np
+
+from . import load_plot_save
+
+DESIGNS = ("grid", "latin_hypercube", "sobol")
+
+# Parameters a sweep may vary: everything but the names of the run
+SWEEP_PARAMETERS = tuple(
+    name
+    for name in load_plot_save.PARAMETER_NAMES
+    if name not in ("run_ID", "folder")
+)
+
+# Sobol direction numbers of Joe and Kuo (2008), new-joe-kuo-6.21201, for
+# dimensions 2 to 21 as (degree s, coefficients a, initial m_1 ... m_s);
+# the first dimension uses m_i = 1.
+_SOBOL_DIRECTIONS = (
+    (1, 0, (1,)),
+    (2, 1, (1, 3)),
+    (3, 1, (1, 3, 1)),
+    (3, 2, (1, 1, 1)),
+    (4, 1, (1, 1, 3, 3)),
+    (4, 4, (1, 3, 5, 13)),
+    (5, 2, (1, 1, 5, 5, 17)),
+    (5, 4, (1, 1, 5, 5, 5)),
+    (5, 7, (1, 1, 7, 11, 19)),
+    (5, 11, (1, 1, 5, 1, 1)),
+    (5, 13, (1, 1, 1, 3, 11)),
+    (5, 14, (1, 3, 5, 5, 31)),
+    (6, 1, (1, 3, 3, 9, 7, 49)),
+    (6, 13, (1, 1, 1, 15, 21, 21)),
+    (6, 16, (1, 3, 1, 13, 27, 49)),
+    (6, 19, (1, 1, 1, 15, 7, 5)),
+    (6, 22, (1, 3, 1, 15, 13, 25)),
+    (6, 25, (1, 1, 5, 5, 19, 61)),
+    (7, 1, (1, 3, 7, 11, 23, 15, 103)),
+    (7, 4, (1, 3, 7, 13, 13, 15, 69)),
+)
+_SOBOL_BITS = 30
+
+
+def _sobol_directions(dimensions):
+    """Return the direction integers of the first `dimensions` dimensions."""
+    if dimensions > len(_SOBOL_DIRECTIONS) + 1:
+        raise ValueError(
+            f"Sobol designs support at most {len(_SOBOL_DIRECTIONS) + 1} "
+            "parameters"
+        )
+    bits = _SOBOL_BITS
+    directions = np.zeros((dimensions, bits), dtype=np.int64)
+    directions[0] = [1 << (bits - i) for i in range(1, bits + 1)]
+    for d in range(1, dimensions):
+        s, a, m = _SOBOL_DIRECTIONS[d - 1]
+        v = [m[i] << (bits - i - 1) for i in range(s)]
+        for i in range(s, bits):
+            value = v[i - s] ^ (v[i - s] >> s)
+            for k in range(1, s):
+                if (a >> (s - 1 - k)) & 1:
+                    value ^= v[i - k]
+            v.append(value)
+        directions[d] = v
+    return directions
+
+
+def sobol_points(n_points, dimensions, shift=None):
+    """
+    Yield points of a Sobol sequence in the unit hypercube.
+
+    Parameters
+    ----------
+    n_points : int
+        Number of points.
+    dimensions : int
+        Number of dimensions, at most 21.
+    shift : numpy.ndarray, optional
+        Integers (below 2**30) XORed with each point, one per dimension: a
+        random digital shift, which keeps the balance of the sequence.
+
+    Yields
+    ------
+    point : numpy.ndarray
+        Coordinates in (0, 1), one per dimension. Each is taken at the
+        centre of its 2**-30 wide cell so that no coordinate is exactly 0.
+
+    """
+    directions = _sobol_directions(dimensions)
+    state = np.zeros(dimensions, dtype=np.int64)
+    scale = float(1 << _SOBOL_BITS)
+    for n in range(n_points):
+        if n > 0:
+            # Gray code order: flip the direction of the lowest zero bit
+            bit = ~(n - 1) & n
+            state ^= directions[:, bit.bit_length() - 1]
+        point = state if shift is None else state ^ shift
+        yield (point + 0.5) / scale
+
+
+def latin_hypercube(n_points, dimensions, rng):
+    """
+    Return a Latin hypercube sample of the unit hypercube.
+
+    Parameters
+    ----------
+    n_points : int
+        Number of points.
+    dimensions : int
+        Number of dimensions.
+    rng : numpy.random.Generator
+        Source of random numbers.
+
+    Returns
+    -------
+    points : numpy.ndarray
+        Array of shape (n_points, dimensions); in each dimension every
+        interval [k / n_points, (k + 1) / n_points) holds exactly one point.
+
+    """
+    strata = np.stack(
+        [rng.permutation(n_points) for _ in range(dimensions)], axis=1
+    )
+    return (strata + rng.random((n_points, dimensions))) / n_points
+
+
+class Parameter:
+    """
+    One varied parameter of a sweep.
+
+    Attributes
+    ----------
+    name : str
+        Name of the parameter, one of `SWEEP_PARAMETERS`.
+    values : list or None
+        Explicit values, if given.
+    low, high : float or None
+        Range of a uniform or log-uniform parameter.
+    log : bool
+        Whether the range is sampled logarithmically.
+    mean, std : float or None
+        Mean and standard deviation of a normal parameter.
+    steps : int or None
+        Number of values of a range in a grid design.
+
+    """
+
+    def __init__(self, name, spec):
+        """Check and store the `spec` of parameter `name`."""
+        if name not in SWEEP_PARAMETERS:
+            raise ValueError(
+                f"Unknown sweep parameter {name!r}, choose from "
+                f"{list(SWEEP_PARAMETERS)}"
+            )
+        if not isinstance(spec, dict):
+            spec = {"values": spec}
+        self.name = name
+        self.values = spec.get("values")
+        self.low = spec.get("min")
+        self.high = spec.get("max")
+        self.log = spec.get("scale", "linear") == "log"
+        self.mean = spec.get("mean")
+        self.std = spec.get("std")
+        self.steps = spec.get("steps")
+        if self.values is not None:
+            if not isinstance(self.values, list) or not self.values:
+                raise ValueError(f"{name}: 'values' must be a non-empty list")
+        elif self.low is not None and self.high is not None:
+            if self.log and min(self.low, self.high) <= 0:
+                raise ValueError(f"{name}: a log range must be positive")
+        elif self.mean is None or self.std is None:
+            raise ValueError(
+                f"{name}: give 'values', 'min' and 'max', or 'mean' and 'std'"
+            )
+
+    def grid_values(self):
+        """Return the values of this parameter in a grid design."""
+        if self.values is not None:
+            return list(self.values)
+        if self.low is None or self.steps is None:
+            raise ValueError(
+                f"{self.name}: grid designs need 'values', or 'min', 'max' "
+                "and 'steps'"
+            )
+        if self.log:
+            values = np.geomspace(self.low, self.high, int(self.steps))
+        else:
+            values = np.linspace(self.low, self.high, int(self.steps))
+        return [float(value) for value in values]
+
+    def from_unit(self, u):
+        """Return the value at quantile `u` (0 < u < 1) of the parameter."""
+        if self.values is not None:
+            return self.values[min(int(u * len(self.values)),
+                                   len(self.values) - 1)]
+        if self.low is not None:
+            if self.log:
+                return float(
+                    np.exp(
+                        np.log(self.low)
+                        + u * (np.log(self.high) - np.log(self.low))
+                    )
+                )
+            return float(self.low + u * (self.high - self.low))
+        return self.mean + self.std * normal_quantile(float(u))
+
+
+# coefficients of the rational approximations of `normal_quantile`
+_QUANTILE_A = (-3.969683028665376e01, 2.209460984245205e02,
+               -2.759285104469687e02, 1.383577518672690e02,
+               -3.066479806614716e01, 2.506628277459239e00)
+_QUANTILE_B = (-5.447609879822406e01, 1.615858368580409e02,
+               -1.556989798598866e02, 6.680131188771972e01,
+               -1.328068155288572e01)
+_QUANTILE_C = (-7.784894002430293e-03, -3.223964580411365e-01,
+               -2.400758277161838e00, -2.549732539343734e00,
+               4.374664141464968e00, 2.938163982698783e00)
+_QUANTILE_D = (7.784695709041462e-03, 3.224671290700398e-01,
+               2.445134137142996e00, 3.754408661907416e00)
+
+
+def _polynomial(coefficients, x):
+    """Evaluate a polynomial, highest power first, by Horner's rule."""
+    value = 0.0
+    for coefficient in coefficients:
+        value = value * x + coefficient
+    return value
+
+
+def normal_quantile(p):
+    """
+    Return the quantile `p` (0 < p < 1) of the standard normal distribution.
+
+    Uses the rational approximations of P. J. Acklam, refined with one step
+    of Halley's method on `math.erfc`, which makes it accurate to about
+    1e-15. Unlike `statistics.NormalDist` it also works on Python 3.7.
+
+    """
+    if not 0 < p < 1:
+        raise ValueError(f"Quantile {p} must be between 0 and 1")
+    if p > 0.5:
+        # by symmetry, where 1 - p is exact
+        return -normal_quantile(1 - p)
+    if p < 0.02425:
+        q = math.sqrt(-2 * math.log(p))
+        x = _polynomial(_QUANTILE_C, q) / (_polynomial(_QUANTILE_D, q) * q
+                                           + 1)
+    else:
+        q = p - 0.5
+        r = q * q
+        x = q * _polynomial(_QUANTILE_A, r) / (_polynomial(_QUANTILE_B, r)
+                                               * r + 1)
+    error = 0.5 * math.erfc(-x / math.sqrt(2)) - p
+    step = error * math.sqrt(2 * math.pi) * math.exp(x * x / 2)
+    return x - step / (1 + x * step / 2)
+
+
+class SweepSpec:
+    """
+    A parameter sweep, expanded lazily into run parameters.
+
+    Iterating over a `SweepSpec` yields the full parameters of each run as
+    a dictionary, with "run_ID" and "folder" set; `paramfiles` writes each
+    run's parameters file just before yielding its path.
+
+    Attributes
+    ----------
+    name : str
+        Prefix of the run IDs, "<name>_<index>".
+    base : dict
+        Parameters shared by every run.
+    folder : str
+        Folder the runs save their results to.
+    design : str
+        One of `DESIGNS`.
+    parameters : list of Parameter
+        The varied parameters.
+    samples : int or None
+        Number of runs of a sampling design.
+    seed : int or None
+        Seed of the random numbers of a sampling design.
+    scramble : bool
+        Whether a Sobol design is randomly shifted.
+
+    """
+
+    def __init__(self, spec, root="."):
+        """
+        Check a sweep specification.
+
+        Parameters
+        ----------
+        spec : dict
+            The specification, see the module documentation. "base" may be
+            a path or a dictionary of parameters.
+        root : str, default "."
+            Folder that relative paths in `spec` are relative to.
+
+        """
+        base = spec.get("base")
+        if base is None:
+            raise ValueError("A sweep needs a 'base' parameters file")
+        if not isinstance(base, dict):
+            base = dict(
+                zip(
+                    load_plot_save.PARAMETER_NAMES,
+                    load_plot_save.load_params_from_file(
+                        os.path.join(root, base)
+                    ),
+                )
+            )
+        self.base = dict(base)
+        self.name = spec.get("name", "sweep")
+        folder = spec.get("folder", self.base.get("folder", "results"))
+        self.folder = os.path.join(root, folder)
+        self.design = spec.get("design", "grid")
+        if self.design not in DESIGNS:
+            raise ValueError(
+                f"Unknown sweep design {self.design!r}, choose from "
+                f"{list(DESIGNS)}"
+            )
+        self.parameters = [
+            Parameter(name, value)
+            for name, value in spec.get("parameters", {}).items()
+        ]
+        if not self.parameters:
+            raise ValueError("A sweep needs at least one parameter")
+        self.samples = spec.get("samples")
+        self.seed = spec.get("seed")
+        self.scramble = spec.get("scramble", True)
+        if self.design == "grid":
+            self._grid = [p.grid_values() for p in self.parameters]
+        elif not self.samples or int(self.samples) < 1:
+            raise ValueError(f"A {self.design} design needs 'samples'")
+
+    @classmethod
+    def from_file(cls, filepath):
+        """
+        Read a sweep specification from a JSON or TOML (.toml) file.
+
+        Relative paths in the file are taken relative to its folder, and
+        the name of the sweep defaults to the name of the file.
+        """
+        filepath = str(filepath)
+        if filepath.endswith(".toml"):
+            try:
+                import tomllib
+            except ImportError:  # before Python 3.11
+                import tomli as tomllib
+            with open(filepath, "rb") as file:
+                spec = tomllib.load(file)
+        else:
+            with open(filepath) as file:
+                spec = json.load(file)
+        spec.setdefault(
+            "name", os.path.splitext(os.path.basename(filepath))[0]
+        )
+        return cls(spec, root=os.path.dirname(filepath))
+
+    def __len__(self):
+        """Return the number of runs."""
+        if self.design == "grid":
+            return int(np.prod([len(values) for values in self._grid]))
+        return int(self.samples)
+
+    def _points(self):
+        """Yield the values of the varied parameters of each run."""
+        if self.design == "grid":
+            yield from itertools.product(*self._grid)
+            return
+        rng = np.random.default_rng(self.seed)
+        dimensions = len(self.parameters)
+        if self.design == "latin_hypercube":
+            units = latin_hypercube(len(self), dimensions, rng)
+        else:
+            shift = None
+            if self.scramble:
+                shift = rng.integers(0, 1 << _SOBOL_BITS, dimensions)
+            units = sobol_points(len(self), dimensions, shift)
+        for unit in units:
+            yield tuple(
+                parameter.from_unit(u)
+                for parameter, u in zip(self.parameters, unit)
+            )
+
+    def __iter__(self):
+        """Yield the parameters of each run as a dictionary."""
+        width = len(str(max(len(self) - 1, 0)))
+        for index, values in enumerate(self._points()):
+            params = dict(self.base)
+            params.update(
+                (parameter.name, _plain(value))
+                for parameter, value in zip(self.parameters, values)
+            )
+            params["run_ID"] = f"{self.name}_{index:0{width}d}"
+            params["folder"] = self.folder
+            yield params
+
+    def paramfiles(self, folder):
+        """
+        Return the parameters files of the runs, written as they are needed.
+
+        Parameters
+        ----------
+        folder : str
+            Folder to write the parameters files to, as "<run_ID>.txt".
+
+        Returns
+        -------
+        paramfiles : _ParamFiles
+            A sized iterable of paths; each file is written when its path is
+            reached, so it can be passed straight to `sweep.run_sweep`.
+
+        """
+        return _ParamFiles(self, folder)
+
+
+class _ParamFiles:
+    """Sized, lazy iterable of the parameters files of a sweep."""
+
+    def __init__(self, spec, folder):
+        self.spec = spec
+        self.folder = str(folder)
+
+    def __len__(self):
+        return len(self.spec)
+
+    def __iter__(self):
+        load_plot_save.check_folder_exists(self.folder)
+        for params in self.spec:
+            filepath = os.path.join(self.folder, f"{params['run_ID']}.txt")
+            # several sweeps may write the same files, so replace atomically
+            partial = f"{filepath}.{socket.gethostname()}.{os.getpid()}"
+            with open(partial, "w") as file:
+                json.dump(params, file, indent=4)
+            os.replace(partial, filepath)
+            yield filepath
+
+
+def _plain(value):
+    """Return numpy scalars as python numbers for json."""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
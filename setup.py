@@ -1,3 +1,5 @@
+import re
+
 #Try to use setuptools if present. If not then python_requires,
 #install_requires and setup_requires will be ignored
 try:
@@ -5,13 +7,18 @@ try:
 except:
     from distutils.core import setup
 
-
 with open("package_description.md", "r", encoding="utf-8") as fh:
     long_description = fh.read()
 
+# the version is defined once, in the package (the result cache hashes it)
+with open("pytesimal/__init__.py", "r", encoding="utf-8") as fh:
+    version = re.search(
+        r'^__version__ = "([^"]+)"', fh.read(), re.MULTILINE
+    ).group(1)
+
 setup(
     name="pytesimal",
-    version="2.0.0",
+    version=version,
     description="Model the conductive cooling of planetesimals with temperature-dependent material properties.",
     long_description=long_description,
     long_description_content_type="text/markdown",
@@ -24,6 +31,9 @@ setup(
         "Scientific Background:": "https://doi.org/10.1029/2020JE006726",
     },
     packages=["pytesimal"],
+    entry_points={
+        "console_scripts": ["pytesimal = pytesimal.cli:main"],
+    },
     # py_modules=["pytesimal"],
     python_requires=">=3.7",
     install_requires=["numpy", "matplotlib", ],
@@ -5,8 +5,11 @@ Created on 14/04/2021
 by murphyqm
 
 """
+import json
+
 import pytest
 from context import setup_functions as mainmod
+from context import load_plot_save
 from context import numerical_methods as mantle_timestepping
 from context import core_function
 from context import mantle_properties
@@ -162,3 +165,22 @@ def temperature_timestepping_var():
         "times": times,
     }
     return results
+
+
+@pytest.fixture
+def small_param_file(tmpdir):
+    """Write a parameter file for a small, fast model run."""
+    filepath = tmpdir.join("small.txt")
+    load_plot_save.make_default_param_file(str(filepath))
+    with open(filepath) as file:
+        params = json.load(file)
+    params.update(
+        run_ID="small",
+        folder=str(tmpdir.join("results")),
+        r_planet=30000.0,
+        reg_fraction=0.1,
+        max_time=5,
+    )
+    with open(filepath, "w") as file:
+        json.dump(params, file, indent=4)
+    return "small", str(tmpdir)
@@ -22,3 +22,23 @@ import mantle_properties
 import setup_functions
 import analysis
 import load_plot_save
+
+# modules using package-relative imports are imported from the package
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")),
+)
+
+from pytesimal import quick_workflow
+from pytesimal import result_cache
+from pytesimal import catalog
+from pytesimal import planning
+from pytesimal import metrics
+from pytesimal import sweep
+from pytesimal import cli
+from pytesimal import sweep_spec
+from pytesimal import shared_arrays
+from pytesimal import async_sweep
+from pytesimal import query_service
+from pytesimal import surrogate
+from pytesimal import reduced_order
+from pytesimal import inversion
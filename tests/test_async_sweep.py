@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for running sweeps from asyncio code.
+
+"""
+import asyncio
+import json
+import time
+
+import pytest
+
+from context import async_sweep
+from context import load_plot_save
+
+
+def _write_params(tmpdir, name, **changes):
+    filepath = str(tmpdir.join(f"{name}.txt"))
+    load_plot_save.make_default_param_file(filepath)
+    with open(filepath) as file:
+        params = json.load(file)
+    params.update(run_ID=name, folder=str(tmpdir.join("results")),
+                  r_planet=30000.0, reg_fraction=0.1, max_time=2)
+    params.update(changes)
+    with open(filepath, "w") as file:
+        json.dump(params, file, indent=4)
+    return filepath
+
+
+def test_run_sweep_async(tmpdir):
+    paramfiles = [
+        _write_params(tmpdir, "first"),
+        _write_params(tmpdir, "second", core_size_factor=0.3),
+        str(tmpdir.join("missing.txt")),
+    ]
+    results = asyncio.run(async_sweep.run_sweep_async(paramfiles, jobs=2))
+    assert [r["paramfile"] for r in results] == paramfiles
+    assert results[0]["error"] is None
+    assert results[1]["summary"]["arrays_file"].endswith("second_results.npz")
+    assert results[2]["error"].startswith("FileNotFoundError")
+
+
+def test_priority_and_as_completed(tmpdir):
+    async def main():
+        async with async_sweep.AsyncSweep(jobs=1) as runs:
+            for name, priority in (("a", 0), ("b", 5), ("c", -1)):
+                await runs.submit(_write_params(tmpdir, name),
+                                  priority=priority)
+            finished = [r["paramfile"] async for r in runs.as_completed()]
+            assert runs.counts()["done"] == 3
+        return finished
+
+    finished = asyncio.run(main())
+    assert [path[-5] for path in finished] == ["c", "a", "b"]
+
+
+def test_workers_are_reused(tmpdir):
+    async def main():
+        async with async_sweep.AsyncSweep(jobs=1) as runs:
+            pids = []
+            for name in ("first", "second"):
+                result = await (await runs.submit(_write_params(tmpdir, name)))
+                assert result["error"] is None
+                pids.append([w.process.pid for w in runs._idle])
+        return pids
+
+    first, second = asyncio.run(main())
+    assert len(first) == 1 and first == second
+
+
+def test_timeout_and_cancel(tmpdir):
+    slow = _write_params(tmpdir, "slow", r_planet=250000.0, max_time=400)
+
+    async def main():
+        async with async_sweep.AsyncSweep(jobs=1, max_queued=1) as runs:
+            start = time.perf_counter()
+            timed_out = await runs.submit(slow, timeout=1.0)
+            result = await timed_out
+            assert time.perf_counter() - start < 30
+            assert result["error"].startswith("TimeoutError")
+
+            running = await runs.submit(slow)
+            queued = await runs.submit(_write_params(tmpdir, "quick"))
+            # the queue is full while the slow run holds the only worker
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(runs.submit(slow), 0.5)
+            assert queued.cancel()
+            assert running.state == "running"
+            assert running.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await running
+            assert runs.counts() == {"queued": 0, "running": 0, "done": 1,
+                                     "cancelled": 2}
+            again = await runs.submit(_write_params(tmpdir, "again"))
+            assert (await again)["error"] is None
+
+    asyncio.run(main())
+
+
+def test_closed_sweep_rejects_runs(tmpdir):
+    async def main():
+        runs = async_sweep.AsyncSweep()
+        await runs.close()
+        with pytest.raises(RuntimeError, match="closed"):
+            await runs.submit(_write_params(tmpdir, "late"))
+
+    asyncio.run(main())
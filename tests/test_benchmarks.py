@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the benchmark suite in benchmarks/bench.py.
+
+"""
+import importlib.util
+import json
+import os
+import types
+
+import pytest
+
+spec = importlib.util.spec_from_file_location(
+    "bench",
+    os.path.join(os.path.dirname(__file__), "..", "benchmarks", "bench.py"),
+)
+bench = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bench)
+
+
+def _results(commit, **benchmarks):
+    return {
+        "meta": {"commit": commit, "dirty": False},
+        "benchmarks": {
+            name: {"seconds": seconds, "peak_bytes": peak}
+            for name, (seconds, peak) in benchmarks.items()
+        },
+    }
+
+
+def test_compare_flags_regressions():
+    baseline = _results("a" * 40, solve=(1.0, 100), io=(1.0, 100),
+                        removed=(1.0, 1))
+    current = _results("b" * 40, solve=(1.05, 100), io=(1.0, 150),
+                       added=(1.0, 1))
+    rows = {row["name"]: row for row in bench.compare(baseline, current)}
+    assert rows["solve"]["time_ratio"] == pytest.approx(1.05)
+    assert not rows["solve"]["regression"]
+    assert rows["io"]["regression"]  # 50% more memory
+    assert rows["removed"]["time_ratio"] is None
+    assert rows["added"]["time_ratio"] is None
+    slower = _results("c" * 40, solve=(1.5, 100))
+    assert bench.compare(baseline, slower, threshold=0.6)[0][
+        "regression"] is False
+    assert "REGRESSION" in bench.format_comparison(
+        bench.compare(baseline, current), baseline, current
+    )
+
+
+def test_run_and_compare_command(tmpdir):
+    output = str(tmpdir.join("results.json"))
+    assert bench.main(["run", "--quick", "--repeat", "1", "--filter",
+                       "cooling_rate", "-o", output]) == 0
+    with open(output) as file:
+        results = json.load(file)
+    assert list(results["benchmarks"]) == ["cooling_rate"]
+    entry = results["benchmarks"]["cooling_rate"]
+    assert entry["seconds"] > 0 and entry["peak_bytes"] > 0
+    assert results["meta"]["quick"]
+    # identical results never regress
+    assert bench.main(["compare", output, output]) == 0
+
+
+def test_filtered_benchmarks_build_nothing(tmpdir, monkeypatch):
+    def fail(*args):
+        raise AssertionError("built a benchmark that was not run")
+
+    monkeypatch.setattr(bench, "_synthetic_history", fail)
+    pkg = bench._import_package(bench.ROOT)
+    numerical_methods = pkg["numerical_methods"]
+    pkg["numerical_methods"] = types.SimpleNamespace(
+        discretisation=fail,
+        surface_dirichlet_bc=numerical_methods.surface_dirichlet_bc,
+        cmb_dirichlet_bc=numerical_methods.cmb_dirichlet_bc,
+    )
+    names = [name for name, _, _, _ in bench.benchmarks(pkg, str(tmpdir))]
+    assert "meteorite_depth_and_timing" in names
+    assert tmpdir.listdir() == []
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the SQLite run catalog.
+
+"""
+import os
+
+import numpy as np
+import pytest
+
+from context import catalog
+from context import load_plot_save
+from context import quick_workflow
+
+
+def _params(tmpdir, **changes):
+    filepath = str(tmpdir.join("params.txt"))
+    load_plot_save.make_default_param_file(filepath)
+    params = dict(
+        zip(
+            load_plot_save.PARAMETER_NAMES,
+            load_plot_save.load_params_from_file(filepath),
+        )
+    )
+    params.update(changes)
+    return params
+
+
+def test_catalog_query(tmpdir):
+    with catalog.RunCatalog(str(tmpdir.join("runs.sqlite"))) as runs:
+        for n, factor in enumerate([0.2, 0.4, 0.6]):
+            runs.add_run(
+                _params(tmpdir, core_size_factor=factor, run_ID=f"run{n}"),
+                results={
+                    "core_begins_to_freeze": 100.0 + n,
+                    "core finishes freezing": 150.0 + n,
+                    "meteorite_results": {"imilac": {"depth": 40.0 + n}},
+                },
+                wall_time=1.5,
+            )
+        runs.add_run(_params(tmpdir, cond_constant="n", run_ID="var"))
+        assert len(runs) == 4
+
+        found = runs.query(
+            columns=["run_ID", "core_begins_to_freeze",
+                     "meteorite_results.imilac.depth"],
+            core_size_factor=(0.3, None),
+            cond_constant="y",
+        )
+        assert list(found["run_ID"]) == ["run1", "run2"]
+        np.testing.assert_array_equal(
+            found["core_begins_to_freeze"], [101.0, 102.0]
+        )
+        np.testing.assert_array_equal(
+            found["meteorite_results.imilac.depth"], [41.0, 42.0]
+        )
+        missing = runs.query(columns=["core_begins_to_freeze"],
+                             run_ID=["var"])
+        assert np.isnan(missing["core_begins_to_freeze"][0])
+        with pytest.raises(KeyError):
+            runs.query(not_a_column=1)
+
+
+def test_workflow_adds_to_catalog(tmpdir, small_param_file):
+    filename, folder_path = small_param_file
+    catalog_path = str(tmpdir.join("runs.sqlite"))
+    summary = quick_workflow.workflow(
+        filename, folder_path, catalog=catalog_path
+    )
+    with catalog.RunCatalog(catalog_path) as runs:
+        found = runs.query(columns=["arrays_file", "wall_time", "r_planet"])
+        assert found["arrays_file"][0] == summary["arrays_file"]
+        assert found["wall_time"][0] == summary["wall_time"]
+        assert found["r_planet"][0] == 30000.0
+        assert runs.index_folder(f"{folder_path}/results") == 0
+
+
+def test_one_row_per_results_file(tmpdir, small_param_file, monkeypatch):
+    filename, folder_path = small_param_file
+    catalog_path = str(tmpdir.join("runs.sqlite"))
+    first = quick_workflow.workflow(filename, folder_path,
+                                    catalog=catalog_path)
+    # a re-run, and indexing the folder by a relative path
+    quick_workflow.workflow(filename, folder_path, catalog=catalog_path)
+    monkeypatch.chdir(folder_path)
+    with catalog.RunCatalog(catalog_path) as runs:
+        assert len(runs) == 1
+        assert runs.index_folder("results") == 0
+        run_id = runs.add_results_file(
+            os.path.join("results", os.path.basename(first["results_file"]))
+        )
+        assert len(runs) == 1
+        found = runs.query(columns=["results_file"])
+        assert list(found["id"]) == [run_id]
+        assert found["results_file"][0] == os.path.realpath(
+            first["results_file"]
+        )
+        scalars = runs.connection.execute(
+            "SELECT COUNT(DISTINCT run_id) FROM scalars"
+        ).fetchone()[0]
+        assert scalars <= 1
+
+
+def test_write_ahead_log_is_opt_in(tmpdir):
+    filepath = str(tmpdir.join("runs.sqlite"))
+    with catalog.RunCatalog(filepath) as runs:
+        assert not runs.wal
+        mode = runs.connection.execute("PRAGMA journal_mode").fetchone()[0]
+        assert mode == "delete"
+    with catalog.RunCatalog(filepath, wal=True) as runs:
+        assert runs.wal
+        runs.add_run(_params(tmpdir))
+        assert len(runs) == 1
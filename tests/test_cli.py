@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the pytesimal command.
+
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from context import cli
+from context import load_plot_save
+from context import metrics
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_run_inspect_and_plot(small_param_file, capsys):
+    filename, folder_path = small_param_file
+    paramfile = os.path.join(folder_path, f"{filename}.txt")
+    metrics_log = os.path.join(folder_path, "metrics.jsonl")
+    assert cli.main(["run", paramfile, "--metrics-log", metrics_log,
+                     "--profile", "--chunk-steps", "512"]) == 0
+    summary = json.loads(capsys.readouterr().out)
+    arrays_file = summary["arrays_file"]
+    assert os.path.isfile(arrays_file)
+    assert len(metrics.read_records(metrics_log)) == 1
+
+    info = cli.summarise_results(arrays_file)
+    assert info["layout"] == "chunked"
+    assert info["timestep"] == 1e11
+    assert info["max_time"] == pytest.approx(5)
+    assert info["shapes"]["temperatures"] == (15, 1579)
+    assert info["initial"] == (1600.0, 1600.0)
+    assert info["final"][0] == 250.0
+    assert info["run"]["run_ID"] == "small"
+    assert cli.main(["inspect", arrays_file]) == 0
+    text = capsys.readouterr().out
+    assert "Run ID: small" in text and "(15, 1579)" in text
+    assert cli.main(["inspect", "--json", arrays_file]) == 0
+    assert json.loads(capsys.readouterr().out)[0]["latent_steps"] >= 0
+
+    figures = os.path.join(folder_path, "figures")
+    assert cli.main(["plot", arrays_file, "-o", figures, "-j", "1"]) == 0
+    assert os.path.isfile(os.path.join(figures, "small_results.png"))
+
+
+def test_plan(tmpdir, capsys):
+    paramfile = str(tmpdir.join("params.txt"))
+    load_plot_save.make_default_param_file(paramfile)
+    assert cli.main(["plan", paramfile, "--no-calibrate"]) == 0
+    assert "Peak memory" in capsys.readouterr().out
+    assert cli.main(["plan", paramfile, "--no-calibrate", "--json",
+                     "--memory-budget", "1e6"]) == 1
+    plan = json.loads(capsys.readouterr().out)
+    assert not plan["fits_budget"]
+
+
+def test_sweep_command(small_param_file, capsys):
+    filename, folder_path = small_param_file
+    paramfile = os.path.join(folder_path, f"{filename}.txt")
+    output = os.path.join(folder_path, "sweep.json")
+    missing = os.path.join(folder_path, "missing.txt")
+    assert cli.main(["sweep", paramfile, missing, "-j", "2", "--progress",
+                     "--interval", "0.05", "-o", output]) == 1
+    captured = capsys.readouterr()
+    assert "small_results.npz" in captured.out
+    assert "FAILED FileNotFoundError" in captured.out
+    assert "2/2 runs done (1 failed" in captured.err
+    with open(output) as file:
+        assert [r["error"] is None for r in json.load(file)] == [True, False]
+
+
+def test_module_entry_point():
+    output = subprocess.run(
+        [sys.executable, "-m", "pytesimal", "--version"],
+        cwd=ROOT, check=True, capture_output=True, text=True,
+    ).stdout
+    assert output.strip().startswith("pytesimal ")
+    # setup.py takes the version from the package
+    version = output.split()[-1]
+    setup = subprocess.run(
+        [sys.executable, "setup.py", "--version"],
+        cwd=ROOT, check=True, capture_output=True, text=True,
+    ).stdout
+    assert setup.split()[-1] == version
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the convergence harness in benchmarks/convergence.py.
+
+"""
+import importlib.util
+import json
+import os
+
+import numpy as np
+import pytest
+
+spec = importlib.util.spec_from_file_location(
+    "convergence",
+    os.path.join(
+        os.path.dirname(__file__), "..", "benchmarks", "convergence.py"
+    ),
+)
+convergence = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(convergence)
+
+
+def test_analytical_temperature():
+    radii = np.linspace(0, 1000.0, 11)
+    initial = convergence.analytical_temperature(
+        radii, 0.0, 1000.0, 1e-6, 1600.0, 250.0
+    )
+    assert np.all(initial[:-1] == 1600.0) and initial[-1] == 250.0
+    # surface stays fixed, the centre follows its own series
+    time_s, decay = 1e11, 1e-6 * np.pi ** 2 * 1e11 / 1000.0 ** 2
+    later = convergence.analytical_temperature(
+        radii, time_s, 1000.0, 1e-6, 1600.0, 250.0
+    )
+    n = np.arange(1, 200)
+    centre = 250.0 + 1350.0 * 2 * np.sum(
+        (-1.0) ** (n + 1) * np.exp(-decay * n ** 2)
+    )
+    assert later[0] == pytest.approx(centre)
+    assert later[-1] == pytest.approx(250.0, abs=1e-6)
+    assert np.all(np.diff(later) <= 0)
+    assert convergence.analytical_temperature(
+        radii, 1e14, 1000.0, 1e-6, 1600.0, 250.0
+    ) == pytest.approx(250.0)
+
+
+def test_orders_and_pareto_front():
+    assert convergence.observed_order(4.0, 1.0, 2.0, 1.0) == pytest.approx(2)
+    assert convergence.observed_order(0.0, 1.0, 2.0, 1.0) is None
+
+    def run(dr, timestep, error, seconds):
+        return {"backend": "ftcs", "dr": dr, "timestep": timestep,
+                "stable": True, "linf": error, "l2": error,
+                "wall_time": seconds}
+
+    runs = [run(2.0, 1.0, 4.0, 1.0), run(1.0, 1.0, 1.0, 2.0),
+            run(2.0, 0.5, 5.0, 3.0), run(1.0, 0.5, 0.5, 4.0),
+            {"backend": "ftcs", "dr": 0.5, "timestep": 1.0,
+             "stable": False}]
+    front = convergence.pareto_front(runs)
+    assert [(r["dr"], r["timestep"]) for r in front] == [
+        (2.0, 1.0), (1.0, 1.0), (1.0, 0.5)
+    ]
+    assert convergence.cheapest_within(runs, 1.0)["wall_time"] == 2.0
+    assert convergence.cheapest_within(runs, 0.1) is None
+    orders = convergence.convergence_orders(runs)
+    assert {"backend": "ftcs", "refine": "dr", "timestep": 1.0,
+            "coarse": 2.0, "fine": 1.0, "order": 2.0} in orders
+
+
+def test_ladder_converges(tmpdir):
+    output = str(tmpdir.join("convergence.json"))
+    assert convergence.main(
+        ["--dr", "4000", "2000", "--timestep", "1e11", "--times", "1",
+         "--radius", "20000", "--target", "100", "-o", output]
+    ) == 0
+    with open(output) as file:
+        results = json.load(file)
+    coarse, fine = results["runs"]
+    assert coarse["stable"] and fine["stable"]
+    assert fine["linf"] < coarse["linf"] < 50.0
+    # second order in space
+    assert results["orders"][0]["order"] == pytest.approx(2, abs=0.5)
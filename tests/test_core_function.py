@@ -38,3 +38,20 @@ def test_new_core_unit():
     assert core_lh_extracted == 7000.0
     assert temperature_core == 1000.0
     print("Success.")
+
+
+def test_core_phase():
+    core = core_function.IsothermalEutecticCore(
+        initial_temperature=1201.0,
+        melting_temperature=1200.0,
+        outer_r=10000.0,
+        inner_r=0,
+        rho=7800.0,
+        cp=850.0,
+        core_latent_heat=1e-6,
+    )
+    assert core.phase == "liquid"
+    core.temperature = 1200.0
+    assert core.phase == "freezing"
+    core.latent = core.maxlatent
+    assert core.phase == "frozen"
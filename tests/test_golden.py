@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the golden-output harness in benchmarks/golden.py.
+
+"""
+import importlib.util
+import json
+import os
+
+import numpy as np
+import pytest
+
+spec = importlib.util.spec_from_file_location(
+    "golden",
+    os.path.join(os.path.dirname(__file__), "..", "benchmarks", "golden.py"),
+)
+golden = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(golden)
+
+
+def test_error_stats_streams_blocks():
+    reference = np.arange(20.0).reshape(2, 10)
+    candidate = reference.copy()
+    candidate[1, 7] += 0.5
+    stats = golden.ErrorStats()
+    for start in range(0, 10, 4):
+        stats.update(candidate[:, start:start + 4],
+                     reference[:, start:start + 4], offset=start)
+    assert stats.max_abs == 0.5
+    assert stats.worst == (1, 7)
+    assert stats.max_rel == pytest.approx(0.5 / 19.0)
+    assert stats.passes(rtol=0.03) and not stats.passes(rtol=0.02)
+
+    same = golden.ErrorStats()
+    same.update(np.array([[np.nan, 1.0]]), np.array([[np.nan, 1.0]]))
+    assert same.max_abs == 0.0 and same.worst is None
+    nan = golden.ErrorStats()
+    nan.update(np.array([[np.nan, 1.0]]), np.array([[0.0, 1.0]]))
+    assert nan.max_abs == np.inf and not nan.passes(rtol=1.0)
+
+
+def test_record_and_check(tmpdir, monkeypatch):
+    folder = str(tmpdir)
+    # small blocks so that the references are streamed in several pieces
+    monkeypatch.setattr(golden, "CHUNK_STEPS", 7)
+    assert golden.main(["record", "--config", "bryson2015",
+                        "--max-time", "0.2", "--dir", folder]) == 0
+    with open(os.path.join(folder, "bryson2015.json")) as file:
+        assert json.load(file)["max_time"] == 0.2
+    report = golden.check(folder=folder)
+    assert [entry["passed"] for entry in report] == [True]
+    assert report[0]["arrays"]["temperatures"]["worst"] is None
+
+    reference = golden.numerical_methods.SOLVER_BACKENDS["ftcs"]
+
+    def perturbed(*args, **kwargs):
+        temperatures, coretemp, latent = reference(*args, **kwargs)
+        temperatures[3, 20] += 1e-3
+        return temperatures, coretemp, latent
+
+    monkeypatch.setitem(golden.numerical_methods.SOLVER_BACKENDS,
+                        "perturbed", perturbed)
+    report = {entry["backend"]: entry for entry in golden.check(
+        folder=folder, rtol=1e-10)}
+    assert report["ftcs"]["passed"]
+    assert not report["perturbed"]["passed"]
+    stats = report["perturbed"]["arrays"]["temperatures"]
+    assert stats["worst"] == (3, 20)
+    assert stats["max_abs"] == pytest.approx(1e-3)
+    assert report["perturbed"]["arrays"]["coretemp"]["max_abs"] == 0
+    # a looser tolerance accepts the difference
+    assert all(entry["passed"] for entry in golden.check(
+        folder=folder, backends=["perturbed"], rtol=1e-5))
+    output = str(tmpdir.join("report.json"))
+    assert golden.main(["check", "--backend", "ftcs", "--dir", folder,
+                        "-o", output]) == 0
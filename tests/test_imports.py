@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Check that the solver modules import quickly and without optional modules.
+
+Each check runs in a fresh interpreter so that modules already imported by
+the test session do not hide the cost.
+
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# numpy is imported first so that only pytesimal's own import cost is timed
+IMPORT_SCRIPT = """
+import json, sys, time
+import numpy
+start = time.perf_counter()
+import pytesimal.quick_workflow
+import pytesimal.load_plot_save
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "matplotlib": sorted(m for m in sys.modules if m.startswith("matplotlib")),
+    "optional": sorted(m for m in sys.modules if m in OPTIONAL),
+}))
+"""
+
+# only imported by quick_workflow when a run uses the feature
+OPTIONAL_MODULES = [
+    "pytesimal.catalog",
+    "pytesimal.metrics",
+    "pytesimal.planning",
+    "pytesimal.reduced_order",
+    "pytesimal.result_cache",
+    "sqlite3",
+]
+
+
+def _time_import():
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"OPTIONAL = {OPTIONAL_MODULES!r}\n" + IMPORT_SCRIPT,
+        ],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def test_workflow_import_without_matplotlib():
+    result = _time_import()
+    assert result["matplotlib"] == []
+
+
+def test_workflow_import_without_optional_modules():
+    assert _time_import()["optional"] == []
+
+
+def test_workflow_import_time():
+    # best of three to smooth out a cold file cache; importing matplotlib
+    # alone takes longer than this budget
+    seconds = min(_time_import()["seconds"] for _ in range(3))
+    assert seconds < 0.5
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for fitting parameters to meteorite cooling rates.
+
+"""
+import json
+
+import numpy as np
+import pytest
+
+from context import analysis
+from context import cli
+from context import inversion
+from context import load_plot_save
+
+
+@pytest.fixture(scope="module")
+def base_file(tmp_path_factory):
+    """A 60 km body that freezes and cools within 150 Myr."""
+    filepath = str(tmp_path_factory.mktemp("inversion") / "base.txt")
+    load_plot_save.make_default_param_file(filepath)
+    with open(filepath) as file:
+        params = json.load(file)
+    params.update(r_planet=60000.0, reg_fraction=0.1, max_time=150)
+    with open(filepath, "w") as file:
+        json.dump(params, file, indent=4)
+    return filepath
+
+
+def test_constraint_misfit():
+    constraint = inversion.MeteoriteConstraint(
+        "Imilac", cloudy_zone_diameter=143, depth=(10.0, None), dynamo=True,
+        depth_sigma=2.0,
+    )
+    assert constraint.cooling_rate == pytest.approx(
+        analysis.cooling_rate_cloudyzone_diameter(143)
+    )
+    prediction = {"depth": 12.0, "time_of_crossing": 15.0}
+    assert constraint.misfit(prediction, 10.0, 20.0) == 0.0
+    prediction = {"depth": 6.0, "time_of_crossing": 22.0}
+    assert constraint.misfit(prediction, 10.0, 20.0) == 4.0 + 4.0
+    assert constraint.misfit({"depth": None}, 10.0, 20.0) == (
+        inversion.MISSING_PENALTY
+    )
+    with pytest.raises(ValueError):
+        inversion.MeteoriteConstraint("x", cooling_rate=5, tetra_width=50)
+
+
+def test_forward_run_stops_early(base_file):
+    params = dict(zip(load_plot_save.PARAMETER_NAMES,
+                      load_plot_save.load_params_from_file(base_file)))
+    rates = [20.0, 50.0, 1000.0]
+    early = inversion.forward_run(params, rates)
+    full = inversion.forward_run(params, rates, stop_temperature=None)
+    assert early["stopped_early"] and not full["stopped_early"]
+    assert early["steps"] < full["steps"]
+    for result in (early, full):
+        for name in ("steps", "stopped_early", "wall_time"):
+            result.pop(name)
+    assert early == full
+    depths = [prediction["depth"] for prediction in early["meteorites"]]
+    assert depths[0] > depths[1] and depths[2] is None
+
+
+def test_fit(base_file, tmp_path):
+    spec = {
+        "base": base_file,
+        "parameters": {"r_planet": {"min": 55000.0, "max": 65000.0}},
+        "constraints": [
+            {"name": "fast", "cooling_rate": 50.0, "dynamo": True},
+        ],
+        "resolution": {"r_planet": 5000.0},
+        "memo_file": str(tmp_path / "memo.jsonl"),
+    }
+    spec_file = str(tmp_path / "fit.json")
+    with open(spec_file, "w") as file:
+        json.dump(spec, file)
+    with inversion.InverseProblem.from_file(spec_file, jobs=2) as problem:
+        best = problem.optimise(population=4, generations=2, seed=0)
+    assert best["parameters"]["r_planet"] in (55000.0, 60000.0, 65000.0)
+    assert best["misfit"] == min(best["history"])
+    # three bodies at most, each solved once
+    assert 0 < best["runs"] <= 3 < best["evaluations"]
+    with open(spec["memo_file"]) as file:
+        assert len(file.readlines()) == best["runs"]
+
+    # the runs are reused by a new problem
+    problem = inversion.InverseProblem.from_file(spec_file, jobs=1)
+    again = problem.optimise(population=4, generations=2, seed=0)
+    assert again["runs"] == 0 and again["misfit"] == best["misfit"]
+    sampled = problem.sample(walkers=4, steps=3, seed=1)
+    assert sampled["chain"].shape == (3, 4, 1)
+    assert set(np.unique(sampled["chain"])) <= {55000.0, 60000.0, 65000.0}
+    assert np.all(np.isfinite(sampled["misfit"]))
+    assert sampled["runs"] == 0
+
+    assert cli.main(["invert", spec_file, "--jobs", "1", "--population",
+                     "4", "--generations", "1"]) == 0
+
+
+def test_failed_runs_are_retried(base_file, tmp_path, monkeypatch):
+    memo_file = str(tmp_path / "memo.jsonl")
+    problem = inversion.InverseProblem(
+        base_file, {"r_planet": {"values": [60000.0]}},
+        [{"name": "fast", "cooling_rate": 50.0}], memo_file=memo_file, jobs=1,
+    )
+    forward_run = inversion.forward_run
+
+    def interrupted(*args):
+        raise MemoryError("out of memory")
+
+    monkeypatch.setattr(inversion, "forward_run", interrupted)
+    candidate = {"r_planet": 60000.0}
+    failed, = problem.results([candidate])
+    assert failed == {"error": "MemoryError: out of memory"}
+    assert problem.memo == {}
+    with open(memo_file) as file:
+        assert file.read() == ""
+    # the next lookup solves the run again, and keeps it
+    monkeypatch.setattr(inversion, "forward_run", forward_run)
+    solved, = problem.results([candidate])
+    assert "error" not in solved and problem.runs == 2
+    assert problem.results([candidate]) == [solved] and problem.runs == 2
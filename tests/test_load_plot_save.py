@@ -5,7 +5,11 @@ Created on 13/05/2021
 by murphyqm
 
 """
+import json
+import os
+
 import numpy as np
+import pytest
 from context import load_plot_save
 
 
@@ -110,3 +114,242 @@ def test_results_arrays(tmpdir):
     assert coretemp.mean() == 5.8
     assert dT_by_dt.mean() == 5.8
     assert dT_by_dt_core.mean() == 5.8
+
+
+def test_lazy_results_chunked(tmpdir):
+    folder = tmpdir
+    temperatures = np.arange(5 * 250, dtype=float).reshape(5, 250)
+    coretemp = np.full((3, 250), 1200.0)
+    load_plot_save.save_result_arrays(
+        'chunked',
+        folder,
+        temperatures,
+        coretemp,
+        -temperatures,
+        -coretemp,
+        latent=[1, 2, 3],
+        chunk_steps=64,
+        timestep=3.1556926e13,
+    )
+    filepath = str(tmpdir.join('chunked.npz'))
+    with load_plot_save.load_results(filepath) as results:
+        assert results.temperatures.shape == (5, 250)
+        assert results.timestep == 3.1556926e13
+        np.testing.assert_array_equal(
+            results.temperatures[-1, 60:70], temperatures[-1, 60:70]
+        )
+        np.testing.assert_array_equal(
+            results.dT_by_dt[:, 3:200:9], -temperatures[:, 3:200:9]
+        )
+        np.testing.assert_array_equal(
+            results.coretemp[1, [249, 0, 128]], coretemp[1, [249, 0, 128]]
+        )
+        # one timestep per Myr, so 10 to 20 Myr is 11 columns
+        np.testing.assert_array_equal(
+            results.temperatures.myr(10, 20, radius=2),
+            temperatures[2, 10:21],
+        )
+        assert results.latent_array == 3
+    (saved_temperatures, _, _, dT_by_dt_core) = load_plot_save.read_datafile(
+        filepath
+    )
+    np.testing.assert_array_equal(saved_temperatures, temperatures)
+    np.testing.assert_array_equal(dT_by_dt_core, -coretemp)
+
+
+def test_lazy_results_single_block(tmpdir):
+    temperatures = np.arange(12, dtype=float).reshape(3, 4)
+    load_plot_save.save_result_arrays(
+        'single', tmpdir, temperatures, temperatures, temperatures,
+        temperatures,
+    )
+    with load_plot_save.load_results(str(tmpdir.join('single.npz'))) as res:
+        assert res.timestep is None
+        assert res.temperatures.shape == (3, 4)
+        np.testing.assert_array_equal(res.temperatures[1], temperatures[1])
+
+
+def test_svd_results(tmpdir):
+    # smooth cooling history, two and a bit SVD blocks
+    radii = np.linspace(0, 1, 40)[:, None]
+    times = np.linspace(0, 1, 2500)[None, :]
+    temperatures = 250 + 1350 * np.exp(-3 * times) * np.cos(radii)
+    coretemp = np.tile(temperatures[:1], (10, 1))
+    rates = np.gradient(temperatures, axis=1) / 1e11
+    core_rates = np.gradient(coretemp, axis=1) / 1e11
+    arrays = (temperatures, coretemp, rates, core_rates)
+    load_plot_save.save_result_arrays('exact', tmpdir, *arrays)
+    load_plot_save.save_result_arrays(
+        'svd', tmpdir, *arrays, latent=[1, 2], svd_tolerance=0.5
+    )
+    filepath = str(tmpdir.join('svd.npz'))
+    assert os.path.getsize(filepath) * 10 < os.path.getsize(
+        str(tmpdir.join('exact.npz'))
+    )
+    for saved, array in zip(load_plot_save.read_datafile(filepath), arrays):
+        assert saved.shape == array.shape
+    saved = load_plot_save.read_datafile(filepath)
+    assert np.abs(saved[0] - temperatures).max() <= 0.5
+    assert np.abs(saved[1] - coretemp).max() <= 0.5
+    assert np.abs(saved[2] - rates).max() <= 1e-17
+    with load_plot_save.load_results(filepath) as results:
+        assert results.temperatures.chunk_steps == 1024
+        np.testing.assert_allclose(
+            results.temperatures[7, 1000:1100],
+            temperatures[7, 1000:1100],
+            atol=0.5,
+        )
+        assert results.latent_array == 2
+
+
+def test_pyramid_levels(tmpdir):
+    rng = np.random.default_rng(1)
+    temperatures = rng.random((4, 1000))
+    coretemp = rng.random((2, 1000))
+    load_plot_save.save_result_arrays(
+        'run', tmpdir, temperatures, coretemp, -temperatures, -coretemp,
+        chunk_steps=96, timestep=1e11,
+    )
+    path = load_plot_save.build_pyramid(
+        str(tmpdir.join('run.npz')), factor=4, min_columns=20, chunk_steps=50
+    )
+    with load_plot_save.load_pyramid(str(tmpdir.join('run.npz'))) as pyramid:
+        assert pyramid.filepath == path
+        # 1000 -> 250 -> 63 -> 16 columns
+        assert pyramid.factors == [1, 4, 16, 64]
+        assert pyramid.choose_level(1000, 60) == 2
+        assert pyramid.choose_level(1000, 2000) == 0
+        values, first, factor = pyramid.read('temperatures', 2, 'max',
+                                             start=40, stop=100)
+        assert (first, factor) == (32, 16)
+        expected = temperatures[:, 32:112].reshape(4, 5, 16).max(axis=2)
+        np.testing.assert_allclose(values, expected)
+        values, _, _ = pyramid.read('dT_by_dt', 3, 'mean')
+        np.testing.assert_allclose(
+            values[:, :15],
+            -temperatures[:, :960].reshape(4, 15, 64).mean(axis=2),
+        )
+        np.testing.assert_allclose(
+            values[:, 15], -temperatures[:, 960:].mean(axis=1)
+        )
+        values, first, _ = pyramid.read('coretemp', 0, start=10, stop=13)
+        np.testing.assert_array_equal(values, coretemp[:, 10:13])
+
+
+def test_plot_from_pyramid(tmpdir):
+    import matplotlib
+    matplotlib.use('Agg')
+    temperatures = np.tile(np.linspace(1600, 250, 5000), (6, 1))
+    coretemp = np.tile(np.linspace(1600, 1200, 5000), (3, 1))
+    load_plot_save.save_result_arrays(
+        'run', tmpdir, temperatures, coretemp, temperatures, coretemp,
+        chunk_steps=1000, timestep=1e11,
+    )
+    load_plot_save.build_pyramid(str(tmpdir.join('run.npz')),
+                                 min_columns=50, chunk_steps=1000)
+    fig, ax = load_plot_save.plot_temperature_history(
+        None, None, 1e11, 5000e11, show=False,
+        pyramid=str(tmpdir.join('run.npz')),
+    )
+    image = ax.get_images()[0]
+    assert image.get_array().shape[0] == 7
+    assert image.get_array().shape[1] < 5000
+    ax.set_xlim(100, 110)  # zoom in to full resolution
+    np.testing.assert_allclose(
+        image.get_array()[0], temperatures[-1, 100:111]
+    )
+    # without a pyramid the arrays are plotted in full unless decimated
+    fig, ax = load_plot_save.plot_temperature_history(
+        temperatures, coretemp, 1e11, 5000e11, show=False,
+    )
+    assert ax.get_images()[0].get_array().shape[1] == 5000
+    fig, ax = load_plot_save.plot_temperature_history(
+        temperatures, coretemp, 1e11, 5000e11, show=False, decimate=True,
+    )
+    assert ax.get_images()[0].get_array().shape[1] < 5000
+    assert ax.get_xlim()[1] == 4999.5
+
+
+def test_render_batch(tmpdir):
+    temperatures = np.tile(np.linspace(1600, 250, 300), (6, 1))
+    coretemp = np.tile(np.linspace(1600, 1200, 300), (3, 1))
+    for name in ('a_results', 'b_results'):
+        load_plot_save.save_result_arrays(
+            name, tmpdir, temperatures, coretemp, -temperatures, -coretemp,
+        )
+    # one file records its times in the json results file...
+    with open(str(tmpdir.join('a_results.txt')), 'w') as json_file:
+        json.dump({'timestep': 2e11, 'max_time': 1.9}, json_file)
+    assert load_plot_save.read_run_times(str(tmpdir.join('a_results.npz'))) \
+        == (2e11, 1.9 * 3.1556926e13)
+    # ...the other has no timestep at all and cannot be plotted
+    with pytest.raises(ValueError):
+        load_plot_save.render_batch(str(tmpdir.join('*_results.npz')), jobs=1)
+    load_plot_save.save_result_arrays(
+        'b_results', tmpdir, temperatures, coretemp, -temperatures, -coretemp,
+        timestep=1e11,
+    )
+    assert load_plot_save.read_run_times(str(tmpdir.join('b_results.npz'))) \
+        == (1e11, 300 * 1e11)
+    images = load_plot_save.render_batch(
+        str(tmpdir.join('*_results.npz')),
+        output_folder=str(tmpdir.join('figures')),
+        jobs=2,
+        fig_w=3,
+        fig_h=4,
+    )
+    assert images == [
+        str(tmpdir.join('figures', 'a_results.png')),
+        str(tmpdir.join('figures', 'b_results.png')),
+    ]
+    for image in images:
+        with open(image, 'rb') as png:
+            assert png.read(8) == b'\x89PNG\r\n\x1a\n'
+    # rendering in process leaves the caller's backend and figures alone
+    import matplotlib
+    import matplotlib.pyplot as plt
+    backend = matplotlib.get_backend()
+    matplotlib.use('svg')
+    try:
+        figure = plt.figure()
+        assert load_plot_save.render_batch(
+            str(tmpdir.join('b_results.npz')), jobs=1
+        ) == [str(tmpdir.join('b_results.png'))]
+        assert matplotlib.get_backend() == 'svg'
+        assert plt.fignum_exists(figure.number)
+        plt.close(figure)
+    finally:
+        matplotlib.use(backend)
+
+
+def test_plot_sweep(tmpdir):
+    import matplotlib
+    matplotlib.use('Agg')
+    # three runs with different lengths, timesteps and temperature ranges
+    runs = [('a', 300, 1e11, 1600.0), ('b', 500, 1e11, 1700.0),
+            ('c', 200, 2e11, 1650.0)]
+    for name, n_times, timestep, hottest in runs:
+        temperatures = np.tile(np.linspace(hottest, 250, n_times), (6, 1))
+        coretemp = np.tile(np.linspace(hottest, 1200, n_times), (3, 1))
+        load_plot_save.save_result_arrays(
+            name, tmpdir, temperatures, coretemp, -temperatures, -coretemp,
+            chunk_steps=64, timestep=timestep,
+        )
+    load_plot_save.build_pyramid(str(tmpdir.join('b.npz')), factor=4,
+                                 min_columns=20, chunk_steps=50)
+    fig, axs = load_plot_save.plot_sweep(
+        str(tmpdir.join('[abc].npz')), ncols=2, n_columns=50, show=False,
+        savefile=str(tmpdir.join('sweep.png')),
+    )
+    assert axs.shape == (2, 2)
+    assert not axs[1, 1].get_visible()
+    images = [ax.get_images()[0] for ax in axs.flat[:3]]
+    for image in images:
+        assert image.get_clim() == (250.0, 1700.0)
+        assert 50 <= image.get_array().shape[1] <= 125
+    # shared time axis in Myr, long enough for the longest run
+    assert axs[0, 0].get_xlim() == (0, 500 * 1e11 / 3.1556926e13)
+    assert images[2].get_extent()[1] == 200 * 2e11 / 3.1556926e13
+    assert os.path.isfile(str(tmpdir.join('sweep.png')))
+    with pytest.raises(ValueError):
+        load_plot_save.plot_sweep(str(tmpdir.join('a.npz')), quantity='x')
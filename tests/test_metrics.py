@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the JSON lines run-metrics log.
+
+"""
+import multiprocessing
+
+from context import metrics
+from context import quick_workflow
+
+
+def _append_many(args):
+    filepath, writer = args
+    for n in range(50):
+        # long records are more likely to interleave without the lock
+        metrics.append_record(
+            filepath, {"writer": writer, "n": n, "padding": "x" * 5000}
+        )
+
+
+def test_concurrent_appends(tmpdir):
+    filepath = str(tmpdir.join("metrics.jsonl"))
+    with multiprocessing.Pool(4) as pool:
+        pool.map(_append_many, [(filepath, writer) for writer in range(4)])
+    records = metrics.read_records(filepath)
+    assert len(records) == 200
+    for writer in range(4):
+        assert [r["n"] for r in records if r["writer"] == writer] == list(
+            range(50)
+        )
+    with open(filepath) as log:
+        assert len(log.readlines()) == 200
+
+
+def test_read_records_skips_partial_lines(tmpdir):
+    filepath = str(tmpdir.join("metrics.jsonl"))
+    metrics.append_record(filepath, {"n": 1})
+    with open(filepath, "a") as log:
+        log.write('{"n": 2, "trunc')
+    assert metrics.read_records(filepath) == [{"n": 1}]
+
+
+def test_workflow_metrics(tmpdir, small_param_file):
+    filename, folder_path = small_param_file
+    filepath = str(tmpdir.join("metrics.jsonl"))
+    cache_dir = str(tmpdir.join("cache"))
+    for _ in range(2):
+        quick_workflow.workflow(
+            filename, folder_path, cache=cache_dir,
+            instruments=quick_workflow.InstrumentOptions(metrics_log=filepath),
+        )
+    miss, hit = metrics.read_records(filepath)
+    assert not miss["cache_hit"] and hit["cache_hit"]
+    assert miss["run_ID"] == "small"
+    assert miss["backend"] == "ftcs"
+    assert miss["steps"] > 0
+    assert miss["steps_per_second"] > 0
+    assert miss["cpu_time"] > 0
+    assert miss["peak_rss_bytes"] > 1e6
+    assert miss["bytes_written"] > 1000
+    assert hit["steps"] is None and hit["solve_time"] is None
+    assert hit["bytes_written"] == 0
+    assert hit["wall_time"] < miss["wall_time"]
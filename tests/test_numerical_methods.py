@@ -5,9 +5,14 @@ Created on 22/04/2021
 by murphyqm
 
 """
+import io
+
 import numpy as np
 import pytest
 from context import numerical_methods
+from context import setup_functions
+from context import core_function
+from context import mantle_properties
 
 
 def test_diffusivity():
@@ -92,3 +97,132 @@ def test_energy_extracted2():
     k = 10.0
     power_extracted = energy_object.power(mantle_temperatures, i, k)
     assert power_extracted == -12566.370614359173
+
+
+def _small_run(max_time, checkpoint=None, resume=False, profiler=None,
+               progress=None):
+    (
+        r_core,
+        radii,
+        core_radii,
+        reg_thickness,
+        where_regolith,
+        times,
+        temperatures,
+        coretemp,
+    ) = setup_functions.set_up(
+        timestep=1e11, r_planet=30000.0, core_size_factor=0.5,
+        reg_fraction=0.1, max_time=max_time, dr=1000.0,
+    )
+    core_values = core_function.IsothermalEutecticCore(
+        initial_temperature=1600.0,
+        melting_temperature=1200.0,
+        outer_r=r_core,
+        inner_r=0,
+        rho=7800.0,
+        cp=850.0,
+        core_latent_heat=270000.0,
+    )
+    start_step = 1
+    if resume:
+        start_step = checkpoint.restore(temperatures, core_values, 1e11, 1000.0)
+    cond, heatcap, dens = mantle_properties.set_up_mantle_properties()
+    temperatures, coretemp, latent = numerical_methods.discretisation(
+        core_values, [], 1600.0, 1600.0,
+        numerical_methods.surface_dirichlet_bc,
+        numerical_methods.cmb_dirichlet_bc,
+        250.0, temperatures, 1000.0, coretemp, 1e11, r_core, radii, times,
+        where_regolith, 5e-8, cond, heatcap, dens,
+        checkpoint=checkpoint, start_step=start_step, profiler=profiler,
+        progress=progress,
+    )
+    return temperatures, coretemp, latent
+
+
+def test_checkpoint_extend_run(tmpdir):
+    reference = _small_run(15.0)
+    checkpoint = numerical_methods.Checkpointer(
+        str(tmpdir.join('run_checkpoint.npz')), every_steps=1000
+    )
+    _small_run(5.0, checkpoint=checkpoint)
+    # one segment per 1000 steps of the 5 Myr run, plus the final one
+    assert len(tmpdir.listdir(lambda p: '_history' in p.basename)) == 2
+    resumed = numerical_methods.Checkpointer(checkpoint.filepath)
+    extended = _small_run(15.0, checkpoint=resumed, resume=True)
+    assert len(reference[2]) > 0  # core froze during the extension
+    np.testing.assert_array_equal(extended[0], reference[0])
+    np.testing.assert_array_equal(extended[1], reference[1])
+    assert extended[2] == reference[2]
+
+
+def test_solver_profile():
+    reference = _small_run(1.0)
+    profiler = numerical_methods.SolverProfile()
+    profiled = _small_run(1.0, profiler=profiler)
+    np.testing.assert_array_equal(profiled[0], reference[0])
+    n_steps = reference[0].shape[1] - 1
+    assert profiler.steps == n_steps
+    for phase in ('stencil', 'top_mantle_bc', 'bottom_mantle_bc',
+                  'cmb_power', 'extract_heat'):
+        assert profiler.calls[phase] == n_steps
+    # getk is called twice per non-regolith interior point, plus at the cmb
+    n_interior = int(((1 - 0.1) * 30000.0 - 15000.0) / 1000.0) - 1
+    assert profiler.calls['getk'] % n_steps == 0
+    assert profiler.calls['getk'] // n_steps >= 2 * n_interior
+    assert profiler.seconds['stencil'] > profiler.seconds['getrho']
+    assert 0 < sum(profiler.seconds.values()) < 3 * profiler.wall_time
+    profile = profiler.as_dict()
+    assert profile['phases']['getcp']['calls'] == profiler.calls['getcp']
+    assert 'stencil' in str(profiler)
+
+
+def test_progress_reporter():
+    stream = io.StringIO()
+    reporter = numerical_methods.ProgressReporter(
+        interval=3600.0, stream=stream, label='small'
+    )
+    phases = []
+
+    def progress(step, n_steps, time, core_phase):
+        phases.append(core_phase)
+        reporter(step, n_steps, time, core_phase)
+
+    temperatures, _, _ = _small_run(15.0, progress=progress)
+    n_steps = temperatures.shape[1] - 1
+    assert len(phases) == n_steps
+    # the core cools, freezes and is then fully frozen, in that order
+    assert phases[0] == 'liquid' and phases[-1] == 'frozen'
+    assert sorted(set(phases), key=phases.index) == [
+        'liquid', 'freezing', 'frozen'
+    ]
+    # rate limited: only the final step is reported within the interval
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1
+    assert lines[-1].startswith('small: 15.00 Myr (100.0%)')
+    assert lines[-1].endswith('core frozen')
+    snapshot = reporter.snapshot()
+    assert snapshot['step'] == n_steps
+    assert snapshot['steps_per_second'] > 0
+    assert snapshot['eta'] == 0
+
+
+def test_progress_callback_can_stop_run():
+    def stop(step, n_steps, time, core_phase):
+        if step == 10:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        _small_run(1.0, progress=stop)
+
+
+def test_checkpoint_shape_mismatch(tmpdir):
+    checkpoint = numerical_methods.Checkpointer(
+        str(tmpdir.join('run_checkpoint.npz'))
+    )
+    _small_run(1.0, checkpoint=checkpoint)
+    core = core_function.IsothermalEutecticCore(1600.0, 1200.0, 1.0, 0,
+                                                7800.0, 850.0, 270000.0)
+    with pytest.raises(ValueError):
+        checkpoint.restore(np.zeros((3, 500)), core)
+    checkpoint.remove()
+    assert not tmpdir.listdir()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the pre-flight run planner.
+
+"""
+import os
+
+import pytest
+
+from context import load_plot_save
+from context import planning
+from context import quick_workflow
+from context import setup_functions
+
+
+@pytest.mark.parametrize(
+    "timestep, r_planet, core_size_factor, max_time, dr",
+    [
+        (1e11, 250000.0, 0.5, 1.0, 1000.0),
+        (3e11, 30000.0, 0.3, 2.7, 700.0),
+        (2e11, 200000.0, 0.48, 0.5, 1000.0),
+    ],
+)
+def test_grid_size_matches_set_up(
+    timestep, r_planet, core_size_factor, max_time, dr
+):
+    (_, radii, core_radii, _, _, times, _, _) = setup_functions.set_up(
+        timestep, r_planet, core_size_factor, 0.1, max_time, dr
+    )
+    assert planning.grid_size(
+        timestep, r_planet, core_size_factor, max_time, dr
+    ) == (radii.size, core_radii.size, times.size)
+
+
+def test_plan_default_run(tmpdir):
+    filepath = str(tmpdir.join("params.txt"))
+    load_plot_save.make_default_param_file(filepath)
+    plan = planning.plan_run(filepath, memory_budget=2e8, calibrate_time=False)
+    # 400 Myr at 1e11 s on a 250 km body with a 125 km core
+    assert plan["shapes"]["mantle_temperature_array"] == (125, 126229)
+    assert plan["bytes"]["mantle_temperature_array"] == 125 * 126229 * 8
+    assert plan["peak_bytes"] > 4 * 125 * 126229 * 8
+    assert plan["stable"]
+    assert plan["stability_criterion"] == pytest.approx(
+        3.0 / (3341.0 * 819.0) * 1e11 / 1000.0 ** 2
+    )
+    assert plan["predicted_wall_time"] is None
+    assert not plan["fits_budget"]
+    assert 0 < plan["max_time_within_budget"] < 400
+    assert "Peak memory" in planning.describe_plan(plan)
+
+
+def test_plan_calibration():
+    params = {
+        "timestep": 1e11, "r_planet": 30000.0, "core_size_factor": 0.5,
+        "reg_fraction": 0.1, "max_time": 1.0, "temp_core_melting": 1200.0,
+        "mantle_heat_cap_value": 819.0, "mantle_density_value": 3341.0,
+        "mantle_conductivity_value": 3.0, "core_cp": 850.0,
+        "core_density": 7800.0, "temp_init": 1600.0, "temp_surface": 250.0,
+        "core_temp_init": 1600.0, "core_latent_heat": 270000.0,
+        "kappa_reg": 5e-8, "dr": 1000.0, "cond_constant": "n",
+        "density_constant": "y", "heat_cap_constant": "y",
+    }
+    plan = planning.plan_run(params)
+    assert plan["seconds_per_step"] > 0
+    assert plan["predicted_wall_time"] == pytest.approx(
+        plan["seconds_per_step"] * (plan["n_times"] - 1)
+    )
+    # variable conductivity is highest at the surface temperature
+    assert plan["max_diffusivity"] > 3.0 / (3341.0 * 819.0)
+
+
+def test_workflow_memory_budget(small_param_file):
+    filename, folder_path = small_param_file
+    with pytest.raises(MemoryError, match="max_time"):
+        quick_workflow.workflow(filename, folder_path, memory_budget=1e5)
+    assert not os.path.exists(os.path.join(folder_path, "results",
+                                           "small_results.npz"))
+    summary = quick_workflow.workflow(filename, folder_path,
+                                      memory_budget=1e9)
+    assert os.path.isfile(summary["arrays_file"])
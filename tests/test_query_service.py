@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the meteorite query service.
+
+"""
+import json
+import os
+import shutil
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+from context import analysis
+from context import catalog
+from context import load_plot_save
+from context import query_service
+from context import quick_workflow
+
+
+@pytest.fixture(scope="module")
+def results_folder(tmp_path_factory):
+    """Run a body whose 800 K isotherm crosses the mantle."""
+    folder = tmp_path_factory.mktemp("query")
+    filepath = str(folder / "medium.txt")
+    load_plot_save.make_default_param_file(filepath)
+    with open(filepath) as file:
+        params = json.load(file)
+    params.update(run_ID="medium", folder=str(folder / "results"),
+                  r_planet=60000.0, reg_fraction=0.1, max_time=80)
+    with open(filepath, "w") as file:
+        json.dump(params, file, indent=4)
+    quick_workflow.workflow("medium", str(folder),
+                            catalog=str(folder / "runs.sqlite"))
+    return str(folder)
+
+
+def test_index_matches_analysis(results_folder):
+    arrays_file = os.path.join(results_folder, "results",
+                               "medium_results.npz")
+    index = query_service.ResultIndex(arrays_file)
+    temperatures, _, dT_by_dt, _ = load_plot_save.read_datafile(arrays_file)
+    matched = 0
+    for rate in np.geomspace(1.0, 2000.0, 25):
+        CR = analysis.cooling_rate_to_seconds(rate)
+        expected = analysis.meteorite_depth_and_timing(
+            CR, temperatures, dT_by_dt, index.radii, index.r_planet,
+            index.core_size_factor, index.time_core_frozen,
+            index.fully_frozen, dr=index.dr, dt=index.timestep,
+        )
+        assert index.depth_and_timing(CR) == expected
+        matched += expected[0] is not None
+    assert 0 < matched < 25
+
+
+def test_crossing_as_the_core_freezes(results_folder):
+    index = query_service.ResultIndex(
+        os.path.join(results_folder, "results", "medium_results.npz")
+    )
+    CR = analysis.cooling_rate_to_seconds(40.0)
+    crossing = index.depth_and_timing(CR)[3]
+    assert crossing > 0
+    # crossing exactly as the core starts, then finishes, freezing
+    index.time_core_frozen, index.fully_frozen = crossing, 2 * crossing
+    assert index.depth_and_timing(CR)[1] == "Core has started solidifying"
+    index.time_core_frozen, index.fully_frozen = crossing / 2, crossing
+    assert index.depth_and_timing(CR)[1] == "Core has finished solidifying"
+
+
+def _copy_results(results_folder, tmpdir):
+    results = os.path.join(results_folder, "results")
+    copies = []
+    for name in ("a", "b"):
+        for suffix in (".npz", ".txt"):
+            shutil.copy(os.path.join(results, f"medium_results{suffix}"),
+                        str(tmpdir.join(f"{name}_results{suffix}")))
+        copies.append(str(tmpdir.join(f"{name}_results.npz")))
+    return copies
+
+
+def test_index_cache(results_folder, tmpdir):
+    copies = _copy_results(results_folder, tmpdir)
+    cache = query_service.IndexCache(max_entries=1)
+    first = cache.get(copies[0])
+    assert cache.get(copies[0]) is first
+    cache.get(copies[1])
+    assert len(cache) == 1
+    assert cache.get(copies[0]) is not first
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+    # a changed file is indexed again
+    os.utime(copies[0], ns=(0, 0))
+    assert cache.get(copies[0]) is not first
+    assert query_service.IndexCache(max_bytes=1).get(copies[1]).nbytes > 1
+
+
+def test_index_cache_builds_files_in_parallel(results_folder, tmpdir,
+                                              monkeypatch):
+    copies = _copy_results(results_folder, tmpdir)
+    started, release = threading.Event(), threading.Event()
+    build = query_service.ResultIndex
+
+    def slow_build(filepath):
+        if filepath.endswith("a_results.npz"):
+            started.set()
+            release.wait(30)
+        return build(filepath)
+
+    monkeypatch.setattr(query_service, "ResultIndex", slow_build)
+    cache = query_service.IndexCache()
+    thread = threading.Thread(target=cache.get, args=(copies[0],))
+    thread.start()
+    assert started.wait(30)
+    # not held up by the file being indexed in the other thread
+    cache.get(copies[1])
+    assert len(cache) == 1
+    release.set()
+    thread.join()
+    assert len(cache) == 2
+
+
+def _post(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode())
+    with urllib.request.urlopen(request) as reply:
+        return json.load(reply)
+
+
+def test_server(results_folder):
+    server = query_service.make_server(
+        results_folder, port=0, catalog=os.path.join(results_folder,
+                                                     "runs.sqlite")
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        with urllib.request.urlopen(f"{url}/health") as reply:
+            assert json.load(reply)["status"] == "ok"
+        answer = _post(f"{url}/query", {
+            "run": "results/medium_results.npz",
+            "cooling_rates": [1.0, 40.0],
+            "cz_diameters": [140.0],
+        })
+        assert [r["cooling_rate"] for r in answer["results"]][:2] == [1.0,
+                                                                      40.0]
+        assert answer["results"][0]["timing"] == (
+            "No cooling rate matched cooling history"
+        )
+        assert answer["results"][0]["depth"] is None
+        assert answer["time_ms"] > 0
+        # by run ID through the catalog, in a batch
+        batch = _post(f"{url}/query", [
+            {"run": "medium", "cooling_rates": [40.0]},
+            {"run": "results/medium_results.npz", "cooling_rates": [40.0]},
+        ])
+        first, second = batch["results"]
+        assert first["results"] == second["results"]
+        assert server.cache.stats()["misses"] == 1
+        # an array file without its json results, and a corrupt one
+        results = os.path.join(results_folder, "results")
+        shutil.copy(os.path.join(results, "medium_results.npz"),
+                    os.path.join(results_folder, "no_json.npz"))
+        with open(os.path.join(results, "medium_results.npz"), "rb") as file:
+            truncated = file.read(100)
+        with open(os.path.join(results_folder, "corrupt.npz"), "wb") as file:
+            file.write(truncated)
+        shutil.copy(os.path.join(results, "medium_results.txt"),
+                    os.path.join(results_folder, "corrupt.txt"))
+        for body, status in (
+            ({"run": "missing"}, 404),
+            ({"run": "no_json.npz", "cooling_rates": [40.0]}, 404),
+            ({"run": "corrupt.npz", "cooling_rates": [40.0]}, 500),
+            ({"run": "../../etc/passwd"}, 400),
+            ({"cooling_rates": [1.0]}, 400),
+        ):
+            with pytest.raises(urllib.error.HTTPError) as error:
+                _post(f"{url}/query", body)
+            assert error.value.code == status
+            assert "error" in json.load(error.value)
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the reduced-order model of the mantle.
+
+"""
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from context import async_sweep
+from context import core_function
+from context import load_plot_save
+from context import mantle_properties
+from context import quick_workflow
+from context import reduced_order
+from context import setup_functions
+
+# the package module, whose boundary conditions and backends the model uses
+numerical_methods = reduced_order.numerical_methods
+
+
+def _solve(solver, kappa_reg, temp_init, bottom_mantle_bc=None):
+    """Solve a 60 km body for 20 Myr with variable properties."""
+    (r_core, radii, _, _, where_regolith, times, temperatures,
+     coretemp) = setup_functions.set_up(1e11, 60000.0, 0.5, 0.1, 20, 1000.0)
+    core = core_function.IsothermalEutecticCore(
+        temp_init, 1200.0, r_core, 0, 7800.0, 850.0, 270000.0
+    )
+    cond, heatcap, dens = mantle_properties.set_up_mantle_properties(
+        "n", "n", "n"
+    )
+    temperatures, coretemp, latent = solver(
+        core, [], temp_init, temp_init,
+        numerical_methods.surface_dirichlet_bc,
+        bottom_mantle_bc or numerical_methods.cmb_dirichlet_bc,
+        250.0, temperatures, 1000.0, coretemp, 1e11, r_core, radii, times,
+        where_regolith, kappa_reg, cond, heatcap, dens,
+    )
+    return temperatures, coretemp, latent
+
+
+@pytest.fixture(scope="module")
+def training():
+    return [
+        _solve(numerical_methods.discretisation, kappa_reg, temp_init)[0]
+        for kappa_reg, temp_init in ((2e-8, 1500.0), (1e-7, 1700.0))
+    ]
+
+
+def test_deim_points():
+    basis = np.linalg.qr(np.random.default_rng(0).random((30, 6)))[0]
+    points = reduced_order.deim_points(basis)
+    assert len(set(points)) == 6
+    # the basis is interpolated exactly from its points
+    vector = basis @ np.arange(1.0, 7.0)
+    weights = np.linalg.solve(basis[points], vector[points])
+    assert np.allclose(weights, np.arange(1.0, 7.0))
+
+
+@pytest.mark.parametrize("n_points", [None, 20])
+def test_matches_full_model(training, n_points):
+    model = reduced_order.ReducedOrderModel.fit(
+        training, n_modes=10, n_points=n_points
+    )
+    assert model.energy > 0.9999
+    expected, expected_core, expected_latent = _solve(
+        numerical_methods.discretisation, 4e-8, 1650.0
+    )
+    temperatures, coretemp, latent = _solve(
+        model.discretisation, 4e-8, 1650.0
+    )
+    assert np.max(np.abs(temperatures - expected)) < 2.0
+    assert np.max(np.abs(coretemp - expected_core)) < 1.0
+    assert abs(len(latent) - len(expected_latent)) <= 2
+    # boundary conditions hold exactly
+    assert np.all(temperatures[-1, 1:] == 250.0)
+
+
+def _write_params(tmpdir):
+    """Write the parameters of `_solve` with kappa_reg 4e-8 to rom.txt."""
+    paramfile = str(tmpdir.join("rom.txt"))
+    load_plot_save.make_default_param_file(paramfile)
+    with open(paramfile) as file:
+        params = json.load(file)
+    params.update(run_ID="rom", folder=str(tmpdir), r_planet=60000.0,
+                  reg_fraction=0.1, max_time=20, kappa_reg=4e-8,
+                  cond_constant="n", density_constant="n",
+                  heat_cap_constant="n")
+    with open(paramfile, "w") as file:
+        json.dump(params, file, indent=4)
+    return paramfile
+
+
+def test_backend_and_save(training, tmpdir):
+    model = reduced_order.ReducedOrderModel.fit(training, n_modes=8)
+    filepath = str(tmpdir.join("model.npz"))
+    model.save(filepath)
+    loaded = reduced_order.ReducedOrderModel.load(filepath)
+    assert loaded.digest == model.digest
+    backend = loaded.register()
+    try:
+        _write_params(tmpdir)
+        quick_workflow.workflow("rom", str(tmpdir), backend=backend)
+    finally:
+        del numerical_methods.SOLVER_BACKENDS[backend]
+    temperatures = load_plot_save.read_datafile(
+        str(tmpdir.join("rom_results.npz"))
+    )[0]
+    direct = _solve(model.discretisation, 4e-8, 1600.0)[0]
+    assert np.allclose(temperatures, direct)
+    with pytest.raises(ValueError):
+        _solve(model.discretisation, 4e-8, 1600.0,
+               bottom_mantle_bc=numerical_methods.cmb_neumann_bc)
+
+
+def test_saved_model_in_spawned_workers(training, tmpdir):
+    model = reduced_order.ReducedOrderModel.fit(training, n_modes=8)
+    filepath = str(tmpdir.join("model.npz"))
+    model.save(filepath)
+    paramfile = _write_params(tmpdir)
+    # AsyncSweep workers are not forked, so a registered model is unknown
+    backend = model.register()
+    try:
+        failed, = asyncio.run(async_sweep.run_sweep_async(
+            [paramfile], jobs=1, backend=backend
+        ))
+    finally:
+        del numerical_methods.SOLVER_BACKENDS[backend]
+    assert failed["error"].startswith("ValueError: Unknown solver backend")
+    # but they load a saved model by its path
+    solved, = asyncio.run(async_sweep.run_sweep_async(
+        [paramfile], jobs=1, backend=filepath
+    ))
+    assert solved["error"] is None
+    assert reduced_order.load_backend(filepath) == backend
+    del numerical_methods.SOLVER_BACKENDS[backend]
+    temperatures = load_plot_save.read_datafile(
+        solved["summary"]["arrays_file"]
+    )[0]
+    assert np.allclose(temperatures, _solve(model.discretisation, 4e-8,
+                                            1600.0)[0])
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the parameter-hash result cache.
+
+"""
+import json
+import os
+
+import numpy as np
+
+from context import load_plot_save
+from context import quick_workflow
+from context import result_cache
+
+
+def test_parameter_hash_canonical(tmpdir):
+    filepath = str(tmpdir.join("params.txt"))
+    load_plot_save.make_default_param_file(filepath)
+    params = load_plot_save.load_params_from_file(filepath)
+    key = result_cache.parameter_hash(params)
+    as_dict = dict(zip(load_plot_save.PARAMETER_NAMES, params))
+    as_dict.update(run_ID="renamed", folder="elsewhere", max_time=400.0)
+    assert result_cache.parameter_hash(as_dict) == key
+    as_dict["dr"] = 500.0
+    assert result_cache.parameter_hash(as_dict) != key
+    assert result_cache.parameter_hash(params, backend="other") != key
+    assert result_cache.parameter_hash(params, version="0.0.0") != key
+
+
+def test_workflow_cache_hit(tmpdir, small_param_file):
+    filename, folder_path = small_param_file
+    cache_dir = str(tmpdir.join("cache"))
+    first = quick_workflow.workflow(filename, folder_path, cache=cache_dir)
+    assert not first["cache_hit"]
+
+    # same parameters under another name and folder
+    with open(f"{folder_path}/{filename}.txt") as file:
+        params = json.load(file)
+    params.update(run_ID="copy", folder=str(tmpdir.join("copy")))
+    with open(f"{folder_path}/copy.txt", "w") as file:
+        json.dump(params, file)
+    second = quick_workflow.workflow(
+        "copy", folder_path,
+        cache=result_cache.ResultCache(cache_dir, link=True),
+    )
+    assert second["cache_hit"]
+    assert second["cache_key"] == first["cache_key"]
+    cache = result_cache.ResultCache(cache_dir)
+    cached_file = cache.lookup(first["cache_key"])[".npz"]
+    assert os.path.samefile(second["arrays_file"], cached_file)
+    with open(second["results_file"]) as file:
+        assert json.load(file)["run_ID"] == "copy"
+    original = load_plot_save.read_datafile(first["arrays_file"])
+    cached = load_plot_save.read_datafile(second["arrays_file"])
+    assert all((a == b).all() for a, b in zip(original, cached))
+    # the linked file outlives its cache entry
+    assert cache.evict(0) == [first["cache_key"]]
+    cached = load_plot_save.read_datafile(second["arrays_file"])
+    assert all((a == b).all() for a, b in zip(original, cached))
+
+
+def test_array_layouts_cached_apart(tmpdir, small_param_file):
+    filename, folder_path = small_param_file
+    cache_dir = str(tmpdir.join("cache"))
+    plain = quick_workflow.workflow(filename, folder_path,
+                                    cache=cache_dir)
+    # whole arrays by default, readable with numpy alone
+    with np.load(plain["arrays_file"]) as arrays:
+        temperatures = arrays["temperatures"]
+    chunked = quick_workflow.workflow(
+        filename, folder_path, cache=cache_dir,
+        storage=quick_workflow.StorageOptions(chunk_steps=64),
+    )
+    assert not chunked["cache_hit"]
+    assert chunked["cache_key"] != plain["cache_key"]
+    with load_plot_save.load_results(chunked["arrays_file"]) as results:
+        assert results.temperatures.chunk_steps == 64
+        assert (results.temperatures.read() == temperatures).all()
+
+
+def test_cache_eviction(tmpdir):
+    cache = result_cache.ResultCache(str(tmpdir.join("cache")))
+    for n, key in enumerate(["a", "b", "c"]):
+        stem = str(tmpdir.join(key))
+        for suffix in (".npz", ".txt"):
+            with open(stem + suffix, "w") as file:
+                file.write("x" * 100)
+        cache.store(key, stem)
+        os.utime(cache.entry(key), (n, n))
+    cache.lookup("a")  # most recently used
+    assert cache.size() == 600
+    assert cache.evict(400) == ["b"]
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") is not None
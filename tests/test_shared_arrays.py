@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for handing result arrays between processes without copying.
+
+"""
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from context import analysis
+from context import load_plot_save
+from context import quick_workflow
+from context import shared_arrays
+from context import sweep
+
+
+def _fill(kind, directory):
+    allocate = shared_arrays.ArrayAllocator(kind, directory=directory)
+    array = allocate("temperatures", (3, 4))
+    array[:] = np.arange(12.0).reshape(3, 4)
+    del array
+    allocate.close()
+    return allocate.handles
+
+
+@pytest.mark.parametrize("kind", shared_arrays.KINDS)
+def test_arrays_from_another_process(kind, tmpdir):
+    if kind == "shared_memory":
+        # new in Python 3.8
+        shared_memory = pytest.importorskip("multiprocessing.shared_memory")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        handles = executor.submit(_fill, kind, str(tmpdir)).result()
+    arrays = shared_arrays.SharedResultArrays(handles)
+    assert list(arrays) == ["temperatures"]
+    np.testing.assert_array_equal(
+        arrays["temperatures"], np.arange(12.0).reshape(3, 4)
+    )
+    assert arrays.nbytes == 96
+    arrays.release()
+    if kind == "shared_memory":
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=handles["temperatures"]["name"])
+    else:
+        assert os.listdir(str(tmpdir)) == []
+
+
+def test_allocator_checks(tmpdir):
+    with pytest.raises(ValueError, match="Unknown array kind"):
+        shared_arrays.ArrayAllocator("pipe")
+    with pytest.raises(ValueError, match="directory"):
+        shared_arrays.ArrayAllocator("memmap")
+    allocate = shared_arrays.ArrayAllocator("memmap", directory=str(tmpdir))
+    allocate("a", (2,))
+    with pytest.raises(ValueError, match="already"):
+        allocate("a", (2,))
+    allocate.release()
+    assert allocate.handles == {}
+
+
+def test_shared_memory_needs_python_38(monkeypatch, tmpdir):
+    # as on Python 3.7, where the module does not exist
+    monkeypatch.setitem(sys.modules, "multiprocessing.shared_memory", None)
+    monkeypatch.delattr(multiprocessing, "shared_memory", raising=False)
+    with pytest.raises(ValueError, match="memmap"):
+        shared_arrays.ArrayAllocator("shared_memory")
+    with pytest.raises(ValueError, match="memmap"):
+        sweep.run_sweep([str(tmpdir.join("run.txt"))],
+                        share_arrays="shared_memory")
+
+
+def test_cooling_rate_out():
+    temperatures = np.random.default_rng(0).random((4, 30))
+    out = np.empty_like(temperatures)
+    assert analysis.cooling_rate(temperatures, 1e11, out=out) is out
+    np.testing.assert_array_equal(
+        out, analysis.cooling_rate(temperatures, 1e11)
+    )
+
+
+def test_workflow_into_allocated_arrays(small_param_file, tmpdir):
+    filename, folder_path = small_param_file
+    allocate = shared_arrays.ArrayAllocator(
+        "memmap", directory=str(tmpdir.join("arrays"))
+    )
+    cache_dir = str(tmpdir.join("cache"))
+    summary = quick_workflow.workflow(
+        filename, folder_path, allocate=allocate, cache=cache_dir
+    )
+    allocate.close()
+    saved = load_plot_save.read_datafile(summary["arrays_file"])
+    with shared_arrays.SharedResultArrays(allocate.handles) as arrays:
+        for name, array in zip(load_plot_save._RESULT_ARRAY_NAMES, saved):
+            np.testing.assert_array_equal(arrays[name], array)
+    # a cache hit reads the cached arrays into the allocated ones
+    allocate = shared_arrays.ArrayAllocator()
+    summary = quick_workflow.workflow(
+        filename, folder_path, allocate=allocate, cache=cache_dir
+    )
+    assert summary["cache_hit"]
+    allocate.close()
+    with shared_arrays.SharedResultArrays(allocate.handles) as arrays:
+        np.testing.assert_array_equal(arrays["dT_by_dt"], saved[2])
+
+
+def test_sweep_shares_arrays(tmpdir):
+    pytest.importorskip("multiprocessing.shared_memory")
+    paramfiles = []
+    for name in ("first", "second"):
+        filepath = str(tmpdir.join(f"{name}.txt"))
+        load_plot_save.make_default_param_file(filepath)
+        with open(filepath) as file:
+            params = json.load(file)
+        params.update(run_ID=name, folder=str(tmpdir.join("results")),
+                      r_planet=30000.0, reg_fraction=0.1, max_time=2)
+        with open(filepath, "w") as file:
+            json.dump(params, file)
+        paramfiles.append(filepath)
+    results = sweep.run_sweep(paramfiles, jobs=2,
+                              share_arrays="shared_memory",
+                              storage=quick_workflow.StorageOptions(
+                                  save_arrays=False))
+    for result in results:
+        assert result["error"] is None
+        assert result["summary"]["arrays_file"] is None
+        with result["arrays"] as arrays:
+            assert arrays["temperatures"].shape[0] == 15
+            assert arrays["temperatures"][:, -1].max() < 1600.0
+    assert not os.path.exists(str(tmpdir.join("results", "first_results.npz")))
+    with pytest.raises(ValueError, match="array kind"):
+        sweep.run_sweep(paramfiles, share_arrays="pipe")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the surrogate model.
+
+"""
+import json
+
+import numpy as np
+import pytest
+
+from context import catalog
+from context import load_plot_save
+from context import quick_workflow
+from context import surrogate
+
+
+def _function(x, y):
+    return np.sin(3.0 * x) + y ** 2
+
+
+def test_emulator_interpolates():
+    rng = np.random.default_rng(1)
+    points = rng.random((60, 2))
+    emulator = surrogate.RBFEmulator().fit(points, _function(*points.T))
+    test = rng.random((200, 2))
+    predicted, std = emulator.predict(test, return_std=True)
+    assert np.max(np.abs(predicted - _function(*test.T))) < 0.05
+    assert np.all(std >= 0)
+    # the training points are interpolated, with no uncertainty
+    assert np.allclose(emulator.predict(points), _function(*points.T),
+                       atol=1e-4)
+    assert emulator.validation()["rmse"] < 0.05
+
+
+def test_leave_one_out_errors():
+    rng = np.random.default_rng(2)
+    points = rng.random((15, 2))
+    values = _function(*points.T)
+    emulator = surrogate.RBFEmulator(smoothing=1e-6).fit(points, values)
+    for n in range(len(values)):
+        keep = np.arange(len(values)) != n
+        refit = surrogate.RBFEmulator(emulator.length_scale, 1e-6)
+        refit.fit(points[keep], values[keep])
+        error = refit.predict(points[n:n + 1])[0] - values[n]
+        # close, not equal: a refit is centred on its own mean
+        assert emulator.loo_errors[n] == pytest.approx(error, rel=0.05,
+                                                        abs=1e-5)
+
+
+def test_surrogate_scaling_and_save(tmpdir):
+    rng = np.random.default_rng(3)
+    kappa = 10 ** rng.uniform(-9, -6, 40)
+    flag = np.where(rng.random(40) < 0.5, "y", "n")
+    values = np.log10(kappa) + (flag == "y")
+    values[0] = np.nan
+    fitted = surrogate.Surrogate(
+        {"kappa_reg": kappa, "cond_constant": flag}, {"out": values}
+    )
+    assert fitted.validation()["out"]["n_runs"] == 39
+    predicted = fitted.predict(kappa_reg=[1e-8, 1e-7], cond_constant="y")
+    assert predicted["out"] == pytest.approx([-7.0, -6.0], abs=0.05)
+    filepath = str(tmpdir.join("surrogate.npz"))
+    fitted.save(filepath)
+    loaded = surrogate.Surrogate.load(filepath)
+    again, std = loaded.predict(kappa_reg=[1e-8, 1e-7], cond_constant="y",
+                                return_std=True)
+    assert np.array_equal(again["out"], predicted["out"])
+    assert loaded.validation() == fitted.validation()
+    with pytest.raises(ValueError):
+        fitted.predict(kappa_reg=1e-8)
+
+
+def test_duplicate_runs_are_merged():
+    rng = np.random.default_rng(4)
+    kappa = 10 ** rng.uniform(-9, -6, 20)
+    values = np.log10(kappa) + 0.1 * np.sin(5 * np.log10(kappa))
+    fitted = surrogate.Surrogate({"kappa_reg": kappa}, {"out": values})
+    # the same runs again, e.g. catalogued under other names
+    doubled = surrogate.Surrogate(
+        {"kappa_reg": np.concatenate([kappa, kappa[:5]])},
+        {"out": np.concatenate([values, values[:5]])},
+    )
+    # fitted as the 20 distinct runs, up to the order of the points
+    validation = doubled.validation()["out"]
+    assert validation["n_runs"] == 20
+    assert validation["rmse"] == pytest.approx(
+        fitted.validation()["out"]["rmse"]
+    )
+    predicted = doubled.predict(kappa_reg=[1e-8, 1e-7])["out"]
+    assert predicted == pytest.approx(
+        fitted.predict(kappa_reg=[1e-8, 1e-7])["out"]
+    )
+
+
+def test_surrogate_from_catalog(tmpdir):
+    catalog_path = str(tmpdir.join("runs.sqlite"))
+    for n, radius in enumerate((50000.0, 60000.0, 70000.0)):
+        filepath = str(tmpdir.join(f"run{n}.txt"))
+        load_plot_save.make_default_param_file(filepath)
+        with open(filepath) as file:
+            params = json.load(file)
+        params.update(run_ID=f"run{n}", folder=str(tmpdir.join("results")),
+                      r_planet=radius, reg_fraction=0.1, max_time=80)
+        with open(filepath, "w") as file:
+            json.dump(params, file, indent=4)
+        quick_workflow.workflow(f"run{n}", str(tmpdir), catalog=catalog_path)
+    with catalog.RunCatalog(catalog_path) as runs:
+        fitted = surrogate.Surrogate.from_catalog(
+            runs, parameters=("r_planet",), cooling_rates=[50.0]
+        )
+        expected = runs.query(columns=["core_begins_to_freeze"])
+    assert "depth@50" in fitted.outputs
+    assert "time_of_crossing@50" in fitted.outputs
+    predicted = fitted.predict(r_planet=60000.0)
+    assert predicted["core_begins_to_freeze"] == pytest.approx(
+        expected["core_begins_to_freeze"][1], rel=1e-3
+    )
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for running sweeps of parameter files in parallel.
+
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from context import load_plot_save
+from context import metrics
+from context import quick_workflow
+from context import sweep
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def _write_params(tmpdir, name, **changes):
+    filepath = str(tmpdir.join(f"{name}.txt"))
+    load_plot_save.make_default_param_file(filepath)
+    with open(filepath) as file:
+        params = json.load(file)
+    params.update(run_ID=name, folder=str(tmpdir.join("results")),
+                  r_planet=30000.0, reg_fraction=0.1, max_time=2,
+                  **changes)
+    with open(filepath, "w") as file:
+        json.dump(params, file, indent=4)
+    return filepath
+
+
+def test_split_param_path():
+    assert sweep.split_param_path("a/b/run.txt") == ("run", "a/b")
+    assert sweep.split_param_path("run.txt") == ("run", ".")
+    with pytest.raises(ValueError, match=".txt"):
+        sweep.split_param_path("run.json")
+
+
+def test_combine_progress():
+    snapshots = [
+        {"fraction": 0.5, "steps_per_second": 100.0},
+        {"fraction": 0.25, "steps_per_second": None},
+    ]
+    progress = sweep.combine_progress(snapshots, 4, 1, 0, 10.0)
+    assert progress["fraction"] == pytest.approx(1.75 / 4)
+    assert progress["steps_per_second"] == 100.0
+    assert progress["running"] == 2
+    assert progress["eta"] == pytest.approx(10.0 * 2.25 / 1.75)
+    assert "1/4 runs done" in sweep.describe_progress(progress)
+    done = sweep.combine_progress([], 4, 4, 1, 10.0)
+    assert done["fraction"] == 1.0 and done["eta"] == 0.0
+
+
+def test_run_sweep(tmpdir):
+    paramfiles = [
+        _write_params(tmpdir, "first"),
+        _write_params(tmpdir, "second", core_size_factor=0.3),
+        str(tmpdir.join("missing.txt")),
+    ]
+    metrics_log = str(tmpdir.join("metrics.jsonl"))
+    updates = []
+    results = sweep.run_sweep(paramfiles, jobs=2, progress=updates.append,
+                              interval=0.05,
+                              instruments=quick_workflow.InstrumentOptions(
+                                  metrics_log=metrics_log))
+    assert [r["paramfile"] for r in results] == paramfiles
+    first, second, broken = results
+    assert first["error"] is None and second["error"] is None
+    assert os.path.isfile(first["summary"]["arrays_file"])
+    assert second["summary"]["arrays_file"].endswith("second_results.npz")
+    assert broken["summary"] is None
+    assert broken["error"].startswith("FileNotFoundError")
+    # every finished run is reported, the last update covers the sweep
+    assert updates[-1]["done"] == 3 and updates[-1]["failed"] == 1
+    assert updates[-1]["fraction"] == 1.0
+    records = metrics.read_records(metrics_log)
+    assert sorted(r["run_ID"] for r in records) == ["first", "second"]
+
+
+def test_results_valid(tmpdir):
+    paramfile = _write_params(tmpdir, "run")
+    assert not sweep.results_valid(paramfile)
+    (result,) = sweep.run_sweep([paramfile], jobs=1)
+    assert sweep.results_valid(paramfile)
+    # a changed parameter or a partly written array file is not valid
+    changed = _write_params(tmpdir, "run", temp_init=1500.0)
+    assert not sweep.results_valid(changed)
+    _write_params(tmpdir, "run")
+    arrays_file = result["summary"]["arrays_file"]
+    with open(arrays_file, "rb") as file:
+        contents = file.read()
+    with open(arrays_file, "wb") as file:
+        file.write(contents[: len(contents) // 2])
+    assert not sweep.results_valid(paramfile)
+
+
+def test_claim_run(tmpdir):
+    claim_dir = str(tmpdir.join("claims"))
+    paramfile = str(tmpdir.join("run.txt"))
+    assert sweep.claim_run(claim_dir, paramfile)
+    assert not sweep.claim_run(claim_dir, paramfile)
+    lock = os.path.join(claim_dir, "run.lock")
+    assert json.load(open(lock))["pid"] == os.getpid()
+    # a lock nobody has touched for a while is taken over
+    old = time.time() - 120
+    os.utime(lock, (old, old))
+    assert not sweep.claim_run(claim_dir, paramfile, stale_after=600)
+    assert sweep.claim_run(claim_dir, paramfile, stale_after=60)
+    assert os.listdir(claim_dir) == ["run.lock"]
+    sweep.release_run(claim_dir, paramfile)
+    assert os.listdir(claim_dir) == []
+
+
+def test_claim_race_on_stale_lock(tmpdir, monkeypatch):
+    claim_dir = str(tmpdir.join("claims"))
+    paramfile = str(tmpdir.join("run.txt"))
+    assert sweep.claim_run(claim_dir, paramfile)
+    lock = os.path.join(claim_dir, "run.lock")
+    old = time.time() - 120
+    os.utime(lock, (old, old))
+    rename = os.rename
+    claimed = []
+
+    def racing_rename(source, destination):
+        # the other claimer takes over the stale lock after this one has
+        # found it stale, but before this one renames it
+        monkeypatch.setattr(os, "rename", rename)
+        claimed.append(sweep.claim_run(claim_dir, paramfile, stale_after=60))
+        rename(source, destination)
+
+    monkeypatch.setattr(os, "rename", racing_rename)
+    assert not sweep.claim_run(claim_dir, paramfile, stale_after=60)
+    assert claimed == [True]
+    # the winner's fresh lock is back in place, and nothing else is left
+    assert os.listdir(claim_dir) == ["run.lock"]
+    assert time.time() - os.path.getmtime(lock) < 60
+    assert not sweep.claim_run(claim_dir, paramfile, stale_after=60)
+
+
+def _die_once(marker):
+    """Kill the process the first time it is called."""
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        os._exit(1)
+
+
+class _KillsWorker:
+    """An option that kills the first worker process to unpickle it."""
+
+    def __init__(self, marker):
+        self.marker = marker
+
+    def __reduce__(self):
+        return _die_once, (self.marker,)
+
+
+def test_sweep_survives_dead_worker(tmpdir):
+    paramfiles = [_write_params(tmpdir, f"run{n}") for n in range(3)]
+    claim_dir = str(tmpdir.join("claims"))
+    results = sweep.run_sweep(
+        paramfiles, jobs=1, claim_dir=claim_dir,
+        memory_budget=_KillsWorker(str(tmpdir.join("killed"))),
+    )
+    assert [r["paramfile"] for r in results] == paramfiles
+    # the runs queued in the broken pool fail, the rest run in a new one
+    assert results[0]["error"].startswith("BrokenProcessPool")
+    assert results[-1]["error"] is None
+    assert os.listdir(claim_dir) == []
+
+
+def test_sharded_sweep(tmpdir):
+    paramfiles = [_write_params(tmpdir, f"run{n}") for n in range(5)]
+    results = sweep.run_sweep(paramfiles, jobs=2, shard=(1, 2))
+    assert [r["paramfile"] for r in results] == paramfiles[1::2]
+    with pytest.raises(ValueError, match="Shard index"):
+        sweep.run_sweep(paramfiles, shard=(2, 2))
+
+
+def test_claimed_sweep_across_processes(tmpdir):
+    paramfiles = [_write_params(tmpdir, f"run{n}") for n in range(6)]
+    claim_dir = str(tmpdir.join("claims"))
+    outputs = [str(tmpdir.join(f"worker{n}.json")) for n in range(3)]
+    command = [sys.executable, "-m", "pytesimal", "sweep", *paramfiles,
+               "--jobs", "1", "--claim-dir", claim_dir, "--skip-complete"]
+    workers = [
+        subprocess.Popen(command + ["-o", output], cwd=ROOT,
+                         stdout=subprocess.DEVNULL)
+        for output in outputs
+    ]
+    assert all(worker.wait(timeout=300) == 0 for worker in workers)
+    ran = []
+    for output in outputs:
+        with open(output) as file:
+            ran += [r["paramfile"] for r in json.load(file)
+                    if r["skipped"] is None]
+    # every run was done by exactly one of the workers
+    assert sorted(ran) == sorted(paramfiles)
+    assert os.listdir(claim_dir) == []
+    # resuming the finished sweep has nothing left to do
+    results = sweep.run_sweep(paramfiles, jobs=2, claim_dir=claim_dir,
+                              skip_complete=True)
+    assert all(r["skipped"] == "complete" for r in results)
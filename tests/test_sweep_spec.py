@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for declarative sweep specifications.
+
+"""
+import json
+import os
+
+import numpy as np
+import pytest
+
+from context import cli
+from context import load_plot_save
+from context import sweep_spec
+
+
+def _spec(small_param_file, **changes):
+    filename, folder = small_param_file
+    spec = {
+        "base": os.path.join(folder, f"{filename}.txt"),
+        "folder": os.path.join(folder, "sweep_results"),
+        "parameters": {
+            "temp_init": [1500.0, 1600.0],
+            "r_planet": {"min": 30000.0, "max": 40000.0, "steps": 3},
+        },
+    }
+    spec.update(changes)
+    return spec
+
+
+def test_grid_expands_every_combination(small_param_file):
+    spec = sweep_spec.SweepSpec(_spec(small_param_file, name="grid"))
+    runs = list(spec)
+    assert len(spec) == len(runs) == 6
+    assert [run["run_ID"] for run in runs[:2]] == ["grid_0", "grid_1"]
+    assert {(run["temp_init"], run["r_planet"]) for run in runs} == {
+        (t, r) for t in (1500.0, 1600.0) for r in (30000.0, 35000.0, 40000.0)
+    }
+    assert all(run["max_time"] == 5 for run in runs)
+
+
+def test_latin_hypercube_is_stratified():
+    rng = np.random.default_rng(3)
+    points = sweep_spec.latin_hypercube(16, 3, rng)
+    for column in points.T:
+        assert sorted(np.floor(column * 16).astype(int)) == list(range(16))
+
+
+def test_sobol_points_are_balanced():
+    points = np.array(list(sweep_spec.sobol_points(64, 5)))
+    assert np.all((points > 0) & (points < 1))
+    for column in points.T:
+        counts = np.bincount(np.floor(column * 8).astype(int), minlength=8)
+        assert np.all(counts == 8)
+    shift = np.arange(5) * 12345
+    shifted = np.array(list(sweep_spec.sobol_points(64, 5, shift)))
+    for column in shifted.T:
+        counts = np.bincount(np.floor(column * 8).astype(int), minlength=8)
+        assert np.all(counts == 8)
+    with pytest.raises(ValueError, match="at most"):
+        list(sweep_spec.sobol_points(1, 22))
+
+
+def test_normal_quantile():
+    # values of statistics.NormalDist().inv_cdf, new in Python 3.8
+    for p, expected in ((0.5, 0.0), (0.975, 1.9599639845400536),
+                        (0.1, -1.2815515655446008),
+                        (1e-10, -6.361340902404056)):
+        assert sweep_spec.normal_quantile(p) == pytest.approx(expected,
+                                                              abs=1e-14)
+        # symmetric, up to the rounding of 1 - p
+        q = 1 - p
+        assert sweep_spec.normal_quantile(q) == -sweep_spec.normal_quantile(
+            1 - q
+        )
+    with pytest.raises(ValueError):
+        sweep_spec.normal_quantile(1.0)
+
+
+def test_sampling_designs_are_reproducible(small_param_file):
+    parameters = {
+        "kappa_reg": {"min": 1e-8, "max": 1e-6, "scale": "log"},
+        "temp_init": {"mean": 1600.0, "std": 25.0},
+    }
+    for design in ("latin_hypercube", "sobol"):
+        spec = _spec(small_param_file, design=design, samples=32, seed=7,
+                     parameters=parameters)
+        first = list(sweep_spec.SweepSpec(spec))
+        again = list(sweep_spec.SweepSpec(spec))
+        assert first == again
+        kappa = np.array([run["kappa_reg"] for run in first])
+        assert np.all((kappa >= 1e-8) & (kappa <= 1e-6))
+        # log-uniform: about half below the geometric mean
+        assert 10 <= np.sum(kappa < 1e-7) <= 22
+        temps = np.array([run["temp_init"] for run in first])
+        assert abs(np.mean(temps) - 1600.0) < 15.0
+
+
+def test_invalid_specs_raise(small_param_file):
+    with pytest.raises(ValueError, match="Unknown sweep parameter"):
+        sweep_spec.SweepSpec(_spec(small_param_file, parameters={"x": [1]}))
+    with pytest.raises(ValueError, match="design"):
+        sweep_spec.SweepSpec(_spec(small_param_file, design="random"))
+    with pytest.raises(ValueError, match="samples"):
+        sweep_spec.SweepSpec(_spec(small_param_file, design="sobol"))
+    with pytest.raises(ValueError, match="steps"):
+        sweep_spec.SweepSpec(
+            _spec(small_param_file,
+                  parameters={"temp_init": {"min": 1.0, "max": 2.0}})
+        )
+    with pytest.raises(ValueError, match="positive"):
+        sweep_spec.SweepSpec(
+            _spec(small_param_file, parameters={
+                "kappa_reg": {"min": 0.0, "max": 1.0, "scale": "log"}
+            })
+        )
+
+
+def test_from_file_json_and_toml(small_param_file, tmpdir):
+    filename, folder = small_param_file
+    json_path = tmpdir.join("spec.json")
+    json_path.write(json.dumps({
+        "base": f"{filename}.txt",
+        "parameters": {"temp_init": [1500.0, 1600.0]},
+    }))
+    spec = sweep_spec.SweepSpec.from_file(str(json_path))
+    assert spec.name == "spec"
+    assert len(spec) == 2
+    toml_path = tmpdir.join("other.toml")
+    toml_path.write(
+        f'base = "{filename}.txt"\n'
+        'folder = "out"\n'
+        'design = "sobol"\n'
+        'samples = 4\n'
+        '[parameters.temp_init]\n'
+        'min = 1500.0\n'
+        'max = 1600.0\n'
+    )
+    spec = sweep_spec.SweepSpec.from_file(str(toml_path))
+    assert spec.name == "other"
+    assert spec.folder == os.path.join(str(tmpdir), "out")
+    assert len(list(spec)) == 4
+
+
+def test_paramfiles_are_written_lazily(small_param_file, tmpdir):
+    spec = sweep_spec.SweepSpec(_spec(small_param_file, name="lazy"))
+    folder = str(tmpdir.join("params"))
+    paramfiles = spec.paramfiles(folder)
+    assert len(paramfiles) == 6
+    assert not os.path.exists(folder)
+    first = next(iter(paramfiles))
+    assert os.listdir(folder) == ["lazy_0.txt"]
+    params = load_plot_save.load_params_from_file(first)
+    assert params[load_plot_save.PARAMETER_NAMES.index("run_ID")] == "lazy_0"
+
+
+def test_cli_sweep_spec(small_param_file, tmpdir, capsys):
+    filename, folder = small_param_file
+    spec_path = tmpdir.join("mini.json")
+    spec_path.write(json.dumps({
+        "base": f"{filename}.txt",
+        "folder": "mini_results",
+        "parameters": {"temp_init": [1500.0, 1600.0]},
+    }))
+    output = str(tmpdir.join("results.json"))
+    assert cli.main(
+        ["sweep", "--spec", str(spec_path), "-j", "2", "-o", output]
+    ) == 0
+    with open(output) as file:
+        results = json.load(file)
+    assert [os.path.basename(r["paramfile"]) for r in results] == [
+        "mini_0.txt", "mini_1.txt"
+    ]
+    assert all(r["error"] is None for r in results)
+    assert os.path.exists(tmpdir.join("mini_params", "mini_0.txt"))
+    assert cli.main(["sweep"]) == 2